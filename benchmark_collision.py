@@ -0,0 +1,412 @@
+"""
+Benchmark suite for the collision pipeline
+Times the stages of a collision check on the shipped 3d_inputs assets
+(scene bundle), appends every run to a JSON history and compares runs to
+flag regressions.
+
+Benchmarks (BENCHMARKS, names are dotted so --filter can select groups):
+    kinematics.*        C-arm / table forward kinematics, link frames
+    transform.*         C-arm point cloud and moving obstacle mesh transforms
+    inside.<obstacle>.* inside test (VTK / ray parity) of points in each obstacle
+    check.*             full CollisionServer.check_collision per configuration
+    workspace.*         WorkspaceAnalyzer throughput at 1k (and 10k with --full) samples
+
+Every benchmark is timed asv-style: after a warm-up call the call count
+per round is raised until a round takes MIN_ROUND_TIME, then ROUNDS rounds
+are timed and the median / min / mean time per call are recorded. The
+workspace benchmarks take seconds per call and run a single cold round.
+
+Usage:
+    python benchmark_collision.py run [--filter PATTERN] [--full] [--no-save] [--history PATH]
+    python benchmark_collision.py compare [--threshold 0.2] [--against N] [--stat min]
+                                          [--history PATH]
+    python benchmark_collision.py list
+
+compare exits with status 1 when a benchmark got slower than the baseline
+(the previous run by default) by more than the threshold. It compares the
+fastest round by default: on a shared machine the median picks up noise
+from other processes, the minimum much less so.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import fnmatch
+import platform
+import contextlib
+import subprocess
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib'))
+
+DEFAULT_HISTORY = 'benchmark_results/history.json'
+DEFAULT_THRESHOLD = 0.2         # flag benchmarks more than 20% slower
+DEFAULT_STAT = 'min'            # statistic compared: 'min', 'median' or 'mean' time per call
+ROUNDS = 5
+MIN_ROUND_TIME = 0.2            # s
+POSES = 50                      # random poses cycled through by the per-call benchmarks
+INSIDE_POINTS = 2000            # points per inside-test call
+
+BENCHMARKS = {}
+
+
+def benchmark(name, full=False, rounds=None, warmup=True):
+    """
+    Register a benchmark. The decorated function does the setup and returns
+    the callable to time; with full=True it only runs with --full. `rounds`
+    overrides the round count of the run.
+    """
+    def register(setup):
+        BENCHMARKS[name] = {'setup': setup, 'full': full, 'rounds': rounds, 'warmup': warmup}
+        return setup
+    return register
+
+
+class Context:
+    """Shared, lazily built fixtures (servers, bundle, random poses)"""
+
+    def __init__(self):
+        self._cache = {}
+        rng = np.random.default_rng(0)
+        from workspace_analysis import JOINT_LIMITS
+        self.poses = [{joint: rng.uniform(*limits) for joint, limits in JOINT_LIMITS.items()}
+                      for _ in range(POSES)]
+
+    def get(self, key, build):
+        if key not in self._cache:
+            with contextlib.redirect_stdout(io.StringIO()):
+                self._cache[key] = build()
+        return self._cache[key]
+
+    def server(self, **options):
+        from collision_server import CollisionServer
+        return self.get(('server', tuple(sorted(options.items()))), lambda: CollisionServer(**options))
+
+    def bundle(self):
+        from collision_server import open_scene_bundle
+        return self.get('bundle', open_scene_bundle)
+
+    @staticmethod
+    def check_args(pose):
+        return (pose['orbital'], pose['tilt'], pose['wigwag'], pose['lateral'], pose['vertical'],
+                pose['horizontal'], pose['table_vertical'], pose['table_longitudinal'],
+                pose['table_transverse'])
+
+
+def _cycle(items):
+    """Callable that returns the next item on every call"""
+    state = {'i': 0}
+
+    def next_item():
+        state['i'] = (state['i'] + 1) % len(items)
+        return items[state['i']]
+    return next_item
+
+
+# ---------------------------------------------------------------------------
+# Benchmarks
+# ---------------------------------------------------------------------------
+
+@benchmark('kinematics.c_arm_base_to_ee')
+def bench_c_arm_kinematics(ctx):
+    from TransformationMats import calc_transf_mat_c_arm_base_to_ee
+    pose = _cycle(ctx.poses)
+
+    def run():
+        p = pose()
+        calc_transf_mat_c_arm_base_to_ee(p['horizontal'], p['vertical'], 0, p['lateral'],
+                                         p['tilt'], p['orbital'])
+    return run
+
+
+@benchmark('kinematics.table_base_to_ee')
+def bench_table_kinematics(ctx):
+    from TransformationMats import calc_transf_mat_table_base_to_ee
+    pose = _cycle(ctx.poses)
+
+    def run():
+        p = pose()
+        calc_transf_mat_table_base_to_ee(p['table_vertical'], 0.0, 0.0, p['table_longitudinal'],
+                                         p['table_transverse'])
+    return run
+
+
+@benchmark('kinematics.link_frames')
+def bench_link_frames(ctx):
+    from CArmLinks import link_frames
+    pose = _cycle(ctx.poses)
+
+    def run():
+        p = pose()
+        link_frames(p['horizontal'], p['vertical'], p['wigwag'], p['lateral'], p['tilt'], p['orbital'])
+    return run
+
+
+@benchmark('transform.c_arm_points')
+def bench_c_arm_transform(ctx):
+    from TransformationMats import calc_transf_mat_c_arm_base_to_ee
+    from CArmLinks import transform_points
+    points = np.asarray(ctx.bundle().array('c_arm', 'points'))
+    frame = calc_transf_mat_c_arm_base_to_ee(0.05, 0.2, 0, 0.0, 30.0, 45.0)[None]
+    return lambda: transform_points(points, frame, 0)
+
+
+@benchmark('transform.table_body_mesh')
+def bench_mesh_transform(ctx):
+    from collision_server import bundle_mesh, table_poses
+    mesh = bundle_mesh(ctx.bundle(), 'table_body')
+    pose = table_poses(0.2, 0.3, 0.05)['table_body']
+
+    def run():
+        moved = mesh.clone()
+        moved.apply_transform(T=pose, reset=False, concatenate=False)
+    return run
+
+
+def _inside_benchmark(name, backend):
+    @benchmark(f'inside.{name}.{backend}')
+    def setup(ctx):
+        import vedo
+        from PointInMesh import PointInMesh
+        bundle = ctx.bundle()
+        vertices = np.asarray(bundle.array(name, 'points'), dtype=np.float64)
+        lo, hi = vertices.min(axis=0), vertices.max(axis=0)
+        points = np.random.default_rng(1).uniform(lo, hi, (INSIDE_POINTS, 3))
+        if backend == 'vtk':
+            mesh = vedo.Mesh([vertices, bundle.array(name, 'faces')])
+            return lambda: mesh.inside_points(points, return_ids=True)
+        test = PointInMesh(vertices, bundle.array(name, 'triangles'), bundle.bvh(name))
+        return lambda: test.inside(points)
+
+
+for _obstacle in ('table_top', 'table_body', 'table_base', 'patient'):
+    for _backend in ('vtk', 'bvh'):
+        _inside_benchmark(_obstacle, _backend)
+
+
+def _check_benchmark(name, sweep=False, **options):
+    @benchmark(f'check.{name}')
+    def setup(ctx):
+        server = ctx.server(**options)
+        if sweep:
+            # Consecutive 1-degree orbital steps (slider drag)
+            args = [(angle, 0.0, 0.0) for angle in range(-90, 90)]
+        else:
+            args = [ctx.check_args(p) for p in ctx.poses]
+        next_args = _cycle(args)
+
+        def run():
+            with contextlib.redirect_stdout(io.StringIO()):
+                server.check_collision(*next_args())
+        return run
+
+
+_check_benchmark('default')
+_check_benchmark('default_sweep', sweep=True)
+_check_benchmark('no_acceleration', coherence=False, grid=False)
+_check_benchmark('bvh', inside='bvh')
+_check_benchmark('gjk', engine='gjk')
+_check_benchmark('links', links=True)
+
+
+def _workspace_benchmark(samples, full):
+    @benchmark(f'workspace.{samples // 1000}k', full=full, rounds=1, warmup=False)
+    def setup(ctx):
+        from workspace_analysis import WorkspaceAnalyzer
+        analyzer = ctx.get('analyzer', WorkspaceAnalyzer)
+
+        def run():
+            np.random.seed(0)
+            with contextlib.redirect_stdout(io.StringIO()):
+                analyzer.analyze_workspace('setup5', 'AP', num_samples=samples, verbose=False)
+        return run
+
+
+_workspace_benchmark(1000, full=False)
+_workspace_benchmark(10000, full=True)
+
+
+# ---------------------------------------------------------------------------
+# Running, history, comparison
+# ---------------------------------------------------------------------------
+
+def time_benchmark(run, rounds=ROUNDS, min_round_time=MIN_ROUND_TIME, warmup=True):
+    """
+    Time a callable asv-style
+
+    Returns:
+        {'median', 'min', 'mean' (s per call), 'rounds', 'number' (calls per round)}
+    """
+    if warmup:
+        run()  # caches, first-use setup
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_round_time:
+            break
+        number *= max(2, min(10, int(min_round_time / max(elapsed, 1e-9)) + 1))
+    times = [elapsed / number]
+    for _ in range(rounds - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        times.append((time.perf_counter() - start) / number)
+    return {'median': float(np.median(times)), 'min': float(np.min(times)),
+            'mean': float(np.mean(times)), 'rounds': rounds, 'number': number}
+
+
+def select_benchmarks(pattern=None, full=False):
+    """Benchmark names matching a glob pattern ('check.*'), --full ones only if `full`"""
+    return [name for name, spec in BENCHMARKS.items()
+            if (full or not spec['full']) and (pattern is None or fnmatch.fnmatch(name, pattern))]
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(names, rounds=ROUNDS, min_round_time=MIN_ROUND_TIME):
+    """
+    Run the named benchmarks
+
+    Returns:
+        Run record: {'timestamp', 'commit', 'machine', 'results': {name: timing}}
+    """
+    ctx = Context()
+    results = {}
+    for name in names:
+        spec = BENCHMARKS[name]
+        run = spec['setup'](ctx)
+        results[name] = time_benchmark(run, spec['rounds'] or rounds, min_round_time, spec['warmup'])
+        print(f"  {name:32s} {format_time(results[name]['median'])} "
+              f"(min {format_time(results[name]['min'])}, "
+              f"{results[name]['number']} x {results[name]['rounds']})")
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'machine': {'platform': platform.platform(), 'python': platform.python_version(),
+                    'numpy': np.__version__, 'cpus': os.cpu_count()},
+        'results': results,
+    }
+
+
+def load_history(path=DEFAULT_HISTORY):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_run(record, path=DEFAULT_HISTORY):
+    """Append a run record to the history file"""
+    history = load_history(path)
+    history.append(record)
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(history, f, indent=2)
+    return len(history)
+
+
+def compare_runs(baseline, current, threshold=DEFAULT_THRESHOLD, stat=DEFAULT_STAT):
+    """
+    Time per call (`stat` of the rounds) of the benchmarks both runs have
+
+    Returns:
+        List of (name, baseline s, current s, ratio, status) with status
+        'regression' (slower by more than threshold), 'improvement' (faster
+        by more than threshold) or 'ok'
+    """
+    rows = []
+    for name, result in current['results'].items():
+        if name not in baseline['results']:
+            continue
+        old, new = baseline['results'][name][stat], result[stat]
+        ratio = new / old if old > 0 else float('inf')
+        status = ('regression' if ratio > 1 + threshold else
+                  'improvement' if ratio < 1 / (1 + threshold) else 'ok')
+        rows.append((name, old, new, ratio, status))
+    return rows
+
+
+def format_time(seconds):
+    if seconds >= 1:
+        return f"{seconds:8.2f}s "
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:8.2f}ms"
+    return f"{seconds * 1e6:8.2f}us"
+
+
+def print_comparison(rows, baseline, current, threshold, stat=DEFAULT_STAT):
+    print(f"Baseline: {baseline['timestamp']} ({baseline.get('commit') or 'no commit'})")
+    print(f"Current:  {current['timestamp']} ({current.get('commit') or 'no commit'})")
+    print(f"Threshold: {threshold * 100:.0f}% on the {stat} time per call\n")
+    for name, old, new, ratio, status in rows:
+        flag = {'regression': '[REGRESSION]', 'improvement': '[faster]', 'ok': ''}[status]
+        print(f"  {name:32s} {format_time(old)} -> {format_time(new)}  x{ratio:5.2f} {flag}")
+    regressions = [row for row in rows if row[4] == 'regression']
+    print(f"\n{len(regressions)} regression(s) in {len(rows)} benchmarks")
+    return regressions
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Collision pipeline benchmarks')
+    parser.add_argument('command', choices=('run', 'compare', 'list'))
+    parser.add_argument('--filter', type=str, default=None,
+                        help="Glob pattern of benchmark names, e.g. 'inside.*' or 'check.*'")
+    parser.add_argument('--full', action='store_true',
+                        help='Include the long benchmarks (workspace.10k)')
+    parser.add_argument('--rounds', type=int, default=ROUNDS,
+                        help=f'Timed rounds per benchmark (default: {ROUNDS})')
+    parser.add_argument('--history', type=str, default=DEFAULT_HISTORY,
+                        help=f'Results history (default: {DEFAULT_HISTORY})')
+    parser.add_argument('--no-save', action='store_true', help='Do not append the run to the history')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f'Relative slowdown flagged as regression (default: {DEFAULT_THRESHOLD})')
+    parser.add_argument('--stat', choices=('min', 'median', 'mean'), default=DEFAULT_STAT,
+                        help=f'Statistic compared (default: {DEFAULT_STAT})')
+    parser.add_argument('--against', type=int, default=-2,
+                        help='History index of the baseline run (default: -2, the run before the latest)')
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        for name, spec in BENCHMARKS.items():
+            print(f"  {name}{'  (--full)' if spec['full'] else ''}")
+        return
+
+    if args.command == 'run':
+        print("=" * 70)
+        print("COLLISION PIPELINE BENCHMARKS")
+        print("=" * 70)
+        names = select_benchmarks(args.filter, args.full)
+        record = run_benchmarks(names, rounds=args.rounds)
+        if not args.no_save:
+            count = save_run(record, args.history)
+            print(f"\nSaved run #{count} to {args.history}")
+        return
+
+    history = load_history(args.history)
+    if len(history) < 2:
+        print(f"Need at least two runs in {args.history} to compare (found {len(history)})")
+        sys.exit(1)
+    baseline, current = history[args.against], history[-1]
+    regressions = print_comparison(compare_runs(baseline, current, args.threshold, args.stat),
+                                   baseline, current, args.threshold, args.stat)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
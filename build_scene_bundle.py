@@ -0,0 +1,231 @@
+"""
+Build the compiled collision scene bundle
+Compiles the C-arm point cloud, table meshes and patient mesh (see
+SCENE_ASSETS in collision_server.py) into 3d_inputs/collision_scene.bundle,
+including the conservative simplified levels of every obstacle mesh
+(see lib/MeshLOD.py) that CollisionServer(fidelity=...) sweeps with, and
+the convex pieces of the C-arm mesh for CollisionServer(engine='gjk').
+The other C-arm links (lib/CArmLinks.py) are stored as meshes with surface
+samples, plus the link pairs that are allowed to touch (never tested) and
+the link samples already inside an obstacle at the home pose (exempt from
+that obstacle), for
+CollisionServer(links=True). The spatial hash grids over the C-arm
+collision points (lib/SpatialHash.py) are stored too, so the server maps
+them instead of building them at startup.
+
+Scenes defined in scenes.json (lib/SceneRegistry.py) get a bundle of
+their own obstacles only, in 3d_inputs/scenes/ (--scene ID).
+
+Usage:
+    python build_scene_bundle.py [--output PATH] [--scene ID] [--lod-max-error M]
+                                 [--lod-max-pieces N] [--lod-resolution M] [--no-lod]
+
+The collision server, visualizer and analysis tools rebuild the bundle
+automatically when it is missing or one of its sources changed.
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+import vedo
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib'))
+from SceneBundle import compile_object, write_bundle, SceneBundle, DEFAULT_BUNDLE
+from SpatialHash import PointGrid
+from MeshLOD import build_lods, DEFAULT_RESOLUTION, DEFAULT_MAX_ERROR, DEFAULT_MAX_PIECES
+from X3DGeometry import read_mesh
+from SceneRegistry import SceneRegistry
+from CArmLinks import LINKS, LINK_POINT_DENSITY, link_meshes, link_frames, transform_points, \
+    allowed_collisions, home_contacts
+
+
+def build_scene_bundle(path=DEFAULT_BUNDLE, lod=True, lod_resolution=DEFAULT_RESOLUTION,
+                       lod_max_error=DEFAULT_MAX_ERROR, lod_max_pieces=DEFAULT_MAX_PIECES,
+                       assets=None):
+    """
+    Compile SCENE_ASSETS into a bundle at `path`
+
+    Args:
+        assets: Assets to compile instead (a scene's own obstacles, see
+                SceneRegistry.assets())
+        lod: Also generate the simplified levels of the obstacle meshes
+        lod_resolution: Sample spacing of the Hausdorff bound (m)
+        lod_max_error: Target Hausdorff bound of the convex decomposition (m)
+        lod_max_pieces: Piece budget of the convex decomposition
+    """
+    from collision_server import SCENE_ASSETS, LINK_OBJECTS, OBSTACLES, table_poses
+    from convert_x3d_to_npy import H3D_SCALE, SAMPLE_SEED, sample_mesh_surface, triangle_areas
+
+    objects = {}
+    sources = {}
+    links = None
+    for name, asset in (SCENE_ASSETS if assets is None else assets).items():
+        samples = None
+        if 'link' in asset:
+            if links is None:
+                links = link_meshes(asset['file'], H3D_SCALE)
+            mesh = vedo.Mesh(list(links[asset['link']])).clean()
+            points, faces = mesh.points(), np.asarray(mesh.faces())
+            count = int(round(triangle_areas(points, faces).sum() * LINK_POINT_DENSITY))
+            samples = sample_mesh_surface(points, faces, count, seed=SAMPLE_SEED)
+            lod_points, lod_faces = points, faces
+        elif asset['file'].endswith('.npy'):
+            points, faces = np.load(asset['file']), None
+            # Levels of the point cloud come from the mesh it was sampled from
+            lod_points, lod_faces, _ = read_mesh(asset['x3d'][0])
+            lod_points = lod_points * H3D_SCALE
+        else:
+            mesh = vedo.load(asset['file'])
+            points, faces = mesh.points(), np.asarray(mesh.faces())
+            lod_points, lod_faces = points, faces
+        if 'scale' in asset:
+            # A scene's scale goes into the points so the stored transform stays rigid
+            points, lod_points = points * asset['scale'], lod_points * asset['scale']
+            if np.prod(asset['scale']) < 0:
+                faces, lod_faces = (None if f is None else f[:, ::-1] for f in (faces, lod_faces))
+        lods = None
+        if lod:
+            lods = build_lods(lod_points, lod_faces, lod_resolution, lod_max_error, lod_max_pieces)
+        objects[name] = compile_object(points, faces, asset['transform'], lods, samples)
+        sources[name] = {'inputs': [asset['file']] + asset.get('inputs', []), 'x3d': asset['x3d']}
+
+    if 'c_arm' in objects:
+        add_allowed_collisions(objects, LINK_OBJECTS,
+                               {name: table_poses(0, 0, 0).get(name) for name in OBSTACLES})
+        add_hash_grids(objects)
+
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_bundle(path, objects, sources)
+    return path
+
+
+def add_hash_grids(objects):
+    """
+    Store the spatial hash grids of the C-arm collision points on the c_arm
+    object, one per HASH_GRID_KINDS (C-shape points only, all links), as
+    CollisionServer(grid=True) would build them
+    """
+    from collision_server import HASH_GRID_KINDS, LINK_OBJECTS, robot_clouds
+
+    arrays, info = objects['c_arm']
+    info['hash_grids'] = {}
+    for kind, links in HASH_GRID_KINDS.items():
+        if links and not all(name in objects for name in LINK_OBJECTS.values()):
+            continue
+        clouds = robot_clouds(lambda name, key: objects[name][0][key], links)
+        grid = PointGrid(np.concatenate(clouds),
+                         groups=np.repeat(np.arange(len(clouds)), [len(cloud) for cloud in clouds]))
+        for key, array in grid.arrays().items():
+            arrays[f'hash_{kind}_{key}'] = array
+        info['hash_grids'][kind] = {'cell_size': grid.cell_size, 'cells': len(grid)}
+
+
+def add_allowed_collisions(objects, link_objects, obstacle_poses):
+    """
+    Store on the c_arm object the pairs of C-arm links that are allowed to
+    touch (see CArmLinks.allowed_collisions), and per link and obstacle the
+    ids of the link's samples inside the obstacle (CArmLinks.home_contacts),
+    from the compiled objects at the home pose (all C-arm and table joints 0)
+
+    Args:
+        obstacle_poses: {obstacle: home pose, or None if its transform is baked}
+    """
+    frames = link_frames(0, 0, 0, 0, 0, 0)
+
+    def mesh(b):
+        if b in obstacle_poses:
+            arrays, _ = objects[b]
+            pose = obstacle_poses[b]
+            if pose is None:
+                return vedo.Mesh([arrays['placed_points'] if 'placed_points' in arrays
+                                  else arrays['points'], arrays['faces']])
+        else:
+            arrays, _ = objects[link_objects[b]]
+            if 'faces' not in arrays:
+                return None
+            pose = frames[LINKS.index(b)]
+        return vedo.Mesh([transform_points(arrays['points'], pose[None], 0), arrays['faces']])
+
+    def inside_ids(a, b):
+        target = mesh(b)
+        if target is None:
+            return np.zeros(0, np.int32)
+        arrays, _ = objects[link_objects[a]]
+        points = arrays['samples'] if 'samples' in arrays else arrays['points']
+        points = transform_points(points, frames[[LINKS.index(a)]], 0)
+        return np.asarray(target.inside_points(points, return_ids=True), dtype=np.int32)
+
+    arrays, info = objects['c_arm']
+    info['allowed_collisions'] = [list(pair) for pair in
+                                  allowed_collisions(lambda a, b: inside_ids(a, b).size)]
+    info['home_contacts'] = {}
+    for link, per_obstacle in home_contacts(inside_ids, tuple(obstacle_poses)).items():
+        for name, ids in per_obstacle.items():
+            arrays[f'contact_{link}_{name}'] = ids
+            info['home_contacts'].setdefault(link, {})[name] = len(ids)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Compile collision inputs into a scene bundle')
+    parser.add_argument('--output', type=str, default=DEFAULT_BUNDLE,
+                        help=f'Bundle file (default: {DEFAULT_BUNDLE})')
+    parser.add_argument('--scene', type=str, default=None,
+                        help='Build the bundle of a scene from scenes.json instead of the main one')
+    parser.add_argument('--lod-max-error', type=float, default=DEFAULT_MAX_ERROR,
+                        help=f'Target Hausdorff bound of the convex level in m (default: {DEFAULT_MAX_ERROR})')
+    parser.add_argument('--lod-max-pieces', type=int, default=DEFAULT_MAX_PIECES,
+                        help=f'Maximum convex pieces per obstacle (default: {DEFAULT_MAX_PIECES})')
+    parser.add_argument('--lod-resolution', type=float, default=DEFAULT_RESOLUTION,
+                        help=f'Sample spacing for the error bound in m (default: {DEFAULT_RESOLUTION})')
+    parser.add_argument('--no-lod', action='store_true',
+                        help='Skip the simplified levels (full-fidelity point checks only)')
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("Scene Bundle Builder")
+    print("=" * 60)
+
+    assets = None
+    if args.scene is not None:
+        from collision_server import SCENE_ASSETS
+        registry = SceneRegistry()
+        assets = registry.assets(args.scene, SCENE_ASSETS)
+        if not assets:
+            print(f"Scene '{args.scene}' has no obstacles of its own (uses {args.output})")
+            return
+        args.output = registry.bundle_path(args.scene)
+
+    start_time = time.time()
+    build_scene_bundle(args.output, not args.no_lod, args.lod_resolution,
+                       args.lod_max_error, args.lod_max_pieces, assets)
+    print(f"\nWrote {args.output} ({os.path.getsize(args.output) / 1e6:.1f} MB) "
+          f"in {time.time() - start_time:.2f}s")
+
+    bundle = SceneBundle(args.output)
+    for name, entry in bundle.objects.items():
+        extra = f", {entry['faces']} faces" if 'faces' in entry else ""
+        extra += f", {entry['samples']} surface samples" if 'samples' in entry else ""
+        baked = " (transform baked)" if 'transform' in entry else ""
+        print(f"  {name:12s} {entry['kind']:6s} {entry['count']} points{extra}{baked}")
+        for level, info in bundle.levels(name).items():
+            print(f"      {level:8s} {info['pieces']:3d} pieces, {info['faces']:5d} faces, "
+                  f"Hausdorff <= {info['hausdorff'] * 1000:.1f} mm"
+                  f"{'' if info.get('closed', True) else ' (mesh not closed, not decomposed)'}")
+    if 'c_arm' in bundle.objects:
+        allowed = bundle.objects['c_arm'].get('allowed_collisions', [])
+        print(f"  Allowed collisions, never tested: "
+              f"{', '.join('-'.join(pair) for pair in allowed)}")
+        for link, per_obstacle in bundle.objects['c_arm'].get('home_contacts', {}).items():
+            for name, count in per_obstacle.items():
+                print(f"  Home contact {link}-{name}: {count} points exempt from {name}")
+        for kind, info in bundle.objects['c_arm'].get('hash_grids', {}).items():
+            print(f"  Spatial hash ({kind}): {info['cells']} cells of {info['cell_size'] * 100:.0f}cm")
+
+
+if __name__ == '__main__':
+    main()
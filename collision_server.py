@@ -1,69 +1,648 @@
 """
 Collision Detection Server (Python 3)
 Uses point cloud + mesh intersection (research paper method)
-Communicates with H3D via JSON files
+Communicates with H3D via the shared-memory pose bus and result slot
+(JSON files as fallback)
 """
 
-import numpy as np
-import vedo
-import json
 import time
+IMPORT_STARTED = time.perf_counter()    # --startup-report counts imports from here
+
+import numpy as np
+import functools
 import sys
 import os
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'lib'))
 from TransformationMats import calc_transf_mat_c_arm_base_to_ee, calc_transf_mat_table_base_to_ee
+from SceneBundle import SceneBundle, DEFAULT_BUNDLE, bounding_sphere
+from MeshLOD import inside_level, clearance_bounds, LEVELS, PLANE_TOLERANCE
+from ConvexCollision import ConvexCollisionEngine, split_pieces
+from TemporalCoherence import CoherenceCache
+from SpatialHash import PointGrid, DEFAULT_CELL_SIZE
+from PointInMesh import PointInMesh
+from SceneRegistry import SceneRegistry, SceneView, DEFAULT_SCENES, DEFAULT_SCENE
+from CArmLinks import LINKS, LINKS_X3D, link_frames, transform_points
+from StageTiming import StageTimer
+from PoseTrace import PoseTraceWriter
+from PoseBus import PoseSubscriber, DEFAULT_BUS_FILE
+from ResultSlot import ResultSlotWriter, write_result_file, DEFAULT_SLOT_FILE
+from CollisionWorkerPool import CollisionWorkerPool, start_check_server, COLLISION_CHECK_PORT
+from SamplingProfiler import ProfileControl, PROFILE_REQUEST_FILE, idle
+from ServerMetrics import MetricsRegistry, Heartbeat, start_metrics_server, COLLISION_METRICS_PORT
+from StartupReport import StartupReport
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
+
+
+def _translation(x, y, z):
+    transform = np.eye(4)
+    transform[:3, 3] = x, y, z
+    return transform
+
+
+def _patient_transform():
+    """External transform from main.x3d: translation='0.22 -0.15 -0.2' scale="-1.35 1.35 -1.35"
+    plus 90-degree rotation around Z-axis to align with table.
+    Internal X3D transform is already baked into the PLY file."""
+    patient_transform = np.eye(4)
+    
+    # Apply 270-degree Z rotation (to flip head/feet orientation)
+    cos_z = np.cos(3 * np.pi / 2)
+    sin_z = np.sin(3 * np.pi / 2)
+    patient_transform[0, 0] = cos_z
+    patient_transform[0, 1] = -sin_z
+    patient_transform[1, 0] = sin_z
+    patient_transform[1, 1] = cos_z
+    
+    # Apply translation
+    patient_transform[0, 3] = 0.3  # X translation
+    patient_transform[1, 3] = 1.35   # left right
+    patient_transform[2, 3] = 0.8   # up
+    
+    # Apply scale (need to combine with rotation) - matches visualizer
+    scale_transform = np.eye(4)
+    scale_transform[0, 0] = -1.0  # X scale
+    scale_transform[1, 1] = 1.0   # Y scale
+    scale_transform[2, 2] = -1.0  # Z scale
+    
+    return patient_transform @ scale_transform
+
+
+# Constant placements in the C-arm base frame
+TABLE_BASE_TRANSFORM = _translation(0.4, 1.35, 0.0)
+TABLE_WHEELS_BASE_TRANSFORM = _translation(0.4 - 0.15, 1.35, 0.0)  # stays on ground
+PATIENT_TRANSFORM = _patient_transform()
+
+# Collision inputs compiled into the scene bundle (build_scene_bundle.py).
+# Obstacles with a constant 'transform' are stored pre-placed; the others
+# (table top, table body) are placed per check from the table DOF. The
+# remaining C-arm links are meshes sampled from the X3D assembly
+# (CArmLinks.py), each attached to its own DH frame.
+SCENE_ASSETS = {
+    'c_arm': {'file': '3d_inputs/c_arm_pcd_pts.npy',
+              'x3d': ['models/carm_c_shape.x3d'], 'transform': None},
+    'c_arm_column': {'file': LINKS_X3D, 'x3d': [LINKS_X3D], 'transform': None, 'link': 'column'},
+    'c_arm_arm': {'file': LINKS_X3D, 'x3d': [LINKS_X3D], 'transform': None, 'link': 'arm'},
+    'c_arm_tilt': {'file': LINKS_X3D, 'x3d': [LINKS_X3D], 'transform': None, 'link': 'tilt'},
+    'table_top': {'file': '3d_inputs/table_top_watertight_mesh.ply',
+                  'x3d': ['models/table_top_watertight_mesh.x3d'], 'transform': None},
+    'table_body': {'file': '3d_inputs/table_body_sphere_watertight_mesh.ply',
+                   'x3d': ['models/table_body_sphere_watertight_mesh.x3d'], 'transform': None},
+    'table_base': {'file': '3d_inputs/table_wheels_base_watertight_mesh.ply',
+                   'x3d': ['models/table_wheels_base_watertight_mesh.x3d'],
+                   'transform': TABLE_WHEELS_BASE_TRANSFORM},
+    'patient': {'file': 'models/patient_model.ply',
+                'x3d': ['models/patient-model.x3d'], 'transform': PATIENT_TRANSFORM},
+}
+OBSTACLES = ('table_top', 'table_body', 'table_base', 'patient')
+LINK_OBJECTS = {'column': 'c_arm_column', 'arm': 'c_arm_arm', 'tilt': 'c_arm_tilt', 'c_arm': 'c_arm'}
+
+# Per-obstacle model fidelity: 'full' mesh or a conservative MeshLOD level
+FIDELITY_LEVELS = ('full',) + LEVELS
+
+# Collision backends: C-arm points inside obstacle meshes, or GJK/EPA
+# between the convex pieces of the C-arm and the obstacles
+ENGINES = ('points', 'gjk')
+
+# Inside test of the points engine: VTK (vtkSelectEnclosedPoints, see
+# EnclosedPoints.py) or the numpy ray-parity kernel over the bundle's
+# triangle hierarchies
+INSIDE_TESTS = ('vtk', 'bvh')
+
+# Spatial hash grids compiled into the bundle: kind -> links=...
+HASH_GRID_KINDS = {'points': False, 'links': True}
+
+# Threads building the acceleration structures at load
+LOAD_THREADS = min(8, os.cpu_count() or 1)
+
+# Checks between two stage-latency summaries of a server with timing=True
+TIMING_REPORT_EVERY = 100
+
+
+def parse_fidelity(spec):
+    """
+    Fidelity per obstacle from None, a level for all obstacles ('convex'),
+    a {name: level} dict or its string form ('patient=convex,table_body=dop').
+    Obstacles not mentioned stay at 'full'.
+    """
+    fidelity = dict.fromkeys(OBSTACLES, 'full')
+    if spec is None:
+        return fidelity
+    if isinstance(spec, str):
+        if '=' not in spec:
+            spec = dict.fromkeys(OBSTACLES, spec)
+        else:
+            spec = dict(item.split('=', 1) for item in spec.split(','))
+    
+    for name, level in spec.items():
+        name, level = name.strip(), level.strip()
+        if name not in fidelity:
+            raise ValueError(f"Unknown obstacle '{name}' (expected one of {', '.join(OBSTACLES)})")
+        if level not in FIDELITY_LEVELS:
+            raise ValueError(f"Unknown fidelity '{level}' (expected one of {', '.join(FIDELITY_LEVELS)})")
+        fidelity[name] = level
+    return fidelity
+
+
+def table_poses(table_vertical_m, table_longitudinal_m, table_transverse_m):
+    """Transforms of the obstacles that move with the table DOF (not pre-placed)"""
+    # Table top uses full DH transformation (no trend/tilt yet)
+    transf_table_base_to_ee = calc_transf_mat_table_base_to_ee(
+        table_vertical_m, 0.0, 0.0,  # vertical, trend=0, tilt=0
+        table_longitudinal_m, table_transverse_m
+    )
+    
+    # Table body pose (extends upward with vertical movement)
+    # Z-axis is vertical in world frame (after 90° Y rotation)
+    return {
+        'table_top': TABLE_BASE_TRANSFORM @ transf_table_base_to_ee,
+        'table_body': TABLE_BASE_TRANSFORM @ _translation(0.0, 0.0, table_vertical_m),
+    }
+
+
+def open_scene_bundle(path=DEFAULT_BUNDLE, assets=None):
+    """
+    Open the compiled scene, (re)building it if missing or out of date
+
+    Args:
+        assets: Assets compiled into the bundle (default: SCENE_ASSETS)
+    """
+    reason = None
+    if not os.path.exists(path):
+        reason = "not built yet"
+    else:
+        try:
+            bundle = SceneBundle(path)
+            stale = bundle.stale_sources()
+            if not stale:
+                return bundle
+            reason = f"sources changed: {', '.join(stale)}"
+        except ValueError as e:
+            reason = str(e)
+    
+    print(f"        Building scene bundle ({reason})...")
+    from build_scene_bundle import build_scene_bundle
+    build_scene_bundle(path, assets=assets)
+    return SceneBundle(path)
+
+
+# Opened once per process and shared by every resident scene
+_OPEN_BUNDLES = {}      # absolute path -> SceneBundle
+_SHARED_GEOMETRY = {}   # (bundle path, object, kind) -> immutable geometry
+
+
+def open_scene(registry, scene_id=DEFAULT_SCENE, bundle_path=DEFAULT_BUNDLE):
+    """SceneView of a registered scene: its own obstacles over the main bundle"""
+    paths = [(bundle_path, None)]
+    scene_bundle = registry.bundle_path(scene_id)
+    if scene_bundle is not None:
+        paths.insert(0, (scene_bundle, registry.assets(scene_id, SCENE_ASSETS)))
+    bundles = []
+    for path, assets in paths:
+        key = os.path.abspath(path)
+        if key not in _OPEN_BUNDLES:
+            _OPEN_BUNDLES[key] = open_scene_bundle(path, assets)
+        bundles.append(_OPEN_BUNDLES[key])
+    return SceneView(bundles)
+
+
+def shared_geometry(bundle, name, kind, build):
+    """
+    Geometry derived from a bundle object, built once per process: scenes
+    reading the object from the same bundle get the same instance, so it
+    must never be modified (moving obstacles are cloned before placing)
+    """
+    key = (os.path.abspath(bundle.source(name).path), name, kind)
+    if key not in _SHARED_GEOMETRY:
+        _SHARED_GEOMETRY[key] = build()
+    return _SHARED_GEOMETRY[key]
+
+
+def bundle_mesh(bundle, name, placed=False):
+    """vedo.Mesh of a bundle object (pre-placed points if `placed`), for display"""
+    import vedo
+    
+    points = bundle.array(name, 'placed_points' if placed else 'points')
+    return vedo.Mesh([points, bundle.array(name, 'faces')])
+
+
+def enclosed_mesh(bundle, name, placed=False):
+    """VTK inside test of a bundle mesh (pre-placed points if `placed`), see EnclosedPoints.py"""
+    from EnclosedPoints import EnclosedPoints
+    
+    points = bundle.array(name, 'placed_points' if placed else 'points')
+    return EnclosedPoints(points, bundle.array(name, 'faces'))
+
+
+def robot_clouds(array, links):
+    """
+    Collision points of the C-arm, per link, each in its link's frame
+    
+    Args:
+        array: Reads a compiled array, array(object, key) (SceneBundle.array)
+        links: All LINKS, or only the C-shape point cloud
+    """
+    return [array(LINK_OBJECTS[link], 'samples' if link != 'c_arm' else 'points')
+            for link in (LINKS if links else ('c_arm',))]
 
 
 class CollisionServer:
-    def __init__(self):
+    def __init__(self, bundle_path=DEFAULT_BUNDLE, fidelity=None, confirm=True, engine='points',
+                 coherence=True, links=False, grid=True, inside='vtk', scene=DEFAULT_SCENE,
+                 scenes=None, timing=False, startup=None):
+        """
+        Args:
+            bundle_path: Compiled scene bundle (built if missing or stale)
+            fidelity: Model used per obstacle, see parse_fidelity(). Coarse
+                      levels contain the full mesh, so they never miss a hit
+            confirm: Re-test the points inside a coarse level against the
+                     full mesh (exact counts); False reports the coarse
+                     counts, which over-estimate by at most the level's
+                     Hausdorff bound
+            engine: 'points' (C-arm points inside obstacle meshes) or 'gjk'
+                    (convex pieces, see ConvexCollision.py); 'gjk' reports
+                    intersecting piece pairs as collision_points and adds
+                    per-obstacle distance / penetration depth as 'contacts'
+            coherence: Carry clearance bounds from one check to the next and
+                       skip what the pose change cannot have brought into
+                       contact (see TemporalCoherence.py); results are
+                       unchanged except that a skipped 'gjk' contact reports
+                       a lower bound of its distance
+            links: Check every C-arm link (column, arm, tilt block, C-shape),
+                   each on its own DH frame, against the obstacles and the
+                   other links (see CArmLinks.py); adds per-link counts as
+                   'links' and link-vs-link counts as 'self_collision'.
+                   False checks the C-shape point cloud only
+            grid: Reject C-arm points by hash-grid cell against each
+                  obstacle's bounding box before the point engine's narrow
+                  phase (see SpatialHash.py); results are unchanged
+            inside: Inside test of the points engine, 'vtk' or 'bvh' (ray
+                    parity without VTK, see PointInMesh.py)
+            scene: Scene served by this instance (see SceneRegistry.py)
+            scenes: SceneRegistry shared by the resident scenes (default:
+                    the definitions in scenes.json). Checks for another
+                    scene_id are passed to that scene's resident server,
+                    loaded with the same options on first use
+            timing: Time every check by stage (kinematics, broad phase,
+                    transforms, narrow phase per obstacle, ...); adds the
+                    check's stage times as 'timing' and prints rolling
+                    p50/p95/p99 per stage every TIMING_REPORT_EVERY checks
+                    (see StageTiming.py)
+            startup: StartupReport to charge the load and build times to
+                     (see StartupReport.py)
+        """
         print("=" * 70)
         print("COLLISION DETECTION SERVER")
         print("=" * 70)
         
-        self._load_models()
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine '{engine}' (expected one of {', '.join(ENGINES)})")
+        if inside not in INSIDE_TESTS:
+            raise ValueError(f"Unknown inside test '{inside}' (expected one of {', '.join(INSIDE_TESTS)})")
+        if links and engine != 'points':
+            raise ValueError("Link-level checks need the 'points' engine")
+        self.engine = engine
+        self.links = links
+        self.fidelity = parse_fidelity(fidelity)
+        self.confirm = confirm
+        self.use_coherence = coherence
+        self.use_grid = grid
+        self.inside = inside
+        self.scene = scene
+        self.scenes = scenes if scenes is not None else SceneRegistry(DEFAULT_SCENES)
+        if self.scenes.loader is None:
+            options = dict(fidelity=fidelity, confirm=confirm, engine=engine, coherence=coherence,
+                           links=links, grid=grid, inside=inside, timing=timing)
+            self.scenes.loader = lambda scene_id: CollisionServer(bundle_path, scene=scene_id,
+                                                                  scenes=self.scenes, **options)
+        self.scenes.resident.setdefault(scene, self)
+        self.startup = startup if startup is not None else StartupReport()
+        self.joint_limits = self.scenes.joint_limits(scene, {})
+        self._load_models(bundle_path)
         self.check_count = 0
-        self.transf_c_arm_base_to_table_base = self._get_table_base_transform()
+        self.timer = StageTimer() if timing else None
+        self.transf_c_arm_base_to_table_base = TABLE_BASE_TRANSFORM
         
         print("\n" + "=" * 70)
         print("SERVER READY - Waiting for collision check requests")
         print("=" * 70 + "\n")
     
-    def _load_models(self):
-        """Load all 3D models and meshes"""
-        print("\n[1/5] Loading C-arm point cloud...")
-        self.c_arm_pc = vedo.Points(np.load('3d_inputs/c_arm_pcd_pts.npy'))
-        print(f"        Loaded {self.c_arm_pc.points().shape[0]} points")
-        
-        print("\n[2/5] Loading table top mesh...")
-        self.table_top_mesh = vedo.load('3d_inputs/table_top_watertight_mesh.ply')
-        print(f"        Loaded {self.table_top_mesh.npoints} vertices")
-        
-        print("\n[3/5] Loading table body mesh...")
-        self.table_body_mesh = vedo.load('3d_inputs/table_body_sphere_watertight_mesh.ply')
-        print(f"        Loaded {self.table_body_mesh.npoints} vertices")
-        
-        print("\n[4/5] Loading table wheels mesh...")
-        self.table_wheels_base_mesh = vedo.load('3d_inputs/table_wheels_base_watertight_mesh.ply')
-        print(f"        Loaded {self.table_wheels_base_mesh.npoints} vertices")
-        
-        print("\n[5/5] Loading patient model...")
-        self.patient_mesh = vedo.load('models/patient_model.ply')
-        print(f"        Loaded {self.patient_mesh.npoints} vertices")
+    def _load_models(self, bundle_path):
+        """Load all 3D models and meshes from the compiled scene bundle"""
+        report = self.startup
+        print(f"\n[1/2] Opening scene '{self.scene}'")
+        start_time = time.time()
+        with report.phase('load', 'scene bundles'):
+            self.bundle = open_scene(self.scenes, self.scene, bundle_path)
+        print(f"        Bundles: {', '.join(bundle.path for bundle in self.bundle.bundles)}")
+        
+        self.c_arm_points = self.bundle.array('c_arm', 'points')
+        print(f"        C-arm: {len(self.c_arm_points)} points")
+        
+        # Collision points of all links in one array, each in its link's frame
+        self.link_names = LINKS if self.links else ('c_arm',)
+        clouds = robot_clouds(self.bundle.array, self.links)
+        self.robot_points = np.concatenate(clouds)
+        self.point_links = np.repeat(np.arange(len(clouds)), [len(cloud) for cloud in clouds])
+        self.link_spheres = np.array([bounding_sphere(cloud) for cloud in clouds], dtype=np.float64)
+        
+        # Only the VTK inside test needs VTK; bvh and gjk servers never import it
+        vtk_meshes = self.engine == 'points' and self.inside == 'vtk'
+        if vtk_meshes:
+            with report.phase('import', 'vtk (EnclosedPoints)'):
+                import EnclosedPoints
+        
+        # Acceleration structures are independent, and numpy, VTK and the
+        # BVH kernel release the GIL, so they are built in parallel
+        print("\n[2/2] Building obstacle meshes...")
+        placed = {name: self.bundle.has(name, 'placed_points') for name in OBSTACLES}
+        with report.phase('build'), ThreadPoolExecutor(LOAD_THREADS) as executor:
+            grid = meshes = tests = None
+            if self.use_grid and self.engine == 'points':
+                grid = executor.submit(report.timed, 'build', 'spatial hash', self._point_grid)
+            if vtk_meshes:
+                meshes = {name: executor.submit(report.timed, 'build', f'mesh {name}', shared_geometry,
+                                                self.bundle, name, 'mesh',
+                                                functools.partial(enclosed_mesh, self.bundle, name,
+                                                                  placed[name]))
+                          for name in OBSTACLES}
+            if self.inside == 'bvh':
+                tests = {name: executor.submit(report.timed, 'build', f'bvh {name}',
+                                               self._point_test, name)
+                         for name in OBSTACLES}
+            self.grid = grid.result() if grid is not None else None
+            self.obstacles = {name: (meshes[name].result() if meshes else None, placed[name])
+                              for name in OBSTACLES}
+            if tests is not None:
+                self.point_tests = {name: test.result() for name, test in tests.items()}
+        if self.grid is not None:
+            print(f"        Spatial hash: {len(self.grid)} cells of {self.grid.cell_size * 100:.0f}cm")
+        for name in OBSTACLES:
+            print(f"        {name}: {self.bundle.objects[name]['count']} vertices"
+                  f"{' (pre-placed)' if placed[name] else ''}")
+        if self.inside == 'bvh':
+            nodes = ', '.join(f"{name} {len(test.bvh['lo'])}" for name, test in self.point_tests.items())
+            print(f"        Inside test: ray parity, BVH nodes {nodes}")
+        self.self_collision_tests = []
+        if self.links:
+            with report.phase('build', 'self-collision tests'):
+                self.self_collision_tests = self._build_self_collision_tests()
+        
+        # Link points already inside an obstacle at the home pose are not tested
+        # against it; the rest of the link is
+        self.pruned_points = {}
+        self.home_contacts = {}
+        if self.links:
+            starts = np.searchsorted(self.point_links, np.arange(len(LINKS)))
+            contacts = self.bundle.objects['c_arm'].get('home_contacts', {})
+            for link, per_obstacle in contacts.items():
+                for name, count in per_obstacle.items():
+                    if name not in self.obstacles:
+                        continue
+                    ids = self.bundle.array('c_arm', f'contact_{link}_{name}')
+                    pruned = self.pruned_points.setdefault(name, np.zeros(len(self.robot_points), bool))
+                    pruned[starts[LINKS.index(link)] + ids] = True
+                    self.home_contacts.setdefault(link, {})[name] = count
+                    print(f"        {link} vs {name}: {count} points exempt (in contact at the home pose)")
+        
+        # Model-frame boxes the spatial hash rejects cells against
+        self.obstacle_bounds = {name: self.bundle.array(name, 'bounds').astype(np.float64)
+                                for name in OBSTACLES}
+        
+        # Coarse levels are tested in the obstacle's model frame
+        self.static_poses = {name: self.bundle.transform(name) for name in OBSTACLES
+                             if self.bundle.transform(name) is not None}
+        self.world_to_model = {name: np.linalg.inv(pose) for name, pose in self.static_poses.items()}
+        self.lods = {}
+        for name, level in self.fidelity.items():
+            if level == 'full':
+                continue
+            info = self.bundle.levels(name).get(level)
+            if info is None:
+                raise ValueError(f"Scene bundle has no '{level}' level for {name} "
+                                 f"(rebuild it without --no-lod)")
+            self.lods[name] = self.bundle.array(name, f'lod_{level}_offsets')
+            print(f"        {name}: sweeping on '{level}' ({info['pieces']} pieces, "
+                  f"Hausdorff <= {info['hausdorff'] * 1000:.0f}mm"
+                  f"{', hits confirmed on full mesh' if self.confirm else ''})")
+        
+        if self.engine == 'gjk':
+            with report.phase('build', 'GJK pieces'):
+                self.convex_engine = self._build_convex_engine()
+        with report.phase('build', 'coherence cache'):
+            self.coherence = self._build_coherence() if self.use_coherence else None
+        print(f"        Loaded in {(time.time() - start_time) * 1000:.0f}ms")
+        
+        self.table_top_mesh = self.obstacles['table_top'][0]
+        self.table_body_mesh = self.obstacles['table_body'][0]
+        self.table_wheels_base_mesh = self.obstacles['table_base'][0]
+        self.patient_mesh = self.obstacles['patient'][0]
+    
+    @property
+    def c_arm_pc(self):
+        """vedo.Points of the C-arm point cloud, for display (imports vedo)"""
+        import vedo
+        
+        return vedo.Points(self.c_arm_points)
+    
+    def _point_grid(self):
+        """Spatial hash grid over the robot points, mapped from the bundle when compiled into it"""
+        kind = 'links' if self.links else 'points'
+        
+        def build():
+            stored = self.bundle.hash_grid('c_arm', kind)
+            if stored is not None and stored[1] == DEFAULT_CELL_SIZE:
+                return PointGrid.from_arrays(*stored)
+            return PointGrid(self.robot_points, groups=self.point_links)
+        
+        return shared_geometry(self.bundle, 'c_arm', f'grid-{kind}', build)
+    
+    def _point_test(self, name):
+        """Ray-parity inside test of a bundle mesh (model frame)"""
+        return shared_geometry(self.bundle, name, 'bvh', lambda: PointInMesh(
+            self.bundle.array(name, 'points'), self.bundle.array(name, 'triangles'),
+            self.bundle.bvh(name)))
+    
+    def _build_convex_engine(self):
+        """GJK/EPA engine over the 'convex' pieces stored in the bundle"""
+        def pieces(name):
+            if 'convex' not in self.bundle.levels(name):
+                raise ValueError(f"Scene bundle has no convex pieces for {name} "
+                                 f"(rebuild it without --no-lod)")
+            return split_pieces(self.bundle.array(name, 'lod_convex_points'),
+                                self.bundle.array(name, 'lod_convex_vertex_offsets'))
+        
+        engine = ConvexCollisionEngine(pieces('c_arm'), {name: pieces(name) for name in OBSTACLES})
+        print(f"        GJK engine: {len(engine.robot_pieces)} C-arm pieces, " +
+              ", ".join(f"{name} {len(p)}" for name, p in engine.obstacles.items()))
+        return engine
+    
+    def _build_coherence(self):
+        """Clearance cache over the C-arm points (bounded by the 'dop' levels) or GJK pieces"""
+        if self.engine == 'gjk':
+            vertices = np.concatenate(self.convex_engine.robot_pieces)
+            sphere = bounding_sphere(vertices)
+            return CoherenceCache(sphere[:3], sphere[3], 1)
+        
+        missing = [name for name in OBSTACLES if 'dop' not in self.bundle.levels(name)]
+        if missing:
+            print(f"        Temporal coherence off: no 'dop' level for {', '.join(missing)}")
+            return None
+        self.dop_offsets = {name: self.bundle.array(name, 'lod_dop_offsets') for name in OBSTACLES}
+        return CoherenceCache(self.link_spheres[:, :3], self.link_spheres[:, 3], len(self.robot_points),
+                              groups=self.point_links if self.links else None)
+    
+    def _build_self_collision_tests(self):
+        """
+        (link a, link b, mesh of b, 'convex' offsets of b, bounds of b) for every link pair
+        not in the allowed collisions: points of a are tested inside b
+        (in b's frame) for every b with a mesh, i.e. all links but the C-shape
+        """
+        allowed = {tuple(pair) for pair in self.bundle.objects['c_arm'].get('allowed_collisions', [])}
+        tests = []
+        for i, a in enumerate(LINKS):
+            for j, b in enumerate(LINKS):
+                if i == j or (a, b) in allowed or (b, a) in allowed or b == 'c_arm':
+                    continue
+                name = LINK_OBJECTS[b]
+                mesh = (self._point_test(name) if self.inside == 'bvh' else
+                        shared_geometry(self.bundle, name, 'mesh', lambda: enclosed_mesh(self.bundle, name)))
+                tests.append((i, j, mesh,
+                              self.bundle.array(name, 'lod_convex_offsets'),
+                              self.bundle.array(name, 'bounds').astype(np.float64)))
+        pairs = sorted({tuple(sorted((LINKS[i], LINKS[j]), key=LINKS.index)) for i, j, *_ in tests})
+        print(f"        Links: {', '.join(f'{link} {np.count_nonzero(self.point_links == i)}' for i, link in enumerate(LINKS))} points; "
+              f"self-collision pairs: {', '.join('-'.join(pair) for pair in pairs)}")
+        return tests
+    
+    def _self_collisions(self, frames):
+        """Points of one link inside another, per tested link pair"""
+        counts = {}
+        for i, j, mesh, offsets, (lo, hi) in self.self_collision_tests:
+            relative = np.linalg.inv(frames[j]) @ frames[i]
+            if self.grid is None:
+                local = self.robot_points[self.point_links == i]
+            else:
+                local = self.robot_points[self.grid.candidates(np.linalg.inv(frames[j]) @ frames,
+                                                               lo, hi, group=i)]
+            local = local @ relative[:3, :3].T + relative[:3, 3]
+            # Only points inside the link's convex pieces can be inside its mesh
+            local = local[inside_level(local, offsets)]
+            pair = '-'.join(sorted((LINKS[i], LINKS[j]), key=LINKS.index))
+            if not len(local):
+                counts.setdefault(pair, 0)
+            elif self.inside == 'bvh':
+                counts[pair] = counts.get(pair, 0) + int(np.count_nonzero(mesh.inside(local)))
+            else:
+                counts[pair] = counts.get(pair, 0) + mesh.inside_points(local).size
+        return counts
+    
+    def _obstacle_poses(self, table_vertical_m, table_longitudinal_m, table_transverse_m):
+        """Per-check transforms of the obstacles that are not pre-placed"""
+        return table_poses(table_vertical_m, table_longitudinal_m, table_transverse_m)
+    
+    def _count_inside_points(self, frames, poses):
+        """
+        C-arm points inside each obstacle mesh (via its coarse level if selected)
+        
+        Args:
+            frames: (links, 4, 4) world frames of self.link_names
+        
+        Returns:
+            {obstacle: (links,) point counts}
+        """
+        counts = {}
+        timer = self.timer
+        for name, (mesh, placed) in self.obstacles.items():
+            to_model = self.world_to_model[name] if placed else np.linalg.inv(poses[name])
+            relative = to_model @ frames
+            lo, hi = self.obstacle_bounds[name]
+            if self.coherence is None:
+                ids = (np.arange(len(self.robot_points)) if self.grid is None
+                       else self.grid.candidates(relative, lo, hi))
+            else:
+                # Points the pose change may have brought inside the bounding polytope;
+                # cells clear of the obstacle's box keep their gap as the bound
+                ids = self.coherence.candidates(name, relative if self.links else relative[0])
+                bounds = (np.zeros(ids.size) if self.grid is None
+                          else self.grid.point_gaps(relative, lo, hi)[ids])
+                near = bounds <= PLANE_TOLERANCE
+                local = transform_points(self.robot_points[ids[near]], relative,
+                                         self.point_links[ids[near]])
+                bounds[near] = clearance_bounds(local, self.dop_offsets[name])
+                self.coherence.update(name, ids, bounds)
+                ids = ids[bounds <= PLANE_TOLERANCE]
+            if name in self.pruned_points:
+                ids = ids[~self.pruned_points[name][ids]]
+            
+            if name in self.lods and ids.size:
+                # Only points inside the conservative level can hit the mesh
+                local = transform_points(self.robot_points[ids], relative, self.point_links[ids])
+                ids = ids[inside_level(local, self.lods[name])]
+                if not self.confirm:
+                    counts[name] = np.bincount(self.point_links[ids], minlength=len(frames))
+                    if timer:
+                        timer.lap('broad')
+                    continue
+            if timer:
+                timer.lap('broad')
+            if ids.size and self.inside == 'bvh':
+                local = transform_points(self.robot_points[ids], relative, self.point_links[ids])
+                if timer:
+                    timer.lap('transform')
+                ids = ids[self.point_tests[name].inside(local)]
+            elif ids.size:
+                points = transform_points(self.robot_points[ids], frames, self.point_links[ids])
+                if not placed:
+                    mesh = mesh.placed(poses[name])
+                if timer:
+                    timer.lap('transform')
+                ids = ids[mesh.inside_points(points)]
+            if timer:
+                timer.lap(f'narrow.{name}')
+            counts[name] = np.bincount(self.point_links[ids], minlength=len(frames))
+        return counts
     
-    def _get_table_base_transform(self):
-        """Get transformation from C-arm base to table base"""
-        transform = np.eye(4)
-        transform[0, 3] = 0.4
-        transform[1, 3] = 1.35
-        return transform
+    def _query_convex(self, c_arm_pose, poses):
+        """GJK/EPA contacts per obstacle, skipping obstacles the coherence cache rules out"""
+        world = dict(self.static_poses, **poses)
+        names = OBSTACLES
+        if self.coherence is not None:
+            names = [name for name in OBSTACLES
+                     if self.coherence.candidates(name, np.linalg.inv(world[name]) @ c_arm_pose).size]
+        
+        contacts = self.convex_engine.query(c_arm_pose, world, names=names)
+        for name in OBSTACLES:
+            if self.coherence is None:
+                continue
+            if name in contacts:
+                self.coherence.update(name, 0, contacts[name]['distance'])
+            else:
+                contacts[name] = {'intersecting': False, 'pairs': 0,
+                                  'distance': self.coherence.clearance(name), 'depth': 0.0}
+        return contacts
     
     def check_collision(self, lao_rao_deg, cran_caud_deg, wigwag_deg=0, 
                         lateral_m=0, vertical_m=0, horizontal_m=0,
-                        table_vertical_m=0, table_longitudinal_m=0, table_transverse_m=0):
-        """Check collision using DH transformations for 9 DOF (6 C-arm + 3 table)"""
+                        table_vertical_m=0, table_longitudinal_m=0, table_transverse_m=0,
+                        scene_id=None):
+        """
+        Check collision using DH transformations for 9 DOF (6 C-arm + 3 table)
+        
+        Args:
+            scene_id: Scene to check in (default: this server's scene); other
+                      scenes are served by their resident servers
+        """
+        if scene_id is not None and scene_id != self.scene:
+            return self.scenes.get(scene_id).check_collision(
+                lao_rao_deg, cran_caud_deg, wigwag_deg, lateral_m, vertical_m, horizontal_m,
+                table_vertical_m, table_longitudinal_m, table_transverse_m)
+        
         self.check_count += 1
+        timer = self.timer
+        if timer:
+            timer.start()
         
         # Calculate C-arm pose using DH transformation WITHOUT wigwag
         # Wigwag will be applied as rotation around origin
@@ -73,7 +652,11 @@ class CollisionServer:
         )
         
         # Apply wigwag as pure rotation to orientation only (no position change)
-        if abs(wigwag_deg) > 0.01:
+        if self.links:
+            # Same chain arguments; the other links follow the C-shape's wigwag
+            frames = link_frames(horizontal_m, vertical_m, wigwag_deg, lateral_m, cran_caud_deg, lao_rao_deg)
+            c_arm_pose = frames[LINKS.index('c_arm')]
+        elif abs(wigwag_deg) > 0.01:
             wigwag_rad = np.radians(wigwag_deg)
             cos_w = np.cos(wigwag_rad)
             sin_w = np.sin(wigwag_rad)
@@ -88,86 +671,29 @@ class CollisionServer:
             # Apply rotation to orientation only (no position change)
             c_arm_pose[:3, :3] = rot_z[:3, :3] @ c_arm_pose[:3, :3]
         
-        # Transform C-arm point cloud
-        c_arm_pc_cpy = self.c_arm_pc.clone()
-        c_arm_pc_cpy.apply_transform(T=c_arm_pose, reset=False, concatenate=False)
-        
-        # Calculate table poses based on current DOF
-        # Table top uses full DH transformation (no trend/tilt yet)
-        transf_table_base_to_ee = calc_transf_mat_table_base_to_ee(
-            table_vertical_m, 0.0, 0.0,  # vertical, trend=0, tilt=0
-            table_longitudinal_m, table_transverse_m
-        )
-        table_top_pose = self.transf_c_arm_base_to_table_base @ transf_table_base_to_ee
-        
-        # Table body pose (extends upward with vertical movement)
-        # Z-axis is vertical in world frame (after 90° Y rotation)
-        transf_c_arm_base_to_table_body = np.eye(4)
-        transf_c_arm_base_to_table_body[0, 3] = 0.4
-        transf_c_arm_base_to_table_body[1, 3] = 1.35
-        transf_c_arm_base_to_table_body[2, 3] = table_vertical_m  # Extends upward in Z
-        
-        # Table wheels base pose (stays on ground - does NOT move vertically)
-        transf_c_arm_base_to_table_wheels_base = np.eye(4)
-        transf_c_arm_base_to_table_wheels_base[0, 3] = 0.4 - 0.15
-        transf_c_arm_base_to_table_wheels_base[1, 3] = 1.35  # Fixed height
-        transf_c_arm_base_to_table_wheels_base[2, 3] = 0.0  # Fixed Z
-        
-        # Transform table meshes (using copies)
-        table_top_mesh_cpy = self.table_top_mesh.clone()
-        table_top_mesh_cpy.apply_transform(T=table_top_pose, reset=False, concatenate=False)
-        
-        table_body_mesh_cpy = self.table_body_mesh.clone()
-        table_body_mesh_cpy.apply_transform(T=transf_c_arm_base_to_table_body, reset=False, concatenate=False)
-        
-        table_wheels_base_mesh_cpy = self.table_wheels_base_mesh.clone()
-        table_wheels_base_mesh_cpy.apply_transform(T=transf_c_arm_base_to_table_wheels_base, reset=False, concatenate=False)
-        
-        # Transform patient mesh (external transform from main.x3d only)
-        # Internal X3D transform is already baked into the PLY file
-        patient_mesh_cpy = self.patient_mesh.clone()
-        
-        # External transform from main.x3d: translation='0.22 -0.15 -0.2' scale="-1.35 1.35 -1.35"
-        # Plus 90-degree rotation around Z-axis to align with table
-        patient_transform = np.eye(4)
-        
-        # Apply 270-degree Z rotation (to flip head/feet orientation)
-        cos_z = np.cos(3 * np.pi / 2)
-        sin_z = np.sin(3 * np.pi / 2)
-        patient_transform[0, 0] = cos_z
-        patient_transform[0, 1] = -sin_z
-        patient_transform[1, 0] = sin_z
-        patient_transform[1, 1] = cos_z
-        
-        # Apply translation
-        patient_transform[0, 3] = 0.3  # X translation
-        patient_transform[1, 3] = 1.35   # left right
-        patient_transform[2, 3] = 0.8   # up
-        
-        # Apply scale (need to combine with rotation) - matches visualizer
-        scale_transform = np.eye(4)
-        scale_transform[0, 0] = -1.0  # X scale
-        scale_transform[1, 1] = 1.0   # Y scale
-        scale_transform[2, 2] = -1.0  # Z scale
-        
-        patient_transform = patient_transform @ scale_transform
-        
-        patient_mesh_cpy.apply_transform(T=patient_transform, reset=False, concatenate=False)
-        
-        # Check for collision (C-arm points inside table meshes + patient)
-        table_top_collision_pcd = table_top_mesh_cpy.inside_points(c_arm_pc_cpy.points(), return_ids=False)
-        table_body_collision_pcd = table_body_mesh_cpy.inside_points(c_arm_pc_cpy.points(), return_ids=False)
-        table_base_collision_pcd = table_wheels_base_mesh_cpy.inside_points(c_arm_pc_cpy.points(), return_ids=False)
-        patient_collision_pcd = patient_mesh_cpy.inside_points(c_arm_pc_cpy.points(), return_ids=False)
+        poses = self._obstacle_poses(table_vertical_m, table_longitudinal_m, table_transverse_m)
+        if timer:
+            timer.lap('fk')
+        if self.engine == 'gjk':
+            contacts = self._query_convex(c_arm_pose, poses)
+            if timer:
+                timer.lap('narrow.gjk')
+            counts = {name: contact['pairs'] for name, contact in contacts.items()}
+        else:
+            link_counts = self._count_inside_points(frames if self.links else c_arm_pose[None], poses)
+            counts = {name: int(per_link.sum()) for name, per_link in link_counts.items()}
         
         # Count collision points
-        top_count = table_top_collision_pcd.points().shape[0]
-        body_count = table_body_collision_pcd.points().shape[0]
-        base_count = table_base_collision_pcd.points().shape[0]
-        patient_count = patient_collision_pcd.points().shape[0]
+        top_count = counts['table_top']
+        body_count = counts['table_body']
+        base_count = counts['table_base']
+        patient_count = counts['patient']
         total_count = top_count + body_count + base_count + patient_count
         
-        has_collision = total_count > 0
+        self_counts = self._self_collisions(frames) if self.links else {}
+        if timer and self.links:
+            timer.lap('self_collision')
+        has_collision = total_count > 0 or any(self_counts.values())
         
         result = {
             'collision': has_collision,
@@ -189,47 +715,163 @@ class CollisionServer:
                 'table_longitudinal': table_longitudinal_m,
                 'table_transverse': table_transverse_m
             },
+            'scene_id': self.scene,
             'check_count': self.check_count
         }
+        detail = f"pts: {total_count}"
+        if self.links:
+            result['links'] = {link: {name: int(link_counts[name][i]) for name in OBSTACLES}
+                               for i, link in enumerate(LINKS)}
+            result['self_collision'] = self_counts
+            result['home_contacts'] = self.home_contacts
+            detail += "".join(f", {pair}: {count}" for pair, count in self_counts.items() if count)
+        if self.engine == 'gjk':
+            result['engine'] = self.engine
+            result['contacts'] = {name: {'distance': contact['distance'], 'depth': contact['depth']}
+                                  for name, contact in contacts.items()}
+            clearance = min(contact['distance'] for contact in contacts.values())
+            depth = max(contact['depth'] for contact in contacts.values())
+            detail = (f"pairs: {total_count}, depth: {depth * 1000:.0f}mm" if has_collision
+                      else f"clearance: {clearance * 1000:.0f}mm")
         
         # Print status
         status = "COLLISION" if has_collision else "SAFE"
-        print(f"[Check #{self.check_count}] C-arm: ORB={lao_rao_deg:5.1f}° TILT={cran_caud_deg:5.1f}° " +
+        scene = f" [{self.scene}]" if self.scene != DEFAULT_SCENE else ""
+        print(f"[Check #{self.check_count}]{scene} C-arm: ORB={lao_rao_deg:5.1f}° TILT={cran_caud_deg:5.1f}° " +
               f"WIG={wigwag_deg:5.1f}° LAT={lateral_m:5.2f}m VER={vertical_m:5.2f}m HOR={horizontal_m:5.2f}m | " +
               f"Table: V={table_vertical_m:5.2f}m L={table_longitudinal_m:5.2f}m T={table_transverse_m:5.2f}m → " +
-              f"{status:9s} (pts: {total_count})")
+              f"{status:9s} ({detail})")
         
+        if timer:
+            timer.lap('result')
+            result['timing'] = timer.finish()
+            if self.check_count % TIMING_REPORT_EVERY == 0:
+                self.print_timing_stats()
         return result
     
-    def run_server(self, pose_file='collision_pose.json', result_file='collision_result.json'):
+    def print_coherence_stats(self):
+        """Hit rates of the temporal coherence fast path"""
+        if self.coherence is None or not self.coherence.counters:
+            return
+        print("Temporal coherence (narrow phase skipped / on a subset / entries tested):")
+        for name, stats in self.coherence.stats().items():
+            print(f"        {name:12s} {stats['skip_rate'] * 100:5.1f}% / "
+                  f"{stats['restrict_rate'] * 100:5.1f}% / {stats['tested_fraction'] * 100:5.1f}% "
+                  f"of {stats['queries']} checks")
+    
+    def print_timing_stats(self):
+        """Rolling latency percentiles per check stage (ms)"""
+        if self.timer is None or not self.timer.histograms:
+            return
+        print(f"Stage latency over the last {self.timer.window} checks (p50 / p95 / p99 ms):")
+        for stage, stats in self.timer.stats().items():
+            print(f"        {stage:20s} {stats['p50']:7.2f} / {stats['p95']:7.2f} / {stats['p99']:7.2f}"
+                  f"  ({stats['count']} samples)")
+    
+    def _metrics_registry(self, pool=None):
+        """Request, latency and cache metrics of this server and its resident scenes
+        (and of its worker pool)"""
+        metrics = MetricsRegistry('collision')
+        metrics.counter('requests_total', 'Pose requests checked')
+        metrics.counter('dropped_requests_total', 'Pose requests that could not be read or checked')
+        metrics.counter('coalesced_requests_total',
+                        'Checks whose pose file was rewritten before the result was written')
+        metrics.gauge('pending_requests', 'Pose updates waiting behind the running check (0 or 1)')
+        metrics.histogram('check_seconds', 'check_collision() time')
+        metrics.histogram('pose_to_result_seconds', 'Pose timestamp (slider move) to result written')
+        metrics.histogram('stage_seconds', 'Check time by stage (with --timing)')
+        metrics.gauge_family('resident_scenes', 'Scenes loaded in this process',
+                             lambda: [({}, len(self.scenes.resident))])
+        
+        def coherence_ratios(key):
+            return [({'scene': scene_id, 'obstacle': name}, stats[key])
+                    for scene_id, server in self.scenes.resident.items() if server.coherence is not None
+                    for name, stats in server.coherence.stats().items()]
+        metrics.gauge_family('coherence_skip_ratio',
+                             'Checks whose narrow phase the coherence cache skipped, per obstacle',
+                             lambda: coherence_ratios('skip_rate'))
+        metrics.gauge_family('coherence_tested_ratio',
+                             'Fraction of cached entries re-tested, per obstacle',
+                             lambda: coherence_ratios('tested_fraction'))
+        if pool is not None:
+            metrics.histogram('pool_wait_seconds', 'Time requests waited for a pool worker, per priority')
+            metrics.histogram('pool_request_seconds', 'Pool request time including the wait, per priority')
+            metrics.gauge_family('pool_queued_requests', 'Requests waiting for a pool worker, per priority',
+                                 lambda: [({'priority': p}, n) for p, n in pool.queued().items()])
+            
+            def observe(priority, wait_s, total_s):
+                metrics.observe('pool_wait_seconds', wait_s, priority=priority)
+                metrics.observe('pool_request_seconds', total_s, priority=priority)
+            pool.on_complete = observe
+        return metrics
+    
+    def run_server(self, pose_file='collision_pose.json', result_file='collision_result.json',
+                   metrics_port=COLLISION_METRICS_PORT, trace=None, profile=None,
+                   pose_bus=DEFAULT_BUS_FILE, result_slot=DEFAULT_SLOT_FILE, pool=None):
         """
-        Run server loop: read pose file, check collision, write result file
+        Run server loop: wait for a pose, check collision, publish the result
+        
+        Args:
+            pose_file: Pose JSON, polled until H3D publishes on the pose bus
+            metrics_port: Port of the /metrics endpoint on 127.0.0.1 (None to
+                          disable, see ServerMetrics.py)
+            trace: Append every pose read to this trace (see PoseTrace.py,
+                   replay with replay_trace.py)
+            profile: Sample the loop for this many seconds from the start;
+                     windows can also be started at any time by signal or
+                     profile_request.json (see SamplingProfiler.py)
+            pose_bus: Shared-memory pose bus (see PoseBus.py), None to poll
+                      pose_file only
+            result_slot: Shared-memory result slot (see ResultSlot.py), None
+                         to write result_file only
+            pool: CollisionWorkerPool to check poses in, as interactive
+                  requests (None: check in this process)
         """
-        print(f"Monitoring: {pose_file}")
-        print(f"Writing to: {result_file}\n")
+        subscriber = PoseSubscriber(pose_bus, pose_file, sleep=idle)
+        slot_writer = ResultSlotWriter(result_slot) if result_slot else None
+        print(f"Monitoring: {pose_bus + ' (pose bus), ' if pose_bus else ''}{pose_file}")
+        print(f"Writing to: {result_slot + ' (result slot), ' if result_slot else ''}{result_file}")
+        trace_writer = PoseTraceWriter(trace) if trace else None
+        if trace_writer is not None:
+            print(f"Recording poses to: {trace}")
+        profiling = ProfileControl('collision')
+        profile_signal = profiling.install_signal()
+        print(f"Profiling on request: {PROFILE_REQUEST_FILE}"
+              f"{f' or signal {profile_signal.name}' if profile_signal else ''}")
+        if profile:
+            profiling.start(profile)
+        metrics = self._metrics_registry(pool)
+        heartbeat = Heartbeat()
+        if metrics_port is not None:
+            endpoint = start_metrics_server(metrics.render, metrics_port, health=heartbeat.health)
+            print(f"Metrics: http://127.0.0.1:{endpoint.server_address[1]}/metrics")
+        print()
         
-        last_check_time = 0
-        check_interval = 0.1  # Check every 100ms
+        check_interval = 0.1  # Longest wait between profiling-request checks
+        coalesced = 0
         
         try:
             while True:
-                time.sleep(check_interval)
-                
-                # Check if pose file exists and was recently modified
-                pose_path = Path(pose_file)
-                if not pose_path.exists():
-                    continue
+                messages = subscriber.wait(check_interval)
+                heartbeat.beat()
+                profiling.poll()
                 
-                mod_time = pose_path.stat().st_mtime
-                if mod_time <= last_check_time:
+                # Newest pose; overtaken ones were coalesced by the subscriber
+                poses = [value for kind, value in messages if kind == 'pose']
+                for kind, reason in messages:
+                    if kind == 'dropped':
+                        print(f"ERROR reading pose: {reason}")
+                        metrics.inc('dropped_requests_total')
+                if subscriber.coalesced > coalesced:
+                    metrics.inc('coalesced_requests_total', subscriber.coalesced - coalesced)
+                    coalesced = subscriber.coalesced
+                if not poses:
                     continue
+                pose_data = poses[-1]
                 
-                last_check_time = mod_time
-                
-                # Read pose
                 try:
-                    with open(pose_file, 'r') as f:
-                        pose_data = json.load(f)
+                    if trace_writer is not None:
+                        trace_writer.record(pose_data, pose_data.get('scene_id'))
                     
                     # Extract all 6 C-arm DOF
                     lao_rao = pose_data.get('lao_rao', 0.0)
@@ -244,40 +886,167 @@ class CollisionServer:
                     table_longitudinal = pose_data.get('table_longitudinal', 0.0)
                     table_transverse = pose_data.get('table_transverse', 0.0)
                     
-                    # Check collision
-                    result = self.check_collision(
-                        lao_rao, cran_caud, wigwag,
-                        lateral, vertical, horizontal,
-                        table_vertical, table_longitudinal, table_transverse
-                    )
+                    # Check collision (in the requested scene, optional)
+                    started = time.perf_counter()
+                    if pool is not None:
+                        # Interactive class: batch work on the pool cannot delay it
+                        result = pool.check(pose_data, 'interactive')
+                    else:
+                        result = self.check_collision(
+                            lao_rao, cran_caud, wigwag,
+                            lateral, vertical, horizontal,
+                            table_vertical, table_longitudinal, table_transverse,
+                            scene_id=pose_data.get('scene_id')
+                        )
+                    
+                    checked = time.perf_counter()
+                    
+                    # Publish result, tagged with the client's request ID
+                    if pose_data.get('request_id'):
+                        result['request_id'] = pose_data['request_id']
+                    if slot_writer is not None:
+                        slot_writer.publish(result, pose_data.get('request_id'))
+                    write_result_file(result_file, result)
+                    # A pool worker timed the check; its stages are not kept here
+                    if pool is None:
+                        server = self.scenes.get(result['scene_id'])
+                        if server.timer:
+                            server.timer.record('serialize', time.perf_counter() - checked)
                     
-                    # Write result
-                    with open(result_file, 'w') as f:
-                        json.dump(result, f, indent=2)
+                    metrics.inc('requests_total')
+                    metrics.observe('check_seconds', checked - started)
+                    metrics.observe('pose_to_result_seconds', time.time() - pose_data['timestamp'])
+                    for stage, ms in result.get('timing', {}).get('stages_ms', {}).items():
+                        metrics.observe('stage_seconds', ms / 1000, stage=stage)
                 
                 except Exception as e:
                     print(f"ERROR processing request: {e}")
+                    metrics.inc('dropped_requests_total')
                     continue
+                
+                metrics.set('pending_requests', int(subscriber.pending()))
         
         except KeyboardInterrupt:
             print("\n\nServer stopped by user.")
-            print(f"Total collision checks performed: {self.check_count}")
+            for scene_id, server in self.scenes.resident.items():
+                print(f"Total collision checks performed ({scene_id}): {server.check_count}")
+                server.print_coherence_stats()
+                server.print_timing_stats()
+            if pool is not None:
+                pool.print_stats()
             print("=" * 70)
+        
+        finally:
+            profiling.stop()
+            subscriber.close()
+            if slot_writer is not None:
+                slot_writer.close()
+            if trace_writer is not None:
+                trace_writer.close()
 
 def main():
     """Main entry point"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Collision detection server')
+    parser.add_argument('--bundle', type=str, default=DEFAULT_BUNDLE,
+                        help=f'Compiled scene bundle (default: {DEFAULT_BUNDLE})')
+    parser.add_argument('--fidelity', type=str, default=None,
+                        help=f"Obstacle model: one of {', '.join(FIDELITY_LEVELS)} for all "
+                             f"obstacles or per obstacle, e.g. 'patient=convex,table_body=dop' "
+                             f"(default: full)")
+    parser.add_argument('--no-confirm', action='store_true',
+                        help='Report coarse-level counts without confirming on the full meshes')
+    parser.add_argument('--no-coherence', action='store_true',
+                        help='Check every pose from scratch instead of reusing the previous clearance')
+    parser.add_argument('--engine', choices=ENGINES, default='points',
+                        help='Narrow phase: C-arm points inside meshes, or GJK/EPA on convex '
+                             'pieces (default: points)')
+    parser.add_argument('--no-grid', action='store_true',
+                        help='Test every C-arm point instead of rejecting whole spatial-hash cells')
+    parser.add_argument('--inside', choices=INSIDE_TESTS, default='vtk',
+                        help='Inside test of the points engine: VTK, or numpy ray parity over '
+                             'triangle hierarchies (default: vtk)')
+    parser.add_argument('--scene', type=str, default=DEFAULT_SCENE,
+                        help=f"Scene for requests without a 'scene_id' (default: {DEFAULT_SCENE})")
+    parser.add_argument('--scenes', type=str, default=DEFAULT_SCENES,
+                        help=f'Scene definitions (default: {DEFAULT_SCENES})')
+    parser.add_argument('--preload', type=str, default='',
+                        help="Comma-separated scenes to load at startup instead of on their "
+                             "first request, or 'all'")
+    parser.add_argument('--links', action='store_true',
+                        help='Check every C-arm link on its own DH frame, including self-collision '
+                             '(points engine only)')
+    parser.add_argument('--timing', action='store_true',
+                        help="Time every check by stage; adds 'timing' to the results and prints "
+                             f"rolling p50/p95/p99 every {TIMING_REPORT_EVERY} checks")
+    parser.add_argument('--metrics-port', type=int, default=COLLISION_METRICS_PORT,
+                        help='Port of the Prometheus-style /metrics endpoint on 127.0.0.1, 0 to '
+                             f'disable (default: {COLLISION_METRICS_PORT})')
+    parser.add_argument('--record-trace', type=str, default=None,
+                        help='Append every incoming pose to this binary trace (replay with '
+                             'replay_trace.py)')
+    parser.add_argument('--profile', type=float, default=None, metavar='SECONDS',
+                        help='Sample the server loop for SECONDS from the start and write '
+                             'collapsed stacks to profiles/ (later windows: profile_server.py)')
+    parser.add_argument('--no-pose-bus', action='store_true',
+                        help='Poll collision_pose.json and write collision_result.json only, '
+                             'without the shared-memory pose bus and result slot')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Check in this many pre-forked worker processes; the first only takes '
+                             'interactive requests (default: 0, check in the server process)')
+    parser.add_argument('--check-port', type=int, default=COLLISION_CHECK_PORT,
+                        help='Port of the POST /check endpoint of the worker pool for batch clients '
+                             f'such as workspace_analysis.py --server, 0 to disable (default: {COLLISION_CHECK_PORT})')
+    parser.add_argument('--startup-report', action='store_true',
+                        help='Print the time to ready split into imports, bundle loading and '
+                             'acceleration-structure builds')
+    args = parser.parse_args()
+    
     # Initialize server
+    startup = StartupReport(IMPORT_STARTED)
+    startup.add('import', IMPORT_SECONDS)
     try:
-        server = CollisionServer()
+        server = CollisionServer(args.bundle, args.fidelity, confirm=not args.no_confirm,
+                                 engine=args.engine, coherence=not args.no_coherence, links=args.links,
+                                 grid=not args.no_grid, inside=args.inside, scene=args.scene,
+                                 scenes=SceneRegistry(args.scenes), timing=args.timing,
+                                 startup=startup)
+        preload = server.scenes.ids() if args.preload == 'all' else \
+            [scene_id for scene_id in args.preload.split(',') if scene_id]
+        for scene_id in preload:
+            server.scenes.get(scene_id)
     except Exception as e:
         print(f"\nERROR: Failed to initialize server: {e}")
         print("\nMake sure you have installed required packages:")
         print("  pip install numpy vedo")
         print("\nAnd that 3D mesh files exist in 3d_inputs/ directory")
         sys.exit(1)
+    if args.startup_report:
+        startup.print_report('Startup')
+    
+    # Workers are forked from the loaded server and share its geometry
+    pool = None
+    if args.workers:
+        factory = functools.partial(CollisionServer, args.bundle, args.fidelity,
+                                    confirm=not args.no_confirm, engine=args.engine,
+                                    coherence=not args.no_coherence, links=args.links,
+                                    grid=not args.no_grid, inside=args.inside, scene=args.scene,
+                                    scenes=SceneRegistry(args.scenes), timing=args.timing)
+        pool = CollisionWorkerPool(factory, workers=args.workers, server=server)
+        print(f"Worker pool: {pool.workers} processes ({pool.start_method})")
+        if args.check_port:
+            endpoint = start_check_server(pool, args.check_port)
+            print(f"Batch checks: POST http://127.0.0.1:{endpoint.server_address[1]}/check")
     
     # Run server loop
-    server.run_server()
+    try:
+        server.run_server(metrics_port=args.metrics_port or None, trace=args.record_trace,
+                          profile=args.profile, pose_bus=None if args.no_pose_bus else DEFAULT_BUS_FILE,
+                          result_slot=None if args.no_pose_bus else DEFAULT_SLOT_FILE, pool=pool)
+    finally:
+        if pool is not None:
+            pool.close()
 
 if __name__ == '__main__':
     main()
@@ -6,13 +6,13 @@ Press SPACEBAR to update from collision_pose.json
 
 import numpy as np
 import vedo
-import json
-from pathlib import Path
 import sys
 import os
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'lib'))
 from TransformationMats import calc_transf_mat_c_arm_base_to_ee
+from collision_server import open_scene_bundle, bundle_mesh
+from PoseBus import PoseSubscriber, DEFAULT_BUS_FILE
 
 class SimpleCollisionVisualizer:
     def __init__(self):
@@ -22,7 +22,7 @@ class SimpleCollisionVisualizer:
         
         self._load_models()
         self.check_count = 0
-        self.last_mod_time = 0
+        self.poses = PoseSubscriber(DEFAULT_BUS_FILE, 'collision_pose.json')
         
         print("\n" + "=" * 70)
         print("VISUALIZER READY")
@@ -32,49 +32,41 @@ class SimpleCollisionVisualizer:
         print("=" * 70 + "\n")
     
     def _load_models(self):
-        """Load all 3D models and meshes"""
+        """Load all 3D models and meshes from the compiled scene bundle"""
         print("\n[1/5] Loading C-arm point cloud...")
-        c_arm_pts = np.load('3d_inputs/c_arm_pcd_pts.npy')
+        self.bundle = open_scene_bundle()
+        c_arm_pts = self.bundle.array('c_arm', 'points')
         self.c_arm_pc = vedo.Points(c_arm_pts).color('cyan').point_size(3)
         print(f"        Loaded {c_arm_pts.shape[0]} points")
         
         print("\n[2/5] Loading table top mesh...")
-        self.table_top_mesh = vedo.load('3d_inputs/table_top_watertight_mesh.ply')
+        self.table_top_mesh = bundle_mesh(self.bundle, 'table_top')
         self.table_top_mesh.color('orange').alpha(0.8)
         print(f"        Loaded {self.table_top_mesh.npoints} vertices")
         
         print("\n[3/5] Loading table body mesh...")
-        self.table_body_mesh = vedo.load('3d_inputs/table_body_sphere_watertight_mesh.ply')
+        self.table_body_mesh = bundle_mesh(self.bundle, 'table_body')
         self.table_body_mesh.color('red').alpha(0.7)
         print(f"        Loaded {self.table_body_mesh.npoints} vertices")
         
         print("\n[4/5] Loading table wheels mesh...")
-        self.table_wheels_base_mesh = vedo.load('3d_inputs/table_wheels_base_watertight_mesh.ply')
+        self.table_wheels_base_mesh = bundle_mesh(self.bundle, 'table_base')
         self.table_wheels_base_mesh.color('darkgray').alpha(0.8)
         print(f"        Loaded {self.table_wheels_base_mesh.npoints} vertices")
         
         print("\n[5/5] Loading patient model...")
-        self.patient_mesh = vedo.load('models/patient_model.ply')
+        self.patient_mesh = bundle_mesh(self.bundle, 'patient')
         self.patient_mesh.color('beige').alpha(0.9)
         print(f"        Loaded {self.patient_mesh.npoints} vertices")
     
     def update_from_file(self):
-        """Read pose from file and return updated C-arm"""
-        pose_file = 'collision_pose.json'
-        pose_path = Path(pose_file)
-        
-        if not pose_path.exists():
-            return None
-        
-        mod_time = pose_path.stat().st_mtime
-        if mod_time <= self.last_mod_time:
+        """Take the newest published pose (pose bus or file) and return updated C-arm"""
+        poses = [value for kind, value in self.poses.wait(0) if kind == 'pose']
+        if not poses:
             return None  # No update
         
-        self.last_mod_time = mod_time
-        
         try:
-            with open(pose_file, 'r') as f:
-                pose_data = json.load(f)
+            pose_data = poses[-1]
             
             # Get C-arm pose in the format H3D uses (degrees for angles)
             lao_rao = pose_data.get('lao_rao', 0.0)  # Already in degrees
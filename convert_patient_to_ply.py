@@ -3,31 +3,15 @@ Convert patient X3D model to PLY format for collision detection
 Applies the internal X3D transformation (rotation="0 1 0 3.1415" scale="1 1 -1")
 """
 
-import xml.etree.ElementTree as ET
+import os
+import sys
 import numpy as np
 
-# Parse X3D file
-tree = ET.parse('models/patient-model.x3d')
-root = tree.getroot()
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib'))
+from X3DGeometry import read_mesh
 
-# Find IndexedFaceSet
-for elem in root.iter():
-    if 'IndexedFaceSet' in elem.tag:
-        coord_index = elem.attrib['coordIndex']
-        
-    if 'Coordinate' in elem.tag:
-        points_str = elem.attrib['point']
-
-# Parse coordinate points
-points = []
-for coord_str in points_str.split():
-    try:
-        points.append(float(coord_str))
-    except:
-        pass
-
-# Reshape to Nx3
-vertices = np.array(points).reshape(-1, 3)
+# Parse X3D file (streaming; vertices and triangles as numpy arrays)
+vertices, faces, _ = read_mesh('models/patient-model.x3d')
 print(f"Loaded {len(vertices)} vertices")
 
 # Apply transformations to make patient lie on table
@@ -63,17 +47,6 @@ transform_matrix = np.array([
 vertices = vertices @ transform_matrix.T
 print(f"Applied internal X3D transformation (no X flip to match H3D)")
 
-# Parse face indices
-faces = []
-current_face = []
-for idx_str in coord_index.split():
-    if idx_str == '-1':
-        if len(current_face) == 3:  # Only triangles
-            faces.append(current_face)
-        current_face = []
-    else:
-        current_face.append(int(idx_str))
-
 print(f"Loaded {len(faces)} triangular faces")
 
 # Write PLY file
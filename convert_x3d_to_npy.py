@@ -8,44 +8,61 @@ Supports dense surface sampling for better collision detection
 """
 
 import numpy as np
-import re
+import os
 import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib'))
+from X3DGeometry import iter_shapes
+
 # Scale factor from main.x3d: <Transform DEF='TCArmTransform' scale='1.35 1.35 1.35'>
 H3D_SCALE = 1.35
 
 # Number of points to sample from mesh surface (higher = denser point cloud)
 TARGET_POINTS = 15000  # Adjust this for density
 
-def sample_triangle(v0, v1, v2, n_samples):
+# Seed for the surface sampler so regenerated point clouds are reproducible
+SAMPLE_SEED = 0
+
+def sample_triangles(v0, v1, v2, rng):
     """
-    Sample random points uniformly on a triangle surface.
+    Sample one random point uniformly on each triangle (v0[i], v1[i], v2[i]).
     Uses barycentric coordinates for uniform sampling.
     """
     # Generate random barycentric coordinates
-    r1 = np.random.random(n_samples)
-    r2 = np.random.random(n_samples)
+    r = rng.random((len(v0), 2))
     
     # Ensure points are inside triangle (not in the other half of parallelogram)
-    mask = r1 + r2 > 1
-    r1[mask] = 1 - r1[mask]
-    r2[mask] = 1 - r2[mask]
+    flip = r.sum(axis=1) > 1
+    r[flip] = 1 - r[flip]
     
-    # Convert to Cartesian coordinates
     # P = (1 - r1 - r2) * v0 + r1 * v1 + r2 * v2
-    w0 = 1 - r1 - r2
-    points = np.outer(w0, v0) + np.outer(r1, v1) + np.outer(r2, v2)
-    
-    return points
+    return v0 + r[:, :1] * (v1 - v0) + r[:, 1:] * (v2 - v0)
+
+def triangle_areas(vertices, faces):
+    """Area of every triangle (batched cross products)"""
+    v0, v1, v2 = (vertices[faces[:, k]].astype(np.float64) for k in range(3))
+    return 0.5 * np.linalg.norm(np.cross(v1 - v0, v2 - v0), axis=1)
 
-def triangle_area(v0, v1, v2):
-    """Calculate the area of a triangle given its vertices"""
-    edge1 = v1 - v0
-    edge2 = v2 - v0
-    cross = np.cross(edge1, edge2)
-    return 0.5 * np.linalg.norm(cross)
+def poisson_disk_thin(points, radius, rng):
+    """
+    Greedy Poisson-disk thinning: keep points (in random order) that have no
+    kept neighbour closer than `radius`, giving blue-noise spacing.
+    """
+    from scipy.spatial import cKDTree
+    
+    order = rng.permutation(len(points))
+    points = points[order]
+    neighbours = cKDTree(points).query_ball_point(points, radius)
+    removed = np.zeros(len(points), dtype=bool)
+    keep = []
+    for i, near in enumerate(neighbours):
+        if not removed[i]:
+            keep.append(i)
+            removed[near] = True
+    return points[keep]
 
-def sample_mesh_surface(vertices, faces, n_points):
+def sample_mesh_surface(vertices, faces, n_points, seed=SAMPLE_SEED, blue_noise=False,
+                        oversample=4):
     """
     Sample points uniformly on a mesh surface.
     
@@ -53,40 +70,41 @@ def sample_mesh_surface(vertices, faces, n_points):
         vertices: Nx3 array of vertex positions
         faces: Mx3 array of triangle indices
         n_points: Total number of points to sample
+        seed: RNG seed (None for a different cloud on every run)
+        blue_noise: Draw `oversample` x n_points candidates and thin them with
+                    Poisson-disk sampling for uniform spacing (returns ~n_points)
         
     Returns:
         Sampled points as Nx3 array
     """
-    # Calculate area of each triangle
-    areas = np.zeros(len(faces))
-    for i, face in enumerate(faces):
-        v0, v1, v2 = vertices[face[0]], vertices[face[1]], vertices[face[2]]
-        areas[i] = triangle_area(v0, v1, v2)
+    rng = np.random.default_rng(seed)
+    faces = np.asarray(faces)
     
+    areas = triangle_areas(vertices, faces)
     total_area = areas.sum()
     if total_area == 0:
         return vertices  # Degenerate mesh, return vertices
     
-    # Number of samples per triangle (proportional to area)
-    samples_per_tri = np.round(areas / total_area * n_points).astype(int)
+    n_draw = n_points * oversample if blue_noise else n_points
+    
+    # Number of samples per triangle (proportional to area, exactly n_draw in total)
+    samples_per_tri = rng.multinomial(n_draw, areas / total_area)
     
-    # Ensure we get at least n_points total
-    while samples_per_tri.sum() < n_points:
-        # Add samples to largest triangles
-        idx = np.argmax(areas)
-        samples_per_tri[idx] += 1
+    # One barycentric draw over all sampled faces
+    sampled = faces[np.repeat(np.arange(len(faces)), samples_per_tri)]
+    points = sample_triangles(vertices[sampled[:, 0]], vertices[sampled[:, 1]],
+                              vertices[sampled[:, 2]], rng)
     
-    # Sample each triangle
-    all_points = []
-    for i, face in enumerate(faces):
-        if samples_per_tri[i] > 0:
-            v0, v1, v2 = vertices[face[0]], vertices[face[1]], vertices[face[2]]
-            points = sample_triangle(v0, v1, v2, samples_per_tri[i])
-            all_points.append(points)
+    if blue_noise:
+        # Hexagonal packing radius for n_points, shrunk because greedy random
+        # packing only reaches ~55% of hexagonal density
+        radius = 0.65 * np.sqrt(2 * total_area / (np.sqrt(3) * n_points))
+        points = poisson_disk_thin(points, radius, rng)[:n_points]
     
-    return np.vstack(all_points)
+    return points
 
-def extract_points_from_x3d(x3d_file, apply_transforms=True, dense_sampling=True):
+def extract_points_from_x3d(x3d_file, apply_transforms=True, dense_sampling=True,
+                            n_points=TARGET_POINTS, seed=SAMPLE_SEED, blue_noise=False):
     """
     Extract points from an X3D file, optionally with dense surface sampling.
     
@@ -94,91 +112,42 @@ def extract_points_from_x3d(x3d_file, apply_transforms=True, dense_sampling=True
         x3d_file: Path to the X3D file
         apply_transforms: If True, apply scale to match H3D scene
         dense_sampling: If True, sample mesh surface for denser point cloud
+        n_points: Number of surface samples (dense_sampling only)
+        seed: Sampler RNG seed
+        blue_noise: Poisson-disk thin the samples for uniform spacing
         
     Returns:
         numpy array of shape (N, 3) with all points
     """
     print(f"Reading X3D file: {x3d_file}")
     
-    with open(x3d_file, 'r', encoding='utf-8') as f:
-        content = f.read()
-    
-    # Find all point attributes in Coordinate nodes
-    point_pattern = r'<Coordinate[^>]*point="([^"]+)"'
-    point_matches = re.findall(point_pattern, content, re.DOTALL)
-    
-    # Find all IndexedFaceSet coordIndex (face indices)
-    face_pattern = r'<IndexedFaceSet[^>]*coordIndex="([^"]+)"'
-    face_matches = re.findall(face_pattern, content, re.DOTALL)
-    
+    # Stream shapes (IndexedFaceSet/IndexedTriangleSet, Coordinate DEF/USE)
     all_vertices = []
     all_faces = []
     vertex_offset = 0
     
-    for i, point_match in enumerate(point_matches):
-        # Parse vertices
-        values_str = point_match.strip()
-        values = values_str.split()
-        
-        try:
-            float_values = [float(v) for v in values]
-        except ValueError as e:
-            print(f"  Warning: Could not parse vertices in set {i+1}: {e}")
-            continue
-        
-        # Group into (x, y, z) triplets
-        num_verts = len(float_values) // 3
-        vertices = []
-        for j in range(num_verts):
-            vertices.append([float_values[j*3], float_values[j*3+1], float_values[j*3+2]])
-        
-        print(f"  Mesh {i+1}: {num_verts} vertices", end="")
-        
-        # Parse faces if available
-        if i < len(face_matches):
-            face_str = face_matches[i].strip()
-            face_indices = face_str.split()
-            
-            # Parse triangles (indices separated by -1)
-            current_face = []
-            faces = []
-            for idx_str in face_indices:
-                idx = int(idx_str)
-                if idx == -1:
-                    if len(current_face) >= 3:
-                        # Triangulate if more than 3 vertices (fan triangulation)
-                        for k in range(1, len(current_face) - 1):
-                            faces.append([
-                                current_face[0] + vertex_offset,
-                                current_face[k] + vertex_offset,
-                                current_face[k+1] + vertex_offset
-                            ])
-                    current_face = []
-                else:
-                    current_face.append(idx)
-            
-            print(f", {len(faces)} triangles")
-            all_faces.extend(faces)
-        else:
-            print("")
-        
-        all_vertices.extend(vertices)
-        vertex_offset += num_verts
+    for i, shape in enumerate(iter_shapes(x3d_file)):
+        print(f"  Mesh {i+1}: {len(shape.vertices)} vertices, {len(shape.faces)} triangles")
+        all_vertices.append(shape.vertices)
+        all_faces.append(shape.faces + vertex_offset)
+        vertex_offset += len(shape.vertices)
     
     if not all_vertices:
         print("ERROR: No vertices found in the X3D file!")
         return None
     
-    vertices_array = np.array(all_vertices, dtype=np.float32)
+    vertices_array = np.concatenate(all_vertices).astype(np.float32)
+    all_faces = np.concatenate(all_faces)
     
     print(f"\nTotal vertices: {len(vertices_array)}")
     print(f"Total triangles: {len(all_faces)}")
     
     # Either use dense sampling or just vertices
-    if dense_sampling and all_faces:
-        print(f"\nPerforming dense surface sampling ({TARGET_POINTS} target points)...")
-        faces_array = np.array(all_faces, dtype=np.int32)
-        sampled_points = sample_mesh_surface(vertices_array, faces_array, TARGET_POINTS)
+    if dense_sampling and len(all_faces):
+        print(f"\nPerforming dense surface sampling ({n_points} target points"
+              f"{', blue noise' if blue_noise else ''})...")
+        sampled_points = sample_mesh_surface(vertices_array, all_faces, n_points,
+                                             seed=seed, blue_noise=blue_noise)
         print(f"  Sampled {len(sampled_points)} points from mesh surface")
         output_points = sampled_points
     else:
@@ -203,6 +172,17 @@ def extract_points_from_x3d(x3d_file, apply_transforms=True, dense_sampling=True
     return output_points.astype(np.float32)
 
 def main():
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Convert the C-arm X3D mesh to an NPY point cloud')
+    parser.add_argument('--points', type=int, default=TARGET_POINTS,
+                        help=f'Number of surface samples (default: {TARGET_POINTS})')
+    parser.add_argument('--seed', type=int, default=SAMPLE_SEED,
+                        help=f'Sampler RNG seed (default: {SAMPLE_SEED})')
+    parser.add_argument('--blue-noise', action='store_true',
+                        help='Poisson-disk thin the samples for uniform point spacing')
+    args = parser.parse_args()
+    
     # Input and output files
     input_file = 'models/carm_c_shape.x3d'
     output_file = '3d_inputs/c_arm_pcd_pts.npy'
@@ -215,7 +195,6 @@ def main():
     # Backup existing file
     try:
         import shutil
-        import os
         if os.path.exists(output_file) and not os.path.exists(backup_file):
             shutil.copy(output_file, backup_file)
             print(f"\nBacked up existing file to: {backup_file}")
@@ -223,7 +202,8 @@ def main():
         print(f"Warning: Could not backup existing file: {e}")
     
     # Extract points
-    points = extract_points_from_x3d(input_file)
+    points = extract_points_from_x3d(input_file, n_points=args.points, seed=args.seed,
+                                     blue_noise=args.blue_noise)
     
     if points is None:
         print("\nFailed to extract points!")
@@ -1,34 +1,136 @@
 """
 DRR Server - Photorealistic X-ray Generation using DiffDRR
-Monitors collision_pose.json and generates DRR images with optional segmentation overlay
-Communicates with H3D via JSON files and PNG images
+Waits for poses and generates DRR images with optional segmentation overlay
+Communicates with H3D via a shared-memory pose bus (JSON files as fallback),
+a raw memory-mapped frame ring and PNG images
 """
 
 import torch
 import numpy as np
 from PIL import Image
-import json
 import time
 import sys
+import os
 from pathlib import Path
 import colorsys
+import contextlib
 
 from diffdrr.drr import DRR
 from diffdrr.data import load_example_ct
+from diffdrr.pose import convert
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib'))
+from DRRFrameBuffer import FrameRingWriter, DEFAULT_HEADER_FILE
+from CTVolumeCache import CTVolumeCache, DEFAULT_CACHE_DIR
+from CTVolumeIngest import ingest_volume
+from PoseTrace import PoseTraceWriter
+from PoseBus import PoseSubscriber, DEFAULT_BUS_FILE
+from ResultSlot import replace_file
+from SamplingProfiler import ProfileControl, PROFILE_REQUEST_FILE, idle
+from ServerMetrics import MetricsRegistry, Heartbeat, start_metrics_server, DRR_METRICS_PORT
+
+
+def example_ct_sources():
+    """Files read by diffdrr's load_example_ct() (used as cache key)"""
+    import diffdrr.data
+    datadir = Path(diffdrr.data.__file__).resolve().parent / "data"
+    return [datadir / "cxr.nii.gz", datadir / "mask.nii.gz", datadir / "structures.csv"]
+
+
+def configure_torch_threads(threads=None, interop_threads=None, cpu_affinity=None):
+    """Configure CPU threading before any torch work starts.
+    
+    Args:
+        threads: Intra-op thread count (None = torch default)
+        interop_threads: Inter-op thread count (must be set before first parallel op)
+        cpu_affinity: Iterable of CPU ids to pin this process to (Linux only)
+    """
+    if cpu_affinity:
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, set(cpu_affinity))
+            print(f"        Pinned to CPUs: {sorted(cpu_affinity)}")
+        else:
+            print("        [WARNING] CPU pinning not supported on this platform")
+    if threads:
+        torch.set_num_threads(threads)
+    if interop_threads:
+        torch.set_num_interop_threads(interop_threads)
+
+
+def collimation_mask(height, shape, size=(1.0, 1.0)):
+    """Boolean (height, height) mask of the collimated X-ray field.
+    
+    Args:
+        shape: 'circle' or 'rect'
+        size: Field (width, height) as a fraction of the detector; a circle
+              uses size[0] as its diameter
+    """
+    centers = (np.arange(height) + 0.5) / height * 2.0 - 1.0  # [-1, 1] pixel centers
+    y, x = np.meshgrid(centers, centers, indexing='ij')
+    if shape == 'circle':
+        return x ** 2 + y ** 2 <= size[0] ** 2
+    if shape == 'rect':
+        return (np.abs(x) <= size[0]) & (np.abs(y) <= size[1])
+    raise ValueError(f"Unknown collimation shape '{shape}' (expected 'circle' or 'rect')")
+
+
+def parse_cpu_list(text):
+    """Parse a CPU list like '0-3,6' into a list of ids"""
+    cpus = []
+    for part in text.split(','):
+        if '-' in part:
+            start, end = part.split('-')
+            cpus.extend(range(int(start), int(end) + 1))
+        elif part:
+            cpus.append(int(part))
+    return cpus
 
 
 class DRRServer:
-    def __init__(self, height=256, sdd=1020.0, delx=2.0):
-        """Initialize DRR server with CT volume and segmentation support"""
+    def __init__(self, height=256, sdd=1020.0, delx=2.0, inference_mode=False,
+                 bf16=False, compile_renderer=False,
+                 cache_dir=DEFAULT_CACHE_DIR, volume=None, labels=None, structures=None,
+                 spacing=None, memory_budget_mb=512, collimation=None,
+                 collimation_size=(1.0, 1.0)):
+        """Initialize DRR server with CT volume and segmentation support
+        
+        Args:
+            cache_dir: Directory of the preprocessed CT cache (None = always
+                       load and preprocess the CT from scratch)
+            volume: NIfTI/NRRD CT to render instead of the DeepFluoro example
+            labels: Label map for `volume` (same voxel grid)
+            structures: CSV with group/structure/id columns for `labels`
+            spacing: Isotropic resampling spacing in mm for `volume`
+            memory_budget_mb: Memory bound for streaming/resampling `volume`
+            inference_mode: Render under torch.inference_mode instead of no_grad
+            bf16: Render with a bfloat16 density volume under autocast
+            compile_renderer: torch.compile the ray marcher (warm-up pass at startup)
+            collimation: None, 'circle' or 'rect' - only rays inside the
+                         collimated field are rendered (see set_collimation)
+            collimation_size: Field size as a fraction of the detector
+        """
         print("=" * 70)
         print("DRR SERVER - Photorealistic X-ray with Segmentation")
         print("=" * 70)
         
-        print("\n[1/3] Loading DeepFluoro CT volume with labels...")
-        self.subject = load_example_ct()
+        start_time = time.time()
+        self._mask_loader = None
+        self.ct_cache_hit = False
+        if volume is None:
+            print("\n[1/3] Loading DeepFluoro CT volume with labels...")
+            self.subject = self._load_subject(cache_dir)
+        else:
+            print(f"\n[1/3] Loading CT volume: {volume}")
+            self.subject = self._load_custom_subject(
+                cache_dir or DEFAULT_CACHE_DIR, volume, labels, structures,
+                spacing, memory_budget_mb)
         print(f"        Volume: {self.subject.volume.shape}")
-        print(f"        Mask: {self.subject.mask.shape}")
-        print(f"        Structures: {len(self.subject.structures)} anatomical labels")
+        if self.subject.mask is not None:
+            print(f"        Mask: {self.subject.mask.shape}")
+        elif self._mask_loader is not None:
+            print("        Mask: deferred until a segmentation group is activated")
+        print(f"        Structures: {len(self.subject.get('structures', []))} anatomical labels")
+        print(f"        Loaded in {time.time() - start_time:.2f}s")
         
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         print(f"\n[2/3] Using device: {self.device}")
@@ -43,16 +145,81 @@ class DRRServer:
         self.render_count = 0
         self._setup_structure_groups()
         
+        # CPU runtime settings
+        self.inference_mode = inference_mode
+        self.bf16 = False
+        self.compiled = False
+        self._density_fp32 = self.drr.density
+        self._renderer_eager = self.drr.renderer
+        print(f"\n        Threads: {torch.get_num_threads()} intra-op, "
+              f"{torch.get_num_interop_threads()} inter-op")
+        self.set_bf16(bf16)
+        self.set_collimation(collimation, collimation_size)
+        if compile_renderer:
+            self.set_compiled(True)
+        
         print("\n" + "=" * 70)
         print("SERVER READY - Waiting for pose updates")
         print(f"Segmentation categories: {list(self.structure_groups.keys())}")
         print("=" * 70 + "\n")
     
+    def _load_subject(self, cache_dir):
+        """Load the CT subject, from the memory-mapped cache when possible"""
+        if cache_dir is None:
+            return load_example_ct()
+        
+        cache = CTVolumeCache(cache_dir)
+        key = cache.key(example_ct_sources(), orientation="AP", bone_attenuation_multiplier=1.0)
+        self.ct_cache_hit = cache.has(key)
+        if not cache.has(key):
+            print(f"        Preprocessing CT into cache: {cache.entry(key)}")
+            cache.store_subject(key, load_example_ct())
+        else:
+            print(f"        Using cached CT: {cache.entry(key)}")
+        
+        if cache.has_mask(key):
+            self._mask_loader = lambda: cache.load_mask(key)
+        return cache.load_subject(key)
+    
+    def _load_custom_subject(self, cache_dir, volume, labels, structures, spacing,
+                             memory_budget_mb):
+        """Stream, resample and cache a user CT, then load it like the example CT"""
+        cache = CTVolumeCache(cache_dir)
+        sources = [p for p in (volume, labels, structures) if p is not None]
+        key = cache.key(sources, spacing=spacing, labels=labels is not None,
+                        structures=structures is not None,
+                        orientation="AP", bone_attenuation_multiplier=1.0)
+        self.ct_cache_hit = cache.has(key)
+        if not cache.has(key):
+            print(f"        Ingesting into cache: {cache.entry(key)} "
+                  f"(budget {memory_budget_mb} MB)")
+            ingest_volume(cache, key, volume, labels, structures, spacing=spacing,
+                          memory_budget_mb=memory_budget_mb)
+        else:
+            print(f"        Using cached CT: {cache.entry(key)}")
+        
+        if cache.has_mask(key):
+            self._mask_loader = lambda: cache.load_mask(key)
+        return cache.load_subject(key)
+    
+    def _ensure_mask(self):
+        """Load the label mask into the renderer on first segmentation use"""
+        if hasattr(self.drr, 'mask') or self._mask_loader is None:
+            return
+        start_time = time.time()
+        mask = torch.from_numpy(np.asarray(self._mask_loader()))
+        self.drr.register_buffer(
+            "mask", mask.to(torch.float32).squeeze().to(self.device), persistent=False
+        )
+        print(f"[Segments] Mask loaded in {(time.time() - start_time) * 1000:.0f}ms")
+    
     def _setup_structure_groups(self):
         """Setup structure groups from TotalSegmentator labels"""
-        structures = self.subject.structures
+        structures = self.subject.get('structures')
         self.structure_groups = {}
         self.structure_colors = {}
+        if structures is None:
+            return
         
         for group_name in structures['group'].unique():
             group_df = structures[structures['group'] == group_name]
@@ -61,6 +228,141 @@ class DRRServer:
         
         self._generate_colors()
     
+    def _render_context(self):
+        """Autograd/precision context for a single render"""
+        stack = contextlib.ExitStack()
+        stack.enter_context(torch.inference_mode() if self.inference_mode else torch.no_grad())
+        if self.bf16:
+            stack.enter_context(torch.autocast(device_type=self.device.type, dtype=torch.bfloat16))
+        return stack
+    
+    def set_bf16(self, enabled):
+        """Switch the density volume between float32 and bfloat16"""
+        self.drr.density = self._density_fp32.to(torch.bfloat16) if enabled else self._density_fp32
+        self.bf16 = enabled
+    
+    def set_collimation(self, shape=None, size=(1.0, 1.0)):
+        """Restrict ray marching to a circular or rectangular X-ray field.
+        
+        The mask is given in output image orientation; outside pixels stay black.
+        """
+        self.collimation = shape
+        self.collimation_size = tuple(size)
+        if shape is None:
+            self._field_mask = None
+            self._field_rays = None
+            return
+        
+        self._field_mask = collimation_mask(self.height, shape, self.collimation_size)
+        # Output images are rotated 90 degrees CCW from the detector grid
+        detector_mask = np.rot90(self._field_mask, k=-1)
+        self._field_rays = torch.from_numpy(
+            np.flatnonzero(detector_mask)).to(self.device)
+        print(f"        Collimation: {shape} {self.collimation_size} - "
+              f"{self._field_rays.numel()}/{self.height * self.height} rays "
+              f"({100.0 * self._field_rays.numel() / self.height ** 2:.0f}%)")
+    
+    def _render(self, rotations, translations, mask_to_channels=False):
+        """Render a (1, C, H, W) DRR, ray marching only the collimated field"""
+        if self._field_rays is None:
+            return self.drr(
+                rotations, translations,
+                parameterization="euler_angles",
+                convention="ZXY",
+                mask_to_channels=mask_to_channels
+            )
+        
+        pose = convert(rotations, translations,
+                       parameterization="euler_angles", convention="ZXY")
+        source, target = self.drr.detector(pose, None)
+        rays = self.drr.render(self.drr.density, source, target[:, self._field_rays],
+                               mask_to_channels)
+        
+        img = rays.new_zeros(rays.shape[0], rays.shape[1], self.height * self.height)
+        img[..., self._field_rays] = rays
+        return img.view(rays.shape[0], rays.shape[1], self.height, self.height)
+    
+    def set_compiled(self, enabled):
+        """Switch between the eager and the torch.compile'd renderer"""
+        if enabled:
+            print("        Compiling renderer (warm-up pass)...")
+            self.drr.renderer = torch.compile(self._renderer_eager)
+            start_time = time.time()
+            self.compiled = True
+            self.render_drr(0, 0)
+            print(f"        [OK] Renderer compiled in {time.time() - start_time:.1f}s")
+        else:
+            self.drr.renderer = self._renderer_eager
+            self.compiled = False
+    
+    def benchmark(self, frames=3, thread_counts=None):
+        """Measure ms/frame for each CPU runtime setting.
+        
+        Args:
+            frames: Timed renders per setting (after one untimed warm-up render)
+            thread_counts: Intra-op thread counts to compare (default: 1, half, all)
+            
+        Returns:
+            List of dicts with 'setting' and 'ms_per_frame'
+        """
+        saved = (self.inference_mode, self.bf16, self.compiled,
+                 torch.get_num_threads(), self.collimation, self.collimation_size)
+        if thread_counts is None:
+            cores = os.cpu_count() or 1
+            thread_counts = sorted({1, max(1, cores // 2), cores})
+        
+        def timed(render):
+            render()
+            start_time = time.time()
+            for _ in range(frames):
+                render()
+            return (time.time() - start_time) * 1000 / frames
+        
+        plain = lambda: self.render_drr(0, 0)
+        segmented = lambda: self.render_with_segmentation(
+            0, 0, active_groups=set(self.structure_groups))
+        
+        results = []
+        
+        def run(name, render, inference_mode=False, bf16=False, compiled=False,
+                threads=saved[3], collimation=None):
+            torch.set_num_threads(threads)
+            if collimation != self.collimation:
+                self.set_collimation(collimation, (0.8, 0.8))
+            self.inference_mode = inference_mode
+            self.set_bf16(bf16)
+            if compiled != self.compiled:
+                self.set_compiled(compiled)
+            ms = timed(render)
+            results.append({'setting': name, 'ms_per_frame': ms})
+            print(f"        {name:40s} {ms:8.1f} ms/frame")
+        
+        print(f"\nCPU runtime benchmark ({frames} frames per setting, {self.height}px)")
+        try:
+            run('no_grad fp32 (default)', plain)
+            run('inference_mode', plain, inference_mode=True)
+            run('inference_mode + bf16', plain, inference_mode=True, bf16=True)
+            run('inference_mode + torch.compile', plain, inference_mode=True, compiled=True)
+            for threads in thread_counts:
+                run(f'inference_mode, {threads} threads', plain, inference_mode=True,
+                    threads=threads)
+            run('inference_mode, segmentation (all groups)', segmented, inference_mode=True)
+            run('inference_mode, circular collimation 0.8', plain, inference_mode=True,
+                collimation='circle')
+        finally:
+            (self.inference_mode, bf16, compiled, threads,
+             collimation, collimation_size) = saved
+            torch.set_num_threads(threads)
+            if (collimation, collimation_size) != (self.collimation, self.collimation_size):
+                self.set_collimation(collimation, collimation_size)
+            self.set_bf16(bf16)
+            if compiled != self.compiled:
+                self.set_compiled(compiled)
+        
+        best = min(results, key=lambda r: r['ms_per_frame'])
+        print(f"        Fastest: {best['setting']} ({best['ms_per_frame']:.1f} ms/frame)\n")
+        return results
+    
     def _generate_colors(self):
         """Generate distinct colors for each structure."""
         # Define base hue ranges for each group
@@ -149,23 +451,22 @@ class DRRServer:
             lateral_m, vertical_m, horizontal_m, zoom
         )
         
-        with torch.no_grad():
-            img = self.drr(
-                rotations, translations,
-                parameterization="euler_angles",
-                convention="ZXY"
-            )
+        with self._render_context():
+            img = self._render(rotations, translations)
         
-        img_np = img.cpu().numpy()[0, 0]
+        img_np = img.float().cpu().numpy()[0, 0]
         
-        # Normalize to 0-255
-        img_min, img_max = img_np.min(), img_np.max()
+        # Rotate 90 degrees counter-clockwise to match H3D display orientation
+        img_np = np.rot90(img_np, k=1)
+        
+        # Normalize to 0-255 (over the collimated field only)
+        field = img_np if self._field_mask is None else img_np[self._field_mask]
+        img_min, img_max = field.min(), field.max()
         if img_max > img_min:
             img_np = (img_np - img_min) / (img_max - img_min)
-        img_uint8 = (img_np * 255).astype(np.uint8)
-        
-        # Rotate 90 degrees counter-clockwise to match H3D display orientation
-        img_uint8 = np.rot90(img_uint8, k=1)
+        if self._field_mask is not None:
+            img_np = np.where(self._field_mask, img_np, 0.0)
+        img_uint8 = (np.clip(img_np, 0, 1) * 255).astype(np.uint8)
         
         # Compensate for image flipping at certain tilt angles
         tilt = getattr(self, '_current_tilt', 0)
@@ -178,26 +479,25 @@ class DRRServer:
                                   lateral_m=0, vertical_m=0, horizontal_m=0,
                                   zoom=1.0, active_groups=None):
         """Render DRR with colored anatomical segmentation overlay"""
+        self._ensure_mask()
         rotations, translations = self.carm_pose_to_diffdrr(
             lao_rao_deg, cran_caud_deg, wigwag_deg,
             lateral_m, vertical_m, horizontal_m, zoom
         )
         
         # Render with all structure channels
-        with torch.no_grad():
-            output = self.drr(
-                rotations, translations,
-                parameterization="euler_angles",
-                convention="ZXY",
-                mask_to_channels=True  # Returns [1, num_structures+1, H, W]
-            )
+        with self._render_context():
+            # Returns [1, num_structures+1, H, W]
+            output = self._render(rotations, translations, mask_to_channels=True)
         
-        output = output.cpu().numpy()[0]  # (num_channels, H, W)
+        output = output.float().cpu().numpy()[0]  # (num_channels, H, W)
         
         # Channel 0 is the base DRR
-        drr_img = output[0]
-        drr_img = (drr_img - drr_img.min()) / (drr_img.max() - drr_img.min() + 1e-8)
-        drr_img = np.rot90(drr_img, k=1)
+        drr_img = np.rot90(output[0], k=1)
+        field = drr_img if self._field_mask is None else drr_img[self._field_mask]
+        drr_img = (drr_img - field.min()) / (field.max() - field.min() + 1e-8)
+        if self._field_mask is not None:
+            drr_img = np.where(self._field_mask, drr_img, 0.0)
         
         # Start with grayscale base
         h, w = drr_img.shape
@@ -252,53 +552,121 @@ class DRRServer:
         
         return img_uint8
     
+    def _metrics_registry(self):
+        """Request, render and cache metrics of the server loop"""
+        metrics = MetricsRegistry('drr')
+        metrics.counter('requests_total', 'Pose file updates read')
+        metrics.counter('renders_total', 'Frames rendered', mode='drr')
+        metrics.counter('renders_total', 'Frames rendered', mode='segmentation')
+        metrics.counter('dropped_requests_total', 'Pose file updates that could not be read')
+        metrics.counter('coalesced_requests_total',
+                        'Pose updates served by another frame: unchanged pose, or rewritten '
+                        'again while the previous frame rendered')
+        metrics.gauge('pending_requests', 'Pose updates waiting behind the running render (0 or 1)')
+        metrics.histogram('render_seconds', 'Ray marching time per frame')
+        metrics.histogram('publish_seconds', 'Frame publish time per output (frame ring, PNG)')
+        metrics.histogram('pose_to_frame_seconds', 'Pose timestamp (slider move) to frame published')
+        metrics.gauge('ct_cache_hit', 'CT volume loaded from the preprocessed cache (1) or built (0)',
+                      lambda: int(self.ct_cache_hit))
+        # The mask lives on the renderer: loaded with an uncached subject, or by _ensure_mask()
+        metrics.gauge('mask_loaded', 'Segmentation mask resident (1) or deferred (0)',
+                      lambda: int(hasattr(self.drr, 'mask')))
+        return metrics
+    
     def run_server(self, pose_file='collision_pose.json', 
                    output_file='drr_live.png',
                    seg_file='segmentation_settings.json',
-                   check_interval=0.1):
-        """Main server loop - monitors pose file and generates DRRs"""
-        print(f"Monitoring: {pose_file}")
+                   check_interval=0.1,
+                   frame_buffer=DEFAULT_HEADER_FILE,
+                   write_png=True,
+                   metrics_port=DRR_METRICS_PORT,
+                   trace=None,
+                   profile=None,
+                   pose_bus=DEFAULT_BUS_FILE):
+        """Main server loop - waits for poses and generates DRRs
+        
+        Args:
+            pose_file, seg_file: JSON files polled until H3D publishes on the
+                                 pose bus
+            check_interval: Longest wait for a message between
+                            profiling-request checks
+            frame_buffer: Header file of the raw frame ring (None to disable)
+            write_png: Also encode every frame to output_file (fallback for
+                       H3D builds that can only load image files)
+            metrics_port: Port of the /metrics endpoint on 127.0.0.1 (None to
+                          disable, see ServerMetrics.py)
+            trace: Append every pose read (with the active segmentation
+                   groups) to this trace (see PoseTrace.py)
+            profile: Sample the loop for this many seconds from the start;
+                     windows can also be started at any time by signal or
+                     profile_request.json (see SamplingProfiler.py)
+            pose_bus: Shared-memory pose bus (see PoseBus.py), None to poll
+                      the JSON files only
+        """
+        metrics = self._metrics_registry()
+        heartbeat = Heartbeat()
+        if metrics_port is not None:
+            endpoint = start_metrics_server(metrics.render, metrics_port, health=heartbeat.health)
+            print(f"Metrics: http://127.0.0.1:{endpoint.server_address[1]}/metrics")
+        subscriber = PoseSubscriber(pose_bus, pose_file, seg_file, sleep=idle)
+        print(f"Monitoring: {pose_bus + ' (pose bus), ' if pose_bus else ''}{pose_file}")
         print(f"Segmentation: {seg_file}")
-        print(f"Output: {output_file}")
+        print(f"Output: {output_file if write_png else '(PNG disabled)'}")
+        if frame_buffer:
+            print(f"Frame buffer: {frame_buffer}")
         print(f"Check interval: {check_interval}s\n")
         
-        last_mod_time = 0
-        last_seg_mod_time = 0
+        frame_writer = FrameRingWriter(frame_buffer) if frame_buffer else None
+        trace_writer = PoseTraceWriter(trace) if trace else None
+        if trace_writer is not None:
+            print(f"Recording poses to: {trace}")
+        profiling = ProfileControl('drr')
+        profile_signal = profiling.install_signal()
+        print(f"Profiling on request: {PROFILE_REQUEST_FILE}"
+              f"{f' or signal {profile_signal.name}' if profile_signal else ''}")
+        if profile:
+            profiling.start(profile)
+        
         last_pose = None
         active_groups = set()
+        coalesced = 0
         
         try:
             while True:
-                time.sleep(check_interval)
-                
-                seg_path = Path(seg_file)
-                if seg_path.exists():
-                    seg_mod_time = seg_path.stat().st_mtime
-                    if seg_mod_time > last_seg_mod_time:
-                        last_seg_mod_time = seg_mod_time
-                        try:
-                            with open(seg_file, 'r') as f:
-                                seg_data = json.load(f)
-                            active_groups = set(seg_data.get('active', []))
-                            print(f"[Segments] {active_groups if active_groups else 'None'}")
-                        except:
-                            pass
-                
-                pose_path = Path(pose_file)
-                if not pose_path.exists():
-                    continue
+                messages = subscriber.wait(check_interval)
+                heartbeat.beat()
+                profiling.poll()
                 
-                mod_time = pose_path.stat().st_mtime
-                if mod_time <= last_mod_time:
-                    continue
-                
-                last_mod_time = mod_time
+                refresh = resegment = False
+                poses = []
+                for kind, value in messages:
+                    if kind == 'segmentation':
+                        resegment = value != active_groups
+                        active_groups = value
+                        print(f"[Segments] {active_groups if active_groups else 'None'}")
+                        if active_groups:
+                            self._ensure_mask()
+                    elif kind == 'refresh':
+                        refresh = True
+                    elif kind == 'pose':
+                        poses.append(value)
+                    elif kind == 'dropped':
+                        metrics.inc('requests_total')
+                        metrics.inc('dropped_requests_total')
+                if subscriber.coalesced > coalesced:
+                    metrics.inc('coalesced_requests_total', subscriber.coalesced - coalesced)
+                    coalesced = subscriber.coalesced
                 
-                try:
-                    with open(pose_file, 'r') as f:
-                        pose_data = json.load(f)
-                except (json.JSONDecodeError, IOError):
+                if poses:
+                    pose_data = poses[-1]
+                    metrics.inc('requests_total')
+                elif (refresh or resegment) and last_pose is not None:
+                    # Segmentation change or refresh: render the last pose again
+                    pose_data = last_pose_data
+                else:
                     continue
+                if trace_writer is not None:
+                    trace_writer.record(pose_data, groups=active_groups)
                 
                 lao_rao = pose_data.get('lao_rao', 0.0)
                 cran_caud = pose_data.get('cran_caud', 0.0)
@@ -310,9 +678,11 @@ class DRRServer:
                 
                 current_pose = (lao_rao, cran_caud, wigwag, lateral, vertical, 
                                horizontal, zoom, tuple(sorted(active_groups)))
-                if current_pose == last_pose:
+                if current_pose == last_pose and not refresh:
+                    metrics.inc('coalesced_requests_total')
                     continue
                 last_pose = current_pose
+                last_pose_data = pose_data
                 
                 self.render_count += 1
                 start_time = time.time()
@@ -329,10 +699,27 @@ class DRRServer:
                         lateral, vertical, horizontal, zoom
                     )
                 
-                # Save image
-                Image.fromarray(img).save(output_file)
+                rendered = time.time()
+                mode = 'segmentation' if active_groups else 'drr'
+                metrics.inc('renders_total', mode=mode)
+                metrics.observe('render_seconds', rendered - start_time, mode=mode)
+                
+                # The PNG is complete before the ring announces the frame: an H3D
+                # without a raw loader reloads drr_live.png as soon as seq changes
+                if write_png:
+                    encode_start = time.time()
+                    Image.fromarray(img).save(output_file + '.tmp', format='PNG')
+                    replace_file(output_file + '.tmp', output_file)
+                    metrics.observe('publish_seconds', time.time() - encode_start, output='png')
+                if frame_writer is not None:
+                    publish_start = time.time()
+                    frame_writer.write(img)
+                    metrics.observe('publish_seconds', time.time() - publish_start, output='frame_buffer')
                 
                 render_time = (time.time() - start_time) * 1000
+                if poses:
+                    metrics.observe('pose_to_frame_seconds', time.time() - pose_data['timestamp'])
+                metrics.set('pending_requests', int(subscriber.pending()))
                 
                 # Log
                 seg_info = f" +{list(active_groups)}" if active_groups else ""
@@ -343,6 +730,14 @@ class DRRServer:
         except KeyboardInterrupt:
             print("\n\nServer stopped.")
             print(f"Total renders: {self.render_count}")
+        
+        finally:
+            profiling.stop()
+            subscriber.close()
+            if frame_writer is not None:
+                frame_writer.close()
+            if trace_writer is not None:
+                trace_writer.close()
 
 
 def main():
@@ -355,13 +750,93 @@ def main():
     parser.add_argument('--sdd', type=float, default=1020.0,
                         help='Source-to-detector distance in mm (default: 1020)')
     parser.add_argument('--interval', type=float, default=0.1,
-                        help='Check interval in seconds (default: 0.1)')
+                        help='Longest wait for a pose in seconds (default: 0.1)')
+    parser.add_argument('--cache-dir', type=str, default=DEFAULT_CACHE_DIR,
+                        help=f'Preprocessed CT cache directory (default: {DEFAULT_CACHE_DIR})')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Always load and preprocess the CT from scratch')
+    parser.add_argument('--volume', type=str, default=None,
+                        help='NIfTI/NRRD CT volume (default: DiffDRR example CT)')
+    parser.add_argument('--labels', type=str, default=None,
+                        help='NIfTI/NRRD label map on the same grid as --volume')
+    parser.add_argument('--structures', type=str, default=None,
+                        help='CSV (group, structure, id) describing --labels')
+    parser.add_argument('--spacing', type=float, default=None,
+                        help='Resample --volume to this isotropic spacing in mm')
+    parser.add_argument('--memory-budget', type=int, default=512,
+                        help='Memory budget in MB for loading --volume (default: 512)')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='Intra-op CPU threads (default: torch default)')
+    parser.add_argument('--interop-threads', type=int, default=None,
+                        help='Inter-op CPU threads (default: torch default)')
+    parser.add_argument('--cpu-affinity', type=str, default=None,
+                        help='Pin the server to CPUs, e.g. "0-3,6" (Linux only)')
+    parser.add_argument('--inference-mode', action='store_true',
+                        help='Render under torch.inference_mode')
+    parser.add_argument('--bf16', action='store_true',
+                        help='Render with a bfloat16 density volume (lower precision)')
+    parser.add_argument('--compile', action='store_true',
+                        help='torch.compile the renderer (slow warm-up at startup)')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='Report ms/frame for each CPU setting at startup')
+    parser.add_argument('--benchmark-frames', type=int, default=3,
+                        help='Timed frames per setting for --benchmark (default: 3)')
+    parser.add_argument('--collimation', choices=['none', 'circle', 'rect'], default='none',
+                        help='Only render rays inside a circular/rectangular X-ray field')
+    parser.add_argument('--collimation-size', type=str, default='1.0',
+                        help='Field size as fraction of the detector: "D" (circle '
+                             'diameter / square) or "W,H" (rect) (default: 1.0)')
+    parser.add_argument('--frame-buffer', type=str, default=DEFAULT_HEADER_FILE,
+                        help=f'Header file of the raw frame ring (default: {DEFAULT_HEADER_FILE})')
+    parser.add_argument('--no-frame-buffer', action='store_true',
+                        help='Do not publish raw frames, PNG output only')
+    parser.add_argument('--no-png', action='store_true',
+                        help='Skip PNG encoding (H3D must read the raw frame ring)')
+    
+    parser.add_argument('--metrics-port', type=int, default=DRR_METRICS_PORT,
+                        help='Port of the Prometheus-style /metrics endpoint on 127.0.0.1, 0 to '
+                             f'disable (default: {DRR_METRICS_PORT})')
+    parser.add_argument('--record-trace', type=str, default=None,
+                        help='Append every incoming pose to this binary trace (replay with '
+                             'replay_trace.py)')
+    parser.add_argument('--profile', type=float, default=None, metavar='SECONDS',
+                        help='Sample the server loop for SECONDS from the start and write '
+                             'collapsed stacks to profiles/ (later windows: profile_server.py)')
+    parser.add_argument('--no-pose-bus', action='store_true',
+                        help='Poll collision_pose.json only, ignoring the shared-memory pose bus')
     
     args = parser.parse_args()
     
+    if args.no_frame_buffer and args.no_png:
+        parser.error('--no-frame-buffer and --no-png leave no output')
+    
+    collimation_size = [float(v) for v in args.collimation_size.split(',')]
+    if len(collimation_size) == 1:
+        collimation_size *= 2
+    if len(collimation_size) != 2 or not all(0 < v <= 1.5 for v in collimation_size):
+        parser.error('--collimation-size must be "D" or "W,H" with values in (0, 1.5]')
+    
     try:
-        server = DRRServer(height=args.height, sdd=args.sdd)
-        server.run_server(check_interval=args.interval)
+        configure_torch_threads(args.threads, args.interop_threads,
+                                parse_cpu_list(args.cpu_affinity) if args.cpu_affinity else None)
+        server = DRRServer(height=args.height, sdd=args.sdd,
+                           inference_mode=args.inference_mode, bf16=args.bf16,
+                           compile_renderer=args.compile,
+                           cache_dir=None if args.no_cache else args.cache_dir,
+                           volume=args.volume, labels=args.labels,
+                           structures=args.structures, spacing=args.spacing,
+                           memory_budget_mb=args.memory_budget,
+                           collimation=None if args.collimation == 'none' else args.collimation,
+                           collimation_size=collimation_size)
+        if args.benchmark:
+            server.benchmark(frames=args.benchmark_frames)
+        server.run_server(check_interval=args.interval,
+                          frame_buffer=None if args.no_frame_buffer else args.frame_buffer,
+                          write_png=not args.no_png,
+                          metrics_port=args.metrics_port or None,
+                          trace=args.record_trace,
+                          profile=args.profile,
+                          pose_bus=None if args.no_pose_bus else DEFAULT_BUS_FILE)
     except Exception as e:
         print(f"\nERROR: {e}")
         import traceback
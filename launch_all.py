@@ -1,20 +1,78 @@
 """
 Launch All Components - C-arm Simulation System
-Starts collision server, DRR server, and optionally visualizer
+Starts collision server, DRR server, and optionally visualizer in parallel,
+waits until each has loaded its meshes / CT, and restarts any that exit or
+stop answering (see lib/ProcessSupervisor.py)
+Serves both servers' metrics on one endpoint and prints end-to-end latency
 """
 
-import subprocess
 import sys
 import time
 from pathlib import Path
 import argparse
 
+sys.path.insert(0, str(Path(__file__).parent / 'lib'))
+from ServerMetrics import (aggregate, parse_metrics, histogram_quantile, start_metrics_server,
+                           LAUNCHER_METRICS_PORT, COLLISION_METRICS_PORT, DRR_METRICS_PORT)
+from ProcessSupervisor import Component, Supervisor, HEALTH_INTERVAL
+
+METRICS_ENDPOINTS = {
+    'collision': f'http://127.0.0.1:{COLLISION_METRICS_PORT}/metrics',
+    'drr': f'http://127.0.0.1:{DRR_METRICS_PORT}/metrics',
+}
+HEALTH_URLS = {
+    'collision': f'http://127.0.0.1:{COLLISION_METRICS_PORT}/health',
+    'drr': f'http://127.0.0.1:{DRR_METRICS_PORT}/health',
+}
+
+
+def print_metrics_summary(previous, current, interval):
+    """
+    Request rates since the previous scrape, latency percentiles and memory
+
+    Args:
+        previous, current: parse_metrics() of two aggregated scrapes
+        interval: Seconds between them
+    """
+    def rate(name):
+        return (current.get((name, ()), 0) - previous.get((name, ()), 0)) / interval
+    
+    def percentiles(name):
+        values = [histogram_quantile(current, name, q) for q in (0.5, 0.95)]
+        if values[0] is None:
+            return "no data"
+        return f"p50 {values[0] * 1000:.0f}ms / p95 {values[1] * 1000:.0f}ms"
+    
+    print(f"[Metrics] collision: {rate('collision_requests_total'):.1f} req/s, "
+          f"slider->result {percentiles('collision_pose_to_result_seconds')}, "
+          f"{current.get(('collision_process_resident_memory_bytes', ()), 0) / 2**20:.0f} MB")
+    if current.get(('launcher_up', (('component', 'drr'),))):
+        print(f"[Metrics] drr: {rate('drr_requests_total'):.1f} req/s, "
+              f"slider->frame {percentiles('drr_pose_to_frame_seconds')}, "
+              f"coalesced {current.get(('drr_coalesced_requests_total', ()), 0):.0f}, "
+              f"dropped {current.get(('drr_dropped_requests_total', ()), 0):.0f}, "
+              f"{current.get(('drr_process_resident_memory_bytes', ()), 0) / 2**20:.0f} MB")
+
+
 def main():
     parser = argparse.ArgumentParser(description='Launch C-arm simulation components')
     parser.add_argument('--no-drr', action='store_true', 
                         help='Skip DRR server (faster startup)')
     parser.add_argument('--visualizer', action='store_true', 
                         help='Include collision visualizer (default: off)')
+    parser.add_argument('--metrics-port', type=int, default=LAUNCHER_METRICS_PORT,
+                        help='Port of the combined /metrics endpoint of both servers, 0 to disable '
+                             f'(default: {LAUNCHER_METRICS_PORT})')
+    parser.add_argument('--metrics-interval', type=float, default=60.0,
+                        help='Seconds between metrics summaries on the console, 0 to disable '
+                             '(default: 60)')
+    parser.add_argument('--ready-timeout', type=float, default=180.0,
+                        help='Seconds for a server to load before it is restarted '
+                             '(default: 180, DRR server at least 600)')
+    parser.add_argument('--health-interval', type=float, default=HEALTH_INTERVAL,
+                        help=f'Seconds between health pings (default: {HEALTH_INTERVAL:g})')
+    parser.add_argument('--no-restart', action='store_true',
+                        help='Shut everything down when a component stops instead of restarting it')
     args = parser.parse_args()
     
     print("=" * 70)
@@ -36,52 +94,39 @@ def main():
         print("          DRR server will use CPU mode (~4s per frame)")
         print("          For real-time: create .venv_gpu with Python 3.11 + CUDA")
     
-    processes = []
-    total_steps = 1 + (0 if args.no_drr else 1) + (1 if args.visualizer else 0)
+    drr_python = venv_gpu_python if has_gpu_venv else venv_python
+    components = [Component("Collision Server", [str(venv_python), "collision_server.py"],
+                            cwd=str(script_dir), health_url=HEALTH_URLS['collision'],
+                            ready_timeout=args.ready_timeout, restart=not args.no_restart)]
+    if not args.no_drr:
+        # CT loading and preprocessing on CPU takes minutes without the cache
+        components.append(Component("DRR Server", [str(drr_python), "drr_server.py"],
+                                    cwd=str(script_dir), health_url=HEALTH_URLS['drr'],
+                                    ready_timeout=max(args.ready_timeout, 600.0),
+                                    restart=not args.no_restart))
+    if args.visualizer:
+        # A closed visualizer window is not restarted
+        components.append(Component("Collision Visualizer", [str(venv_python), "collision_visualizer.py"],
+                                    cwd=str(script_dir), restart=False))
+    supervisor = Supervisor(components, health_interval=args.health_interval)
     
     try:
-        print("\n[1/{}] Starting collision detection server...".format(total_steps))
-        server_process = subprocess.Popen(
-            [str(venv_python), "collision_server.py"],
-            cwd=str(script_dir)
-        )
-        processes.append(("Collision Server", server_process))
-        print("        [OK] Collision server started")
-        time.sleep(2)
-        
-        step = 1
+        print(f"\nStarting {len(components)} components in parallel...")
         if not args.no_drr:
-            step += 1
-            drr_python = venv_gpu_python if has_gpu_venv else venv_python
             mode = "GPU" if has_gpu_venv else "CPU"
-            
-            print("\n[{}/{}] Starting DRR server ({} mode)...".format(step, total_steps, mode))
-            drr_process = subprocess.Popen(
-                [str(drr_python), "drr_server.py"],
-                cwd=str(script_dir)
-            )
-            processes.append(("DRR Server", drr_process))
-            print("        [OK] DRR server started")
-            if has_gpu_venv:
-                print("        [GPU] Real-time rendering (~100ms per frame)")
-            else:
-                print("        [WARNING] CPU mode (~4s per frame)")
-            time.sleep(5)
-        
-        if args.visualizer:
-            step += 1
-            print("\n[{}/{}] Starting collision visualizer...".format(step, total_steps))
-            visualizer_process = subprocess.Popen(
-                [str(venv_python), "collision_visualizer.py"],
-                cwd=str(script_dir)
-            )
-            processes.append(("Collision Visualizer", visualizer_process))
-            print("        [OK] Visualizer started")
-            time.sleep(2)
+            print(f"        DRR server in {mode} mode "
+                  f"({'~100ms' if has_gpu_venv else '~4s'} per frame)")
+        supervisor.start_all()
+        time_to_ready = supervisor.wait_ready()
+        if time_to_ready is None:
+            print("\n[ERROR] Not all components became ready:")
+            print("\n".join(supervisor.status()))
+            return
         
         print("\n" + "=" * 70)
-        print("ALL COMPONENTS RUNNING")
+        print(f"ALL COMPONENTS READY in {time_to_ready:.1f}s")
         print("=" * 70)
+        print("\n".join(supervisor.status()))
         print("\nNow launch H3D separately:")
         print("  .venv\\Scripts\\Activate.ps1")
         print("  python launch_h3d.py")
@@ -91,17 +136,29 @@ def main():
             print("  - Move C-arm sliders → DRR updates in REAL-TIME! (~100ms)")
         elif not args.no_drr:
             print("  - Move C-arm sliders → DRR updates slowly (~4s delay)")
+        endpoints = {name: url for name, url in METRICS_ENDPOINTS.items()
+                     if not (name == 'drr' and args.no_drr)}
+        if args.metrics_port:
+            start_metrics_server(lambda: aggregate(endpoints), args.metrics_port)
+            print(f"\nMetrics (both servers): http://127.0.0.1:{args.metrics_port}/metrics")
         print("\nPress Ctrl+C to stop all servers")
         print("=" * 70)
         
-        # Wait for processes to exit
+        # Keep the servers running: health pings, restarts with backoff
+        last_summary, last_samples = time.time(), parse_metrics(aggregate(endpoints))
         while True:
             time.sleep(1)
-            # Check if any process has terminated
-            for name, process in processes:
-                if process.poll() is not None:
-                    print(f"\n{name} has stopped. Shutting down other components...")
-                    raise KeyboardInterrupt
+            supervisor.poll()
+            if supervisor.failed:
+                print("\nGiving up on a component. Shutting down other components...")
+                break
+            if args.no_restart and any(c.state == 'stopped' for c in components):
+                print("\nA component has stopped. Shutting down other components...")
+                break
+            if args.metrics_interval and time.time() - last_summary >= args.metrics_interval:
+                samples = parse_metrics(aggregate(endpoints))
+                print_metrics_summary(last_samples, samples, time.time() - last_summary)
+                last_summary, last_samples = time.time(), samples
         
     except KeyboardInterrupt:
         print("\n\nShutting down all components...")
@@ -110,16 +167,7 @@ def main():
         print(f"\n[ERROR] {e}")
     
     finally:
-        # Clean up all processes
-        for name, process in processes:
-            if process.poll() is None:  # Process still running
-                print(f"Terminating {name}...")
-                process.terminate()
-                try:
-                    process.wait(timeout=3)
-                except subprocess.TimeoutExpired:
-                    process.kill()
-        
+        supervisor.stop_all()
         print("\nAll components stopped.")
         print("=" * 70)
 
@@ -0,0 +1,159 @@
+"""
+C-Arm Links - Per-link geometry on the frames of the DH chain
+=============================================================
+
+The C-shape point cloud (c_arm_pcd_pts.npy) rides on the end-effector
+frame of calc_transf_mat_c_arm_base_to_ee(), but the rest of the C-arm
+moves with earlier frames of the same chain (calc_c_arm_frames()):
+
+    link     X3D group (models/carm.x3d)     frame
+    column   base cart and column (Tube01)   after the lateral joint
+    arm      horizontal arm                  after vertical + wigwag
+    tilt     tilt (angular) block            after horizontal + tilt
+    c_arm    C-shape (orbital mesh)          end-effector
+
+Link geometry comes from the X3D assembly at its rest pose. The orbital
+mesh's local frame scaled by H3D_SCALE is the point cloud's frame, i.e.
+the end-effector frame, so every link is first expressed in that frame
+and then moved into its own frame with the DH chain at the zero pose.
+CARMORBITAL is set by H3D at runtime and read as identity.
+
+Wigwag follows the collision server's convention (a rotation about the
+vertical axis through the end-effector origin, applied after the chain),
+so the C-shape is placed exactly as before and the links after the
+wigwag joint stay rigidly attached to it.
+
+Allowed collisions: pairs of links that are adjacent in the chain or touch
+at the home pose are never tested against each other. Against obstacles,
+only the points of a link (other than the C-shape, whose checks are
+unchanged) that are already inside an obstacle at the home pose are
+exempt from that obstacle (home contacts); the rest of the link is tested.
+"""
+
+import numpy as np
+
+from TransformationMats import calc_c_arm_frames
+from X3DGeometry import iter_shapes
+
+LINKS = ('column', 'arm', 'tilt', 'c_arm')
+LINK_SHAPES = {'column': 'group_ME_Tube01', 'arm': 'group_ME_horizontal_mesh',
+               'tilt': 'group_ME_angular_mesh', 'c_arm': 'group_ME_orbital_mesh'}
+LINK_FRAMES = {'column': 3, 'arm': 5, 'tilt': 7, 'c_arm': 8}   # index into calc_c_arm_frames()
+WIGWAG_FRAME = 5                                                 # first frame after the wigwag joint
+ADJACENT_LINKS = (('column', 'arm'), ('arm', 'tilt'), ('tilt', 'c_arm'))
+LINKS_X3D = 'models/carm.x3d'
+RUNTIME_TRANSFORMS = ('CARMORBITAL',)
+LINK_POINT_DENSITY = 2500      # surface samples per m^2 of the links other than the C-shape
+
+
+def link_frames(lateral, vertical, wigwag, horizontal, tilt, orbital, links=LINKS):
+    """
+    World frames of the links.
+
+    Returns:
+        (len(links), 4, 4) array; the 'c_arm' frame equals the C-arm pose
+        of CollisionServer.check_collision()
+    """
+    chain = calc_c_arm_frames(lateral, vertical, 0, horizontal, tilt, orbital)
+    frames = chain[[LINK_FRAMES[link] for link in links]]
+    if abs(wigwag) > 0.01:
+        angle = np.radians(wigwag)
+        rotation = np.array([[np.cos(angle), -np.sin(angle), 0],
+                             [np.sin(angle), np.cos(angle), 0],
+                             [0, 0, 1]])
+        pivot = chain[-1][:3, 3]
+        after = np.array([LINK_FRAMES[link] >= WIGWAG_FRAME for link in links])
+        frames[after, :3, :3] = rotation @ frames[after, :3, :3]
+        frames[after, :3, 3] = (frames[after, :3, 3] - pivot) @ rotation.T + pivot
+    return frames
+
+
+def transform_points(points, frames, link_ids):
+    """
+    Move the concatenated points of all links in one batched operation.
+
+    Args:
+        points: (N, 3) points, each in its link's frame
+        frames: (L, 4, 4) link frames
+        link_ids: (N,) link index of every point
+    """
+    if len(frames) == 1:
+        return points @ frames[0, :3, :3].T + frames[0, :3, 3]
+    return (np.einsum('nij,nj->ni', frames[link_ids, :3, :3], points)
+            + frames[link_ids, :3, 3])
+
+
+def link_meshes(x3d_file=LINKS_X3D, scale=1.0):
+    """
+    Triangle mesh of every link in its own frame.
+
+    Args:
+        scale: H3D scene scale of the C-arm (convert_x3d_to_npy.H3D_SCALE)
+
+    Returns:
+        {link: (vertices (N, 3) float64, faces (M, 3) int32)}
+    """
+    groups = {}
+    for shape in iter_shapes(x3d_file, identity_transforms=RUNTIME_TRANSFORMS):
+        groups.setdefault(shape.name, []).append(shape)
+
+    # Rest-pose assembly -> end-effector frame, through the C-shape's local frame
+    to_ee = np.linalg.inv(groups[LINK_SHAPES['c_arm']][0].transform)
+    rest = link_frames(0, 0, 0, 0, 0, 0)
+
+    meshes = {}
+    for i, link in enumerate(LINKS):
+        shapes = groups[LINK_SHAPES[link]]
+        offsets = np.cumsum([0] + [len(s.vertices) for s in shapes[:-1]])
+        vertices = np.concatenate([s.world_vertices() for s in shapes])
+        vertices = (vertices @ to_ee[:3, :3].T + to_ee[:3, 3]) * scale
+        to_link = np.linalg.inv(rest[i]) @ rest[-1]
+        vertices = vertices @ to_link[:3, :3].T + to_link[:3, 3]
+        faces = np.concatenate([s.faces + offset for s, offset in zip(shapes, offsets)])
+        meshes[link] = (vertices, faces.astype(np.int32))
+    return meshes
+
+
+def allowed_collisions(inside):
+    """
+    Link pairs that are never tested: adjacent links and links touching at
+    the home pose.
+
+    Args:
+        inside: Callable(a, b) -> number of link a's points inside link b
+                at the home pose (all joints 0)
+
+    Returns:
+        List of (link, link) pairs
+    """
+    allowed = []
+    for i, a in enumerate(LINKS):
+        for b in LINKS[i + 1:]:
+            if (a, b) in ADJACENT_LINKS or inside(a, b) or inside(b, a):
+                allowed.append((a, b))
+    return allowed
+
+
+def home_contacts(inside_ids, obstacles):
+    """
+    Points of the links other than the C-shape that are inside an obstacle
+    at the home pose (the base cart stands under the table there). Only
+    these points are exempt from that obstacle.
+
+    Args:
+        inside_ids: Callable(link, obstacle) -> ids of the link's points
+                    inside the obstacle at the home pose
+        obstacles: Obstacle names
+
+    Returns:
+        {link: {obstacle: ids}} for the pairs in contact
+    """
+    contacts = {}
+    for link in LINKS:
+        if link == 'c_arm':
+            continue
+        for name in obstacles:
+            ids = inside_ids(link, name)
+            if len(ids):
+                contacts.setdefault(link, {})[name] = ids
+    return contacts
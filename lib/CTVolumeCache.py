@@ -0,0 +1,165 @@
+"""
+CT Volume Cache - Preprocessed, memory-mapped CT volumes for drr_server.py
+==========================================================================
+
+Decompressing and converting a CT (.nii.gz -> HU -> density) takes most of
+the DRR server's startup time. The first launch stores the preprocessed
+density volume, label mask and structure table under .drr_cache/<key>/ as
+plain .npy files; later launches memory-map them, so startup only touches
+the pages the renderer actually reads.
+
+The key is a hash of the source files' contents plus the preprocessing
+parameters, so replacing the CT or changing e.g. the bone attenuation
+multiplier produces a new cache entry instead of stale data.
+
+Cache entry layout:
+    meta.json        affines, orientation, reorient matrix, shapes
+    density.npy      float32 (1, X, Y, Z)
+    mask.npy         smallest unsigned int type holding all labels (optional)
+    structures.csv   structure table (optional)
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = '.drr_cache'
+
+
+def hash_files(paths, chunk_size=1 << 20):
+    """SHA1 over the contents of the given files (in order)"""
+    digest = hashlib.sha1()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CTVolumeCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = Path(cache_dir)
+
+    def key(self, source_paths, **params):
+        """Cache key for the given source files and preprocessing parameters"""
+        digest = hashlib.sha1(hash_files(source_paths).encode())
+        digest.update(json.dumps({'version': CACHE_VERSION, **params}, sort_keys=True).encode())
+        return digest.hexdigest()[:16]
+
+    def entry(self, key):
+        return self.cache_dir / key
+
+    def has(self, key):
+        return (self.entry(key) / 'meta.json').exists()
+
+    def begin(self, key):
+        """Create a temporary directory for a new entry (see commit())"""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        return Path(tempfile.mkdtemp(prefix=f'{key}.', dir=self.cache_dir))
+
+    def commit(self, key, tmp_dir, meta):
+        """Write meta.json and atomically move a temporary entry into place"""
+        meta = dict(meta, version=CACHE_VERSION)
+        with open(Path(tmp_dir) / 'meta.json', 'w') as f:
+            json.dump(meta, f, indent=2)
+        target = self.entry(key)
+        if target.exists():
+            shutil.rmtree(target)
+        os.replace(tmp_dir, target)
+
+    def discard(self, tmp_dir):
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def store_arrays(self, key, density, affine, mask=None, mask_affine=None,
+                     structures=None, **meta):
+        """
+        Write a cache entry atomically (temp directory + rename).
+
+        Args:
+            density: float32 array (1, X, Y, Z)
+            affine: 4x4 voxel-to-world matrix of the density volume
+            mask: Optional integer label volume (1, X, Y, Z)
+            structures: Optional pandas DataFrame of structure labels
+            **meta: Extra JSON-serializable values stored in meta.json
+        """
+        tmp_dir = self.begin(key)
+        try:
+            np.save(tmp_dir / 'density.npy', np.asarray(density, dtype=np.float32))
+            meta = dict(meta, affine=np.asarray(affine).tolist(), shape=list(np.shape(density)))
+            if mask is not None:
+                mask = np.asarray(mask)
+                dtype = np.min_scalar_type(int(mask.max())) if mask.size else np.uint8
+                np.save(tmp_dir / 'mask.npy', mask.astype(dtype))
+                meta['mask_affine'] = np.asarray(
+                    affine if mask_affine is None else mask_affine).tolist()
+            if structures is not None:
+                structures.to_csv(tmp_dir / 'structures.csv', index=False)
+            self.commit(key, tmp_dir, meta)
+        except BaseException:
+            self.discard(tmp_dir)
+            raise
+
+    def store_subject(self, key, subject):
+        """Cache a torchio Subject produced by diffdrr.data.read()"""
+        mask = subject.mask
+        self.store_arrays(
+            key,
+            density=subject.density.data.numpy(),
+            affine=subject.density.affine,
+            mask=mask.data.numpy() if mask is not None else None,
+            mask_affine=mask.affine if mask is not None else None,
+            structures=subject.get('structures'),
+            orientation=subject.orientation,
+            reorient=subject.reorient.tolist(),
+        )
+
+    def meta(self, key):
+        with open(self.entry(key) / 'meta.json', 'r') as f:
+            return json.load(f)
+
+    def load_subject(self, key):
+        """
+        Build a diffdrr-compatible torchio Subject from a cache entry.
+
+        The density volume is memory-mapped (copy-on-write) and the label mask
+        is NOT loaded - use load_mask() when segmentation is first needed.
+        """
+        import pandas as pd
+        import torch
+        from torchio import ScalarImage, Subject
+
+        entry = self.entry(key)
+        meta = self.meta(key)
+        density = torch.from_numpy(np.load(entry / 'density.npy', mmap_mode='c'))
+        affine = np.array(meta['affine'])
+        density_image = ScalarImage(tensor=density, affine=affine)
+
+        structures_path = entry / 'structures.csv'
+        extra = {}
+        if structures_path.exists():
+            extra['structures'] = pd.read_csv(structures_path)
+
+        # The renderer only uses the density and its affine, so the volume
+        # entry shares the density data instead of keeping raw HU around
+        return Subject(
+            volume=density_image,
+            mask=None,
+            orientation=meta.get('orientation'),
+            reorient=torch.tensor(meta['reorient'], dtype=torch.float32),
+            density=density_image,
+            fiducials=None,
+            **extra,
+        )
+
+    def has_mask(self, key):
+        return (self.entry(key) / 'mask.npy').exists()
+
+    def load_mask(self, key):
+        """Memory-mapped label mask (1, X, Y, Z) of a cache entry"""
+        return np.load(self.entry(key) / 'mask.npy', mmap_mode='r')
@@ -0,0 +1,298 @@
+"""
+CT Volume Ingest - Stream arbitrary NIfTI/NRRD CTs into the DRR cache
+=====================================================================
+
+Loads a CT volume (and optional label map) in slabs along the slowest
+on-disk axis, resamples it to isotropic spacing and converts HU to
+density, writing every intermediate straight into memory-mapped .npy
+files of a CTVolumeCache entry. Peak memory is bounded by
+`memory_budget_mb`, so large clinical CTs never get materialized as full
+float64 copies the way nibabel's get_fdata() does.
+
+The result is a cache entry that drr_server.py opens exactly like the
+cached example CT (see CTVolumeCache.py).
+
+Supported inputs:
+    .nii / .nii.gz      via nibabel's array proxy (slabs read on demand)
+    .nrrd / .nhdr       raw encoding is memory-mapped, gzip is streamed
+"""
+
+import gzip
+import os
+from pathlib import Path
+
+import numpy as np
+from scipy.ndimage import affine_transform
+
+# HU thresholds used by diffdrr.data.transform_hu_to_density
+AIR_HU = -800
+BONE_HU = 350
+
+LPS_SPACES = ('left-posterior-superior', 'LPS')
+
+# Frame-of-reference changes used by diffdrr.data.read
+REORIENT = {
+    'AP': [[1, 0, 0, 0], [0, 0, -1, 0], [0, 1, 0, 0], [0, 0, 0, 1]],
+    'PA': [[1, 0, 0, 0], [0, 0, 1, 0], [0, 1, 0, 0], [0, 0, 0, 1]],
+    None: [[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 1, 0], [0, 0, 0, 1]],
+}
+
+
+class VolumeSource:
+    """Slab reader over a volume stored with the last axis slowest on disk"""
+
+    def __init__(self, shape, affine, dtype, read_slab):
+        self.shape = tuple(int(n) for n in shape)
+        self.affine = np.asarray(affine, dtype=np.float64)
+        self.dtype = np.dtype(dtype)
+        self._read_slab = read_slab
+
+    @property
+    def spacing(self):
+        return np.linalg.norm(self.affine[:3, :3], axis=0)
+
+    def read_slab(self, z0, z1):
+        """Voxels [:, :, z0:z1] in the source dtype"""
+        return self._read_slab(z0, z1)
+
+
+def _open_nifti(path):
+    import nibabel as nib
+
+    img = nib.load(str(path), keep_file_open=True)
+    if len(img.shape) == 4 and img.shape[3] == 1:
+        shape = img.shape[:3]
+        read = lambda z0, z1: np.asarray(img.dataobj[:, :, z0:z1, 0])
+    elif len(img.shape) == 3:
+        shape = img.shape
+        read = lambda z0, z1: np.asarray(img.dataobj[:, :, z0:z1])
+    else:
+        raise ValueError(f"Expected a 3D volume, got shape {img.shape}: {path}")
+
+    # Scaled images come back as float64 from the proxy; read_slab callers
+    # convert each slab immediately so only one slab is ever float64
+    return VolumeSource(shape, img.affine, img.get_data_dtype(), read)
+
+
+def _nrrd_affine(header):
+    directions = np.asarray(header['space directions'], dtype=np.float64)
+    affine = np.eye(4)
+    affine[:3, :3] = directions.T
+    affine[:3, 3] = np.asarray(header.get('space origin', np.zeros(3)), dtype=np.float64)
+    if header.get('space') in LPS_SPACES:
+        affine[:2] *= -1  # LPS -> RAS, matching NIfTI/torchio conventions
+    return affine
+
+
+def _open_nrrd(path, scratch_dir):
+    import nrrd
+
+    path = Path(path)
+    with open(path, 'rb') as fh:
+        header = nrrd.read_header(fh)
+        offset = fh.tell()
+
+    if header['dimension'] != 3:
+        raise ValueError(f"Expected a 3D volume, got dimension {header['dimension']}: {path}")
+    if header.get('line skip', 0) or header.get('byte skip', 0):
+        raise ValueError(f"NRRD line/byte skip is not supported: {path}")
+
+    if 'data file' in header:
+        data_path = path.parent / header['data file']
+        offset = 0
+    else:
+        data_path = path
+
+    dtype = nrrd.reader._determine_datatype(header)
+    shape = tuple(int(n) for n in header['sizes'])
+    encoding = header['encoding']
+
+    if encoding == 'raw':
+        data = np.memmap(data_path, dtype=dtype, mode='r', offset=offset, shape=shape, order='F')
+    elif encoding in ('gzip', 'gz'):
+        # Stream-decompress once into a scratch memmap instead of into RAM
+        scratch = Path(scratch_dir) / (path.stem + '.raw')
+        data = np.memmap(scratch, dtype=dtype, mode='w+', shape=shape, order='F')
+        flat = data.reshape(-1, order='F')
+        position = 0
+        with open(data_path, 'rb') as fh:
+            fh.seek(offset)
+            with gzip.GzipFile(fileobj=fh) as stream:
+                while position < flat.size:
+                    chunk = stream.read(min(1 << 24, (flat.size - position) * dtype.itemsize))
+                    if not chunk:
+                        raise ValueError(f"NRRD data ended early: {path}")
+                    values = np.frombuffer(chunk, dtype=dtype)
+                    flat[position:position + values.size] = values
+                    position += values.size
+        data.flush()
+    else:
+        raise ValueError(f"NRRD encoding '{encoding}' is not supported: {path}")
+
+    return VolumeSource(shape, _nrrd_affine(header), dtype, lambda z0, z1: data[:, :, z0:z1])
+
+
+def open_volume(path, scratch_dir):
+    """Open a NIfTI or NRRD file as a VolumeSource"""
+    name = str(path).lower()
+    if name.endswith(('.nii', '.nii.gz')):
+        return _open_nifti(path)
+    if name.endswith(('.nrrd', '.nhdr')):
+        return _open_nrrd(path, scratch_dir)
+    raise ValueError(f"Unsupported volume format (expected .nii, .nii.gz, .nrrd, .nhdr): {path}")
+
+
+def _slab_depth(source, out_shape, scale, memory_budget_mb, itemsize):
+    """Number of output z-slices per slab that fit in the memory budget"""
+    in_slice = source.shape[0] * source.shape[1] * (8 + itemsize)  # float64 proxy + copy
+    out_slice = out_shape[0] * out_shape[1] * itemsize
+    per_slice = scale[2] * in_slice + out_slice
+    depth = int(memory_budget_mb * 1024 * 1024 // max(per_slice, 1)) - 2
+    return max(1, min(depth, out_shape[2]))
+
+
+def resample_to_memmap(source, out_path, spacing, memory_budget_mb, dtype, order):
+    """
+    Resample a VolumeSource to isotropic `spacing` into a (1, X, Y, Z) .npy memmap.
+
+    Returns:
+        (memmap, affine) of the resampled volume
+    """
+    in_spacing = source.spacing
+    scale = np.full(3, float(spacing)) / in_spacing if spacing else np.ones(3)
+    out_shape = tuple(int(np.floor((n - 1) / s)) + 1 for n, s in zip(source.shape, scale))
+
+    out = np.lib.format.open_memmap(out_path, mode='w+', dtype=dtype, shape=(1,) + out_shape)
+    depth = _slab_depth(source, out_shape, scale, memory_budget_mb, np.dtype(dtype).itemsize)
+
+    for k0 in range(0, out_shape[2], depth):
+        k1 = min(k0 + depth, out_shape[2])
+        z0 = int(np.floor(k0 * scale[2]))
+        z1 = min(int(np.ceil((k1 - 1) * scale[2])) + 2, source.shape[2])
+        slab = np.asarray(source.read_slab(z0, z1)).astype(dtype, copy=False)
+        out[0, :, :, k0:k1] = affine_transform(
+            slab, scale, offset=(0.0, 0.0, k0 * scale[2] - z0),
+            output_shape=(out_shape[0], out_shape[1], k1 - k0),
+            order=order, mode='nearest', prefilter=False,
+        )
+        del slab
+
+    out.flush()
+    affine = source.affine @ np.diag(list(scale) + [1.0])
+    return out, affine
+
+
+def hu_to_density_inplace(volume, bone_attenuation_multiplier=1.0, chunk=16):
+    """Chunked equivalent of diffdrr.data.transform_hu_to_density (in place)"""
+    depth = volume.shape[-1]
+    slabs = [(z, min(z + chunk, depth)) for z in range(0, depth, chunk)]
+
+    soft_min = np.inf
+    for z0, z1 in slabs:
+        slab = volume[..., z0:z1]
+        soft = slab[(slab > AIR_HU) & (slab <= BONE_HU)]
+        if soft.size:
+            soft_min = min(soft_min, float(soft.min()))
+    if not np.isfinite(soft_min):
+        soft_min = float(AIR_HU)
+
+    lo, hi = np.inf, -np.inf
+    for z0, z1 in slabs:
+        slab = np.array(volume[..., z0:z1])
+        bone = slab > BONE_HU
+        slab[slab <= AIR_HU] = soft_min
+        slab[bone] *= bone_attenuation_multiplier
+        volume[..., z0:z1] = slab
+        lo, hi = min(lo, float(slab.min())), max(hi, float(slab.max()))
+
+    span = (hi - lo) or 1.0
+    for z0, z1 in slabs:
+        volume[..., z0:z1] = (volume[..., z0:z1] - lo) / span
+    volume.flush()
+
+
+def canonical_affine(affine, shape):
+    """Move the volume center to the world origin (diffdrr.data.canonicalize)"""
+    center = affine @ np.append((np.asarray(shape[-3:]) - 1) / 2.0, 1.0)
+    shift = np.eye(4)
+    shift[:3, 3] = -center[:3]
+    return shift @ affine
+
+
+def default_structures(mask, chunk=16):
+    """Structure table with one 'labels' group entry per label found in the mask"""
+    import pandas as pd
+
+    labels = set()
+    for z in range(0, mask.shape[-1], chunk):
+        labels.update(np.unique(mask[..., z:z + chunk]).tolist())
+    labels.discard(0)
+    ids = sorted(int(label) for label in labels)
+    return pd.DataFrame({
+        'group': ['labels'] * len(ids),
+        'original_idx': ids,
+        'structure': [f'label_{i}' for i in ids],
+        'id': ids,
+    })
+
+
+def ingest_volume(cache, key, volume_path, labels_path=None, structures_path=None,
+                  spacing=None, memory_budget_mb=512, orientation="AP",
+                  bone_attenuation_multiplier=1.0):
+    """
+    Stream a CT (and label map) into cache entry `key`.
+
+    Args:
+        cache: CTVolumeCache
+        spacing: Isotropic output spacing in mm (None keeps the source grid)
+        memory_budget_mb: Upper bound for slab buffers during resampling
+        orientation: 'AP', 'PA' or None (as in diffdrr.data.read)
+    """
+    import pandas as pd
+
+    tmp_dir = cache.begin(key)
+    try:
+        source = open_volume(volume_path, tmp_dir)
+        print(f"        Source: {source.shape} @ {np.round(source.spacing, 3)} mm ({source.dtype})")
+
+        density, affine = resample_to_memmap(
+            source, tmp_dir / 'density.npy', spacing, memory_budget_mb, np.float32, order=1)
+        print(f"        Resampled: {density.shape[1:]} @ {spacing or 'source'} mm")
+        hu_to_density_inplace(density, bone_attenuation_multiplier)
+
+        meta = {
+            'orientation': orientation,
+            'reorient': REORIENT[orientation],
+            'affine': canonical_affine(affine, density.shape).tolist(),
+            'shape': list(density.shape),
+            'source': str(volume_path),
+        }
+        del density
+
+        labels = None
+        if labels_path is not None:
+            labels = open_volume(labels_path, tmp_dir)
+            if labels.shape != source.shape:
+                raise ValueError(f"Label map shape {labels.shape} does not match volume {source.shape}")
+            label_dtype = labels.dtype if labels.dtype.kind in 'ui' else np.dtype(np.uint16)
+            mask, _ = resample_to_memmap(
+                labels, tmp_dir / 'mask.npy', spacing, memory_budget_mb, label_dtype, order=0)
+            meta['mask_affine'] = meta['affine']
+
+            if structures_path is not None:
+                structures = pd.read_csv(structures_path)
+            else:
+                structures = default_structures(mask)
+            structures.to_csv(tmp_dir / 'structures.csv', index=False)
+            del mask
+
+        # Scratch files from streamed gzip NRRDs are not part of the entry
+        # (drop the readers first - mapped files cannot be deleted on Windows)
+        source = labels = None
+        for scratch in tmp_dir.glob('*.raw'):
+            os.remove(scratch)
+
+        cache.commit(key, tmp_dir, meta)
+    except BaseException:
+        cache.discard(tmp_dir)
+        raise
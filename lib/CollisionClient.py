@@ -1,14 +1,20 @@
 """
 Collision Detection Client (Python 2.7 for H3D)
-Communicates with collision_server.py via JSON files
+Communicates with collision_server.py via the shared-memory pose bus
+(PoseBus.py), the result slot (ResultSlot.py) and JSON files
 Handles 9 DOF: 6 C-arm + 3 Table
 """
 
 from H3DInterface import *
 import json
 import os
+import sys
 import time
 
+sys.path.insert(0, os.path.join(os.getcwd(), 'lib'))
+from PoseBus import shared_writer
+from ResultSlot import ResultSlotReader, DEFAULT_SLOT_FILE
+
 # Global state
 collision_material = None
 xray_border_material = None
@@ -23,6 +29,8 @@ last_pose = {
 last_result = {'collision': False, 'collision_points': {'total': 0}}
 check_throttle_time = 0
 THROTTLE_INTERVAL = 0.2
+request_counter = 0
+result_reader = None
 
 def initialize():
     """Initialize material and slider references from main.x3d"""
@@ -76,13 +84,48 @@ def update_visual_feedback(has_collision, point_count):
     if status_text_node is not None:
         status_text_node.string.setValue([status_msg])
 
+def next_request_id():
+    """Request ID for the next pose; starts from the clock so IDs of a
+    restarted H3D never match results left over from the previous run"""
+    global request_counter
+    if request_counter == 0:
+        request_counter = int(time.time() * 1000)
+    request_counter += 1
+    return request_counter
+
+def get_result_reader():
+    """Open the result slot once collision_server.py has created it."""
+    global result_reader
+    if result_reader is None and os.path.exists(DEFAULT_SLOT_FILE):
+        try:
+            result_reader = ResultSlotReader(DEFAULT_SLOT_FILE)
+        except Exception as e:
+            print("[Collision Client] Result slot unavailable: " + str(e))
+    return result_reader
+
+def read_result_file(result_file, request_id, timeout):
+    """Fallback for servers without the result slot: poll the JSON file
+    until it carries this request ID"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        time.sleep(0.01)
+        try:
+            with open(result_file, 'r') as f:
+                result = json.load(f)
+        except (IOError, OSError, ValueError):
+            continue
+        if result.get('request_id') == request_id:
+            return result
+    return None
+
 def check_collision(lao_rao, cran_caud, wigwag=0, lateral=0, vertical=0, horizontal=0,
                     table_vertical=0, table_longitudinal=0, table_transverse=0, zoom=1.0):
-    """Check collision by writing pose to JSON and reading result"""
+    """Check collision by publishing the pose and waiting for its own result"""
     pose_file = 'collision_pose.json'
     result_file = 'collision_result.json'
     
     try:
+        request_id = next_request_id()
         pose_data = {
             'lao_rao': float(lao_rao),
             'cran_caud': float(cran_caud),
@@ -94,32 +137,31 @@ def check_collision(lao_rao, cran_caud, wigwag=0, lateral=0, vertical=0, horizon
             'table_longitudinal': float(table_longitudinal) / 100.0,
             'table_transverse': float(table_transverse) / 100.0,
             'zoom': float(zoom),
-            'timestamp': time.time()
+            'timestamp': time.time(),
+            'request_id': request_id
         }
         
+        # Bus first: the servers pick it up within milliseconds. The JSON
+        # file is still written for servers started with --no-pose-bus
+        try:
+            shared_writer().publish_pose(pose_data)
+        except Exception as e:
+            print("[Collision Client] Pose bus unavailable: " + str(e))
         with open(pose_file, 'w') as f:
             json.dump(pose_data, f)
         
+        # Only the result for this request counts, never an older one
         max_wait = 0.5
-        wait_interval = 0.05
-        waited = 0
-        result_mod_time = os.path.getmtime(result_file) if os.path.exists(result_file) else 0
-        
-        while waited < max_wait:
-            time.sleep(wait_interval)
-            waited += wait_interval
-            
-            if os.path.exists(result_file):
-                new_mod_time = os.path.getmtime(result_file)
-                if new_mod_time > result_mod_time:
-                    break
-        
-        if os.path.exists(result_file):
-            with open(result_file, 'r') as f:
-                return json.load(f)
+        reader = get_result_reader()
+        if reader is not None:
+            result = reader.wait_for(request_id, max_wait)
         else:
-            return {'collision': False, 'error': 'Server not responding', 
-                   'collision_points': {'total': 0}}
+            result = read_result_file(result_file, request_id, max_wait)
+        
+        if result is not None:
+            return result
+        return {'collision': False, 'error': 'Server not responding', 
+               'collision_points': {'total': 0}}
     
     except Exception as e:
         print("[Collision Client ERROR] " + str(e))
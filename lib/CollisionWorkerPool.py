@@ -0,0 +1,363 @@
+"""
+Collision Worker Pool - Pre-forked collision checks with priority classes
+=========================================================================
+
+CollisionWorkerPool runs collision checks in N worker processes behind one
+front-end, so the H3D client's checks do not queue behind a workspace
+sweep sharing the machine:
+
+    workers     forked from the process that loaded the CollisionServer
+                (POSIX), so meshes, point clouds and the memory-mapped scene
+                bundle are shared copy-on-write; with spawn (Windows) each
+                worker builds its own server from `factory`, and the bundle
+                pages are still shared through the page cache
+    priority    PRIORITIES, highest first. An idle worker always takes the
+                oldest request of the highest class. The first `reserved`
+                workers only take interactive requests, so an interactive
+                check waits for at most another interactive one, never
+                behind a batch. Batch work is dispatched one pose at a time,
+                so more interactive requests cut in between batch poses.
+                Interactive requests go to worker 0 first, which keeps its
+                temporal-coherence cache warm
+    latency     per class: queue wait and request time over the last
+                WINDOW requests (StageTiming.RollingHistogram), stats()
+
+A dispatcher thread in the front-end process owns the worker pipes, and
+submit() may be called from any thread. start_check_server() puts the
+pool behind HTTP, so other processes can share it:
+
+    POST http://127.0.0.1:<COLLISION_CHECK_PORT>/check
+         {"priority": "batch", "poses": [{"lao_rao": 30, ...}, ...]}
+      -> {"results": [...]}
+    GET  .../stats    per-class latency
+
+remote_check() is the client side (workspace_analysis.py --server).
+"""
+
+import json
+import multiprocessing
+import threading
+import time
+import urllib.request
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing.connection import wait
+
+from StageTiming import RollingHistogram, WINDOW
+
+PRIORITIES = ('interactive', 'batch')
+COLLISION_CHECK_PORT = 9103
+POSE_ARGS = ('lao_rao', 'cran_caud', 'wigwag', 'lateral', 'vertical', 'horizontal',
+             'table_vertical', 'table_longitudinal', 'table_transverse')
+
+_forked_server = None           # server inherited by forked workers
+
+
+def check_pose(server, pose):
+    """CollisionServer.check_collision() of a pose dict (pose bus / JSON format)"""
+    return server.check_collision(*(pose.get(name, 0.0) for name in POSE_ARGS),
+                                  scene_id=pose.get('scene_id'))
+
+
+def _worker_main(conn, factory):
+    server = _forked_server if _forked_server is not None else factory()
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        task_id, pose = task
+        try:
+            conn.send((task_id, True, check_pose(server, pose)))
+        except Exception as e:
+            conn.send((task_id, False, f'{type(e).__name__}: {e}'))
+
+
+class _Request:
+    def __init__(self, pose, priority):
+        self.pose = pose
+        self.priority = priority
+        self.future = Future()
+        self.submitted = time.perf_counter()
+        self.dispatched = None
+
+
+class CollisionWorkerPool:
+    """N collision worker processes with priority dispatch"""
+
+    def __init__(self, factory, workers=2, reserved=1, server=None, start_method=None,
+                 window=WINDOW, on_complete=None):
+        """
+        Args:
+            factory: Picklable callable returning a CollisionServer (built in
+                     each worker when there is no server to fork from)
+            workers: Number of worker processes
+            reserved: Workers that only take interactive requests (at most
+                      workers - 1, so batch work still runs)
+            server: Loaded CollisionServer to fork the workers from (fork
+                    start method only)
+            start_method: 'fork' or 'spawn' (default: fork where available)
+            on_complete: Called from the dispatcher thread with
+                         (priority, wait_s, total_s) of every request
+        """
+        if workers < 1:
+            raise ValueError('CollisionWorkerPool needs at least one worker')
+        global _forked_server
+        methods = multiprocessing.get_all_start_methods()
+        self.start_method = start_method or ('fork' if 'fork' in methods else 'spawn')
+        self.context = multiprocessing.get_context(self.start_method)
+        self.factory = factory
+        self.reserved = min(reserved, workers - 1)
+        self.on_complete = on_complete
+        self.queues = {priority: deque() for priority in PRIORITIES}
+        self.latency = {priority: {'wait': RollingHistogram(window), 'total': RollingHistogram(window)}
+                        for priority in PRIORITIES}
+        self.completed = {priority: 0 for priority in PRIORITIES}
+        self._lock = threading.Lock()
+        self._wake_recv, self._wake_send = multiprocessing.Pipe(duplex=False)
+        self._running = True
+        self._next_id = 0
+        self._in_flight = {}        # worker index -> (task id, _Request)
+
+        if self.start_method == 'fork':
+            _forked_server = server
+        self.processes = [None] * workers
+        self.conns = [None] * workers
+        try:
+            for index in range(workers):
+                self._start_worker(index)
+        finally:
+            _forked_server = None
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name='collision-pool',
+                                            daemon=True)
+        self._dispatcher.start()
+
+    def _start_worker(self, index):
+        parent_conn, child_conn = self.context.Pipe()
+        process = self.context.Process(target=_worker_main, args=(child_conn, self.factory),
+                                       name=f'collision-worker-{index}', daemon=True)
+        process.start()
+        child_conn.close()
+        self.processes[index], self.conns[index] = process, parent_conn
+
+    @property
+    def workers(self):
+        return len(self.processes)
+
+    def submit(self, pose, priority='interactive'):
+        """
+        Queue a check.
+
+        Args:
+            pose: Pose dict (POSE_ARGS, optional scene_id)
+            priority: One of PRIORITIES
+
+        Returns:
+            concurrent.futures.Future of the result dict
+        """
+        if priority not in self.queues:
+            raise ValueError(f"Unknown priority '{priority}' (expected one of {', '.join(PRIORITIES)})")
+        request = _Request(pose, priority)
+        with self._lock:
+            if not self._running:
+                raise RuntimeError('CollisionWorkerPool is closed')
+            self.queues[priority].append(request)
+            self._wake_send.send_bytes(b'.')    # wakes the dispatcher
+        return request.future
+
+    def check(self, pose, priority='interactive', timeout=None):
+        """Blocking submit()"""
+        return self.submit(pose, priority).result(timeout)
+
+    def map(self, poses, priority='batch', timeout=None):
+        """Results of several poses, in order"""
+        futures = [self.submit(pose, priority) for pose in poses]
+        return [future.result(timeout) for future in futures]
+
+    def queued(self):
+        """{priority: requests waiting for a worker}"""
+        with self._lock:
+            return {priority: len(queue) for priority, queue in self.queues.items()}
+
+    def _dispatch_loop(self):
+        try:
+            while True:
+                # Indices as of this wait: _worker_died() swaps in new pipes meanwhile
+                indices = {conn: index for index, conn in enumerate(self.conns) if conn is not None}
+                for conn in wait(list(indices) + [self._wake_recv]):
+                    if conn is self._wake_recv:
+                        while self._wake_recv.poll():
+                            self._wake_recv.recv_bytes()
+                        continue
+                    index = indices[conn]
+                    if self.conns[index] is not conn:
+                        continue
+                    try:
+                        task_id, ok, value = conn.recv()
+                    except (EOFError, OSError):
+                        self._worker_died(index)
+                        continue
+                    _, request = self._in_flight.pop(index)
+                    self._complete(request, ok, value)
+                with self._lock:
+                    if not self._running:
+                        break
+                self._dispatch()
+        except Exception as e:
+            # Without the dispatcher nothing would ever complete: fail what is waiting
+            reason = f'Collision pool dispatcher failed: {type(e).__name__}: {e}'
+            print(f"[Pool] {reason}; closing the pool")
+            import traceback
+            traceback.print_exc()
+            self._fail_pending(reason)
+
+    def _fail_pending(self, reason):
+        """Close the pool to new requests and fail the queued and in-flight ones"""
+        with self._lock:
+            self._running = False
+            pending = [r for queue in self.queues.values() for r in queue]
+            for queue in self.queues.values():
+                queue.clear()
+            pending += [request for _, request in self._in_flight.values()]
+            self._in_flight.clear()
+        for request in pending:
+            if not request.future.done():
+                request.future.set_exception(RuntimeError(reason))
+
+    def _dispatch(self):
+        with self._lock:
+            for index, conn in enumerate(self.conns):
+                if index in self._in_flight or conn is None:
+                    continue
+                classes = PRIORITIES[:1] if index < self.reserved else PRIORITIES
+                queue = next((self.queues[p] for p in classes if self.queues[p]), None)
+                if queue is None:
+                    continue
+                request = queue.popleft()
+                request.dispatched = time.perf_counter()
+                self._next_id += 1
+                self._in_flight[index] = (self._next_id, request)
+                conn.send((self._next_id, request.pose))
+
+    def _complete(self, request, ok, value):
+        done = time.perf_counter()
+        wait_s, total_s = request.dispatched - request.submitted, done - request.submitted
+        self.latency[request.priority]['wait'].add(wait_s * 1000)
+        self.latency[request.priority]['total'].add(total_s * 1000)
+        self.completed[request.priority] += 1
+        if ok:
+            request.future.set_result(value)
+        else:
+            request.future.set_exception(RuntimeError(value))
+        if self.on_complete is not None:
+            self.on_complete(request.priority, wait_s, total_s)
+
+    def _worker_died(self, index):
+        code = self.processes[index].exitcode
+        flight = self._in_flight.pop(index, None)
+        if flight is not None:
+            flight[1].future.set_exception(RuntimeError(f'Collision worker {index} died (exit code {code})'))
+        if self._running:
+            print(f"[Pool] Worker {index} died (exit code {code}), starting a new one")
+            self.conns[index].close()
+            self._start_worker(index)
+
+    def stats(self):
+        """
+        Returns:
+            {priority: {'count', 'wait_ms': {p50, p95, p99}, 'total_ms': {...}}}
+        """
+        stats = {}
+        for priority in PRIORITIES:
+            histograms = self.latency[priority]
+            stats[priority] = {'count': self.completed[priority]}
+            for kind in ('wait', 'total'):
+                stats[priority][f'{kind}_ms'] = {f'p{q}': round(float(v), 3)
+                                                 for q, v in histograms[kind].percentiles().items()}
+        return stats
+
+    def print_stats(self):
+        print(f"[Pool] {self.workers} workers ({self.reserved} interactive only, {self.start_method})")
+        for priority, stats in self.stats().items():
+            if stats['count']:
+                print(f"        {priority:12s} {stats['count']:6d} requests | "
+                      f"wait p50 {stats['wait_ms']['p50']:7.1f}ms p95 {stats['wait_ms']['p95']:7.1f}ms | "
+                      f"total p50 {stats['total_ms']['p50']:7.1f}ms p95 {stats['total_ms']['p95']:7.1f}ms")
+
+    def close(self):
+        with self._lock:
+            self._running = False
+            self._wake_send.send_bytes(b'.')
+        self._dispatcher.join()
+        self._fail_pending('CollisionWorkerPool closed')
+        for conn in self.conns:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        for conn in self.conns:
+            conn.close()
+
+
+class _CheckHandler(BaseHTTPRequestHandler):
+    def _reply(self, code, payload):
+        body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/stats':
+            self.send_error(404)
+            return
+        self._reply(200, self.server.pool.stats())
+
+    def do_POST(self):
+        if self.path.split('?')[0] != '/check':
+            self.send_error(404)
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            results = self.server.pool.map(request['poses'], request.get('priority', 'batch'))
+        except (ValueError, KeyError, TypeError) as e:
+            self._reply(400, {'error': str(e)})
+            return
+        except RuntimeError as e:
+            self._reply(500, {'error': str(e)})
+            return
+        self._reply(200, {'results': results})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_check_server(pool, port=COLLISION_CHECK_PORT, host='127.0.0.1'):
+    """
+    Serve POST /check and GET /stats of a pool from a daemon thread.
+
+    Returns:
+        The HTTP server; .server_address[1] is the bound port
+    """
+    server = ThreadingHTTPServer((host, port), _CheckHandler)
+    server.daemon_threads = True
+    server.pool = pool
+    threading.Thread(target=server.serve_forever, name=f'collision-check-{port}', daemon=True).start()
+    return server
+
+
+def remote_check(poses, priority='batch', url=f'http://127.0.0.1:{COLLISION_CHECK_PORT}', timeout=60.0):
+    """Results of `poses` from a collision server's pool (collision_server.py --workers)"""
+    body = json.dumps({'priority': priority, 'poses': poses}).encode('utf-8')
+    request = urllib.request.Request(url.rstrip('/') + '/check', data=body,
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read().decode('utf-8'))['results']
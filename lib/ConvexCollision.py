@@ -0,0 +1,314 @@
+"""
+Convex Collision - GJK/EPA narrow phase over convex pieces
+==========================================================
+
+Alternative to the point-in-mesh test: the C-arm and every obstacle are
+sets of convex pieces (the 'convex' level of the scene bundle, see
+MeshLOD.py) and each piece pair is tested with
+
+    GJK   distance between separated pieces / intersection test
+    EPA   penetration depth of intersecting pieces
+
+on the Minkowski difference of the two vertex sets. The cost depends on the
+number of nearby piece pairs instead of the number of C-arm points.
+
+Consecutive poses of a sweep or of the interactive sliders are close, so
+the final GJK simplex of every pair is cached as support vertex indices
+and the next query of that pair starts from it (warm start); for a small
+pose change GJK then usually terminates after one or two iterations.
+
+Pieces contain the meshes they were generated from, so a collision in the
+inside-points backend is always an intersection here; the converse does
+not hold (pieces over-estimate by their Hausdorff bound).
+"""
+
+from itertools import combinations
+
+import numpy as np
+
+GJK_TOLERANCE = 1e-9           # relative, on the squared distance
+EPA_TOLERANCE = 1e-6           # m
+MAX_ITERATIONS = 64
+
+# Sub-simplices of a simplex with n points, grouped by size (smallest first):
+# {n: [(m, k) index arrays]}
+_SUBSETS = {n: [np.array(list(combinations(range(n), k))) for k in range(1, n + 1)]
+            for n in range(1, 5)}
+
+
+def closest_point_on_simplex(points):
+    """
+    Point of the simplex spanned by up to 4 points that is closest to the origin.
+
+    All sub-simplices of one size are solved as a batch; the first (smallest)
+    one whose projection of the origin has positive barycentric weights and
+    whose Voronoi region holds the origin is the answer.
+
+    Returns:
+        (closest point, indices of the smallest sub-simplex containing it,
+         barycentric weights over those indices)
+    """
+    best = None
+    for subsets in _SUBSETS[len(points)]:
+        vertices = points[subsets]                       # (m, k, 3)
+        if subsets.shape[1] == 1:
+            weights = np.ones((len(subsets), 1))
+        else:
+            edges = vertices[:, 1:] - vertices[:, :1]
+            gram = edges @ edges.transpose(0, 2, 1)
+            rhs = -edges @ vertices[:, 0, :, None]
+            # Degenerate (flat) sub-simplices are solved against the identity and dropped
+            singular = np.abs(np.linalg.det(gram)) <= 1e-12 * np.abs(gram).max(axis=(1, 2)) ** gram.shape[1]
+            gram[singular] = np.eye(gram.shape[1])
+            mu = np.linalg.solve(gram, rhs)[..., 0]
+            weights = np.concatenate([1.0 - mu.sum(axis=1, keepdims=True), mu], axis=1)
+            weights[singular] = -1.0
+        valid = np.all(weights > 0, axis=1)
+        if not valid.any():
+            continue
+        closest = np.einsum('mk,mkj->mj', weights[valid], vertices[valid])
+
+        # Points of the sub-simplex itself give 0; the others must not be closer
+        voronoi = np.all((points @ closest.T - np.einsum('mj,mj->m', closest, closest)) >= -1e-12, axis=0)
+        candidates = np.flatnonzero(valid)
+        if voronoi.any():
+            k = int(np.argmax(voronoi))
+            return closest[k], tuple(subsets[candidates[k]]), weights[candidates[k]]
+        k = int(np.argmin(np.einsum('mj,mj->m', closest, closest)))
+        if best is None or closest[k] @ closest[k] < best[0] @ best[0]:
+            best = (closest[k], tuple(subsets[candidates[k]]), weights[candidates[k]])
+    return best
+
+
+def gjk(a, b, simplex=None, max_iterations=MAX_ITERATIONS):
+    """
+    Distance between the convex hulls of two vertex sets (common frame).
+
+    Args:
+        a, b: (N, 3) / (M, 3) vertices
+        simplex: Support pairs [(i, j), ...] to start from (warm start)
+
+    Returns:
+        (distance, simplex support pairs, witness point on a, witness point on b);
+        distance is 0 for intersecting hulls and the simplex then contains
+        the origin (a tetrahedron unless the hulls only touch)
+    """
+    if not simplex:
+        direction = a.mean(axis=0) - b.mean(axis=0)
+        if direction @ direction == 0:
+            direction = np.array([1.0, 0.0, 0.0])
+        simplex = [(int(np.argmax(a @ -direction)), int(np.argmax(b @ direction)))]
+    simplex = list(simplex)
+    points = np.array([a[i] - b[j] for i, j in simplex])
+    v, subset, weights = closest_point_on_simplex(points)
+    simplex = [simplex[k] for k in subset]
+
+    for _ in range(max_iterations):
+        vv = v @ v
+        if vv <= GJK_TOLERANCE * GJK_TOLERANCE or len(simplex) == 4:
+            break
+        i, j = int(np.argmax(a @ -v)), int(np.argmax(b @ v))
+        w = a[i] - b[j]
+        if (i, j) in simplex or vv - v @ w <= GJK_TOLERANCE * vv:
+            break
+        simplex.append((i, j))
+        points = np.array([a[i] - b[j] for i, j in simplex])
+        v, subset, weights = closest_point_on_simplex(points)
+        simplex = [simplex[k] for k in subset]
+
+    if len(simplex) == 4 or v @ v <= GJK_TOLERANCE * GJK_TOLERANCE:
+        v = np.zeros(3)
+    witness_a = weights @ a[[i for i, _ in simplex]]
+    witness_b = weights @ b[[j for _, j in simplex]]
+    return float(np.sqrt(v @ v)), simplex, witness_a, witness_b
+
+
+def _face_planes(vertices, faces):
+    """Unit normals (from the counter-clockwise winding) and origin distances of faces"""
+    p0, p1, p2 = vertices[faces[:, 0]], vertices[faces[:, 1]], vertices[faces[:, 2]]
+    normals = np.cross(p1 - p0, p2 - p0)
+    normals /= np.maximum(np.linalg.norm(normals, axis=1, keepdims=True), 1e-300)
+    return normals, np.einsum('ij,ij->i', normals, p0)
+
+
+def _complete_tetrahedron(a, b, simplex):
+    """
+    Grow a GJK simplex that contains the origin on its boundary (GJK stops
+    as soon as the origin is on a point, edge or triangle) into a
+    tetrahedron with support points in directions that add a dimension.
+
+    Returns:
+        4 support pairs, or None if the Minkowski difference is flat
+    """
+    simplex = list(simplex)
+    while len(simplex) < 4:
+        points = np.array([a[i] - b[j] for i, j in simplex])
+        if len(simplex) == 1:
+            directions = np.concatenate([np.eye(3), -np.eye(3)])
+        elif len(simplex) == 2:
+            edge = points[1] - points[0]
+            first = np.cross(edge, np.eye(3)[int(np.argmin(np.abs(edge)))])
+            second = np.cross(edge, first)
+            directions = np.array([first, -first, second, -second])
+        else:
+            normal = np.cross(points[1] - points[0], points[2] - points[0])
+            directions = np.array([normal, -normal])
+
+        for direction in directions:
+            pair = (int(np.argmax(a @ direction)), int(np.argmax(b @ -direction)))
+            w = a[pair[0]] - b[pair[1]]
+            # Accept w if it leaves the affine hull of the simplex
+            if (w - points[0]) @ direction > EPA_TOLERANCE * np.linalg.norm(direction):
+                simplex.append(pair)
+                break
+        else:
+            return None
+    return simplex
+
+
+def epa(a, b, simplex, max_iterations=MAX_ITERATIONS):
+    """
+    Penetration depth of two intersecting vertex sets, from a GJK tetrahedron.
+
+    Returns:
+        (depth, unit direction): translating `a` by -depth * direction
+        separates the hulls (depth 0 for a flat Minkowski difference)
+    """
+    simplex = _complete_tetrahedron(a, b, simplex)
+    if simplex is None:
+        return 0.0, np.zeros(3)
+
+    vertices = [a[i] - b[j] for i, j in simplex]
+    faces = np.array([[0, 1, 2], [0, 3, 1], [0, 2, 3], [1, 3, 2]])
+    # Wind the tetrahedron outward; faces added later inherit the winding
+    points = np.array(vertices)
+    if np.cross(points[1] - points[0], points[2] - points[0]) @ (points[3] - points[0]) > 0:
+        faces = faces[:, [0, 2, 1]]
+    normals, distances = _face_planes(points, faces)
+
+    for _ in range(max_iterations):
+        closest = int(np.argmin(distances))
+        normal = normals[closest]
+        w = a[int(np.argmax(a @ normal))] - b[int(np.argmax(b @ -normal))]
+        if w @ normal - distances[closest] <= EPA_TOLERANCE:
+            break
+
+        # Replace the faces that see w by a fan from w to their horizon
+        points = np.array(vertices)
+        visible = np.einsum('ij,ij->i', normals, w - points[faces[:, 0]]) > 0
+        edges = np.concatenate([faces[visible][:, [0, 1]], faces[visible][:, [1, 2]],
+                                faces[visible][:, [2, 0]]])
+        reverse = {(int(q), int(p)) for p, q in edges}
+        horizon = [(int(p), int(q)) for p, q in edges if (int(p), int(q)) not in reverse]
+
+        vertices.append(w)
+        new_faces = np.array([[p, q, len(vertices) - 1] for p, q in horizon])
+        if len(new_faces) == 0:
+            break
+        faces = np.concatenate([faces[~visible], new_faces])
+        normals, distances = _face_planes(np.array(vertices), faces)
+
+    closest = int(np.argmin(distances))
+    return float(distances[closest]), normals[closest]
+
+
+def _bounding_volumes(pieces):
+    """Per-piece AABB-centered bounding spheres and AABBs"""
+    lo = np.array([p.min(axis=0) for p in pieces])
+    hi = np.array([p.max(axis=0) for p in pieces])
+    centers = (lo + hi) / 2.0
+    radii = np.array([np.linalg.norm(p - c, axis=1).max() for p, c in zip(pieces, centers)])
+    return {'centers': centers, 'radii': radii, 'lo': lo, 'hi': hi}
+
+
+def _lower_bounds(robot, obstacle, rotation, translation):
+    """
+    (robot pieces, obstacle pieces) lower bounds of the pair distances: the
+    larger of the bounding-sphere gap and the gap between the obstacle AABBs
+    and the AABBs of the moved robot AABBs. Negative means "may intersect".
+    """
+    centers = robot['centers'] @ rotation.T + translation
+    spheres = (np.linalg.norm(centers[:, None] - obstacle['centers'][None], axis=2)
+               - robot['radii'][:, None] - obstacle['radii'][None])
+
+    half = np.abs(rotation) @ ((robot['hi'] - robot['lo']) / 2.0).T
+    lo, hi = centers - half.T, centers + half.T
+    separation = np.maximum(np.maximum(obstacle['lo'][None] - hi[:, None],
+                                       lo[:, None] - obstacle['hi'][None]), 0.0)
+    boxes = np.linalg.norm(separation, axis=2)
+    return np.where(boxes > 0, np.maximum(spheres, boxes), spheres)
+
+
+def split_pieces(points, vertex_offsets):
+    """Per-piece vertex arrays of a packed MeshLOD level"""
+    return [np.asarray(points[vertex_offsets[i]:vertex_offsets[i + 1]], dtype=np.float64)
+            for i in range(len(vertex_offsets) - 1)]
+
+
+class ConvexCollisionEngine:
+    """GJK/EPA queries between a moving convex robot and convex obstacles"""
+
+    def __init__(self, robot_pieces, obstacles):
+        """
+        Args:
+            robot_pieces: List of (N, 3) piece vertices in the robot frame
+            obstacles: {name: list of (N, 3) piece vertices in the obstacle frame}
+        """
+        self.robot_pieces = robot_pieces
+        self.robot_bounds = _bounding_volumes(robot_pieces)
+        self.obstacles = obstacles
+        self.obstacle_bounds = {name: _bounding_volumes(pieces)
+                                for name, pieces in obstacles.items()}
+        self.simplices = {}   # (obstacle, robot piece, obstacle piece) -> GJK support pairs
+        self.gjk_calls = 0
+
+    def query(self, robot_pose, obstacle_poses, depth=True, names=None):
+        """
+        Intersection, penetration depth and distance per obstacle.
+
+        Args:
+            robot_pose: 4x4 world transform of the robot
+            obstacle_poses: {name: 4x4 world transform} (rigid)
+            depth: Run EPA on intersecting piece pairs
+            names: Obstacles to test (default: all)
+
+        Returns:
+            {name: {'intersecting', 'pairs' (intersecting piece pairs),
+                    'distance' (0 if intersecting), 'depth' (deepest pair)}}
+        """
+        results = {}
+        for name in self.obstacles if names is None else names:
+            pieces = self.obstacles[name]
+            # Work in the obstacle frame
+            relative = np.linalg.inv(obstacle_poses[name]) @ robot_pose
+            rotation, translation = relative[:3, :3], relative[:3, 3]
+            gaps = _lower_bounds(self.robot_bounds, self.obstacle_bounds[name], rotation, translation)
+            order = np.argsort(gaps, axis=None)
+
+            distance, max_depth, pairs = np.inf, 0.0, 0
+            robot_vertices = {}
+            for flat in order:
+                i, j = np.unravel_index(flat, gaps.shape)
+                if gaps[i, j] > 0 and (pairs or gaps[i, j] >= distance):
+                    break
+                if i not in robot_vertices:
+                    robot_vertices[i] = self.robot_pieces[i] @ rotation.T + translation
+
+                key = (name, int(i), int(j))
+                pair_distance, simplex, _, _ = gjk(robot_vertices[i], pieces[j], self.simplices.get(key))
+                self.simplices[key] = simplex
+                self.gjk_calls += 1
+
+                if pair_distance <= 0:
+                    pairs += 1
+                    if depth:
+                        max_depth = max(max_depth, epa(robot_vertices[i], pieces[j], simplex)[0])
+                distance = min(distance, pair_distance)
+
+            results[name] = {
+                'intersecting': pairs > 0,
+                'pairs': pairs,
+                'distance': 0.0 if pairs else float(distance),
+                'depth': float(max_depth),
+            }
+        return results
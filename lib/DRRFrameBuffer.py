@@ -0,0 +1,212 @@
+"""
+DRR Frame Buffer - Zero-copy frame handoff from drr_server.py
+=============================================================
+
+drr_server.py writes every rendered frame as raw, uncompressed pixels into
+one of a small ring of memory-mapped slot files (drr_live_0.raw,
+drr_live_1.raw, ...) and then publishes that slot in a tiny header file
+(drr_frames.bin) together with a sequence number.
+
+Readers only look at the header to find out whether a new frame exists:
+no PNG encode/decode, no stat() polling. The slot of frame `seq` is
+refilled by frame seq + slots, whose write starts once seq + slots - 1 is
+published. read_latest() therefore re-reads the header after copying the
+slot, and retries if that many newer frames have appeared, so it never
+returns a half-written frame.
+
+Header layout (little endian, HEADER_SIZE bytes):
+    magic      4s   b'DRRF'
+    version    I
+    slots      I
+    lock       I    odd while the writer is updating the header (seqlock)
+    seq        Q    number of frames published so far (0 = none yet)
+    slot       I    slot file holding frame `seq`
+    width      I
+    height     I
+    channels   I    1 = grayscale, 3 = RGB
+    timestamp  d    time.time() when the frame was published
+
+Pixels are stored row-major, top row first, uint8.
+
+This module only uses the standard library so it can be imported both by
+the Python 3 servers and by the Python 2.7 H3D scripts in lib/.
+"""
+
+import mmap
+import os
+import struct
+import time
+
+MAGIC = b'DRRF'
+VERSION = 1
+HEADER_FORMAT = '<4sIIIQIIIId'
+HEADER_SIZE = 64
+DEFAULT_HEADER_FILE = 'drr_frames.bin'
+DEFAULT_SLOT_PREFIX = 'drr_live'
+DEFAULT_SLOTS = 3
+
+
+def slot_path(slot_prefix, slot):
+    """Path of the raw pixel file for ring slot `slot`."""
+    return '%s_%d.raw' % (slot_prefix, slot)
+
+
+class FrameRingWriter(object):
+    """Publishes frames into the memory-mapped ring (used by drr_server.py)."""
+
+    def __init__(self, header_file=DEFAULT_HEADER_FILE, slot_prefix=DEFAULT_SLOT_PREFIX,
+                 slots=DEFAULT_SLOTS):
+        self.header_file = header_file
+        self.slot_prefix = slot_prefix
+        self.slots = slots
+        self.seq = 0
+        self.lock = 0
+
+        # Reuse an existing header file instead of truncating it: H3D may still
+        # have it mapped from a previous server run (truncation fails on Windows)
+        if not os.path.exists(header_file) or os.path.getsize(header_file) != HEADER_SIZE:
+            with open(header_file, 'wb') as f:
+                f.write(b'\0' * HEADER_SIZE)
+        self._header_fd = open(header_file, 'r+b')
+        self._header = mmap.mmap(self._header_fd.fileno(), HEADER_SIZE)
+        self._write_header(slot=0, width=0, height=0, channels=0, timestamp=0.0)
+
+        # Slot files are (re)mapped lazily whenever the frame size changes,
+        # e.g. when switching between grayscale and segmentation (RGB) output
+        self._slot_fds = [None] * slots
+        self._slot_maps = [None] * slots
+
+    def _write_header(self, slot, width, height, channels, timestamp):
+        struct.pack_into(HEADER_FORMAT, self._header, 0, MAGIC, VERSION, self.slots,
+                         self.lock, self.seq, slot, width, height, channels, timestamp)
+
+    def _map_slot(self, slot, nbytes):
+        """Return a writable mapping of exactly `nbytes` for the given slot."""
+        current = self._slot_maps[slot]
+        if current is not None and len(current) == nbytes:
+            return current
+
+        if current is not None:
+            current.close()
+            self._slot_fds[slot].close()
+
+        path = slot_path(self.slot_prefix, slot)
+        with open(path, 'wb') as f:
+            f.truncate(nbytes)
+        fd = open(path, 'r+b')
+        self._slot_fds[slot] = fd
+        self._slot_maps[slot] = mmap.mmap(fd.fileno(), nbytes)
+        return self._slot_maps[slot]
+
+    def write(self, img):
+        """
+        Publish a frame.
+
+        Args:
+            img: uint8 numpy array of shape (H, W) or (H, W, 3)
+
+        Returns:
+            Sequence number of the published frame
+        """
+        height, width = img.shape[:2]
+        channels = 1 if img.ndim == 2 else img.shape[2]
+        data = memoryview(img.tobytes() if not img.flags['C_CONTIGUOUS'] else img).cast('B')
+
+        slot = self.seq % self.slots
+        slot_map = self._map_slot(slot, len(data))
+        slot_map[:] = data
+
+        # Seqlock: odd lock value while the header is inconsistent
+        self.lock += 1
+        struct.pack_into('<I', self._header, 12, self.lock)
+        self.seq += 1
+        self._write_header(slot, width, height, channels, time.time())
+        self.lock += 1
+        struct.pack_into('<I', self._header, 12, self.lock)
+        return self.seq
+
+    def close(self):
+        for slot_map, fd in zip(self._slot_maps, self._slot_fds):
+            if slot_map is not None:
+                slot_map.close()
+                fd.close()
+        self._header.close()
+        self._header_fd.close()
+
+
+class FrameRingReader(object):
+    """Reads frames published by FrameRingWriter without decoding anything."""
+
+    def __init__(self, header_file=DEFAULT_HEADER_FILE, slot_prefix=DEFAULT_SLOT_PREFIX):
+        self.header_file = header_file
+        self.slot_prefix = slot_prefix
+        self._header_fd = open(header_file, 'rb')
+        self._header = mmap.mmap(self._header_fd.fileno(), HEADER_SIZE, access=mmap.ACCESS_READ)
+
+        magic, version = struct.unpack_from('<4sI', self._header, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError('Not a DRR frame buffer: %s' % header_file)
+
+    @staticmethod
+    def exists(header_file=DEFAULT_HEADER_FILE):
+        return os.path.exists(header_file)
+
+    def sequence(self):
+        """Sequence number of the latest published frame (cheap, no syscalls)."""
+        return struct.unpack_from('<Q', self._header, 16)[0]
+
+    def header(self, retries=100):
+        """
+        Consistent snapshot of the header.
+
+        Returns:
+            Dict with seq, slots, slot, width, height, channels, timestamp and path
+        """
+        for _ in range(retries):
+            before = struct.unpack_from('<I', self._header, 12)[0]
+            if before % 2:
+                continue
+            values = struct.unpack_from(HEADER_FORMAT, self._header, 0)
+            after = struct.unpack_from('<I', self._header, 12)[0]
+            if before == after:
+                _, _, slots, _, seq, slot, width, height, channels, timestamp = values
+                return {
+                    'seq': seq, 'slots': slots, 'slot': slot, 'width': width, 'height': height,
+                    'channels': channels, 'timestamp': timestamp,
+                    'path': slot_path(self.slot_prefix, slot)
+                }
+        raise IOError('DRR frame buffer header kept changing while reading')
+
+    def read_latest(self, retries=100):
+        """
+        Read the latest frame.
+
+        Returns:
+            (header dict, bytes) or (None, None) if nothing was published yet
+        """
+        for _ in range(retries):
+            info = self.header()
+            if info['seq'] == 0:
+                return None, None
+            nbytes = info['width'] * info['height'] * info['channels']
+            try:
+                with open(info['path'], 'rb') as f:
+                    slot_map = mmap.mmap(f.fileno(), nbytes, access=mmap.ACCESS_READ)
+                    try:
+                        data = slot_map[:nbytes]
+                    finally:
+                        slot_map.close()
+            except (IOError, ValueError):
+                # Slot resized by the writer for a newer frame (e.g. RGB output)
+                time.sleep(0)
+                continue
+            # The copy is whole unless the writer has started refilling the slot
+            if self.header()['seq'] <= info['seq'] + info['slots'] - 2:
+                return info, data
+            time.sleep(0)
+        raise IOError('DRR frames kept overwriting the slot while reading')
+
+    def close(self):
+        self._header.close()
+        self._header_fd.close()
@@ -4,14 +4,19 @@ DRR Mode Controller - Toggles between volume rendering and DiffDRR
 
 This script handles:
 1. Toggle button state for switching X-ray rendering modes
-2. Reloading DRR texture when drr_live.png is updated
+2. Reloading DRR texture when drr_server.py publishes a new frame
+   (raw frame ring, see DRRFrameBuffer.py; drr_live.png as fallback)
 3. Visual feedback for current mode
 """
 
 from H3DInterface import *
 import os
+import sys
 import time
 
+sys.path.insert(0, os.path.join(os.getcwd(), 'lib'))
+from DRRFrameBuffer import FrameRingReader, DEFAULT_HEADER_FILE
+
 # Global state
 volume_toggle = None      # ToggleGroup for volume rendering
 drr_toggle = None         # ToggleGroup for DRR display
@@ -21,6 +26,9 @@ last_mod_time = 0
 check_interval = 0.5      # Check every 500ms
 last_check_time = 0
 drr_file_path = "drr_live.png"
+frame_buffer_path = DEFAULT_HEADER_FILE
+frame_reader = None
+last_frame_seq = 0
 drr_mode_active = True  # Start with DRR mode ON by default
 
 def initialize():
@@ -61,6 +69,42 @@ def set_drr_mode(enabled):
             mode_button.text.setValue(["DRR Mode: OFF"])
             print("[DRR Controller] Switched to volume rendering mode")
 
+def reload_from_frame_ring():
+    """
+    Reload the DRR texture from the raw frame ring if a new frame was published.
+    Returns True if the ring is active (PNG polling is then skipped).
+    """
+    global frame_reader, last_frame_seq
+    
+    if frame_reader is None:
+        if not FrameRingReader.exists(frame_buffer_path):
+            return False
+        frame_reader = FrameRingReader(frame_buffer_path)
+    
+    seq = frame_reader.sequence()
+    if seq == 0:
+        return False
+    if seq == last_frame_seq:
+        return True
+    
+    info = frame_reader.header()
+    last_frame_seq = info['seq']
+    
+    raw_loaders = drr_texture.imageLoader.getValue()
+    drr_texture.url.setValue([])  # Clear first
+    if raw_loaders:
+        # RawImageLoader reads the slot file directly - no PNG decode
+        loader = raw_loaders[0]
+        loader.width.setValue(info['width'])
+        loader.height.setValue(info['height'])
+        loader.pixelType.setValue("RGB" if info['channels'] == 3 else "LUMINANCE")
+        loader.bitsPerPixel.setValue(8 * info['channels'])
+        drr_texture.url.setValue([info['path']])
+    else:
+        # drr_server.py replaces drr_live.png before it publishes seq
+        drr_texture.url.setValue([drr_file_path])
+    return True
+
 def reload_drr_texture():
     """Reload the DRR texture if file was updated."""
     global drr_texture, last_mod_time
@@ -68,6 +112,12 @@ def reload_drr_texture():
     if drr_texture is None or not drr_mode_active:
         return
     
+    try:
+        if reload_from_frame_ring():
+            return
+    except Exception as e:
+        print("[DRR Controller ERROR] " + str(e))
+    
     if not os.path.exists(drr_file_path):
         return
     
@@ -87,6 +137,11 @@ def traverseSG():
     """Called every frame - check for texture updates."""
     global last_check_time
     
+    # The frame ring costs one memory read per check, so no throttling needed
+    if frame_reader is not None and frame_reader.sequence() > 0:
+        reload_drr_texture()
+        return
+    
     current_time = time.time()
     if current_time - last_check_time < check_interval:
         return
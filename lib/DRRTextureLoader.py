@@ -1,53 +1,119 @@
 """
-DRR Texture Loader - Reloads DRR image from drr_live.png
-=========================================================
+DRR Texture Loader - Reloads DRR image published by drr_server.py
+=================================================================
 
-This script periodically checks if drr_live.png has been updated
-and reloads the texture in H3D.
+This script checks every frame whether drr_server.py has published a new
+DRR and reloads the texture in H3D.
+
+Two sources are supported:
+1. Raw frame ring (drr_frames.bin + drr_live_<slot>.raw, see DRRFrameBuffer.py).
+   Checking for a new frame is a read of a memory-mapped sequence number, so
+   there is no stat() polling. If the ImageTexture has a RawImageLoader in its
+   imageLoader field, the raw slot file is loaded directly (no PNG decode):
+
+       <ImageTexture DEF="DRRTexture" url="drr_live.png">
+           <RawImageLoader containerField="imageLoader" width="256" height="256"
+                           depth="1" pixelType="LUMINANCE" bitsPerPixel="8" />
+       </ImageTexture>
+
+2. drr_live.png (fallback for H3D builds that can only load image files),
+   polled by modification time every 500ms.
 
 Used in conjunction with drr_server.py for photorealistic X-ray display.
 """
 
 from H3DInterface import *
 import os
+import sys
 import time
 
+sys.path.insert(0, os.path.join(os.getcwd(), 'lib'))
+from DRRFrameBuffer import FrameRingReader, DEFAULT_HEADER_FILE
+
 # Global state
 drr_texture = None
 last_mod_time = 0
-check_interval = 0.5  # Check every 500ms
+check_interval = 0.5  # PNG fallback: check every 500ms
 last_check_time = 0
 drr_file_path = "drr_live.png"
+frame_buffer_path = DEFAULT_HEADER_FILE
+frame_reader = None
+last_frame_seq = 0
 
 def initialize():
     """Initialize the DRR texture loader."""
     global drr_texture
-    
+
     refs = references.getValue()
     if len(refs) >= 1:
         drr_texture = refs[0]
-        print("[DRR Loader] Initialized - watching: " + drr_file_path)
+        print("[DRR Loader] Initialized - watching: " + frame_buffer_path + " / " + drr_file_path)
         print("[DRR Loader] Make sure drr_server.py is running!")
     else:
         print("[DRR Loader ERROR] No texture reference provided!")
 
+def get_frame_reader():
+    """Open the raw frame ring once drr_server.py has created it."""
+    global frame_reader
+
+    if frame_reader is None and FrameRingReader.exists(frame_buffer_path):
+        try:
+            frame_reader = FrameRingReader(frame_buffer_path)
+        except Exception as e:
+            print("[DRR Loader ERROR] " + str(e))
+    return frame_reader
+
+def reload_from_frame_ring(reader):
+    """Reload texture if a new frame was published. Returns True if handled."""
+    global last_frame_seq
+
+    seq = reader.sequence()
+    if seq == 0:
+        return False
+    if seq == last_frame_seq:
+        return True
+
+    info = reader.header()
+    last_frame_seq = info['seq']
+
+    raw_loaders = drr_texture.imageLoader.getValue()
+    if raw_loaders:
+        loader = raw_loaders[0]
+        loader.width.setValue(info['width'])
+        loader.height.setValue(info['height'])
+        loader.pixelType.setValue("RGB" if info['channels'] == 3 else "LUMINANCE")
+        loader.bitsPerPixel.setValue(8 * info['channels'])
+        drr_texture.url.setValue([info['path']])
+    else:
+        # No raw loader available - use the ring only as change notification
+        # (drr_server.py replaces drr_live.png before it publishes seq)
+        drr_texture.url.setValue([drr_file_path + "?" + str(info['seq'])])
+    return True
+
 def traverseSG():
-    """Called every frame - check if DRR file was updated."""
+    """Called every frame - check if a new DRR was published."""
     global drr_texture, last_mod_time, last_check_time
-    
+
     if drr_texture is None:
         return
-    
+
+    try:
+        reader = get_frame_reader()
+        if reader is not None and reload_from_frame_ring(reader):
+            return
+    except Exception as e:
+        print("[DRR Loader ERROR] " + str(e))
+
     # Throttle checks
     current_time = time.time()
     if current_time - last_check_time < check_interval:
         return
     last_check_time = current_time
-    
+
     # Check if file exists and was modified
     if not os.path.exists(drr_file_path):
         return
-    
+
     try:
         mod_time = os.path.getmtime(drr_file_path)
         if mod_time > last_mod_time:
@@ -0,0 +1,319 @@
+"""
+Mesh LOD - Conservative simplified obstacle meshes
+==================================================
+
+Generates coarse stand-ins for the collision obstacles that are safe to
+sweep with: every level contains the full-resolution solid, so a C-arm
+point outside a coarse level is guaranteed to be outside the real mesh and
+only the (few) points inside need confirming at full resolution.
+
+Levels:
+    dop      one bounding polytope around the whole obstacle
+    convex   convex decomposition: the mesh is recursively cut in half
+             along its longest axis (vtkClipClosedSurface, cuts capped)
+             and each closed piece is bounded by its own polytope, until
+             every piece is within `max_error` or `max_pieces` is reached.
+             Capping needs a closed manifold mesh; an open or non-manifold
+             one (the patient model) is not split and gets the dop level
+
+Every polytope is a k-DOP over the same DIRECTIONS (the 6 axes plus a
+Fibonacci sphere): piece i is {x : DIRECTIONS @ x <= offsets[i]} with each
+offset the largest projection of the piece's vertices, so it contains the
+piece by construction. A level is stored as the per-piece offsets plus the
+polytope triangles (for display); the inside test is one (N, K) matrix
+product and a comparison per piece instead of a ray-cast per point.
+
+Error bound: the level contains the obstacle, so its Hausdorff distance to
+the obstacle is the largest distance from a level surface point to the
+solid. Polytope faces are sampled on a regular barycentric grid with
+covering radius `resolution` and each sample is measured to the nearest
+sample of the capped piece surface (points of the solid, so never closer
+than the solid itself); distance is 1-Lipschitz, so max sampled distance +
+resolution is a guaranteed upper bound.
+
+build_lods() verifies every level against surface samples and a grid of
+interior points (as classified by the same vedo inside test the collision
+server uses at full fidelity).
+"""
+
+import heapq
+
+import numpy as np
+
+from SceneBundle import triangulate
+
+# vedo, VTK and scipy are imported by the functions that build levels, so
+# the collision server (inside_level() and clearance_bounds() only) starts
+# without them
+
+DEFAULT_RESOLUTION = 0.01      # m, sample covering radius
+DEFAULT_MAX_ERROR = 0.03       # m, target Hausdorff bound per piece
+DEFAULT_MAX_PIECES = 32
+DOP_SPHERE_DIRECTIONS = 64
+PLANE_TOLERANCE = 1e-5         # m, slack of the half-space test (float32 vertices)
+LEVELS = ('dop', 'convex')
+
+# Cut positions tried per axis, as fractions of the extent from the middle
+# (cuts through vertices or coplanar faces can defeat the capping)
+CUT_SHIFTS = (0.0, 0.013, -0.029)
+
+
+def dop_directions(count=DOP_SPHERE_DIRECTIONS):
+    """Unit k-DOP directions: +-x, +-y, +-z then a Fibonacci sphere of `count`"""
+    i = np.arange(count) + 0.5
+    z = 1.0 - 2.0 * i / count
+    r = np.sqrt(1.0 - z * z)
+    phi = np.pi * (3.0 - np.sqrt(5.0)) * i
+    sphere = np.stack([r * np.cos(phi), r * np.sin(phi), z], axis=1)
+    return np.concatenate([np.eye(3), -np.eye(3), sphere])
+
+
+DIRECTIONS = dop_directions()
+
+
+def surface_samples(points, triangles, resolution):
+    """
+    Regular barycentric grid samples of every triangle; any surface point is
+    within `resolution` of a sample (grid step <= resolution per edge).
+    """
+    tri = points[triangles].astype(np.float64)
+    edges = np.linalg.norm(tri - np.roll(tri, 1, axis=1), axis=2).max(axis=1)
+    steps = np.maximum(np.ceil(edges / resolution).astype(int), 1)
+
+    samples = [points.astype(np.float64)]
+    for k in np.unique(steps):
+        i, j = np.meshgrid(np.arange(k + 1), np.arange(k + 1), indexing='ij')
+        keep = i + j <= k
+        bary = np.stack([i[keep], j[keep]], axis=1) / float(k)
+        group = tri[steps == k]
+        samples.append((group[:, None, 0] * (1 - bary.sum(axis=1))[None, :, None]
+                        + group[:, None, 1] * bary[None, :, 0, None]
+                        + group[:, None, 2] * bary[None, :, 1, None]).reshape(-1, 3))
+    return np.concatenate(samples)
+
+
+def is_closed(mesh):
+    """True if a vedo mesh has no boundary and no non-manifold edges"""
+    from vtkmodules.vtkFiltersCore import vtkFeatureEdges
+
+    edges = vtkFeatureEdges()
+    edges.SetInputData(mesh.polydata())
+    edges.BoundaryEdgesOn()
+    edges.NonManifoldEdgesOn()
+    edges.FeatureEdgesOff()
+    edges.ManifoldEdgesOff()
+    edges.Update()
+    return edges.GetOutput().GetNumberOfCells() == 0
+
+
+def clip_closed(mesh, origin, normal):
+    """Part of a closed vedo mesh on the `normal` side of a plane, cut capped"""
+    import vedo
+    from vtkmodules.vtkCommonDataModel import vtkPlane, vtkPlaneCollection
+    from vtkmodules.vtkFiltersGeneral import vtkClipClosedSurface
+
+    plane = vtkPlane()
+    plane.SetOrigin(*origin)
+    plane.SetNormal(*normal)
+    planes = vtkPlaneCollection()
+    planes.AddItem(plane)
+
+    clipper = vtkClipClosedSurface()
+    clipper.SetInputData(mesh.polydata())
+    clipper.SetClippingPlanes(planes)
+    clipper.Update()
+    return vedo.Mesh(clipper.GetOutput()).triangulate()
+
+
+def convex_piece(mesh, resolution):
+    """
+    Bounding k-DOP of a closed mesh and the Hausdorff bound of it to the mesh.
+
+    Returns:
+        dict with 'offsets' (K,), 'points' / 'faces' (polytope triangles),
+        'bounds' (2, 3) and 'error'
+    """
+    from scipy.spatial import ConvexHull, HalfspaceIntersection, cKDTree
+
+    points = np.asarray(mesh.points(), dtype=np.float64)
+    triangles = np.asarray(mesh.faces(), dtype=np.int64)
+    offsets = (points @ DIRECTIONS.T).max(axis=0)
+
+    # Polytope vertices; the vertex centroid is strictly inside for any
+    # piece with volume
+    halfspaces = np.hstack([DIRECTIONS, -offsets[:, None]])
+    corners = HalfspaceIntersection(halfspaces, points.mean(axis=0)).intersections
+    hull = ConvexHull(corners)
+    used = np.unique(hull.simplices)
+    remap = np.full(len(corners), -1)
+    remap[used] = np.arange(len(used))
+    dop_points = corners[used]
+    dop_faces = remap[hull.simplices].astype(np.int32)
+
+    # Distances to samples of the piece surface bound the distance to the solid from above
+    surface = cKDTree(surface_samples(points, triangles, resolution))
+    distances, _ = surface.query(surface_samples(dop_points, dop_faces, resolution))
+    return {
+        'offsets': offsets,
+        'points': dop_points,
+        'faces': dop_faces,
+        'bounds': np.stack([-offsets[3:6], offsets[:3]]),
+        'error': float(distances.max()) + resolution,
+    }
+
+
+def convex_decomposition(mesh, resolution, max_error, max_pieces):
+    """
+    Split a closed mesh until every piece's polytope is within `max_error`.
+
+    The worst piece is always split next, so stopping at `max_pieces`
+    leaves the error as even as possible. Cuts are tried along the longest
+    axis first, shifted slightly if the halves do not come out closed; a
+    piece without a clean cut is kept whole (an uncapped half would miss
+    its interior).
+
+    Returns:
+        list of convex_piece() dicts
+    """
+    pieces = [(mesh, convex_piece(mesh, resolution))]
+    # Max-heap on error; the counter keeps ties from comparing meshes
+    heap = [(-pieces[0][1]['error'], 0, pieces[0])]
+    final = []
+    counter = 1
+
+    while heap and len(heap) + len(final) < max_pieces:
+        error, _, (part, piece) = heapq.heappop(heap)
+        lo, hi = piece['bounds']
+        extent = hi - lo
+        if -error <= max_error or extent.max() < 2 * resolution:
+            final.append(piece)
+            continue
+
+        halves = None
+        for axis in np.argsort(-extent):
+            for shift in CUT_SHIFTS:
+                origin = (lo + hi) / 2.0
+                origin[axis] += shift * extent[axis]
+                normal = np.zeros(3)
+                normal[axis] = 1.0
+                cut = [clip_closed(part, origin, side) for side in (normal, -normal)]
+                cut = [half for half in cut if half.npoints >= 4]
+                if all(is_closed(half) for half in cut):
+                    halves = cut
+                    break
+            if halves is not None:
+                break
+        if halves is None:
+            final.append(piece)
+            continue
+        for half in halves:
+            half_piece = convex_piece(half, resolution)
+            heapq.heappush(heap, (-half_piece['error'], counter, (half, half_piece)))
+            counter += 1
+
+    return final + [piece for _, _, (_, piece) in heap]
+
+
+def pack_level(pieces):
+    """
+    Concatenate pieces into flat arrays.
+
+    Returns:
+        (arrays dict, info dict); arrays hold 'offsets' (pieces, K), the
+        polytope 'points' / 'faces' of all pieces and 'vertex_offsets', CSR
+        over pieces (piece i is points[vertex_offsets[i]:vertex_offsets[i + 1]])
+    """
+    vertex_offsets = np.cumsum([0] + [len(p['points']) for p in pieces])
+    arrays = {
+        'offsets': np.stack([p['offsets'] for p in pieces]),
+        'points': np.concatenate([p['points'] for p in pieces]).astype(np.float32),
+        'faces': np.concatenate([p['faces'] + offset
+                                 for p, offset in zip(pieces, vertex_offsets)]).astype(np.int32),
+        'vertex_offsets': vertex_offsets.astype(np.int64),
+    }
+    info = {
+        'pieces': len(pieces),
+        'faces': len(arrays['faces']),
+        'hausdorff': max(p['error'] for p in pieces),
+    }
+    return arrays, info
+
+
+def inside_level(points, offsets, tolerance=PLANE_TOLERANCE):
+    """
+    Mask of the points inside any piece of a level.
+
+    Args:
+        points: (N, 3) points in the level's model frame
+        offsets: (pieces, K) k-DOP offsets from pack_level()
+    """
+    points = np.asarray(points, dtype=np.float64)
+    offsets = offsets + tolerance
+    # The first 6 directions are the axes: per-piece AABBs for culling
+    lo, hi = -offsets[:, 3:6], offsets[:, :3]
+
+    inside = np.zeros(len(points), dtype=bool)
+    near = np.flatnonzero(np.all((points >= lo.min(axis=0)) & (points <= hi.max(axis=0)), axis=1))
+    if near.size == 0:
+        return inside
+
+    points = points[near]
+    projections = points @ DIRECTIONS.T
+    hit = np.zeros(len(near), dtype=bool)
+    for i in range(len(offsets)):
+        candidates = np.flatnonzero(~hit & np.all((points >= lo[i]) & (points <= hi[i]), axis=1))
+        if candidates.size:
+            hit[candidates[np.all(projections[candidates] <= offsets[i], axis=1)]] = True
+    inside[near[hit]] = True
+    return inside
+
+
+def clearance_bounds(points, offsets):
+    """
+    Per-point lower bound of the distance to a level (<= 0 inside it).
+
+    Every k-DOP half-space contains its piece, so the largest signed
+    distance to one of the piece's half-spaces bounds the distance to the
+    piece from below; the level's bound is the smallest over its pieces.
+    """
+    projections = np.asarray(points, dtype=np.float64) @ DIRECTIONS.T
+    return np.min([(projections - piece).max(axis=1) for piece in offsets], axis=0)
+
+
+def build_lods(points, faces, resolution=DEFAULT_RESOLUTION, max_error=DEFAULT_MAX_ERROR,
+               max_pieces=DEFAULT_MAX_PIECES):
+    """
+    All conservative levels of one (closed) obstacle mesh.
+
+    Returns:
+        {level: (arrays dict, info dict)} as from pack_level(); info holds
+        'pieces', 'faces' and 'hausdorff' (upper bound, mesh units); the
+        convex level also records whether the mesh was 'closed' (decomposed)
+    Raises:
+        ValueError if a level misses one of the check points
+    """
+    import vedo
+
+    points = np.asarray(points, dtype=np.float64)
+    triangles = triangulate(np.asarray(faces))
+    # Merged coincident vertices (shapes sharing coordinates) for the closed test and the cuts
+    mesh = vedo.Mesh([points, triangles]).clean()
+
+    dop = convex_piece(mesh, resolution)
+    closed = is_closed(mesh)
+    pieces = convex_decomposition(mesh, resolution, max_error, max_pieces) if closed else [dop]
+    lods = {'dop': pack_level([dop]), 'convex': pack_level(pieces)}
+    lods['convex'][1]['closed'] = closed
+
+    # Surface samples plus interior grid points at 2x the sample spacing
+    lo, hi = points.min(axis=0), points.max(axis=0)
+    grid = np.stack(np.meshgrid(*[np.arange(a, b, 2 * resolution) for a, b in zip(lo, hi)],
+                                indexing='ij'), axis=-1).reshape(-1, 3)
+    checks = np.concatenate([surface_samples(points, triangles, resolution),
+                             grid[mesh.inside_points(grid, return_ids=True)]])
+    for level, (arrays, _) in lods.items():
+        inside = inside_level(checks, arrays['offsets'])
+        if not inside.all():
+            raise ValueError(f"'{level}' level misses {np.count_nonzero(~inside)} of "
+                             f"{len(checks)} check points")
+    return lods
@@ -0,0 +1,227 @@
+"""
+Point In Mesh - Ray-parity inside test without VTK
+==================================================
+
+A point is inside a closed triangle mesh when a ray from it crosses the
+surface an odd number of times. Every ray is cast along +z of RAY_FRAME,
+a fixed rotation of the model frame, so the ray direction is generic: it
+does not run along the axis-aligned faces and edges the table meshes are
+made of, where parity counting breaks down.
+
+The triangles are kept in a bounding volume hierarchy (median splits on
+the longer of the two axes across the ray, LEAF_SIZE triangles per leaf),
+stored as flat arrays:
+
+    lo, hi          (K, 3) node boxes (ray frame)
+    child           (K, 2) child nodes, -1 for a leaf
+    start, count    (K,)   leaf triangles: triangles[start:start + count]
+    triangles       (M,)   triangle ids in leaf order
+
+Queries traverse the hierarchy breadth first for a block of points at a
+time: (point, node) pairs whose node box the ray cannot hit are dropped
+in one vectorized step per level, and the pairs that reach a leaf are
+expanded to (point, triangle) crossing tests. Blocks of BLOCK_SIZE points
+keep the working set small and are spread over a thread pool (numpy
+releases the GIL). With numba installed the traversal runs as a compiled
+per-point loop in parallel instead.
+
+Parity assumes a closed mesh, as VTK's test does. Like VTK, points outside
+the mesh's bounding box are outside without casting a ray, which keeps
+the open patient mesh from claiming points below its opening; inside the
+box the two tests agree up to a few points near the opening.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+LEAF_SIZE = 8
+BVH_KEYS = ('lo', 'hi', 'child', 'start', 'count', 'triangles')
+BLOCK_SIZE = 4096
+
+
+def _rotation(x, y, z):
+    """Rotation by Euler angles (radians) about x, then y, then z"""
+    cx, sx, cy, sy, cz, sz = np.cos(x), np.sin(x), np.cos(y), np.sin(y), np.cos(z), np.sin(z)
+    rx = np.array([[1, 0, 0], [0, cx, -sx], [0, sx, cx]])
+    ry = np.array([[cy, 0, sy], [0, 1, 0], [-sy, 0, cy]])
+    rz = np.array([[cz, -sz, 0], [sz, cz, 0], [0, 0, 1]])
+    return rz @ ry @ rx
+
+
+RAY_FRAME = _rotation(0.3119, 0.5261, 0.1753)   # model frame -> ray frame
+
+
+def build_bvh(vertices, triangles, leaf_size=LEAF_SIZE):
+    """
+    Bounding volume hierarchy of a triangle mesh for +z rays in RAY_FRAME.
+
+    Args:
+        vertices: (N, 3) model-frame vertices
+        triangles: (M, 3) vertex indices
+
+    Returns:
+        {'lo', 'hi', 'child', 'start', 'count', 'triangles'} arrays (see above)
+    """
+    corners = (np.asarray(vertices, dtype=np.float64) @ RAY_FRAME.T)[np.asarray(triangles)]
+    tri_lo, tri_hi = corners.min(axis=1), corners.max(axis=1)
+    centroids = (tri_lo + tri_hi) / 2
+
+    order = np.arange(len(triangles))
+    lo, hi, child, start, count = [], [], [], [], []
+    stack = [(0, len(order), -1, 0)]      # (begin, end, parent, slot)
+    while stack:
+        begin, end, parent, slot = stack.pop()
+        node = len(lo)
+        if parent >= 0:
+            child[parent][slot] = node
+        ids = order[begin:end]
+        lo.append(tri_lo[ids].min(axis=0))
+        hi.append(tri_hi[ids].max(axis=0))
+        child.append([-1, -1])
+        start.append(begin)
+        count.append(end - begin)
+        if end - begin <= leaf_size:
+            continue
+        extent = centroids[ids, :2].max(axis=0) - centroids[ids, :2].min(axis=0)
+        axis = int(np.argmax(extent))
+        middle = (end - begin) // 2
+        order[begin:end] = ids[np.argpartition(centroids[ids, axis], middle)]
+        stack.append((begin + middle, end, node, 1))
+        stack.append((begin, begin + middle, node, 0))
+
+    return {'lo': np.array(lo), 'hi': np.array(hi), 'child': np.array(child, dtype=np.int64),
+            'start': np.array(start, dtype=np.int64), 'count': np.array(count, dtype=np.int64),
+            'triangles': order}
+
+
+def _crossings(corners, origin):
+    """+z ray from every origin against its paired triangle (ray frame)"""
+    a, b, c = corners[:, 0] - origin, corners[:, 1] - origin, corners[:, 2] - origin
+    # 2D edge functions: the ray pierces the triangle where all three agree in sign
+    wa = b[:, 0] * c[:, 1] - b[:, 1] * c[:, 0]
+    wb = c[:, 0] * a[:, 1] - c[:, 1] * a[:, 0]
+    wc = a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0]
+    inside = ((wa > 0) & (wb > 0) & (wc > 0)) | ((wa < 0) & (wb < 0) & (wc < 0))
+    area = np.where(inside, wa + wb + wc, 1.0)
+    height = (wa * a[:, 2] + wb * b[:, 2] + wc * c[:, 2]) / area
+    return inside & (height > 0)
+
+
+def _inside_block(bvh, corners, points):
+    """Ray parity of a block of ray-frame points, breadth-first traversal"""
+    crossings = np.zeros(len(points), dtype=np.int64)
+    pid = np.arange(len(points))
+    node = np.zeros(len(points), dtype=np.int64)
+    while pid.size:
+        p = points[pid]
+        lo, hi = bvh['lo'][node], bvh['hi'][node]
+        hit = ((p[:, 0] >= lo[:, 0]) & (p[:, 0] <= hi[:, 0]) & (p[:, 1] >= lo[:, 1])
+               & (p[:, 1] <= hi[:, 1]) & (p[:, 2] <= hi[:, 2]))
+        pid, node = pid[hit], node[hit]
+
+        leaf = bvh['child'][node, 0] < 0
+        if leaf.any():
+            leaf_pid, leaf_node = pid[leaf], node[leaf]
+            counts = bvh['count'][leaf_node]
+            pair_pid = np.repeat(leaf_pid, counts)
+            first = np.repeat(bvh['start'][leaf_node] - np.cumsum(counts) + counts, counts)
+            pair_tri = first + np.arange(counts.sum())
+            # Corners relative to the ray origin keep the float error small
+            crossed = _crossings(corners[pair_tri], points[pair_pid])
+            crossings += np.bincount(pair_pid[crossed], minlength=len(points))
+
+        pid, node = pid[~leaf], node[~leaf]
+        pid = np.concatenate([pid, pid])
+        node = np.concatenate([bvh['child'][node, 0], bvh['child'][node, 1]])
+    return crossings % 2 == 1
+
+
+if numba is not None:
+    @numba.njit(parallel=True, cache=True)
+    def _inside_numba(lo, hi, child, start, count, corners, points):
+        inside = np.zeros(len(points), dtype=np.bool_)
+        for i in numba.prange(len(points)):
+            px, py, pz = points[i, 0], points[i, 1], points[i, 2]
+            stack = np.empty(128, dtype=np.int64)
+            stack[0] = 0
+            depth = 1
+            crossings = 0
+            while depth:
+                depth -= 1
+                node = stack[depth]
+                if (px < lo[node, 0] or px > hi[node, 0] or py < lo[node, 1]
+                        or py > hi[node, 1] or pz > hi[node, 2]):
+                    continue
+                if child[node, 0] >= 0:
+                    stack[depth] = child[node, 0]
+                    stack[depth + 1] = child[node, 1]
+                    depth += 2
+                    continue
+                for t in range(start[node], start[node] + count[node]):
+                    ax, ay, az = corners[t, 0, 0] - px, corners[t, 0, 1] - py, corners[t, 0, 2] - pz
+                    bx, by, bz = corners[t, 1, 0] - px, corners[t, 1, 1] - py, corners[t, 1, 2] - pz
+                    cx, cy, cz = corners[t, 2, 0] - px, corners[t, 2, 1] - py, corners[t, 2, 2] - pz
+                    wa = bx * cy - by * cx
+                    wb = cx * ay - cy * ax
+                    wc = ax * by - ay * bx
+                    if (wa > 0 and wb > 0 and wc > 0) or (wa < 0 and wb < 0 and wc < 0):
+                        if (wa * az + wb * bz + wc * cz) / (wa + wb + wc) > 0:
+                            crossings += 1
+            inside[i] = crossings % 2 == 1
+        return inside
+
+
+class PointInMesh:
+    """Inside test of one closed mesh (model frame)"""
+
+    def __init__(self, vertices, triangles, bvh=None, workers=None):
+        """
+        Args:
+            vertices: (N, 3) model-frame vertices
+            triangles: (M, 3) vertex indices
+            bvh: Precomputed build_bvh() arrays (built here if None)
+            workers: Threads for the numpy traversal (default: CPU count)
+        """
+        self.bvh = build_bvh(vertices, triangles) if bvh is None else bvh
+        self.lo, self.hi = np.min(vertices, axis=0), np.max(vertices, axis=0)
+        ray_vertices = np.asarray(vertices, dtype=np.float64) @ RAY_FRAME.T
+        self.corners = ray_vertices[np.asarray(triangles)[self.bvh['triangles']]]
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = ThreadPoolExecutor(self.workers) if self.workers > 1 else None
+
+    def inside(self, points):
+        """
+        Args:
+            points: (P, 3) model-frame points
+
+        Returns:
+            (P,) bool, True inside the mesh
+        """
+        points = np.asarray(points, dtype=np.float64)
+        inside = np.all((points >= self.lo) & (points <= self.hi), axis=1)
+        points = points[inside] @ RAY_FRAME.T
+        if numba is not None:
+            bvh = self.bvh
+            inside[inside] = _inside_numba(bvh['lo'], bvh['hi'], bvh['child'], bvh['start'],
+                                           bvh['count'], self.corners, points)
+            return inside
+        blocks = [points[i:i + BLOCK_SIZE] for i in range(0, len(points), BLOCK_SIZE)]
+        if self.pool is None or len(blocks) < 2:
+            results = [_inside_block(self.bvh, self.corners, block) for block in blocks]
+        else:
+            results = list(self.pool.map(lambda block: _inside_block(self.bvh, self.corners, block),
+                                         blocks))
+        if results:
+            inside[inside] = np.concatenate(results)
+        return inside
+
+    def inside_ids(self, points):
+        """Indices of the points inside (like vedo's inside_points(return_ids=True))"""
+        return np.flatnonzero(self.inside(points))
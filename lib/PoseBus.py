@@ -0,0 +1,358 @@
+"""
+Pose Bus - Shared-memory publication of poses and segmentation settings
+=======================================================================
+
+H3D (CollisionClient.py, SegmentationController.py) publishes typed
+messages into one small memory-mapped file (pose_bus.bin). The servers
+and the visualizer read it without any file opens or stat() calls:
+
+    pose            the 9 DOF + zoom, scene_id and    (CollisionClient)
+                    the client's request_id
+    segmentation    the active segmentation groups    (SegmentationController)
+    refresh         re-render the current pose        (SegmentationController)
+
+Each message type has its own section with a sequence number and the
+publish time; a bus-wide sequence number counts every message. Sections
+are updated under a seqlock, as in DRRFrameBuffer.py: the lock word is
+odd while a section is being written, and readers retry a snapshot that
+overlapped a write, so no reader ever sees a torn pose.
+
+Layout (little endian, BUS_SIZE bytes):
+    magic       4s   b'POSB'
+    version     I
+    lock        I    odd while a section is being written (seqlock)
+    reserved    I
+    seq         Q    messages published so far (0 = bus not used yet)
+    pose        Q seq, d time, Q request_id, POSE_FIELDS (10 d), scene_id (32s)
+    segmentation Q seq, d time, comma-joined groups (256s)
+    refresh     Q seq, d time
+
+One process writes the bus (H3D runs all its scripts on one thread);
+PoseBusWriter re-reads the lock and sequence words from the map on every
+publish, so several writer objects in that process stay consistent.
+
+PoseSubscriber is the server side: it waits for new messages by watching
+the sequence word (BUS_POLL_INTERVAL), and falls back to polling
+collision_pose.json / segmentation_settings.json until the bus carries
+its first message, so H3D builds that only write the JSON files keep
+working. pose_bus.bin outlives the H3D session that wrote it, so while
+the bus is idle the subscriber also checks the JSON files every
+FILE_CHECK_INTERVAL: if one is newer than the last bus message (by more
+than BUS_GRACE, as bus writers also write the files), a JSON-only writer
+has taken over and the files are polled until the bus moves again.
+
+This module only uses the standard library so it can be imported both by
+the Python 3 servers and by the Python 2.7 H3D scripts in lib/.
+"""
+
+import json
+import mmap
+import os
+import struct
+import time
+
+MAGIC = b'POSB'
+VERSION = 2
+BUS_SIZE = 512
+DEFAULT_BUS_FILE = 'pose_bus.bin'
+BUS_POLL_INTERVAL = 0.002       # s between sequence-word checks while waiting
+FILE_CHECK_INTERVAL = 0.5       # s between JSON file checks while the bus is idle
+BUS_GRACE = 1.0                 # s a JSON file may trail the bus message it mirrors
+
+POSE_FIELDS = ('lao_rao', 'cran_caud', 'wigwag', 'lateral', 'vertical', 'horizontal',
+               'table_vertical', 'table_longitudinal', 'table_transverse', 'zoom')
+POSE_DEFAULTS = {'zoom': 1.0}
+
+BUS_FORMAT = '<4sIIIQ' + 'QdQ10d32s' + 'Qd256s' + 'Qd'
+LOCK_OFFSET = 8
+SEQ_OFFSET = 16
+POSE_OFFSET, POSE_FORMAT = 24, '<QdQ10d32s'
+SEGMENTATION_OFFSET, SEGMENTATION_FORMAT = 160, '<Qd256s'
+REFRESH_OFFSET, REFRESH_FORMAT = 432, '<Qd'
+
+
+def _encode(text, size):
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+    if len(text) > size:
+        raise ValueError('Pose bus text longer than %d bytes: %r' % (size, text))
+    return text
+
+
+def _decode(data):
+    return data.split(b'\0', 1)[0].decode('utf-8')
+
+
+def open_bus(path=DEFAULT_BUS_FILE, writable=True):
+    """(file, mmap) of the bus, creating a zeroed bus file if there is none"""
+    # Reuse an existing file instead of truncating it: other processes may
+    # have it mapped (truncation fails on Windows)
+    if not os.path.exists(path) or os.path.getsize(path) != BUS_SIZE:
+        with open(path, 'wb') as f:
+            f.write(b'\0' * BUS_SIZE)
+            f.flush()
+    fd = open(path, 'r+b' if writable else 'rb')
+    bus = mmap.mmap(fd.fileno(), BUS_SIZE,
+                    access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+    return fd, bus
+
+
+class PoseBusWriter(object):
+    """Publishes pose, segmentation and refresh messages (H3D side)"""
+
+    def __init__(self, path=DEFAULT_BUS_FILE):
+        self.path = path
+        self._fd, self._bus = open_bus(path)
+        magic, version = struct.unpack_from('<4sI', self._bus, 0)
+        if magic != MAGIC or version != VERSION:
+            # New bus, or one left by an older version: the writer owns the layout
+            self._bus[:] = b'\0' * BUS_SIZE
+            struct.pack_into('<4sI', self._bus, 0, MAGIC, VERSION)
+
+    def _publish(self, offset, fmt, *values):
+        lock = struct.unpack_from('<I', self._bus, LOCK_OFFSET)[0]
+        lock += 2 if lock % 2 else 1        # recover from a writer that died mid-write
+        struct.pack_into('<I', self._bus, LOCK_OFFSET, lock)
+        section_seq = struct.unpack_from('<Q', self._bus, offset)[0] + 1
+        struct.pack_into(fmt, self._bus, offset, section_seq, time.time(), *values)
+        seq = struct.unpack_from('<Q', self._bus, SEQ_OFFSET)[0] + 1
+        struct.pack_into('<Q', self._bus, SEQ_OFFSET, seq)
+        struct.pack_into('<I', self._bus, LOCK_OFFSET, lock + 1)
+        return seq
+
+    def publish_pose(self, pose):
+        """
+        Publish a pose.
+
+        Args:
+            pose: Dict with POSE_FIELDS (missing ones at their default) and
+                  optionally 'scene_id' and 'request_id' (a positive int the
+                  result will carry, see ResultSlot.py)
+        """
+        values = [float(pose.get(field, POSE_DEFAULTS.get(field, 0.0))) for field in POSE_FIELDS]
+        return self._publish(POSE_OFFSET, POSE_FORMAT, int(pose.get('request_id') or 0),
+                             *(values + [_encode(pose.get('scene_id') or '', 32)]))
+
+    def publish_segmentation(self, groups):
+        """Publish the active segmentation groups"""
+        return self._publish(SEGMENTATION_OFFSET, SEGMENTATION_FORMAT,
+                             _encode(','.join(sorted(groups)), 256))
+
+    def publish_refresh(self):
+        """Ask for the current pose to be rendered again"""
+        return self._publish(REFRESH_OFFSET, REFRESH_FORMAT)
+
+    def close(self):
+        self._bus.close()
+        self._fd.close()
+
+
+_shared_writers = {}
+
+
+def shared_writer(path=DEFAULT_BUS_FILE):
+    """One writer per bus file for all scripts of this process"""
+    if path not in _shared_writers:
+        _shared_writers[path] = PoseBusWriter(path)
+    return _shared_writers[path]
+
+
+class PoseBusReader(object):
+    """Consistent snapshots of the bus"""
+
+    def __init__(self, path=DEFAULT_BUS_FILE):
+        self.path = path
+        self._fd, self._bus = open_bus(path, writable=False)
+
+    def sequence(self):
+        """Messages published so far (cheap, no syscalls)"""
+        return struct.unpack_from('<Q', self._bus, SEQ_OFFSET)[0]
+
+    def snapshot(self, retries=1000):
+        """
+        Consistent view of every section.
+
+        Returns:
+            Dict with seq and 'pose', 'segmentation', 'refresh' sections,
+            each with seq and time (plus the pose dict / the groups)
+        """
+        for _ in range(retries):
+            before = struct.unpack_from('<I', self._bus, LOCK_OFFSET)[0]
+            values = struct.unpack_from(BUS_FORMAT, self._bus, 0)
+            after = struct.unpack_from('<I', self._bus, LOCK_OFFSET)[0]
+            if before % 2 or before != after:
+                time.sleep(0)       # let a writer in this process finish
+                continue
+            pose = dict(zip(POSE_FIELDS, values[8:18]))
+            pose['timestamp'] = values[6]
+            if values[7]:
+                pose['request_id'] = values[7]
+            scene_id = _decode(values[18])
+            if scene_id:
+                pose['scene_id'] = scene_id
+            groups = _decode(values[21])
+            return {
+                'seq': values[4],
+                'pose': {'seq': values[5], 'time': values[6], 'pose': pose},
+                'segmentation': {'seq': values[19], 'time': values[20],
+                                 'groups': set(groups.split(',')) if groups else set()},
+                'refresh': {'seq': values[22], 'time': values[23]},
+            }
+        raise IOError('Pose bus kept changing while reading')
+
+    def last_publish_time(self):
+        """time.time() of the newest message in any section (0 = none yet)"""
+        return max(struct.unpack_from('<d', self._bus, offset + 8)[0]
+                   for offset in (POSE_OFFSET, SEGMENTATION_OFFSET, REFRESH_OFFSET))
+
+    def latest_pose(self):
+        """Last published pose dict, or None before the first one"""
+        section = self.snapshot()['pose']
+        return section['pose'] if section['seq'] else None
+
+    def close(self):
+        self._bus.close()
+        self._fd.close()
+
+
+class PoseSubscriber(object):
+    """
+    New messages for a server loop, from the bus or (until the bus is used,
+    or while JSON files newer than an idle bus appear) from the JSON files
+    H3D used to write.
+
+    wait() returns messages as (type, value) pairs:
+        ('pose', pose dict)           newest pose; overtaken poses are counted
+                                      in self.coalesced
+        ('segmentation', groups set)
+        ('refresh', None)
+        ('dropped', reason)           a pose file that could not be read
+    """
+
+    def __init__(self, bus_file=DEFAULT_BUS_FILE, pose_file='collision_pose.json',
+                 seg_file=None, sleep=time.sleep):
+        """
+        Args:
+            bus_file: Pose bus (None: JSON files only)
+            pose_file: Pose JSON polled while the bus is unused (None: bus only)
+            seg_file: Segmentation settings JSON polled while the bus is unused
+            sleep: Called to wait between checks
+        """
+        self.reader = PoseBusReader(bus_file) if bus_file else None
+        self.pose_file = pose_file
+        self.seg_file = seg_file
+        self.sleep = sleep
+        self.coalesced = 0
+        self._seen = {'seq': 0, 'pose': 0, 'segmentation': 0, 'refresh': 0}
+        self._file_times = {}
+        self._files_checked = 0.0
+        self._files_newer = False
+        if self.reader is not None:
+            # The current pose and groups are delivered once, like the JSON
+            # files at startup; earlier messages and refreshes are not
+            snapshot = self.reader.snapshot()
+            self._seen = {'seq': snapshot['seq'], 'refresh': snapshot['refresh']['seq'],
+                          'pose': max(snapshot['pose']['seq'] - 1, 0),
+                          'segmentation': max(snapshot['segmentation']['seq'] - 1, 0)}
+            if snapshot['pose']['seq'] or snapshot['segmentation']['seq']:
+                self._seen['seq'] -= 1
+
+    @property
+    def source(self):
+        """
+        'bus' once the bus has carried a message, unless it is idle and a
+        JSON file is newer than its last message (then 'files')
+        """
+        if self.reader is None:
+            return 'files'
+        seq = self.reader.sequence()
+        if not (self._seen['seq'] or seq):
+            return 'files'
+        if seq != self._seen['seq']:
+            return 'bus'
+        now = time.time()
+        if now - self._files_checked >= FILE_CHECK_INTERVAL:
+            self._files_checked = now
+            self._files_newer = self._newest_file_time() > self.reader.last_publish_time() + BUS_GRACE
+        return 'files' if self._files_newer else 'bus'
+
+    def _newest_file_time(self):
+        times = [0.0]
+        for path in (self.pose_file, self.seg_file):
+            try:
+                if path:
+                    times.append(os.path.getmtime(path))
+            except OSError:
+                pass
+        return max(times)
+
+    def pending(self):
+        """Whether a message is waiting"""
+        if self.source == 'bus':
+            return self.reader.sequence() != self._seen['seq']
+        return any(self._file_changed(path) for path in (self.pose_file, self.seg_file) if path)
+
+    def wait(self, timeout):
+        """Messages published since the last call, waiting up to `timeout` seconds for one"""
+        deadline = time.time() + timeout
+        while True:
+            if self.source == 'bus':
+                if self.reader.sequence() != self._seen['seq']:
+                    return self._bus_messages()
+                interval = BUS_POLL_INTERVAL
+            else:
+                messages = self._file_messages()
+                if messages:
+                    return messages
+                interval = min(timeout, 0.1)
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return []
+            self.sleep(min(interval, remaining))
+
+    def _bus_messages(self):
+        snapshot = self.reader.snapshot()
+        messages = []
+        if snapshot['segmentation']['seq'] != self._seen['segmentation']:
+            messages.append(('segmentation', snapshot['segmentation']['groups']))
+        if snapshot['pose']['seq'] != self._seen['pose']:
+            self.coalesced += max(snapshot['pose']['seq'] - self._seen['pose'] - 1, 0)
+            messages.append(('pose', snapshot['pose']['pose']))
+        if snapshot['refresh']['seq'] != self._seen['refresh']:
+            messages.append(('refresh', None))
+        self._seen = {'seq': snapshot['seq'], 'pose': snapshot['pose']['seq'],
+                      'segmentation': snapshot['segmentation']['seq'],
+                      'refresh': snapshot['refresh']['seq']}
+        self._files_newer = False       # the bus writer is back
+        return messages
+
+    def _file_changed(self, path):
+        try:
+            return os.path.getmtime(path) > self._file_times.get(path, 0)
+        except OSError:
+            return False
+
+    def _file_messages(self):
+        messages = []
+        if self.seg_file and self._file_changed(self.seg_file):
+            self._file_times[self.seg_file] = os.path.getmtime(self.seg_file)
+            try:
+                with open(self.seg_file, 'r') as f:
+                    messages.append(('segmentation', set(json.load(f).get('active', []))))
+            except (IOError, OSError, ValueError):
+                pass
+        if self.pose_file and self._file_changed(self.pose_file):
+            mod_time = os.path.getmtime(self.pose_file)
+            self._file_times[self.pose_file] = mod_time
+            try:
+                with open(self.pose_file, 'r') as f:
+                    pose = json.load(f)
+                pose.setdefault('timestamp', mod_time)
+                messages.append(('pose', pose))
+            except (IOError, OSError, ValueError) as e:
+                messages.append(('dropped', str(e)))
+        return messages
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.close()
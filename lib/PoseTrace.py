@@ -0,0 +1,177 @@
+"""
+Pose Trace - Compact binary record of incoming poses
+====================================================
+
+collision_server.py and drr_server.py (--record-trace PATH) append every
+pose they read from collision_pose.json to a trace; replay_trace.py feeds
+a trace back to either server. Layout (little endian):
+
+    header      MAGIC, version (I)
+    records     kind (1 byte), then
+                  b'P'  time (d), FIELDS (10 f), scene (H), groups (H)
+                  b'S'  length (H), utf-8 text
+
+`time` is the pose's 'timestamp' (written by H3D when the slider moved)
+or the time the server read it. `scene` and `groups` index the strings
+recorded so far (scene_id and the sorted, comma-joined segmentation
+groups active in the DRR server); index 0 is the empty string. Every
+record is flushed as it is written, so the trace of a crashed session is
+readable up to the last pose.
+
+Stock traces in TRACE_DIR are built by `python replay_trace.py stock`:
+Sample_data_files/random_joint_values.csv at the H3D client's throttle
+interval, and the scenarios of test_table_dof.py.
+"""
+
+import csv
+import os
+import struct
+import time
+
+import numpy as np
+
+MAGIC = b'PTRC'
+VERSION = 1
+TRACE_DIR = 'traces'
+
+FIELDS = ('lao_rao', 'cran_caud', 'wigwag', 'lateral', 'vertical', 'horizontal',
+          'table_vertical', 'table_longitudinal', 'table_transverse', 'zoom')
+DEFAULTS = {'zoom': 1.0}
+
+_HEADER = struct.Struct('<4sI')
+_POSE = struct.Struct('<d' + 'f' * len(FIELDS) + 'HH')
+_STRING = struct.Struct('<H')
+
+# random_joint_values.csv column -> pose field
+CSV_COLUMNS = {
+    'c_arm_orbital_deg': 'lao_rao', 'c_arm_tilt_deg': 'cran_caud', 'c_arm_wigwag_deg': 'wigwag',
+    'c_arm_lateral_m': 'lateral', 'c_arm_vertical_m': 'vertical', 'c_arm_horizontal_m': 'horizontal',
+    'table_vertical_m': 'table_vertical', 'table_longitudinal_m': 'table_longitudinal',
+    'table_transverse_m': 'table_transverse',
+}
+
+
+class PoseTraceWriter:
+    """Appends poses to a trace file (created with its header if missing)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.strings = {'': 0}
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        if exists:
+            self.strings.update({text: i for i, text in enumerate(PoseTrace(path).strings) if i})
+        self.file = open(path, 'ab')
+        if not exists:
+            self.file.write(_HEADER.pack(MAGIC, VERSION))
+            self.file.flush()
+
+    def _string(self, text):
+        if text not in self.strings:
+            data = text.encode('utf-8')
+            self.file.write(b'S' + _STRING.pack(len(data)) + data)
+            self.strings[text] = len(self.strings)
+        return self.strings[text]
+
+    def record(self, pose_data, scene_id=None, groups=()):
+        """
+        Append one pose.
+
+        Args:
+            pose_data: Pose as read from collision_pose.json
+            scene_id: Scene the pose was checked in (None: the default)
+            groups: Active segmentation groups (DRR server)
+        """
+        scene = self._string(scene_id or '')
+        group_text = self._string(','.join(sorted(groups)))
+        values = [float(pose_data.get(field, DEFAULTS.get(field, 0.0))) for field in FIELDS]
+        self.file.write(b'P' + _POSE.pack(float(pose_data.get('timestamp', time.time())),
+                                          *values, scene, group_text))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class PoseTrace:
+    """A trace read into memory"""
+
+    def __init__(self, path=None, times=None, poses=None, scenes=None, groups=None, strings=None):
+        """
+        Args:
+            path: Trace file to read; or build a trace from `times` (N,) and
+                  `poses` (N, len(FIELDS)) with optional string indices
+        """
+        self.path = path
+        if path is not None:
+            times, poses, scenes, groups, strings = _read(path)
+        self.times = np.asarray(times, dtype=np.float64)
+        self.poses = np.asarray(poses, dtype=np.float32).reshape(len(self.times), len(FIELDS))
+        self.scenes = np.zeros(len(self.times), np.uint16) if scenes is None else np.asarray(scenes, np.uint16)
+        self.groups = np.zeros(len(self.times), np.uint16) if groups is None else np.asarray(groups, np.uint16)
+        self.strings = strings or ['']
+
+    def __len__(self):
+        return len(self.times)
+
+    def duration(self):
+        return float(self.times[-1] - self.times[0]) if len(self) > 1 else 0.0
+
+    def pose(self, i):
+        """Pose i as a collision_pose.json dict (with 'scene_id' / 'groups' when set)"""
+        pose = {field: float(value) for field, value in zip(FIELDS, self.poses[i])}
+        pose['timestamp'] = float(self.times[i])
+        if self.scenes[i]:
+            pose['scene_id'] = self.strings[self.scenes[i]]
+        if self.groups[i]:
+            pose['groups'] = self.strings[self.groups[i]].split(',')
+        return pose
+
+    def save(self, path):
+        """Write the trace to a new file"""
+        if os.path.exists(path):
+            os.remove(path)
+        writer = PoseTraceWriter(path)
+        for i in range(len(self)):
+            pose = self.pose(i)
+            writer.record(pose, pose.get('scene_id'), pose.get('groups', ()))
+        writer.close()
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a pose trace (version {VERSION})")
+    strings, rows = [''], []
+    offset = _HEADER.size
+    while offset < len(data):
+        kind = data[offset:offset + 1]
+        offset += 1
+        if kind == b'P':
+            if offset + _POSE.size > len(data):
+                break       # last record cut short (writer killed mid-write)
+            rows.append(_POSE.unpack_from(data, offset))
+            offset += _POSE.size
+        elif kind == b'S':
+            (length,) = _STRING.unpack_from(data, offset)
+            strings.append(data[offset + _STRING.size:offset + _STRING.size + length].decode('utf-8'))
+            offset += _STRING.size + length
+        else:
+            raise ValueError(f"{path}: unknown record type {kind!r} at byte {offset - 1}")
+    rows = np.array(rows, dtype=np.float64).reshape(-1, len(FIELDS) + 3)
+    return rows[:, 0], rows[:, 1:-2], rows[:, -2], rows[:, -1], strings
+
+
+def trace_from_poses(poses, interval):
+    """Trace of pose dicts (FIELDS keys, missing ones at their default) `interval` seconds apart"""
+    values = [[pose.get(field, DEFAULTS.get(field, 0.0)) for field in FIELDS] for pose in poses]
+    return PoseTrace(times=np.arange(len(poses)) * interval, poses=values)
+
+
+def trace_from_csv(path, interval):
+    """Trace of a joint-value table with the columns of random_joint_values.csv"""
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    return trace_from_poses([{field: float(row[column]) for column, field in CSV_COLUMNS.items()}
+                             for row in rows], interval)
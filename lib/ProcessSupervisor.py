@@ -0,0 +1,225 @@
+"""
+Process Supervisor - Parallel start, readiness and restarts of the servers
+==========================================================================
+
+launch_all.py runs collision_server.py, drr_server.py and the visualizer
+as Components of a Supervisor:
+
+    start       every component is started at once; startup takes as long
+                as the slowest component, not the sum of fixed sleeps
+    ready       a server is ready once its /health endpoint answers (see
+                ServerMetrics.py). The endpoint only comes up in run_server(),
+                after the meshes / CT are loaded. The health dict must carry
+                the token the supervisor put in the child's environment, so
+                a stale server still holding the port is not taken for it
+    health      ready servers are pinged every HEALTH_INTERVAL seconds; one
+                that stops answering HEALTH_FAILURES times in a row, or whose
+                loop has not come round for `hung_after` seconds, is restarted
+    restart     a component that exits, fails its health pings or misses
+                its ready_timeout is restarted after RESTART_BACKOFF (1 s,
+                2 s, 4 s, ... 30 s); the backoff resets once it has been ready
+                for STABLE_AFTER seconds. After max_restarts restarts in a
+                row it is given up (Supervisor.failed)
+
+Components without a health URL (the visualizer) are ready once started
+and, with restart=False, are only reported when they exit.
+"""
+
+import os
+import subprocess
+import time
+import uuid
+
+from ServerMetrics import probe_health, SUPERVISOR_TOKEN_ENV
+
+HEALTH_INTERVAL = 5.0           # s between health pings of a ready server
+HEALTH_FAILURES = 3             # unanswered pings in a row before a restart
+HUNG_AFTER = 60.0               # s without a loop iteration before a restart
+READY_POLL_INTERVAL = 0.1       # s between readiness probes while starting
+RESTART_BACKOFF = (1.0, 2.0, 4.0, 8.0, 16.0, 30.0)
+STABLE_AFTER = 60.0             # s ready before the backoff resets
+MAX_RESTARTS = 5
+
+
+class Component:
+    """One supervised process"""
+
+    def __init__(self, name, command, cwd=None, health_url=None, ready_timeout=120.0,
+                 restart=True, hung_after=HUNG_AFTER, max_restarts=MAX_RESTARTS,
+                 backoff=RESTART_BACKOFF):
+        """
+        Args:
+            name: Name in the supervisor's messages
+            command: Argument list for subprocess.Popen
+            health_url: /health URL of the process (None: ready once started)
+            ready_timeout: Seconds from start to ready before a restart
+            restart: Restart when the process exits or fails (False: report only)
+            hung_after: Restart when the loop_age_s reported on /health
+                        exceeds this (None to ignore)
+        """
+        self.name = name
+        self.command = command
+        self.cwd = cwd
+        self.health_url = health_url
+        self.ready_timeout = ready_timeout
+        self.restart = restart
+        self.hung_after = hung_after
+        self.max_restarts = max_restarts
+        self.backoff = backoff
+        self.process = None
+        self.state = 'stopped'      # starting, ready, backoff, stopped, failed
+        self.token = None
+        self.started = self.ready_at = self.next_start = self.next_ping = None
+        self.restarts = 0           # in a row, reset once stable
+        self.total_restarts = 0
+        self.ping_failures = 0
+
+    @property
+    def time_to_ready(self):
+        """Seconds from the last start to ready (None while not ready)"""
+        return self.ready_at - self.started if self.ready_at is not None else None
+
+    def start(self):
+        self.token = uuid.uuid4().hex
+        env = dict(os.environ, **{SUPERVISOR_TOKEN_ENV: self.token})
+        self.process = subprocess.Popen(self.command, cwd=self.cwd, env=env)
+        self.started, self.ready_at = time.time(), None
+        self.state = 'starting'
+        self.ping_failures = 0
+
+    def stop(self, timeout=3.0):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+    def probe(self, timeout=1.0):
+        """/health of this process (None if it does not answer, or another process does)"""
+        health = probe_health(self.health_url, timeout)
+        if health is None or health.get('token') != self.token:
+            return None
+        return health
+
+
+class Supervisor:
+    """Starts components in parallel, waits for them to be ready and keeps them running"""
+
+    def __init__(self, components, health_interval=HEALTH_INTERVAL,
+                 health_failures=HEALTH_FAILURES, stable_after=STABLE_AFTER):
+        self.components = list(components)
+        self.health_interval = health_interval
+        self.health_failures = health_failures
+        self.stable_after = stable_after
+
+    @property
+    def failed(self):
+        """Components given up after too many restarts"""
+        return [c for c in self.components if c.state == 'failed']
+
+    def start_all(self):
+        for component in self.components:
+            component.start()
+            print(f"[Supervisor] Started {component.name} (pid {component.process.pid})")
+
+    def wait_ready(self, timeout=None):
+        """
+        Supervise until every component is ready (or has failed / stopped).
+
+        Returns:
+            Seconds from the first start to the last component ready, None
+            if a component failed or `timeout` ran out first
+        """
+        first_start = min(c.started for c in self.components)
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            self.poll()
+            waiting = [c for c in self.components if c.state in ('starting', 'backoff')]
+            if not waiting:
+                break
+            if deadline is not None and time.time() >= deadline:
+                return None
+            time.sleep(READY_POLL_INTERVAL)
+        if any(c.state != 'ready' for c in self.components if c.restart or c.health_url):
+            return None
+        return max(c.ready_at for c in self.components if c.ready_at is not None) - first_start
+
+    def poll(self):
+        """One supervision step: readiness probes, exits, health pings, restarts"""
+        now = time.time()
+        for component in self.components:
+            if component.state == 'backoff':
+                if now >= component.next_start:
+                    component.start()
+                    print(f"[Supervisor] Restarted {component.name} (pid {component.process.pid}, "
+                          f"restart {component.restarts})")
+                continue
+            if component.state not in ('starting', 'ready'):
+                continue
+
+            code = component.process.poll()
+            if code is not None:
+                self._failed(component, f"exited with code {code}")
+            elif component.state == 'starting':
+                if component.health_url is None or component.probe() is not None:
+                    component.state = 'ready'
+                    component.ready_at = time.time()
+                    component.next_ping = component.ready_at + self.health_interval
+                    print(f"[Supervisor] {component.name} ready in {component.time_to_ready:.1f}s")
+                elif now - component.started > component.ready_timeout:
+                    self._failed(component, f"not ready after {component.ready_timeout:g}s")
+            else:
+                if component.restarts and now - component.ready_at >= self.stable_after:
+                    component.restarts = 0
+                if component.health_url is not None and now >= component.next_ping:
+                    self._ping(component, now)
+
+    def _ping(self, component, now):
+        component.next_ping = now + self.health_interval
+        health = component.probe()
+        if health is None:
+            component.ping_failures += 1
+            if component.ping_failures >= self.health_failures:
+                self._failed(component, f"{component.ping_failures} health pings unanswered")
+            return
+        component.ping_failures = 0
+        if component.hung_after is not None and health.get('loop_age_s', 0) > component.hung_after:
+            self._failed(component, f"loop stuck for {health['loop_age_s']:.0f}s")
+
+    def _failed(self, component, reason):
+        component.stop()
+        if not component.restart:
+            component.state = 'stopped'
+            print(f"[Supervisor] {component.name} {reason}")
+            return
+        if component.restarts >= component.max_restarts:
+            component.state = 'failed'
+            print(f"[Supervisor] {component.name} {reason}; giving up after "
+                  f"{component.restarts} restarts")
+            return
+        delay = component.backoff[min(component.restarts, len(component.backoff) - 1)]
+        component.restarts += 1
+        component.total_restarts += 1
+        component.state = 'backoff'
+        component.next_start = time.time() + delay
+        print(f"[Supervisor] {component.name} {reason}; restarting in {delay:g}s")
+
+    def stop_all(self):
+        for component in self.components:
+            if component.process is not None and component.process.poll() is None:
+                print(f"Terminating {component.name}...")
+            component.stop()
+            if component.state != 'failed':
+                component.state = 'stopped'
+
+    def status(self):
+        """Detail lines (name, state, pid, restarts) for the console"""
+        lines = []
+        for component in self.components:
+            pid = component.process.pid if component.process is not None else '-'
+            ready = f", ready in {component.time_to_ready:.1f}s" if component.time_to_ready else ""
+            lines.append(f"        {component.name:22s} {component.state:9s} pid {pid}{ready}"
+                         f", {component.total_restarts} restarts")
+        return lines
@@ -0,0 +1,175 @@
+"""
+Result Slot - Atomic publication of collision results
+=====================================================
+
+collision_server.py publishes every result twice, never in place:
+
+    collision_result.bin    shared-memory slot (this module): the request ID
+                            and the minified JSON result under a seqlock, as
+                            in PoseBus.py / DRRFrameBuffer.py
+    collision_result.json   minified JSON written to a temporary file and
+                            renamed over the old one (write_result_file)
+
+Every pose carries a request ID chosen by the client (CollisionClient.py,
+see PoseBus.py) and the result repeats it, so a client waits for exactly
+its own result: wait_for() watches the slot's sequence word in memory and
+returns as soon as the result with that ID is in, never a result for an
+older pose and never a half-written one.
+
+Layout (little endian, SLOT_SIZE bytes):
+    magic       4s   b'CRES'
+    version     I
+    lock        I    odd while the slot is being written (seqlock)
+    length      I    bytes of JSON payload
+    seq         Q    results published so far
+    request_id  Q    request ID of the pose (0: none supplied)
+    payload          UTF-8 JSON, MAX_PAYLOAD bytes at most
+
+This module only uses the standard library so it can be imported both by
+the Python 3 server and by the Python 2.7 H3D scripts in lib/.
+"""
+
+import json
+import mmap
+import os
+import struct
+import time
+
+MAGIC = b'CRES'
+VERSION = 1
+SLOT_SIZE = 16384
+DEFAULT_SLOT_FILE = 'collision_result.bin'
+RESULT_POLL_INTERVAL = 0.001    # s between sequence-word checks while waiting
+
+HEADER_FORMAT = '<4sIIIQQ'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+MAX_PAYLOAD = SLOT_SIZE - HEADER_SIZE
+LOCK_OFFSET = 8
+SEQ_OFFSET = 16
+
+
+def encode_result(result):
+    """Minified JSON bytes of a result"""
+    return json.dumps(result, separators=(',', ':')).encode('utf-8')
+
+
+def write_result_file(path, result):
+    """Replace `path` with the minified result in one rename: readers see the
+    old file or the new one, never a partial write"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(encode_result(result))
+    replace_file(tmp_path, path)
+
+
+def replace_file(tmp_path, path):
+    """os.replace(), retried while a reader holds `path` open (Windows)"""
+    for attempt in range(3):
+        try:
+            os.replace(tmp_path, path)
+            return
+        except PermissionError:
+            # Windows refuses while a reader has the old file open
+            if attempt == 2:
+                raise
+            time.sleep(0.005)
+
+
+def _open_slot(path, writable):
+    if not os.path.exists(path) or os.path.getsize(path) != SLOT_SIZE:
+        with open(path, 'wb') as f:
+            f.write(b'\0' * SLOT_SIZE)
+    fd = open(path, 'r+b' if writable else 'rb')
+    slot = mmap.mmap(fd.fileno(), SLOT_SIZE,
+                     access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+    return fd, slot
+
+
+class ResultSlotWriter(object):
+    """Publishes results into the slot (collision server side)"""
+
+    def __init__(self, path=DEFAULT_SLOT_FILE):
+        self.path = path
+        self._fd, self._slot = _open_slot(path, writable=True)
+        magic, version = struct.unpack_from('<4sI', self._slot, 0)
+        if magic != MAGIC or version != VERSION:
+            self._slot[:] = b'\0' * SLOT_SIZE
+            struct.pack_into('<4sI', self._slot, 0, MAGIC, VERSION)
+
+    def publish(self, result, request_id=None):
+        """
+        Publish a result.
+
+        Args:
+            result: JSON-serializable result dict
+            request_id: Request ID of the pose it answers (None: none supplied)
+
+        Returns:
+            Sequence number of the result
+        """
+        payload = encode_result(result)
+        if len(payload) > MAX_PAYLOAD:
+            raise ValueError('Result of %d bytes does not fit the slot (%d)' % (len(payload), MAX_PAYLOAD))
+        lock = struct.unpack_from('<I', self._slot, LOCK_OFFSET)[0]
+        lock += 2 if lock % 2 else 1
+        struct.pack_into('<I', self._slot, LOCK_OFFSET, lock)
+        seq = struct.unpack_from('<Q', self._slot, SEQ_OFFSET)[0] + 1
+        self._slot[HEADER_SIZE:HEADER_SIZE + len(payload)] = payload
+        struct.pack_into('<IQQ', self._slot, 12, len(payload), seq, request_id or 0)
+        struct.pack_into('<I', self._slot, LOCK_OFFSET, lock + 1)
+        return seq
+
+    def close(self):
+        self._slot.close()
+        self._fd.close()
+
+
+class ResultSlotReader(object):
+    """Consistent reads of the slot (client side)"""
+
+    def __init__(self, path=DEFAULT_SLOT_FILE):
+        self.path = path
+        self._fd, self._slot = _open_slot(path, writable=False)
+
+    def sequence(self):
+        """Results published so far (cheap, no syscalls)"""
+        return struct.unpack_from('<Q', self._slot, SEQ_OFFSET)[0]
+
+    def read(self, retries=1000):
+        """
+        Returns:
+            (seq, request_id, result dict), result None before the first one
+        """
+        for _ in range(retries):
+            before = struct.unpack_from('<I', self._slot, LOCK_OFFSET)[0]
+            length, seq, request_id = struct.unpack_from('<IQQ', self._slot, 12)
+            payload = self._slot[HEADER_SIZE:HEADER_SIZE + min(length, MAX_PAYLOAD)]
+            after = struct.unpack_from('<I', self._slot, LOCK_OFFSET)[0]
+            if before % 2 or before != after:
+                time.sleep(0)
+                continue
+            return seq, request_id, json.loads(payload.decode('utf-8')) if seq else None
+        raise IOError('Result slot kept changing while reading')
+
+    def wait_for(self, request_id, timeout, sleep=time.sleep):
+        """
+        Wait for the result of one request.
+
+        Returns:
+            Result dict, None if it did not arrive within `timeout` seconds
+        """
+        deadline = time.time() + timeout
+        seen = None
+        while True:
+            seq = self.sequence()
+            if seq != seen:
+                seen, result_id, result = self.read()
+                if result is not None and result_id == request_id:
+                    return result
+            if time.time() >= deadline:
+                return None
+            sleep(RESULT_POLL_INTERVAL)
+
+    def close(self):
+        self._slot.close()
+        self._fd.close()
@@ -0,0 +1,220 @@
+"""
+Sampling Profiler - Collapsed stacks of a running server loop
+=============================================================
+
+SamplingProfiler samples the Python stack of one thread (the server's main
+loop) every `interval` seconds from a timer thread, for a fixed window,
+and writes the samples as collapsed stacks, one line per distinct stack:
+
+    run_server (collision_server.py:712);check_collision (collision_server.py:598);... 42
+
+which flamegraph.pl, speedscope and inferno read as they are. A summary
+attributes every sample to the package of its innermost frame (vedo,
+vtkmodules, numpy, json, a repo module, ...); the server loops sleep in
+idle(), so waiting for the next pose shows up as 'idle'.
+
+The sampler needs the GIL to read the stack, so time in a C call that
+holds the GIL (part of a VTK filter) is charged to the first sample the
+sampler gets after it, still at the Python line that made the call.
+
+ProfileControl starts windows on a running server without a restart:
+
+    signal      SIGUSR1 (POSIX) / SIGBREAK (Windows, Ctrl+Break)
+    control     PROFILE_REQUEST_FILE, {"target": "collision" | "drr" | "all",
+                                       "seconds": 10}, e.g. written by
+                profile_server.py
+
+Profiles are written to PROFILE_DIR/<server>_<time>.collapsed.
+"""
+
+import json
+import os
+import signal
+import sys
+import sysconfig
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+DEFAULT_INTERVAL = 0.005        # s between samples
+DEFAULT_WINDOW = 10.0           # s of sampling per request
+PROFILE_DIR = 'profiles'
+PROFILE_REQUEST_FILE = 'profile_request.json'
+PROFILE_SIGNAL = getattr(signal, 'SIGUSR1', None) or getattr(signal, 'SIGBREAK', None)
+_STDLIB = sysconfig.get_paths()['stdlib'].replace('\\', '/') + '/'
+
+
+def frame_label(frame):
+    """`function (file:line)` of a frame; site-package and standard library
+    files relative to their root (vedo/mesh.py, json/encoder.py)"""
+    code = frame.f_code
+    path = code.co_filename.replace('\\', '/')
+    for marker in ('/site-packages/', '/dist-packages/'):
+        if marker in path:
+            path = path.split(marker, 1)[1]
+            break
+    else:
+        path = path[len(_STDLIB):] if path.startswith(_STDLIB) else os.path.basename(path)
+    return f'{code.co_name} ({path}:{frame.f_lineno})'
+
+
+def idle(seconds):
+    """Sleep of a server loop between polls; samples in here count as 'idle'"""
+    time.sleep(seconds)
+
+
+def frame_package(label):
+    """Package of a frame label: top-level site package, else the file's module"""
+    if label.startswith('idle (SamplingProfiler.py:'):
+        return 'idle'
+    path = label.rsplit(' (', 1)[1].rsplit(':', 1)[0]
+    return path.split('/', 1)[0].replace('.py', '') if '/' in path else path.replace('.py', '')
+
+
+class SamplingProfiler:
+    """Timer-thread sampler of one thread's Python stack"""
+
+    def __init__(self, interval=DEFAULT_INTERVAL, thread_id=None):
+        """
+        Args:
+            interval: Seconds between samples
+            thread_id: Thread to sample (default: the thread creating the profiler)
+        """
+        self.interval = interval
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.stacks = Counter()
+        self.samples = 0
+        self.started = self.stopped = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds=DEFAULT_WINDOW, on_done=None):
+        """
+        Sample for `seconds` (None: until stop()) from a daemon thread.
+
+        Args:
+            on_done: Called with the profiler from the sampling thread when
+                     the window ends
+        """
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop.clear()
+        self.started, self.stopped = time.time(), None
+        self._thread = threading.Thread(target=self._run, args=(seconds, on_done),
+                                        name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self, seconds, on_done):
+        deadline = None if seconds is None else time.perf_counter() + seconds
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break           # sampled thread has exited
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame))
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+        self.stopped = time.time()
+        if on_done is not None:
+            on_done(self)
+
+    def collapsed(self):
+        """Collapsed stack lines, most frequent first"""
+        return [f'{stack} {count}' for stack, count in self.stacks.most_common()]
+
+    def write(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            f.write('\n'.join(self.collapsed()) + '\n')
+        os.replace(path + '.tmp', path)     # readers never see a partial profile
+
+    def summary(self, top=8):
+        """
+        Returns:
+            [(package, fraction of samples)] of the innermost frames, largest first
+        """
+        packages = Counter()
+        for stack, count in self.stacks.items():
+            packages[frame_package(stack.rsplit(';', 1)[-1])] += count
+        return [(package, count / max(self.samples, 1)) for package, count in packages.most_common(top)]
+
+
+class ProfileControl:
+    """Starts profiling windows of a server loop on a signal or control file"""
+
+    def __init__(self, name, request_file=PROFILE_REQUEST_FILE, output_dir=PROFILE_DIR,
+                 interval=DEFAULT_INTERVAL):
+        """
+        Args:
+            name: Server name, matched against a request's "target"
+            request_file: Control file polled by poll()
+            output_dir: Directory of the collapsed-stack files
+        """
+        self.name = name
+        self.request_file = request_file
+        self.output_dir = output_dir
+        self.profiler = SamplingProfiler(interval)
+        self.last_request = os.path.getmtime(request_file) if os.path.exists(request_file) else 0
+        self.last_output = None
+
+    def install_signal(self, seconds=DEFAULT_WINDOW):
+        """Profile `seconds` whenever PROFILE_SIGNAL arrives (main thread only)"""
+        if PROFILE_SIGNAL is None or threading.current_thread() is not threading.main_thread():
+            return None
+        signal.signal(PROFILE_SIGNAL, lambda signum, frame: self.start(seconds))
+        return PROFILE_SIGNAL
+
+    def start(self, seconds=DEFAULT_WINDOW):
+        """Start a window unless one is running"""
+        if self.profiler.running:
+            print("[Profile] Already sampling, request ignored")
+            return False
+        print(f"[Profile] Sampling {self.name} for {seconds:g}s "
+              f"(every {self.profiler.interval * 1000:g}ms)")
+        self.profiler.start(seconds, on_done=self._finish)
+        return True
+
+    def poll(self):
+        """Start a window if the control file has a new request for this server"""
+        try:
+            mod_time = os.path.getmtime(self.request_file)
+        except OSError:
+            return
+        if mod_time <= self.last_request:
+            return
+        self.last_request = mod_time
+        try:
+            with open(self.request_file) as f:
+                request = json.load(f)
+        except (OSError, ValueError):
+            return
+        if request.get('target', 'all') in ('all', self.name):
+            self.start(float(request.get('seconds', DEFAULT_WINDOW)))
+
+    def stop(self):
+        if self.profiler.running:
+            self.profiler.stop()
+
+    def _finish(self, profiler):
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        path = os.path.join(self.output_dir, f'{self.name}_{stamp}.collapsed')
+        profiler.write(path)
+        self.last_output = path
+        shares = ', '.join(f'{package} {fraction * 100:.0f}%' for package, fraction in profiler.summary())
+        print(f"[Profile] {profiler.samples} samples over {profiler.stopped - profiler.started:.1f}s "
+              f"-> {path}")
+        print(f"        Innermost frames: {shares or 'none'}")
@@ -0,0 +1,305 @@
+"""
+Scene Bundle - Compiled, memory-mappable collision scene
+========================================================
+
+build_scene_bundle.py compiles every collision input (C-arm point cloud,
+table and patient meshes) into a single file. Consumers memory-map it, so
+opening the scene costs a few page faults instead of parsing an .npy and
+four PLYs through vedo.load, and processes opening the same bundle share
+its pages.
+
+File layout:
+    header   32 bytes   magic b'CSCNBNDL', version, index offset/length
+    arrays   raw little-endian arrays, each 64-byte aligned
+    index    JSON: objects, array descriptors, transforms, source hashes
+
+Per object ('points' or 'mesh'):
+    points          (N, 3) float32, model frame
+    faces           (M, K) int32  polygons as in the source (K=3 or 4) (mesh)
+    triangles       (T, 3) int32  fan triangulation of faces        (mesh)
+    face_normals    (M, 3) float32                                 (mesh)
+    vertex_normals  (N, 3) float32                                 (mesh)
+    bounds          (2, 3) float32  AABB min/max
+    sphere          (4,)   float32  bounding sphere center + radius
+    grid_offsets /  uniform grid over the AABB, CSR list of the faces
+    grid_faces      overlapping each cell                          (mesh)
+    bvh_*           triangle hierarchy of the ray-parity inside
+                    test (see PointInMesh.py)                      (mesh)
+    placed_points / points and AABB with the object's constant scene
+    placed_bounds   transform baked in (only if it has one; transforms are
+                    rigid, a scene's scale is already in the points)
+    lod_<level>_*   conservative simplified levels (see MeshLOD.py):
+                    offsets (pieces, K) float64 k-DOP offsets, the
+                    polytope points / faces and per-piece vertex_offsets,
+                    model frame (obstacle meshes; the C-arm's come from
+                    its X3D mesh)
+    samples         (S, 3) float32 surface samples of a moving mesh (the
+                    C-arm links, see CArmLinks.py)
+    hash_<kind>_*   spatial hash grid over the collision points (see
+                    SpatialHash.py): kind 'points' for the C-shape cloud,
+                    'links' for all links (C-arm object only)
+    contact_<link>_<obstacle>
+                    (P,) int32 ids of the link's samples inside the
+                    obstacle at the home pose, exempt from it (C-arm
+                    object only, see CArmLinks.home_contacts)
+
+The index also records the SHA1 of every input file and of the X3D
+sources that produced them, so a bundle is rebuilt when any of them change.
+"""
+
+import hashlib
+import json
+import os
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from PointInMesh import build_bvh, BVH_KEYS
+from SpatialHash import GRID_ARRAYS
+
+MAGIC = b'CSCNBNDL'
+VERSION = 8
+HEADER_FORMAT = '<8sIIQQ'
+HEADER_SIZE = 32
+ALIGNMENT = 64
+DEFAULT_BUNDLE = '3d_inputs/collision_scene.bundle'
+
+
+def file_sha1(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _polygon_normals(points, faces):
+    """Newell normals of (M, K) polygons (length = 2 x polygon area)"""
+    p = points.astype(np.float64)
+    return np.cross(p[faces], p[np.roll(faces, -1, axis=1)]).sum(axis=1)
+
+
+def _normalize(vectors):
+    lengths = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(lengths > 0, lengths, 1.0)
+
+
+def face_normals(points, faces):
+    """Unit normal of every polygon"""
+    return _normalize(_polygon_normals(points, faces))
+
+
+def vertex_normals(points, faces):
+    """Area-weighted vertex normals"""
+    weighted = _polygon_normals(points, faces)
+    result = np.zeros((len(points), 3))
+    for k in range(faces.shape[1]):
+        np.add.at(result, faces[:, k], weighted)
+    return _normalize(result)
+
+
+def triangulate(faces):
+    """Fan triangulation of (M, K) polygons"""
+    return np.concatenate([faces[:, [0, k, k + 1]] for k in range(1, faces.shape[1] - 1)])
+
+
+def bounding_sphere(points):
+    """AABB-centered bounding sphere (center x, y, z, radius)"""
+    center = (points.min(axis=0) + points.max(axis=0)) / 2.0
+    return np.append(center, np.linalg.norm(points - center, axis=1).max())
+
+
+def face_grid(points, faces, target_faces_per_cell=8):
+    """
+    Uniform grid over the mesh AABB listing the faces whose AABB overlaps
+    each cell (CSR: faces of cell c are grid_faces[offsets[c]:offsets[c+1]]).
+
+    Returns:
+        (origin, cell_size, dims, offsets, grid_faces)
+    """
+    lo, hi = points.min(axis=0), points.max(axis=0)
+    extent = np.maximum(hi - lo, 1e-9)
+    n_cells = max(1, len(faces) // target_faces_per_cell)
+    cell_size = float((np.prod(extent) / n_cells) ** (1.0 / 3.0))
+    cell_size = max(cell_size, float(extent.max()) / 256)
+    dims = np.maximum(np.ceil(extent / cell_size).astype(np.int64), 1)
+
+    tri = points[faces]
+    cmin = np.clip(((tri.min(axis=1) - lo) / cell_size).astype(np.int64), 0, dims - 1)
+    cmax = np.clip(((tri.max(axis=1) - lo) / cell_size).astype(np.int64), 0, dims - 1)
+    spans = cmax - cmin + 1
+    counts = spans.prod(axis=1)
+
+    # Expand every face over the cells of its AABB
+    face_ids = np.repeat(np.arange(len(faces)), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    span = spans[face_ids]
+    ijk = cmin[face_ids] + np.stack([local % span[:, 0],
+                                     (local // span[:, 0]) % span[:, 1],
+                                     local // (span[:, 0] * span[:, 1])], axis=1)
+    cells = (ijk[:, 2] * dims[1] + ijk[:, 1]) * dims[0] + ijk[:, 0]
+
+    order = np.argsort(cells, kind='stable')
+    offsets = np.zeros(int(np.prod(dims)) + 1, dtype=np.int64)
+    np.add.at(offsets, cells + 1, 1)
+    return lo, cell_size, dims, np.cumsum(offsets), face_ids[order].astype(np.int32)
+
+
+def compile_object(points, faces=None, transform=None, lods=None, samples=None):
+    """
+    Precompute the arrays stored for one scene object.
+
+    Args:
+        points: (N, 3) model-frame points/vertices
+        faces: (M, K) polygons, None for a point cloud
+        transform: Constant 4x4 scene transform to bake (None if it moves)
+        lods: {level: (arrays, info)} from MeshLOD.build_lods() (optional)
+        samples: (S, 3) surface samples used as collision points (optional)
+
+    Returns:
+        (arrays dict, JSON-serializable info dict)
+    """
+    points = np.ascontiguousarray(points, dtype=np.float32)
+    arrays = {
+        'points': points,
+        'bounds': np.stack([points.min(axis=0), points.max(axis=0)]),
+        'sphere': bounding_sphere(points).astype(np.float32),
+    }
+    info = {'kind': 'points' if faces is None else 'mesh', 'count': len(points)}
+
+    if faces is not None:
+        faces = np.ascontiguousarray(faces, dtype=np.int32)
+        arrays['faces'] = faces
+        arrays['triangles'] = triangulate(faces)
+        arrays['face_normals'] = face_normals(points, faces).astype(np.float32)
+        arrays['vertex_normals'] = vertex_normals(points, faces).astype(np.float32)
+        origin, cell_size, dims, offsets, grid_faces = face_grid(points, faces)
+        arrays['grid_offsets'] = offsets
+        arrays['grid_faces'] = grid_faces
+        for key, array in build_bvh(points, arrays['triangles']).items():
+            arrays[f'bvh_{key}'] = array
+        info['faces'] = len(faces)
+        info['grid'] = {'origin': origin.tolist(), 'cell_size': cell_size,
+                        'dims': dims.tolist()}
+
+    if transform is not None:
+        transform = np.asarray(transform, dtype=np.float64)
+        placed = (points @ transform[:3, :3].T + transform[:3, 3]).astype(np.float32)
+        arrays['placed_points'] = placed
+        arrays['placed_bounds'] = np.stack([placed.min(axis=0), placed.max(axis=0)])
+        info['transform'] = transform.tolist()
+
+    if samples is not None:
+        arrays['samples'] = np.ascontiguousarray(samples, dtype=np.float32)
+        info['samples'] = len(samples)
+
+    if lods:
+        info['lods'] = {}
+        for level, (level_arrays, level_info) in lods.items():
+            for key, array in level_arrays.items():
+                arrays[f'lod_{level}_{key}'] = array
+            info['lods'][level] = level_info
+
+    return arrays, info
+
+
+def write_bundle(path, objects, sources):
+    """
+    Write a bundle atomically.
+
+    Args:
+        objects: {name: (arrays dict, info dict)} from compile_object()
+        sources: {name: {'inputs': [paths], 'x3d': [paths]}} for the hash record
+    """
+    index = {'version': VERSION, 'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+             'objects': {}, 'sources': {}}
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(b'\0' * HEADER_SIZE)
+        for name, (arrays, info) in objects.items():
+            entry = dict(info, arrays={})
+            for key, array in arrays.items():
+                array = np.ascontiguousarray(array)
+                array = array.astype(array.dtype.newbyteorder('<'), copy=False)
+                f.write(b'\0' * (-f.tell() % ALIGNMENT))
+                entry['arrays'][key] = {'offset': f.tell(), 'dtype': array.dtype.str,
+                                        'shape': list(array.shape)}
+                f.write(array.tobytes())
+            index['objects'][name] = entry
+
+        for name, files in sources.items():
+            index['sources'][name] = {
+                kind: {p: file_sha1(p) for p in paths if os.path.exists(p)}
+                for kind, paths in files.items()
+            }
+
+        index_bytes = json.dumps(index, indent=1).encode('utf-8')
+        index_offset = f.tell()
+        f.write(index_bytes)
+        f.seek(0)
+        f.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, 0, index_offset, len(index_bytes)))
+    os.replace(tmp_path, path)
+
+
+class SceneBundle:
+    """Read-only, memory-mapped view of a compiled scene bundle"""
+
+    def __init__(self, path=DEFAULT_BUNDLE):
+        self.path = path
+        self._data = np.memmap(path, dtype=np.uint8, mode='r')
+        magic, version, _, index_offset, index_length = struct.unpack(
+            HEADER_FORMAT, self._data[:HEADER_SIZE].tobytes())
+        if magic != MAGIC:
+            raise ValueError(f"Not a scene bundle: {path}")
+        if version != VERSION:
+            raise ValueError(f"Scene bundle version {version} != {VERSION}: {path} (rebuild it)")
+        self.index = json.loads(self._data[index_offset:index_offset + index_length].tobytes())
+        self.objects = self.index['objects']
+
+    def array(self, name, key):
+        """Zero-copy view of one stored array"""
+        desc = self.objects[name]['arrays'][key]
+        dtype = np.dtype(desc['dtype'])
+        count = int(np.prod(desc['shape']))
+        return np.frombuffer(self._data, dtype=dtype, count=count,
+                             offset=desc['offset']).reshape(desc['shape'])
+
+    def has(self, name, key):
+        return key in self.objects.get(name, {}).get('arrays', {})
+
+    def bvh(self, name):
+        """Triangle hierarchy of a mesh object (PointInMesh.build_bvh() arrays)"""
+        return {key: self.array(name, f'bvh_{key}') for key in BVH_KEYS}
+
+    def levels(self, name):
+        """Simplified levels stored for an object ({level: info})"""
+        return self.objects[name].get('lods', {})
+
+    def hash_grid(self, name, kind):
+        """
+        Stored spatial hash grid of an object's collision points
+
+        Returns:
+            ({key: array} for PointGrid.from_arrays(), cell size), None if not stored
+        """
+        info = self.objects.get(name, {}).get('hash_grids', {}).get(kind)
+        if info is None:
+            return None
+        return {key: self.array(name, f'hash_{kind}_{key}') for key in GRID_ARRAYS}, info['cell_size']
+
+    def transform(self, name):
+        """Baked constant transform of an object (None if it has none)"""
+        transform = self.objects[name].get('transform')
+        return None if transform is None else np.array(transform)
+
+    def stale_sources(self):
+        """Input/X3D files whose contents changed since the bundle was built"""
+        recorded = {path: digest for files in self.index['sources'].values()
+                    for hashes in files.values() for path, digest in hashes.items()}
+        # hashlib releases the GIL, so the sources are hashed in parallel
+        with ThreadPoolExecutor(min(8, len(recorded) or 1)) as executor:
+            current = executor.map(lambda path: file_sha1(path) if os.path.exists(path) else None,
+                                   recorded)
+            return [path for path, digest in zip(recorded, current) if digest != recorded[path]]
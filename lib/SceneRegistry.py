@@ -0,0 +1,189 @@
+"""
+Scene Registry - Named collision scenes over shared geometry
+============================================================
+
+The base scene is collision_server.SCENE_ASSETS, compiled into the main
+scene bundle. Other scenes (another patient model or body habitus) are
+defined in scenes.json by the obstacles they replace:
+
+    {
+      "<scene_id>": {
+        "description": "...",
+        "obstacles": {"patient": {"file": "models/patient_model.ply",
+                                  "x3d": ["models/patient-model.x3d"],
+                                  "transform": {...}}},
+        "joint_limits": {"table_vertical": [0.0, 0.3]}
+      }
+    }
+
+An obstacle's transform is either a 4x4 matrix (nested lists) or
+{"translation": [x, y, z], "rotation_z_deg": a, "scale": [sx, sy, sz]},
+applied as scale, then rotation about z, then translation (the form of
+collision_server.PATIENT_TRANSFORM). The scale is baked into the
+obstacle's points when its bundle is compiled, so the stored transform
+stays rigid (temporal coherence and the coarse levels rely on that).
+
+Replaced obstacles are compiled into a small bundle of their own
+(SCENE_BUNDLE_DIR/<scene_id>.bundle); SceneView layers it over the main
+bundle. Bundles are memory-mapped, so every scene resident in a process
+reads the C-arm and the unchanged obstacles from the same pages.
+"""
+
+import json
+import os
+
+import numpy as np
+
+DEFAULT_SCENES = 'scenes.json'
+DEFAULT_SCENE = 'default'
+SCENE_BUNDLE_DIR = '3d_inputs/scenes'
+
+
+def scene_transform(spec):
+    """4x4 matrix of a scene transform specification (None stays None)"""
+    if spec is None or isinstance(spec, np.ndarray):
+        return spec
+    if isinstance(spec, list):
+        return np.array(spec, dtype=np.float64)
+    angle = np.radians(spec.get('rotation_z_deg', 0.0))
+    transform = np.eye(4)
+    transform[:3, :3] = [[np.cos(angle), -np.sin(angle), 0],
+                         [np.sin(angle), np.cos(angle), 0],
+                         [0, 0, 1]]
+    transform[:3, :3] = transform[:3, :3] @ np.diag(spec.get('scale', [1.0, 1.0, 1.0]))
+    transform[:3, 3] = spec.get('translation', [0.0, 0.0, 0.0])
+    return transform
+
+
+def split_scale(transform):
+    """
+    Rigid transform and per-axis scale with transform = rigid @ diag(scale)
+
+    A mirroring transform keeps its mirror in the scale (first axis), so
+    the rigid part is a proper rotation.
+
+    Returns:
+        (4x4 rigid transform, (3,) scale), or (None, None) for None
+    """
+    if transform is None:
+        return None, None
+    linear = transform[:3, :3]
+    scale = np.linalg.norm(linear, axis=0)
+    rotation = linear / scale
+    if np.linalg.det(rotation) < 0:
+        scale[0], rotation[:, 0] = -scale[0], -rotation[:, 0]
+    if not np.allclose(rotation.T @ rotation, np.eye(3), atol=1e-6):
+        raise ValueError("Scene transform shears; only scale, rotation and translation are supported")
+    rigid = transform.copy()
+    rigid[:3, :3] = rotation
+    return rigid, scale
+
+
+class SceneView:
+    """Several bundles read as one scene; the first bundle with an object wins"""
+
+    def __init__(self, bundles):
+        """
+        Args:
+            bundles: SceneBundles, scene-specific first, main bundle last
+        """
+        self.bundles = bundles
+        self.path = bundles[0].path
+        self.sources = {}
+        for bundle in reversed(bundles):
+            self.sources.update({name: bundle for name in bundle.objects})
+        self.objects = {name: bundle.objects[name] for name, bundle in self.sources.items()}
+
+    def source(self, name):
+        """Bundle an object is read from"""
+        return self.sources[name]
+
+    def array(self, name, key):
+        return self.sources[name].array(name, key)
+
+    def has(self, name, key):
+        return name in self.sources and self.sources[name].has(name, key)
+
+    def bvh(self, name):
+        return self.sources[name].bvh(name)
+
+    def levels(self, name):
+        return self.sources[name].levels(name)
+
+    def hash_grid(self, name, kind):
+        return self.sources[name].hash_grid(name, kind)
+
+    def transform(self, name):
+        return self.sources[name].transform(name)
+
+    def stale_sources(self):
+        return [path for bundle in self.bundles for path in bundle.stale_sources()]
+
+
+class SceneRegistry:
+    """Scene definitions, and the scenes loaded from them (kept resident)"""
+
+    def __init__(self, path=DEFAULT_SCENES, loader=None):
+        """
+        Args:
+            path: Scene definitions (JSON); a missing file leaves only the
+                  base scene
+            loader: Callable(scene_id) -> loaded scene, used by get()
+        """
+        self.path = path
+        self.definitions = {DEFAULT_SCENE: {'description': 'Base scene (SCENE_ASSETS)'}}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.definitions.update(json.load(f))
+        self.loader = loader
+        self.resident = {}
+
+    def ids(self):
+        return list(self.definitions)
+
+    def definition(self, scene_id):
+        if scene_id not in self.definitions:
+            raise KeyError(f"Unknown scene '{scene_id}' (defined: {', '.join(self.definitions)})")
+        return self.definitions[scene_id]
+
+    def assets(self, scene_id, base_assets):
+        """
+        Assets the scene replaces, in the form of SCENE_ASSETS, plus the
+        'scale' of each obstacle whose transform scales (split_scale()).
+
+        Returns:
+            {name: asset}; the definitions file is recorded as an input, so
+            a changed transform also rebuilds the scene's bundle
+        """
+        assets = {}
+        for name, spec in self.definition(scene_id).get('obstacles', {}).items():
+            if name not in base_assets:
+                raise KeyError(f"Scene '{scene_id}' replaces unknown obstacle '{name}'")
+            asset = dict(base_assets[name], **spec)
+            asset['transform'], scale = split_scale(scene_transform(asset.get('transform')))
+            if scale is not None and not np.allclose(scale, 1.0):
+                asset['scale'] = scale
+            asset.setdefault('x3d', [])
+            asset['inputs'] = [self.path]
+            assets[name] = asset
+        return assets
+
+    def bundle_path(self, scene_id):
+        """Bundle of the scene's own obstacles (None if it has none)"""
+        if not self.definition(scene_id).get('obstacles'):
+            return None
+        return os.path.join(SCENE_BUNDLE_DIR, f'{scene_id}.bundle')
+
+    def joint_limits(self, scene_id, defaults):
+        """Joint limits of a scene: `defaults` with the scene's overrides"""
+        limits = dict(defaults)
+        limits.update({joint: tuple(limit) for joint, limit
+                       in self.definition(scene_id).get('joint_limits', {}).items()})
+        return limits
+
+    def get(self, scene_id):
+        """Loaded scene, loading it on first use"""
+        if scene_id not in self.resident:
+            self.definition(scene_id)
+            self.resident[scene_id] = self.loader(scene_id)
+        return self.resident[scene_id]
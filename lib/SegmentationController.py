@@ -3,8 +3,8 @@ Segmentation Controller - Manages segmentation overlay toggles
 ==============================================================
 
 This script handles toggle buttons for different anatomical structures
-and writes the active segments to segmentation_settings.json for the
-DRR server to read.
+and publishes the active segments on the pose bus (PoseBus.py) and to
+segmentation_settings.json for the DRR server to read.
 
 Group names match the DeepFluoro dataset bundled with DiffDRR:
 - ribs: Individual ribs (24 structures)
@@ -18,8 +18,12 @@ Group names match the DeepFluoro dataset bundled with DiffDRR:
 from H3DInterface import *
 import json
 import os
+import sys
 import time
 
+sys.path.insert(0, os.path.join(os.getcwd(), 'lib'))
+from PoseBus import shared_writer
+
 # Global state
 active_segments = set()
 segment_buttons = {}
@@ -43,13 +47,18 @@ def initialize():
     print("[Segmentation] Ready! Categories: " + str(SEGMENT_CATEGORIES))
 
 def write_settings():
-    """Write active segments to JSON file for DRR server."""
+    """Publish active segments to the DRR server (pose bus and JSON file)."""
     global active_segments
     
     settings = {
         'active': list(active_segments)
     }
     
+    # Bus first; the JSON file is still written if the bus is unavailable
+    try:
+        shared_writer().publish_segmentation(active_segments)
+    except Exception as e:
+        print("[Segmentation] Pose bus unavailable: " + str(e))
     try:
         with open('segmentation_settings.json', 'w') as f:
             json.dump(settings, f)
@@ -59,22 +68,12 @@ def write_settings():
 
 def trigger_drr_refresh():
     """
-    Trigger a DRR refresh by updating the timestamp in collision_pose.json.
-    This causes the DRR server to re-render with the new segment settings.
+    Ask the DRR server to re-render the current pose.
+    Not needed after write_settings(): the server re-renders on a
+    segmentation change by itself.
     """
-    pose_file = 'collision_pose.json'
     try:
-        # Read current pose
-        with open(pose_file, 'r') as f:
-            pose_data = json.load(f)
-        
-        # Update timestamp to trigger refresh
-        pose_data['timestamp'] = time.time()
-        
-        # Write back
-        with open(pose_file, 'w') as f:
-            json.dump(pose_data, f)
-        
+        shared_writer().publish_refresh()
         print("[Segmentation] Triggered DRR refresh")
     except Exception as e:
         print("[Segmentation] Could not trigger refresh: " + str(e))
@@ -88,11 +87,8 @@ def toggle_segment(category, enabled):
     else:
         active_segments.discard(category)
     
-    # Write new settings
+    # Publish new settings (the DRR server re-renders immediately)
     write_settings()
-    
-    # Trigger DRR to refresh immediately
-    trigger_drr_refresh()
 
 # Event handler classes for each category
 class RibsHandler(AutoUpdate(SFBool)):
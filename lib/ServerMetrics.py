@@ -0,0 +1,337 @@
+"""
+Server Metrics - Prometheus-style metrics endpoint
+==================================================
+
+collision_server.py and drr_server.py keep a MetricsRegistry of counters,
+gauges and histograms and serve it over HTTP in the Prometheus text
+exposition format (version 0.0.4) on 127.0.0.1:
+
+    GET http://127.0.0.1:<port>/metrics
+    GET http://127.0.0.1:<port>/health     JSON of a Heartbeat (launch_all.py
+                                           readiness and health pings)
+
+    COLLISION_METRICS_PORT   collision_server.py --metrics-port
+    DRR_METRICS_PORT         drr_server.py --metrics-port
+    LAUNCHER_METRICS_PORT    launch_all.py: both servers, one page
+
+Histograms use cumulative `le` buckets like Prometheus, so they can be
+scraped as they are; histogram_quantile() reads percentiles back from
+them the way PromQL does. Gauges may be callables, evaluated at scrape
+time (resident memory), and gauge families collect their label sets at
+scrape time (cache hit ratios of scenes loaded on demand).
+
+Latency from a slider move is measured from the 'timestamp' H3D writes
+into collision_pose.json (CollisionClient.check_collision), or the pose
+file's modification time when there is none.
+
+Standard library only: the endpoint runs in a daemon thread of the
+server and needs no prometheus_client.
+"""
+
+import json
+import os
+import re
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LAUNCHER_METRICS_PORT = 9100
+COLLISION_METRICS_PORT = 9101
+DRR_METRICS_PORT = 9102
+SUPERVISOR_TOKEN_ENV = 'CARM_SUPERVISOR_TOKEN'   # set by ProcessSupervisor.py for its children
+
+# Seconds; spans a 1 ms collision check to a 4 s CPU render
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{.*\})?\s+(\S+)$')
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def resident_memory_bytes():
+    """Resident set size of this process (0 if the platform offers no way to read it)"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        # Peak RSS: kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        return 0
+
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+class Histogram:
+    """Cumulative-bucket histogram of one label set"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """[(le, cumulative count)] including +Inf"""
+        return list(zip(self.buckets, self.counts)) + [(float('inf'), self.count)]
+
+
+class MetricsRegistry:
+    """Named counters, gauges and histograms with optional labels"""
+
+    def __init__(self, prefix):
+        """
+        Args:
+            prefix: Prepended to every metric name (e.g. 'collision')
+        """
+        self.prefix = prefix
+        self.metrics = {}   # name -> (type, help, {labels: value | Histogram | callable}, buckets)
+        self.lock = threading.Lock()
+        self.gauge('process_resident_memory_bytes', 'Resident set size of the server process',
+                   resident_memory_bytes)
+        self.gauge('process_start_time_seconds', 'Start time of the server (unix seconds)', time.time())
+
+    def _series(self, kind, name, help_text, buckets=None):
+        name = f'{self.prefix}_{name}'
+        if name not in self.metrics:
+            self.metrics[name] = (kind, help_text, {}, buckets)
+        return self.metrics[name][2]
+
+    def counter(self, name, help_text, **labels):
+        """Declare a counter; the given label set is listed at 0 until incremented"""
+        with self.lock:
+            self._series('counter', name, help_text).setdefault(tuple(sorted(labels.items())), 0)
+
+    def inc(self, name, amount=1, **labels):
+        with self.lock:
+            series = self.metrics[f'{self.prefix}_{name}'][2]
+            key = tuple(sorted(labels.items()))
+            series[key] = series.get(key, 0) + amount
+
+    def gauge(self, name, help_text, value=0, **labels):
+        """Declare a gauge; `value` may be a callable evaluated at scrape time"""
+        with self.lock:
+            self._series('gauge', name, help_text)[tuple(sorted(labels.items()))] = value
+
+    def gauge_family(self, name, help_text, collect):
+        """Declare a gauge whose label sets are only known at scrape time
+
+        Args:
+            collect: Callable returning [(labels dict, value)]
+        """
+        with self.lock:
+            self.metrics[f'{self.prefix}_{name}'] = ('gauge', help_text, collect, None)
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.metrics[f'{self.prefix}_{name}'][2][tuple(sorted(labels.items()))] = value
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        """Declare a histogram; observe() creates one Histogram per label set"""
+        self._series('histogram', name, help_text, buckets)
+
+    def observe(self, name, value, **labels):
+        with self.lock:
+            _, _, series, buckets = self.metrics[f'{self.prefix}_{name}']
+            key = tuple(sorted(labels.items()))
+            if key not in series:
+                series[key] = Histogram(buckets)
+            series[key].observe(value)
+
+    def render(self):
+        """Prometheus text exposition of every metric"""
+        lines = []
+        with self.lock:
+            for name, (kind, help_text, series, _) in self.metrics.items():
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+                if callable(series):
+                    series = {tuple(sorted(labels.items())): value for labels, value in series()}
+                for labels, value in series.items():
+                    if kind == 'histogram':
+                        for bound, count in value.cumulative():
+                            le = '+Inf' if bound == float('inf') else repr(bound)
+                            lines.append(f'{name}_bucket{_label_text(labels + (("le", le),))} {count}')
+                        lines.append(f'{name}_sum{_label_text(labels)} {value.sum!r}')
+                        lines.append(f'{name}_count{_label_text(labels)} {value.count}')
+                    else:
+                        lines.append(f'{name}{_label_text(labels)} {float(value() if callable(value) else value)!r}')
+        return '\n'.join(lines) + '\n'
+
+
+class Heartbeat:
+    """Liveness of a server loop, served on /health"""
+
+    def __init__(self):
+        self.started = self.last = time.time()
+
+    def beat(self):
+        """Called once per loop iteration"""
+        self.last = time.time()
+
+    def health(self):
+        """
+        Returns:
+            Dict with pid, uptime_s, loop_age_s (seconds since the last
+            beat) and the supervisor token of this process (None outside
+            ProcessSupervisor.py)
+        """
+        now = time.time()
+        return {'pid': os.getpid(), 'uptime_s': now - self.started, 'loop_age_s': now - self.last,
+                'token': os.environ.get(SUPERVISOR_TOKEN_ENV)}
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path == '/health' and self.server.health is not None:
+            body, content_type = json.dumps(self.server.health()).encode('utf-8'), 'application/json'
+        elif path in ('/metrics', '/'):
+            body = self.server.render().encode('utf-8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass    # scrapes would flood the server's console
+
+
+def start_metrics_server(render, port, host='127.0.0.1', health=None):
+    """
+    Serve /metrics (and /health) from a daemon thread.
+
+    Args:
+        render: Callable returning the exposition text (MetricsRegistry.render)
+        port: TCP port (0 picks a free one)
+        health: Callable returning the /health dict (Heartbeat.health)
+
+    Returns:
+        The HTTP server; .server_address[1] is the bound port, .shutdown() stops it
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    server.render = render
+    server.health = health
+    threading.Thread(target=server.serve_forever, name=f'metrics-{port}', daemon=True).start()
+    return server
+
+
+def parse_metrics(text):
+    """
+    Samples of an exposition page.
+
+    Returns:
+        {(name, labels tuple): value} with labels sorted by key
+    """
+    samples = {}
+    for line in text.splitlines():
+        match = _SAMPLE.match(line.strip())
+        if line.startswith('#') or not match:
+            continue
+        name, label_text, value = match.groups()
+        labels = tuple(sorted(_LABEL.findall(label_text or '')))
+        samples[(name, labels)] = float(value)
+    return samples
+
+
+def scrape(url, timeout=1.0):
+    """Exposition text of a metrics endpoint (None if it does not answer)"""
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return response.read().decode('utf-8')
+    except OSError:
+        return None
+
+
+def probe_health(url, timeout=1.0):
+    """/health dict of a server (None if it does not answer)"""
+    text = scrape(url, timeout)
+    try:
+        return json.loads(text) if text is not None else None
+    except ValueError:
+        return None
+
+
+def aggregate(endpoints, timeout=1.0):
+    """
+    One exposition page from several endpoints, plus an `up` gauge per
+    component (0 when its endpoint does not answer).
+
+    Args:
+        endpoints: {component: metrics URL}
+    """
+    pages, up = [], []
+    for component, url in endpoints.items():
+        text = scrape(url, timeout)
+        up.append(f'launcher_up{{component="{component}"}} {0 if text is None else 1}')
+        if text is not None:
+            pages.append(text)
+    header = ['# HELP launcher_up Whether the component\'s metrics endpoint answered',
+              '# TYPE launcher_up gauge']
+    return '\n'.join(header + up) + '\n' + ''.join(pages)
+
+
+def histogram_quantile(samples, name, q, **labels):
+    """
+    Quantile of a histogram from its buckets, interpolated within the
+    bucket like PromQL's histogram_quantile().
+
+    Args:
+        samples: parse_metrics() output
+        name: Histogram name (without _bucket)
+        q: Quantile in [0, 1]
+        labels: Label set of the histogram series
+
+    Returns:
+        Value in the histogram's unit, or None without observations
+    """
+    want = sorted(labels.items())
+    buckets = []
+    for (sample, sample_labels), count in samples.items():
+        if sample != f'{name}_bucket':
+            continue
+        rest = [(key, value) for key, value in sample_labels if key != 'le']
+        if rest == want:
+            le = dict(sample_labels)['le']
+            buckets.append((float('inf') if le == '+Inf' else float(le), count))
+    buckets.sort()
+    if not buckets or buckets[-1][1] == 0:
+        return None
+    rank = q * buckets[-1][1]
+    lower_bound, lower_count = 0.0, 0.0
+    for bound, count in buckets:
+        if count >= rank:
+            if bound == float('inf'):
+                return lower_bound
+            if count == lower_count:
+                return bound
+            return lower_bound + (bound - lower_bound) * (rank - lower_count) / (count - lower_count)
+        lower_bound, lower_count = bound, count
+    return lower_bound
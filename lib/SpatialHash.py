@@ -0,0 +1,123 @@
+"""
+Spatial Hash - Cell-level rejection of C-arm points
+===================================================
+
+A uniform hash grid over the C-arm collision points, built once in the
+points' own frame (per link frame with CArmLinks.py). Every non-empty cell
+keeps the tight box of its points:
+
+    order       point ids sorted by cell
+    counts      points per cell
+    center/half box of the cell's points (its own frame)
+
+At query time only the cells are transformed. A cell box moved by a rigid
+transform lies inside the axis-aligned box
+
+    center' = R center + t,    half' = |R| half
+
+so a cell whose box misses an obstacle's AABB (in the obstacle's model
+frame) cannot contain a point of the obstacle, and its points are rejected
+without any per-point work. The gap between the two boxes is also a lower
+bound of the distance of every point in the cell, which the temporal
+coherence cache can carry instead of a per-point bound.
+
+The scene bundle stores the grids of the C-arm (arrays(), see
+build_scene_bundle.py), so the collision server maps them instead of
+building them at startup (from_arrays()).
+
+The grid only decides which points a narrow phase gets to see, so any
+point-based backend (inside_points, the coarse levels, self-collision) can
+sit behind it.
+"""
+
+import numpy as np
+
+DEFAULT_CELL_SIZE = 0.1        # m
+GAP_TOLERANCE = 1e-5           # m, slack for float32 geometry
+GRID_ARRAYS = ('order', 'counts', 'center', 'half', 'group')
+
+
+class PointGrid:
+    """Uniform hash grid over a (grouped) point cloud"""
+
+    def __init__(self, points, cell_size=DEFAULT_CELL_SIZE, groups=None):
+        """
+        Args:
+            points: (N, 3) points, each in its group's frame
+            cell_size: Cell edge length (m)
+            groups: (N,) group (link) index of every point; cells never mix groups
+        """
+        points = np.asarray(points, dtype=np.float64)
+        groups = np.zeros(len(points), dtype=np.int64) if groups is None else np.asarray(groups)
+        self.cell_size = cell_size
+        self.size = len(points)
+
+        keys = np.floor((points - points.min(axis=0)) / cell_size).astype(np.int64)
+        keys = np.column_stack([groups, keys])
+        _, cell_of_point = np.unique(keys, axis=0, return_inverse=True)
+        cell_of_point = cell_of_point.reshape(-1)
+        self.order = np.argsort(cell_of_point, kind='stable')
+        self.counts = np.bincount(cell_of_point)
+        starts = np.concatenate([[0], np.cumsum(self.counts)[:-1]])
+
+        sorted_points = points[self.order]
+        lo = np.minimum.reduceat(sorted_points, starts)
+        hi = np.maximum.reduceat(sorted_points, starts)
+        self.center = (lo + hi) / 2
+        self.half = (hi - lo) / 2
+        self.group = groups[self.order][starts]
+
+    @classmethod
+    def from_arrays(cls, arrays, cell_size=DEFAULT_CELL_SIZE):
+        """Grid from arrays() (e.g. memory-mapped from the scene bundle), without rebuilding"""
+        grid = cls.__new__(cls)
+        grid.cell_size = cell_size
+        for key in GRID_ARRAYS:
+            setattr(grid, key, arrays[key])
+        grid.size = len(grid.order)
+        return grid
+
+    def arrays(self):
+        """{key: array} of GRID_ARRAYS, enough to restore the grid with from_arrays()"""
+        return {key: getattr(self, key) for key in GRID_ARRAYS}
+
+    def __len__(self):
+        return len(self.counts)
+
+    def cell_gaps(self, relative, lo, hi):
+        """
+        Lower bound of the distance from every cell to an AABB.
+
+        Args:
+            relative: (G, 4, 4) point frame -> box frame transform per group
+            lo, hi: Box corners (box frame)
+
+        Returns:
+            (cells,) gaps, 0 where the moved cell box overlaps the AABB
+        """
+        rotation = relative[self.group, :3, :3]
+        center = np.einsum('cij,cj->ci', rotation, self.center) + relative[self.group, :3, 3]
+        half = np.einsum('cij,cj->ci', np.abs(rotation), self.half)
+        separation = np.maximum(np.maximum(lo - (center + half), (center - half) - hi), 0.0)
+        return np.linalg.norm(separation, axis=1)
+
+    def point_gaps(self, relative, lo, hi):
+        """Per-point version of cell_gaps(), indexed by point id"""
+        gaps = np.empty(self.size)
+        gaps[self.order] = np.repeat(self.cell_gaps(relative, lo, hi), self.counts)
+        return gaps
+
+    def candidates(self, relative, lo, hi, group=None):
+        """
+        Points that may lie inside an AABB.
+
+        Args:
+            group: Only consider the cells of this group
+
+        Returns:
+            Sorted point ids of the cells overlapping the box
+        """
+        hit = self.cell_gaps(relative, lo, hi) <= GAP_TOLERANCE
+        if group is not None:
+            hit &= self.group == group
+        return np.sort(self.order[np.repeat(hit, self.counts)])
@@ -0,0 +1,100 @@
+"""
+Stage Timing - Per-stage latency of collision checks
+====================================================
+
+StageTimer splits one collision check into stages with lap(): each call
+charges the time since the previous lap to a stage, so stages that recur
+(the transform before every obstacle's narrow phase) add up within the
+check. CollisionServer(timing=True) uses the stages
+
+    fk                  C-arm / link / table kinematics
+    broad               coherence, spatial hash and coarse-level filtering
+    transform           C-arm point and moving-mesh transforms
+    narrow.<obstacle>   inside test (or GJK/EPA) per obstacle
+    self_collision      link-vs-link tests
+    result              result assembly and status line
+    serialize           result JSON written by the server loop
+
+Every finished check feeds a RollingHistogram per stage: the last WINDOW
+samples, from which p50 / p95 / p99 are read. With timing off the server
+holds no timer and every lap is skipped by a single `if timer:`.
+"""
+
+import time
+
+import numpy as np
+
+WINDOW = 1000
+PERCENTILES = (50, 95, 99)
+
+
+class RollingHistogram:
+    """Latency distribution over the last `window` samples (ms)"""
+
+    def __init__(self, window=WINDOW):
+        self.samples = np.zeros(window)
+        self.count = 0
+
+    def add(self, value):
+        self.samples[self.count % len(self.samples)] = value
+        self.count += 1
+
+    def values(self):
+        return self.samples[:min(self.count, len(self.samples))]
+
+    def percentiles(self, q=PERCENTILES):
+        """{q: value} over the window"""
+        values = self.values()
+        return dict(zip(q, np.percentile(values, q) if len(values) else [0.0] * len(q)))
+
+
+class StageTimer:
+    """Lap timer of one check at a time, with rolling per-stage histograms"""
+
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self.histograms = {}    # stage -> RollingHistogram
+        self.current = {}       # stage -> seconds in the running check
+        self.started = self.last = 0.0
+
+    def start(self):
+        self.current = {}
+        self.started = self.last = time.perf_counter()
+
+    def lap(self, stage):
+        """Charge the time since the last lap (or start) to `stage`"""
+        now = time.perf_counter()
+        self.current[stage] = self.current.get(stage, 0.0) + now - self.last
+        self.last = now
+
+    def record(self, stage, seconds):
+        """Add a sample measured outside a check (e.g. serialization)"""
+        if stage not in self.histograms:
+            self.histograms[stage] = RollingHistogram(self.window)
+        self.histograms[stage].add(seconds * 1000)
+
+    def finish(self):
+        """
+        Close the running check and record its stages.
+
+        Returns:
+            {'stages_ms': {stage: ms}, 'total_ms': ms} of the check
+        """
+        total = time.perf_counter() - self.started
+        for stage, seconds in self.current.items():
+            self.record(stage, seconds)
+        self.record('total', total)
+        return {'stages_ms': {stage: round(seconds * 1000, 3) for stage, seconds in self.current.items()},
+                'total_ms': round(total * 1000, 3)}
+
+    def stats(self):
+        """
+        Returns:
+            {stage: {'count', 'mean', 'p50', 'p95', 'p99'}} in ms, slowest p50 first
+        """
+        stats = {}
+        for stage, histogram in self.histograms.items():
+            entry = {'count': histogram.count, 'mean': float(np.mean(histogram.values()))}
+            entry.update({f'p{q}': float(v) for q, v in histogram.percentiles().items()})
+            stats[stage] = entry
+        return dict(sorted(stats.items(), key=lambda item: -item[1]['p50']))
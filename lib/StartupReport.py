@@ -0,0 +1,79 @@
+"""
+Startup Report - Where the time to a ready collision server goes
+================================================================
+
+collision_server.py --startup-report and workspace_analysis.py
+--startup-report print the time from the top of the script to the first
+check it could answer, in three phases:
+
+    import      the script's module imports, plus modules a phase imports
+                on first use (VTK is only imported for the 'vtk' inside test)
+    load        opening the scene bundles: mmap, index and source hashes
+    build       acceleration structures built at load: spatial hash grid
+                (or mapped from the bundle), inside-test meshes, BVH tests,
+                GJK pieces, coherence cache
+
+Builds that run in parallel are timed individually (timed()), and their
+phase shows the wall time of the whole block, so the items of a phase can
+add up to more than the phase. Time before the script's first line
+(interpreter start) is not counted.
+"""
+
+import time
+from contextlib import contextmanager
+
+PHASES = ('import', 'load', 'build')
+
+
+class StartupReport:
+    """Wall time per startup phase, with the items timed within each"""
+
+    def __init__(self, started=None):
+        """
+        Args:
+            started: time.perf_counter() at the top of the script (default: now)
+        """
+        self.started = time.perf_counter() if started is None else started
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.items = {phase: {} for phase in PHASES}
+
+    def add(self, phase, seconds, item=None):
+        """Charge `seconds` to a phase (and to one of its items)"""
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+        if item is not None:
+            self._add_item(phase, item, seconds)
+
+    def _add_item(self, phase, item, seconds):
+        items = self.items.setdefault(phase, {})
+        items[item] = items.get(item, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, phase, item=None):
+        """Time a block of a phase (and charge it to `item`)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start, item)
+
+    def timed(self, phase, item, function, *args):
+        """Call function(*args) and charge its time to an item only (for parallel builds)"""
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            self._add_item(phase, item, time.perf_counter() - start)
+
+    def total(self):
+        """Seconds since `started`"""
+        return time.perf_counter() - self.started
+
+    def print_report(self, title='Startup'):
+        total = self.total()
+        print(f"[{title}] Ready in {total * 1000:.0f}ms")
+        for phase, seconds in self.phases.items():
+            print(f"        {phase:8s} {seconds * 1000:7.0f}ms")
+            for item, item_seconds in sorted(self.items.get(phase, {}).items(), key=lambda kv: -kv[1]):
+                print(f"          {item:24s} {item_seconds * 1000:7.1f}ms")
+        other = total - sum(self.phases.values())
+        print(f"        {'other':8s} {other * 1000:7.0f}ms  (console output, setup between phases)")
@@ -0,0 +1,131 @@
+"""
+Temporal Coherence - Reusing clearance between consecutive collision checks
+===========================================================================
+
+Slider moves and sweeps produce a slowly varying pose stream, so most of
+the C-arm is as far from an obstacle as it was one check ago. For every
+obstacle the cache keeps the state of the previous query:
+
+    relative    C-arm model frame -> obstacle model frame transform
+    bounds      lower bounds of the distance to the obstacle, one per
+                C-arm point (points engine) or a single clearance (GJK)
+
+Between two queries no C-arm point moves further relative to the obstacle
+than motion_bound() of the two relative transforms (C-arm and table joint
+deltas both enter through them), so
+
+    every bound > motion    nothing can have reached the obstacle: the
+                            narrow phase is skipped
+    otherwise               only the entries whose bound <= motion are
+                            re-tested (and re-measured)
+
+Bounds are decremented by the motion instead of being recomputed, so they
+stay valid lower bounds over any number of skipped queries, and the
+points re-tested include every point the uncached path finds inside. With
+the ray-parity inside test (inside='bvh') the counts are the same as
+without the cache. vtkSelectEnclosedPoints can decide a point within its
+tolerance of the surface differently depending on the other points of the
+query, so with inside='vtk' counts may differ by a point or two, as they
+already do between the server with and without the spatial hash. Entries can be
+split into groups that move independently (the C-arm links, see
+CArmLinks.py); each group then has its own sphere and relative transform.
+"""
+
+import numpy as np
+
+BOUND_TOLERANCE = 1e-5         # m, slack for float32 geometry
+
+
+def motion_bound(previous, current, center, radius):
+    """
+    Largest displacement of a point within `radius` of `center` (model frame)
+    between two affine transforms.
+
+    |(M1 - M0) p + t1 - t0| <= |(M1 - M0) c + t1 - t0| + ||M1 - M0|| r with
+    the spectral norm of M1 - M0. For rotations that is 2 sin(theta / 2),
+    but an obstacle transform may also scale (scenes.json), so the norm is
+    taken of the matrices rather than derived from a rotation angle.
+    """
+    linear = current[:3, :3] - previous[:3, :3]
+    shift = linear @ center + current[:3, 3] - previous[:3, 3]
+    return float(np.linalg.norm(shift) + np.linalg.norm(linear, 2) * radius)
+
+
+class CoherenceCache:
+    """Per-obstacle distance bounds carried from one query to the next"""
+
+    def __init__(self, center, radius, size, groups=None):
+        """
+        Args:
+            center, radius: Sphere around the moving geometry (model frame),
+                            or (G, 3) / (G,) spheres, one per group
+            size: Bounds per obstacle (C-arm points, or 1 for a clearance)
+            groups: (size,) group index of every entry (default: one group)
+        """
+        self.center = np.asarray(center, dtype=np.float64).reshape(-1, 3)
+        self.radius = np.asarray(radius, dtype=np.float64).reshape(-1)
+        self.size = size
+        self.groups = None if groups is None else np.asarray(groups)
+        self.state = {}     # name -> (relative transform, bounds)
+        self.counters = {}  # name -> {'queries', 'skipped', 'restricted', 'tested'}
+
+    def candidates(self, name, relative):
+        """
+        Entries that may have reached the obstacle since the last query.
+
+        Args:
+            relative: Current C-arm model -> obstacle model transform,
+                      (G, 4, 4) with groups
+
+        Returns:
+            Indices to test (all of them on the first query of an obstacle)
+        """
+        counter = self.counters.setdefault(name, {'queries': 0, 'skipped': 0,
+                                                  'restricted': 0, 'tested': 0})
+        counter['queries'] += 1
+        if name not in self.state:
+            self.state[name] = (relative, np.full(self.size, -np.inf))
+            counter['tested'] += self.size
+            return np.arange(self.size)
+
+        previous, bounds = self.state[name]
+        if self.groups is None:
+            bounds -= motion_bound(previous, relative, self.center[0], self.radius[0])
+        else:
+            motion = np.array([motion_bound(previous[g], relative[g], self.center[g], self.radius[g])
+                               for g in range(len(self.radius))])
+            bounds -= motion[self.groups]
+        self.state[name] = (relative, bounds)
+        ids = np.flatnonzero(bounds <= BOUND_TOLERANCE)
+        if ids.size == 0:
+            counter['skipped'] += 1
+        elif ids.size < self.size:
+            counter['restricted'] += 1
+        counter['tested'] += ids.size
+        return ids
+
+    def update(self, name, ids, bounds):
+        """Store freshly measured bounds of the tested entries"""
+        self.state[name][1][ids] = bounds
+
+    def clearance(self, name):
+        """Current lower bound of the obstacle distance (0 if touching)"""
+        return max(float(self.state[name][1].min()), 0.0)
+
+    def reset(self):
+        self.state.clear()
+
+    def stats(self):
+        """
+        Hit rates per obstacle.
+
+        Returns:
+            {name: {'queries', 'skip_rate' (narrow phase skipped),
+                    'restrict_rate' (narrow phase on a subset),
+                    'tested_fraction' (entries tested / entries queried)}}
+        """
+        return {name: {'queries': c['queries'],
+                       'skip_rate': c['skipped'] / c['queries'],
+                       'restrict_rate': c['restricted'] / c['queries'],
+                       'tested_fraction': c['tested'] / (c['queries'] * self.size)}
+                for name, c in self.counters.items()}
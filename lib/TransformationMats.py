@@ -157,6 +157,37 @@ def calc_transf_mat_c_arm_base_to_ee(lateral, vertical, wigwag, horizontal, tilt
     Returns:
         4x4 transformation matrix
     """
+    # matrix multiplication
+    c_arm_transf_mat = reduce(np.dot, get_c_arm_dh_transf_mats(lateral, vertical, wigwag, horizontal, tilt, orbital))
+
+    return c_arm_transf_mat
+
+
+def calc_c_arm_frames(lateral, vertical, wigwag, horizontal, tilt, orbital):
+    """
+    Calculate all intermediate frames of the C-arm DH chain.
+    
+    Args:
+        Same as calc_transf_mat_c_arm_base_to_ee()
+        
+    Returns:
+        (9, 4, 4) array: frame i is the product of the first i DH transforms,
+        [0] is the base (identity) and [8] the end-effector
+    """
+    frames = [np.eye(4)]
+    for transf in get_c_arm_dh_transf_mats(lateral, vertical, wigwag, horizontal, tilt, orbital):
+        frames.append(np.dot(frames[-1], transf))
+    return np.array(frames)
+
+
+def get_c_arm_dh_transf_mats(lateral, vertical, wigwag, horizontal, tilt, orbital):
+    """
+    DH transformation matrices of the C-arm chain, base to end-effector.
+    
+    Returns:
+        List of the 8 transforms: 3 lateral joint frames, vertical, wigwag,
+        horizontal, tilt, orbital
+    """
     # for new lateral joint - frame 1
     theta_n1 = np.pi/2
     alpha_n1 = np.pi/2
@@ -220,10 +251,7 @@ def calc_transf_mat_c_arm_base_to_ee(lateral, vertical, wigwag, horizontal, tilt
     a5 = 0
     transf5 = get_transf_mat_dh_parameters(theta5, alpha5, d5, a5)
 
-    # matrix multiplication
-    c_arm_transf_mat = reduce(np.dot, [transf_n1, transf_n2, transf_n3, transf1, transf2, transf3, transf4, transf5])
-
-    return c_arm_transf_mat
+    return [transf_n1, transf_n2, transf_n3, transf1, transf2, transf3, transf4, transf5]
 
 
 def get_transf_mat_dh_parameters(theta, alpha, d, a):
@@ -0,0 +1,214 @@
+"""
+X3D Geometry - Streaming mesh reader for the conversion scripts
+===============================================================
+
+Reads triangle meshes out of X3D files with ElementTree.iterparse instead
+of regexes over the whole file or a full DOM. Each <Shape> is turned into
+numpy arrays as soon as its closing tag is seen and then cleared, so memory
+is bounded by the largest single shape rather than the file size.
+
+Numeric attributes (point, coordIndex, index) are parsed in bulk with
+np.fromstring, commas allowed.
+
+Supported geometry:
+    IndexedFaceSet       polygons separated by -1, fan-triangulated
+    IndexedTriangleSet   flat triangle index list
+    Coordinate DEF/USE   shared vertex lists
+
+Usage:
+    for shape in iter_shapes('models/carm_c_shape.x3d'):
+        shape.vertices, shape.faces, shape.transform
+"""
+
+import os
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+GEOMETRY_NODES = ('IndexedFaceSet', 'IndexedTriangleSet')
+
+
+class X3DShape:
+    """Triangle mesh of one X3D <Shape>"""
+
+    def __init__(self, name, geometry, vertices, faces, transform):
+        self.name = name              # DEF of the Shape or its closest DEF'd parent
+        self.geometry = geometry      # 'IndexedFaceSet' or 'IndexedTriangleSet'
+        self.vertices = vertices      # (N, 3) float64, local coordinates
+        self.faces = faces            # (M, 3) int32
+        self.transform = transform    # 4x4 local-to-file matrix from enclosing Transforms
+
+    def world_vertices(self):
+        """Vertices with the enclosing Transform nodes applied"""
+        return self.vertices @ self.transform[:3, :3].T + self.transform[:3, 3]
+
+
+def parse_floats(text):
+    """Bulk-parse an X3D MFFloat/MFVec3f attribute (whitespace and/or commas)"""
+    return np.fromstring(text.replace(',', ' '), dtype=np.float64, sep=' ')
+
+
+def parse_ints(text):
+    """Bulk-parse an X3D MFInt32 attribute (whitespace and/or commas)"""
+    return np.fromstring(text.replace(',', ' '), dtype=np.int64, sep=' ').astype(np.int32)
+
+
+def triangulate_polygons(coord_index):
+    """
+    Fan-triangulate an IndexedFaceSet coordIndex (polygons separated by -1).
+    Polygons with fewer than 3 vertices are dropped.
+
+    Returns:
+        (M, 3) int32 triangle indices
+    """
+    coord_index = np.asarray(coord_index, dtype=np.int32)
+    if coord_index.size == 0:
+        return np.zeros((0, 3), dtype=np.int32)
+    if coord_index[-1] != -1:
+        coord_index = np.append(coord_index, -1)
+
+    ends = np.flatnonzero(coord_index == -1)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    lengths = ends - starts
+
+    # Fast path: all triangles
+    if np.all(lengths == 3):
+        return coord_index.reshape(-1, 4)[:, :3].copy()
+
+    n_tris = np.maximum(lengths - 2, 0)
+    first = np.repeat(starts, n_tris)
+    k = np.arange(n_tris.sum()) - np.repeat(np.cumsum(n_tris) - n_tris, n_tris) + 1
+    return np.stack([coord_index[first], coord_index[first + k],
+                     coord_index[first + k + 1]], axis=1).astype(np.int32)
+
+
+def _axis_angle_matrix(rotation):
+    """3x3 matrix of an X3D SFRotation (x y z angle)"""
+    axis, angle = np.asarray(rotation[:3], dtype=np.float64), float(rotation[3])
+    norm = np.linalg.norm(axis)
+    if norm == 0 or angle == 0:
+        return np.eye(3)
+    x, y, z = axis / norm
+    c, s, t = np.cos(angle), np.sin(angle), 1 - np.cos(angle)
+    return np.array([
+        [t * x * x + c,     t * x * y - s * z, t * x * z + s * y],
+        [t * x * y + s * z, t * y * y + c,     t * y * z - s * x],
+        [t * x * z - s * y, t * y * z + s * x, t * z * z + c],
+    ])
+
+
+def transform_matrix(attrib):
+    """4x4 matrix of an X3D <Transform> (T * C * R * SR * S * -SR * -C)"""
+    def vector(name, default):
+        return parse_floats(attrib[name]) if name in attrib else np.array(default, dtype=np.float64)
+
+    translation = vector('translation', [0, 0, 0])
+    center = vector('center', [0, 0, 0])
+    rotation = _axis_angle_matrix(vector('rotation', [0, 0, 1, 0]))
+    scale_orientation = _axis_angle_matrix(vector('scaleOrientation', [0, 0, 1, 0]))
+    scale = vector('scale', [1, 1, 1])
+
+    linear = rotation @ scale_orientation @ np.diag(scale) @ scale_orientation.T
+    matrix = np.eye(4)
+    matrix[:3, :3] = linear
+    matrix[:3, 3] = translation + center - linear @ center
+    return matrix
+
+
+def _local_tag(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def iter_shapes(x3d_file, follow_inlines=False, identity_transforms=()):
+    """
+    Stream the triangle meshes of an X3D file.
+
+    Args:
+        x3d_file: Path to the X3D file
+        follow_inlines: Also read files referenced by <Inline url=...>
+                        (relative to the including file)
+        identity_transforms: DEF names of Transforms to read as identity
+                             (joints whose value is set at runtime)
+
+    Yields:
+        X3DShape per <Shape> with IndexedFaceSet/IndexedTriangleSet geometry
+    """
+    transforms = [np.eye(4)]
+    names = []
+    coordinates = {}   # DEF name -> (N, 3) vertices, for Coordinate USE
+    geometry = None    # (tag, attrib) of the open geometry node
+    points = None
+    shape_name = None
+
+    for event, elem in ET.iterparse(x3d_file, events=('start', 'end')):
+        tag = _local_tag(elem.tag)
+
+        if event == 'start':
+            if tag == 'Transform':
+                local = np.eye(4) if elem.get('DEF') in identity_transforms else transform_matrix(elem.attrib)
+                transforms.append(transforms[-1] @ local)
+            names.append(elem.get('DEF'))
+            if tag == 'Shape':
+                shape_name = next((n for n in reversed(names) if n), None)
+            elif tag in GEOMETRY_NODES:
+                geometry = (tag, dict(elem.attrib))
+                points = None
+            continue
+
+        names.pop()
+        if tag == 'Transform':
+            transforms.pop()
+
+        elif tag == 'Coordinate' and geometry is not None:
+            if 'USE' in elem.attrib:
+                points = coordinates.get(elem.get('USE'))
+            elif 'point' in elem.attrib:
+                points = parse_floats(elem.get('point')).reshape(-1, 3)
+                if 'DEF' in elem.attrib:
+                    coordinates[elem.get('DEF')] = points
+            elem.clear()
+
+        elif tag in GEOMETRY_NODES and geometry is not None:
+            geometry_tag, attrib = geometry
+            geometry = None
+            if points is not None:
+                if geometry_tag == 'IndexedFaceSet':
+                    faces = triangulate_polygons(parse_ints(attrib.get('coordIndex', '')))
+                else:
+                    index = parse_ints(attrib.get('index', ''))
+                    faces = index[:len(index) // 3 * 3].reshape(-1, 3)
+                yield X3DShape(shape_name, geometry_tag, points, faces, transforms[-1].copy())
+            elem.clear()
+
+        elif tag == 'Shape':
+            elem.clear()
+
+        elif tag == 'Inline' and follow_inlines and elem.get('url'):
+            url = elem.get('url').split('"')[1] if '"' in elem.get('url') else elem.get('url')
+            path = os.path.join(os.path.dirname(x3d_file), url)
+            if os.path.exists(path):
+                for shape in iter_shapes(path, follow_inlines=True,
+                                         identity_transforms=identity_transforms):
+                    shape.transform = transforms[-1] @ shape.transform
+                    yield shape
+
+
+def read_mesh(x3d_file, follow_inlines=False, apply_transforms=False):
+    """
+    All shapes of an X3D file merged into one mesh.
+
+    Args:
+        apply_transforms: Apply the enclosing X3D Transform nodes to each shape
+
+    Returns:
+        (vertices (N, 3) float64, faces (M, 3) int32, list of X3DShape)
+    """
+    shapes = list(iter_shapes(x3d_file, follow_inlines=follow_inlines))
+    if not shapes:
+        return np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int32), shapes
+
+    offsets = np.cumsum([0] + [len(s.vertices) for s in shapes[:-1]])
+    vertices = np.concatenate([s.world_vertices() if apply_transforms else s.vertices
+                               for s in shapes])
+    faces = np.concatenate([s.faces + offset for s, offset in zip(shapes, offsets)])
+    return vertices, faces.astype(np.int32), shapes
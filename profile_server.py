@@ -0,0 +1,94 @@
+"""
+Profile a running server
+Asks collision_server.py and/or drr_server.py to sample their main loop
+for a window (see lib/SamplingProfiler.py), without restarting them and
+losing their warmed caches, and summarizes the collapsed stacks written.
+
+Usage:
+    python profile_server.py [collision|drr|all] [--seconds 10] [--no-wait]
+    python profile_server.py --summarize profiles/collision_20250101_120000.collapsed
+
+On POSIX, `kill -USR1 <pid>` starts a window too (Ctrl+Break on Windows).
+The .collapsed files open in speedscope (https://www.speedscope.app) or
+render with flamegraph.pl.
+"""
+
+import os
+import sys
+import json
+import time
+import glob
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib'))
+from SamplingProfiler import PROFILE_DIR, PROFILE_REQUEST_FILE, DEFAULT_WINDOW, frame_package
+
+POLL_INTERVAL = 0.1         # s, server loops poll the request file at this rate
+
+
+def request_profile(target='all', seconds=DEFAULT_WINDOW, request_file=PROFILE_REQUEST_FILE):
+    """Write a profiling request picked up by the servers' next loop iteration"""
+    with open(request_file, 'w') as f:
+        json.dump({'target': target, 'seconds': seconds, 'timestamp': time.time()}, f)
+
+
+def summarize(path, top=10):
+    """Print the innermost packages and hottest stacks of a collapsed-stack file"""
+    stacks = Counter()
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                stack, count = line.rsplit(' ', 1)
+                stacks[stack] += int(count)
+    total = sum(stacks.values())
+    packages = Counter()
+    for stack, count in stacks.items():
+        packages[frame_package(stack.rsplit(';', 1)[-1])] += count
+    print(f"{path}: {total} samples")
+    print("Innermost frame by package:")
+    for package, count in packages.most_common(top):
+        print(f"        {package:24s} {count / total * 100:5.1f}%")
+    print("Hottest stacks (last 3 frames):")
+    for stack, count in stacks.most_common(top):
+        print(f"        {count / total * 100:5.1f}%  {' <- '.join(reversed(stack.split(';')[-3:]))}")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Profile a running collision or DRR server')
+    parser.add_argument('target', nargs='?', choices=('collision', 'drr', 'all'), default='all')
+    parser.add_argument('--seconds', type=float, default=DEFAULT_WINDOW,
+                        help=f'Sampling window (default: {DEFAULT_WINDOW:g})')
+    parser.add_argument('--no-wait', action='store_true',
+                        help='Only send the request, do not wait for the profiles')
+    parser.add_argument('--summarize', type=str, default=None, metavar='COLLAPSED',
+                        help='Summarize a collapsed-stack file instead of profiling')
+    args = parser.parse_args()
+
+    if args.summarize:
+        summarize(args.summarize)
+        return
+
+    before = set(glob.glob(os.path.join(PROFILE_DIR, '*.collapsed')))
+    request_profile(args.target, args.seconds)
+    print(f"Requested {args.seconds:g}s profile of {args.target} ({PROFILE_REQUEST_FILE})")
+    if args.no_wait:
+        return
+
+    expected = 2 if args.target == 'all' else 1
+    deadline = time.time() + args.seconds + 10 * POLL_INTERVAL + 5
+    written = []
+    while time.time() < deadline and len(written) < expected:
+        time.sleep(POLL_INTERVAL)
+        written = sorted(set(glob.glob(os.path.join(PROFILE_DIR, '*.collapsed'))) - before)
+    if not written:
+        print("No profile written - is the server running in this directory?")
+        sys.exit(1)
+    for path in written:
+        print()
+        summarize(path)
+
+
+if __name__ == '__main__':
+    main()
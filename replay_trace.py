@@ -0,0 +1,270 @@
+"""
+Pose trace replay and load testing
+Feeds a pose trace (see lib/PoseTrace.py) to CollisionServer or DRRServer
+in this process and reports throughput, latency and result differences.
+
+Speeds:
+    1 (default)   original timing of the trace
+    N             N times faster
+    max           back to back, no waiting
+
+At original or accelerated speed the servers' single-slot pose file is
+emulated: a pose that is still waiting when a newer one is due is dropped
+in favor of the newer one (coalesced), as happens when H3D writes
+collision_pose.json faster than the server reads it. Latency is measured
+from when a pose was due to when its result was ready, so it includes the
+wait behind the previous request; at max speed it is the service time.
+
+Usage:
+    python replay_trace.py replay TRACE [--target collision|drr] [--speed 1|N|max]
+                                        [--save RESULTS] [--against RESULTS]
+    python replay_trace.py info TRACE
+    python replay_trace.py stock
+    python replay_trace.py convert CSV TRACE [--interval 0.2]
+
+Record a session with `collision_server.py --record-trace session.trace`
+(or drr_server.py). --save writes the per-pose results, and --against
+compares them with a saved replay. The exit status is 1 when any result
+differs, e.g. after changing the narrow phase.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import hashlib
+import contextlib
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib'))
+from PoseTrace import PoseTrace, TRACE_DIR, trace_from_csv, trace_from_poses
+
+STOCK_CSV = 'Sample_data_files/random_joint_values.csv'
+STOCK_INTERVAL = 0.2        # s, CollisionClient.THROTTLE_INTERVAL
+TABLE_DOF_INTERVAL = 0.3    # s, the wait of test_table_dof.py between poses
+THUMBNAIL_SIZE = 16
+THUMBNAIL_TOLERANCE = 2.0   # gray levels of thumbnail difference still counted as equal
+
+
+def stock_traces():
+    """{name: PoseTrace} of the traces shipped in TRACE_DIR"""
+    from test_table_dof import SCENARIOS
+    table_dof = [dict(c_arm, **{f'table_{axis}': value for axis, value in table.items()})
+                 for _, c_arm, table in SCENARIOS]
+    return {'random_joint_values': trace_from_csv(STOCK_CSV, STOCK_INTERVAL),
+            'table_dof': trace_from_poses(table_dof, TABLE_DOF_INTERVAL)}
+
+
+def collision_target(server):
+    """Replay handler checking each pose with a CollisionServer"""
+    def handle(pose):
+        result = server.check_collision(
+            pose['lao_rao'], pose['cran_caud'], pose['wigwag'],
+            pose['lateral'], pose['vertical'], pose['horizontal'],
+            pose['table_vertical'], pose['table_longitudinal'], pose['table_transverse'],
+            scene_id=pose.get('scene_id'))
+        return {'collision': bool(result['collision']), 'collision_points': result['collision_points']}
+    return handle
+
+
+def drr_target(server):
+    """Replay handler rendering each pose with a DRRServer"""
+    def handle(pose):
+        args = (pose['lao_rao'], pose['cran_caud'], pose['wigwag'],
+                pose['lateral'], pose['vertical'], pose['horizontal'], pose['zoom'])
+        if pose.get('groups'):
+            server._ensure_mask()
+            img = server.render_with_segmentation(*args, set(pose['groups']))
+        else:
+            img = server.render_drr(*args)
+        gray = img if img.ndim == 2 else img.mean(axis=2)
+        rows = np.array_split(np.arange(gray.shape[0]), THUMBNAIL_SIZE)
+        cols = np.array_split(np.arange(gray.shape[1]), THUMBNAIL_SIZE)
+        thumbnail = [[round(float(gray[np.ix_(r, c)].mean()), 2) for c in cols] for r in rows]
+        return {'digest': hashlib.sha1(np.ascontiguousarray(img).tobytes()).hexdigest()[:16],
+                'mean': round(float(gray.mean()), 3), 'thumbnail': thumbnail}
+    return handle
+
+
+def replay(trace, handle, speed=1.0, coalesce=True):
+    """
+    Feed a trace to a handler.
+
+    Args:
+        trace: PoseTrace
+        handle: Callable(pose dict) -> JSON-serializable result
+        speed: Time scale of the trace; None replays back to back
+        coalesce: Drop poses overtaken by a newer due pose (paced replay only)
+
+    Returns:
+        {'processed', 'coalesced', 'wall_s', 'throughput', 'latency_s',
+         'service_s', 'results': {trace index: result}}
+    """
+    offsets = (trace.times - trace.times[0]) if len(trace) else trace.times
+    latencies, services, results = [], [], {}
+    coalesced = 0
+    started = time.perf_counter()
+    i = 0
+    while i < len(trace):
+        if speed is not None:
+            due = started + offsets[i] / speed
+            now = time.perf_counter()
+            if due > now:
+                time.sleep(due - now)
+            elif coalesce:
+                # Newest pose that is due by now replaces the ones before it
+                last = int(np.searchsorted(offsets, (now - started) * speed, side='right')) - 1
+                coalesced += max(last - i, 0)
+                i = max(i, last)
+                due = started + offsets[i] / speed
+        begin = time.perf_counter()
+        results[i] = handle(trace.pose(i))
+        end = time.perf_counter()
+        services.append(end - begin)
+        latencies.append(end - (due if speed is not None else begin))
+        i += 1
+    wall = time.perf_counter() - started
+
+    def percentiles(values):
+        values = np.array(values) if values else np.zeros(1)
+        return {'p50': float(np.percentile(values, 50)), 'p95': float(np.percentile(values, 95)),
+                'p99': float(np.percentile(values, 99)), 'max': float(values.max())}
+
+    return {'processed': len(results), 'coalesced': coalesced, 'wall_s': wall,
+            'throughput': len(results) / wall if wall > 0 else 0.0,
+            'latency_s': percentiles(latencies), 'service_s': percentiles(services),
+            'results': results}
+
+
+def diff_results(baseline, current):
+    """
+    Poses whose result changed between two replays (poses replayed by both)
+
+    Returns:
+        [(trace index, description)]
+    """
+    diffs = []
+    old, new = baseline['results'], current['results']
+    for index in sorted(set(old) & set(new), key=int):
+        a, b = old[index], new[index]
+        if 'collision' in a:
+            if a['collision'] != b['collision'] or a['collision_points'] != b['collision_points']:
+                diffs.append((index, f"collision {a['collision']} -> {b['collision']}, "
+                                     f"points {a['collision_points']['total']} -> "
+                                     f"{b['collision_points']['total']}"))
+        elif a['digest'] != b['digest']:
+            delta = float(np.abs(np.array(a['thumbnail']) - np.array(b['thumbnail'])).max())
+            if delta > THUMBNAIL_TOLERANCE:
+                diffs.append((index, f"image changed, mean {a['mean']:.1f} -> {b['mean']:.1f}, "
+                                     f"max thumbnail difference {delta:.1f}"))
+    return diffs
+
+
+def print_report(report, trace, speed):
+    pace = 'max speed' if speed is None else f'{speed:g}x speed'
+    print(f"\nReplayed {report['processed']} of {len(trace)} poses at {pace} "
+          f"in {report['wall_s']:.2f}s ({report['throughput']:.1f} poses/s)")
+    if report['coalesced']:
+        print(f"        Coalesced: {report['coalesced']} poses overtaken before the server was free")
+    for label, key in (('Latency', 'latency_s'), ('Service', 'service_s')):
+        stats = report[key]
+        print(f"        {label}: p50 {stats['p50'] * 1000:7.1f}ms  p95 {stats['p95'] * 1000:7.1f}ms  "
+              f"p99 {stats['p99'] * 1000:7.1f}ms  max {stats['max'] * 1000:7.1f}ms")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Replay pose traces against the servers')
+    parser.add_argument('command', choices=('replay', 'info', 'stock', 'convert'))
+    parser.add_argument('paths', nargs='*', help='TRACE (replay, info) or CSV TRACE (convert)')
+    parser.add_argument('--target', choices=('collision', 'drr'), default='collision',
+                        help='Server to feed (default: collision)')
+    parser.add_argument('--speed', type=str, default='1',
+                        help="Time scale of the trace, or 'max' for back to back (default: 1)")
+    parser.add_argument('--no-coalesce', action='store_true',
+                        help='Queue every pose instead of dropping overtaken ones')
+    parser.add_argument('--save', type=str, default=None, help='Write the per-pose results (JSON)')
+    parser.add_argument('--against', type=str, default=None,
+                        help='Compare the results with a replay saved with --save')
+    parser.add_argument('--interval', type=float, default=STOCK_INTERVAL,
+                        help=f'Seconds between CSV rows (convert, default: {STOCK_INTERVAL})')
+    parser.add_argument('--engine', choices=('points', 'gjk'), default='points',
+                        help='Collision engine (collision target)')
+    parser.add_argument('--inside', choices=('vtk', 'bvh'), default='vtk',
+                        help='Inside test of the points engine (collision target)')
+    parser.add_argument('--links', action='store_true', help='Check every C-arm link (collision target)')
+    parser.add_argument('--no-coherence', action='store_true',
+                        help='Disable temporal coherence (collision target)')
+    parser.add_argument('--height', type=int, default=256, help='DRR size in pixels (drr target)')
+    args = parser.parse_args()
+
+    if args.command == 'stock':
+        os.makedirs(TRACE_DIR, exist_ok=True)
+        for name, trace in stock_traces().items():
+            path = os.path.join(TRACE_DIR, f'{name}.trace')
+            trace.save(path)
+            print(f"  {path}: {len(trace)} poses over {trace.duration():.1f}s "
+                  f"({os.path.getsize(path) / 1024:.1f} KB)")
+        return
+    if args.command == 'convert':
+        if len(args.paths) != 2:
+            parser.error('convert needs CSV and TRACE')
+        trace = trace_from_csv(args.paths[0], args.interval)
+        trace.save(args.paths[1])
+        print(f"  {args.paths[1]}: {len(trace)} poses over {trace.duration():.1f}s")
+        return
+    if len(args.paths) != 1:
+        parser.error(f'{args.command} needs one TRACE')
+
+    trace = PoseTrace(args.paths[0])
+    if args.command == 'info':
+        print(f"{args.paths[0]}: {len(trace)} poses over {trace.duration():.1f}s")
+        if len(trace) > 1:
+            gaps = np.diff(trace.times)
+            print(f"        Interval: median {np.median(gaps) * 1000:.0f}ms, min {gaps.min() * 1000:.0f}ms")
+        named = [text for text in trace.strings if text]
+        if named:
+            print(f"        Scenes / segmentation groups: {', '.join(named)}")
+        return
+
+    speed = None if args.speed == 'max' else float(args.speed)
+    print("=" * 70)
+    print(f"REPLAY {args.paths[0]} -> {args.target} server")
+    print("=" * 70)
+    with contextlib.redirect_stdout(io.StringIO()):
+        if args.target == 'collision':
+            from collision_server import CollisionServer
+            handle = collision_target(CollisionServer(engine=args.engine, inside=args.inside,
+                                                      links=args.links,
+                                                      coherence=not args.no_coherence))
+        else:
+            from drr_server import DRRServer
+            handle = drr_target(DRRServer(height=args.height))
+        report = replay(trace, handle, speed, coalesce=not args.no_coalesce)
+    print_report(report, trace, speed)
+
+    record = {'trace': args.paths[0], 'target': args.target, 'speed': args.speed,
+              'timestamp': datetime.now().isoformat(),
+              'results': {str(index): result for index, result in report['results'].items()}}
+    record.update({key: value for key, value in report.items() if key != 'results'})
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(record, f, indent=1)
+        print(f"\nSaved results to {args.save}")
+    if args.against:
+        with open(args.against) as f:
+            baseline = json.load(f)
+        diffs = diff_results(baseline, record)
+        compared = len(set(baseline['results']) & set(record['results']))
+        print(f"\n{len(diffs)} of {compared} poses differ from {args.against}")
+        for index, description in diffs[:20]:
+            print(f"        #{index}: {description}")
+        sys.exit(1 if diffs else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Test - Benchmark suite plumbing
+Runs the cheap benchmarks into a temporary history and checks that the
+comparison flags a regression beyond the threshold (and only then)
+"""
+
+import io
+import os
+import sys
+import copy
+import tempfile
+import contextlib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / 'lib'))
+
+
+def test_run_and_save():
+    """Kinematics benchmarks produce timings that round-trip through the history"""
+    print("=" * 70)
+    print("TEST 1: Run benchmarks and persist the results")
+    print("=" * 70)
+
+    from benchmark_collision import select_benchmarks, run_benchmarks, save_run, load_history
+
+    names = select_benchmarks('kinematics.*')
+    assert names and all(name.startswith('kinematics.') for name in names)
+    assert 'workspace.10k' not in select_benchmarks() and 'workspace.10k' in select_benchmarks(full=True)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        record = run_benchmarks(names, rounds=2, min_round_time=0.01)
+    for name in names:
+        timing = record['results'][name]
+        print(f"  {name:32s} {timing['median'] * 1e6:8.1f}us x {timing['number']}")
+        assert 0 < timing['min'] <= timing['median'] and timing['rounds'] == 2
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'history.json')
+        assert save_run(record, path) == 1
+        assert save_run(record, path) == 2
+        history = load_history(path)
+        assert history[-1]['results'] == record['results']
+    print("\n✅ Results saved to and loaded from the JSON history\n")
+
+
+def test_compare_flags_regressions():
+    """Only slowdowns beyond the threshold are regressions"""
+    print("=" * 70)
+    print("TEST 2: Regression flagging")
+    print("=" * 70)
+
+    from benchmark_collision import compare_runs
+
+    timing = {'median': 0.010, 'min': 0.009, 'mean': 0.011, 'rounds': 5, 'number': 10}
+    baseline = {'results': {'check.default': dict(timing), 'inside.patient.vtk': dict(timing),
+                            'kinematics.link_frames': dict(timing)}}
+    current = copy.deepcopy(baseline)
+    current['results']['check.default']['min'] = 0.009 * 1.5        # 50% slower
+    current['results']['inside.patient.vtk']['min'] = 0.009 * 1.1   # within threshold
+    current['results']['kinematics.link_frames']['min'] = 0.009 / 2
+    current['results']['check.new'] = dict(timing)                   # no baseline
+
+    status = {name: row_status for name, _, _, _, row_status in compare_runs(baseline, current, 0.2)}
+    print(f"  {status}")
+    assert status == {'check.default': 'regression', 'inside.patient.vtk': 'ok',
+                      'kinematics.link_frames': 'improvement'}
+    medians = {name: row_status for name, _, _, _, row_status
+               in compare_runs(baseline, current, 0.2, stat='median')}
+    assert set(medians.values()) == {'ok'}
+    print("\n✅ Regressions beyond the threshold are flagged\n")
+
+
+if __name__ == '__main__':
+    test_run_and_save()
+    test_compare_flags_regressions()
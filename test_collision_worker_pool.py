@@ -0,0 +1,177 @@
+"""
+Test - Collision worker pool
+Checks poses in forked workers against the in-process server, and runs
+interactive requests next to a batch backlog
+"""
+
+import io
+import sys
+import functools
+import time
+import contextlib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / 'lib'))
+
+
+class SlowServer:
+    """Stand-in server whose checks take a fixed time"""
+
+    def __init__(self, seconds=0.05):
+        self.seconds = seconds
+
+    def check_collision(self, *joints, scene_id=None):
+        time.sleep(self.seconds)
+        return {'collision': False, 'collision_points': {}, 'pose': list(joints)}
+
+
+def test_pool_matches_server():
+    """Forked workers give the results of the server they were forked from"""
+    print("=" * 70)
+    print("TEST 1: Worker results, in-process and over HTTP")
+    print("=" * 70)
+
+    from collision_server import CollisionServer
+    from CollisionWorkerPool import (CollisionWorkerPool, check_pose, start_check_server,
+                                     remote_check)
+
+    from PoseTrace import PoseTrace
+
+    trace = PoseTrace('traces/random_joint_values.trace')
+    poses = [{name: float(value) for name, value in trace.pose(i).items()} for i in range(6)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        server = CollisionServer(coherence=False)
+        expected = [check_pose(server, pose)['collision_points'] for pose in poses]
+        pool = CollisionWorkerPool(lambda: None, workers=2, server=server, start_method='fork')
+    try:
+        endpoint = start_check_server(pool, port=0)
+        url = f'http://127.0.0.1:{endpoint.server_address[1]}'
+        with contextlib.redirect_stdout(io.StringIO()):
+            interactive = [pool.check(pose)['collision_points'] for pose in poses]
+            batch = [r['collision_points'] for r in remote_check(poses, 'batch', url)]
+        print(f"  totals {[points['total'] for points in expected]}")
+        assert any(points['total'] for points in expected)
+        assert interactive == expected and batch == expected
+        stats = pool.stats()
+        print(f"  {stats}")
+        assert stats['interactive']['count'] == 6 and stats['batch']['count'] == 6
+        endpoint.shutdown()
+    finally:
+        pool.close()
+    print("\n✅ Pool results match the server\n")
+
+
+def test_interactive_priority():
+    """Interactive checks do not wait behind a batch backlog"""
+    print("=" * 70)
+    print("TEST 2: Interactive requests next to batch work")
+    print("=" * 70)
+
+    from CollisionWorkerPool import CollisionWorkerPool
+
+    pool = CollisionWorkerPool(SlowServer, workers=3, reserved=1, start_method='fork')
+    try:
+        backlog = [pool.submit({'lao_rao': float(i)}, 'batch') for i in range(20)]
+        time.sleep(0.1)
+        for i in range(5):
+            result = pool.check({'lao_rao': 100.0 + i}, 'interactive', timeout=5)
+            assert result['pose'][0] == 100.0 + i
+        queued = pool.queued()['batch']
+        for future in backlog:
+            future.result(timeout=10)
+        stats = pool.stats()
+        pool.print_stats()
+        # 20 batch checks on 2 workers take ~0.5s; interactive ones start at once
+        assert queued > 0
+        assert stats['interactive']['wait_ms']['p95'] < 20
+        assert stats['batch']['wait_ms']['p95'] > 200
+    finally:
+        pool.close()
+    print("\n✅ Interactive requests skip the batch queue\n")
+
+
+def test_workers_dying_together():
+    """Workers killed in the same wake-up are replaced; a failing dispatcher fails its requests"""
+    print("=" * 70)
+    print("TEST 3: Worker deaths and dispatcher failure")
+    print("=" * 70)
+
+    from CollisionWorkerPool import CollisionWorkerPool
+
+    pool = CollisionWorkerPool(functools.partial(SlowServer, 0.5), workers=2, reserved=0,
+                               start_method='fork')
+    try:
+        busy = [pool.submit({'lao_rao': float(i)}, 'batch') for i in range(2)]
+        time.sleep(0.2)
+        workers = list(pool.processes)
+        for process in workers:
+            process.kill()
+        for process in workers:
+            process.join()
+        for future in busy:
+            assert isinstance(future.exception(timeout=5), RuntimeError)
+        result = pool.check({'lao_rao': 7.0}, timeout=10)
+        print(f"  after both workers died: {result['pose'][:1]}")
+        assert result['pose'][0] == 7.0 and pool._dispatcher.is_alive()
+    finally:
+        pool.close()
+
+    def broken(priority, wait_s, total_s):
+        raise ValueError('metrics hook failed')
+
+    pool = CollisionWorkerPool(functools.partial(SlowServer, 0.05), workers=1, reserved=0,
+                               start_method='fork', on_complete=broken)
+    try:
+        futures = [pool.submit({'lao_rao': float(i)}) for i in range(3)]
+        assert futures[0].result(timeout=5)['pose'][0] == 0.0
+        for future in futures[1:]:
+            assert 'dispatcher failed' in str(future.exception(timeout=5))
+        try:
+            pool.submit({'lao_rao': 9.0})
+            assert False, 'a pool without dispatcher took a request'
+        except RuntimeError as e:
+            print(f"  after the dispatcher failed: {e}")
+    finally:
+        pool.close()
+    print("\n✅ No request hangs\n")
+
+
+def test_remote_sweep_in_chunks():
+    """workspace_analysis.py --server sends its samples a chunk per request"""
+    print("=" * 70)
+    print("TEST 4: Workspace sweep on the pool")
+    print("=" * 70)
+
+    import workspace_analysis
+    from CollisionWorkerPool import CollisionWorkerPool, start_check_server, remote_check
+
+    requests = []
+
+    def counting_check(poses, *args, **kwargs):
+        requests.append(len(poses))
+        return remote_check(poses, *args, **kwargs)
+
+    pool = CollisionWorkerPool(functools.partial(SlowServer, 0.0), workers=2, start_method='fork')
+    original = workspace_analysis.remote_check
+    workspace_analysis.remote_check = counting_check
+    try:
+        endpoint = start_check_server(pool, port=0)
+        url = f'http://127.0.0.1:{endpoint.server_address[1]}'
+        with contextlib.redirect_stdout(io.StringIO()):
+            analyzer = workspace_analysis.WorkspaceAnalyzer(server_url=url)
+            results, _, _ = analyzer.analyze_workspace('setup5', 'PA', 450, verbose=False)
+        print(f"  {results['statistics']['total']} poses in requests of {requests}")
+        assert requests == [200, 200, 50]
+        assert results['statistics']['total'] == 450 and pool.stats()['batch']['count'] == 450
+        endpoint.shutdown()
+    finally:
+        workspace_analysis.remote_check = original
+        pool.close()
+    print("\n✅ One request per chunk\n")
+
+
+if __name__ == '__main__':
+    test_pool_matches_server()
+    test_interactive_priority()
+    test_workers_dying_together()
+    test_remote_sweep_in_chunks()
@@ -0,0 +1,98 @@
+"""
+Test - GJK/EPA convex collision engine
+Checks GJK/EPA on boxes with known distance / penetration depth and
+cross-validates CollisionServer(engine='gjk') against the inside-points
+backend on random poses
+"""
+
+import io
+import sys
+import contextlib
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent / 'lib'))
+
+CROSS_VALIDATION_POSES = 40
+
+
+def box(center, half):
+    """Corner vertices of an axis-aligned box"""
+    corners = np.array([[x, y, z] for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)], dtype=float)
+    return np.asarray(center, dtype=float) + corners * np.asarray(half, dtype=float)
+
+
+def test_gjk_epa_boxes():
+    """Distance and depth of two unit cubes at known offsets"""
+    print("=" * 70)
+    print("TEST 1: GJK distance / EPA depth of two cubes")
+    print("=" * 70)
+
+    from ConvexCollision import gjk, epa
+
+    a = box([0, 0, 0], [0.5, 0.5, 0.5])
+    for offset, distance, depth in [(1.5, 0.5, 0.0), (1.25, 0.25, 0.0), (0.8, 0.0, 0.2),
+                                    (0.3, 0.0, 0.7)]:
+        b = box([offset, 0.1, 0.05], [0.5, 0.5, 0.5])
+        gjk_distance, simplex, witness_a, witness_b = gjk(a, b)
+        print(f"  offset {offset:.2f}: distance {gjk_distance:.4f}", end='')
+        assert abs(gjk_distance - distance) < 1e-9
+        if distance > 0:
+            assert abs(np.linalg.norm(witness_a - witness_b) - distance) < 1e-9
+        else:
+            epa_depth, normal = epa(a, b, simplex)
+            print(f", depth {epa_depth:.4f} along {np.round(normal, 3)}", end='')
+            assert abs(epa_depth - depth) < 1e-6
+            assert abs(abs(normal[0]) - 1.0) < 1e-6
+        print()
+    print("\n✅ GJK/EPA match the analytic values\n")
+
+
+def test_gjk_cross_validation():
+    """Every inside-points collision must be a GJK intersection"""
+    print("=" * 70)
+    print("TEST 2: GJK engine vs inside-points backend")
+    print("=" * 70)
+
+    from collision_server import CollisionServer, OBSTACLES
+    from workspace_analysis import JOINT_LIMITS
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        points_server = CollisionServer()
+        gjk_server = CollisionServer(engine='gjk')
+
+    rng = np.random.default_rng(0)
+    misses, extra, agree = 0, 0, 0
+    for _ in range(CROSS_VALIDATION_POSES):
+        pose = {joint: rng.uniform(*limits) for joint, limits in JOINT_LIMITS.items()}
+        args = (pose['orbital'], pose['tilt'], pose['wigwag'], pose['lateral'], pose['vertical'],
+                pose['horizontal'], pose['table_vertical'], pose['table_longitudinal'],
+                pose['table_transverse'])
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected = points_server.check_collision(*args)
+            result = gjk_server.check_collision(*args)
+
+        for name in OBSTACLES:
+            hit = expected['collision_points'][name] > 0
+            contact = result['contacts'][name]
+            intersecting = result['collision_points'][name] > 0
+            assert intersecting == (contact['distance'] == 0)
+            if hit and not intersecting:
+                misses += 1
+                print(f"  [MISS] {name} at {pose}")
+            elif intersecting and not hit:
+                extra += 1
+            else:
+                agree += 1
+
+    checks = CROSS_VALIDATION_POSES * len(OBSTACLES)
+    print(f"  {checks} obstacle checks: {agree} agree, {extra} conservative extra hits, "
+          f"{misses} missed")
+    assert misses == 0
+    print("\n✅ GJK engine never misses an inside-points collision\n")
+
+
+if __name__ == '__main__':
+    test_gjk_epa_boxes()
+    test_gjk_cross_validation()
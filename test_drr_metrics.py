@@ -0,0 +1,35 @@
+"""
+Test - DRR server metrics
+Needs DiffDRR and the DeepFluoro example CT (preprocessed into the CT
+cache on first use)
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / 'lib'))
+
+
+def test_mask_loaded_gauge():
+    """mask_loaded turns 1 once segmentation has loaded the deferred mask"""
+    print("=" * 70)
+    print("TEST 1: Deferred segmentation mask gauge")
+    print("=" * 70)
+
+    from drr_server import DRRServer
+    from ServerMetrics import parse_metrics
+
+    server = DRRServer(height=64)
+    metrics = server._metrics_registry()
+    loaded = lambda: parse_metrics(metrics.render())[('drr_mask_loaded', ())]
+    assert server._mask_loader is not None and loaded() == 0
+
+    group = next(iter(server.structure_groups))
+    server.render_with_segmentation(0, 0, active_groups={group})
+    print(f"  mask_loaded after a '{group}' render: {loaded():.0f}")
+    assert loaded() == 1
+    print("\n✅ Gauge follows the lazy mask load\n")
+
+
+if __name__ == '__main__':
+    test_mask_loaded_gauge()
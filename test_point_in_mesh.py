@@ -0,0 +1,89 @@
+"""
+Test - Ray-parity inside test vs VTK
+Compares PointInMesh (numpy BVH kernel) with vedo's inside_points on every
+mesh of the scene bundle, and CollisionServer(inside='bvh') with the VTK
+backend on random poses
+"""
+
+import io
+import sys
+import contextlib
+from pathlib import Path
+
+import numpy as np
+import vedo
+
+sys.path.insert(0, str(Path(__file__).parent / 'lib'))
+
+SAMPLES_PER_MESH = 5000
+MAX_MISMATCH = 0.002            # fraction of points; VTK's rays are randomized
+CROSS_VALIDATION_POSES = 30
+
+
+def test_inside_matches_vtk():
+    """Random points in (and around) every shipped mesh"""
+    print("=" * 70)
+    print("TEST 1: Ray parity vs vedo inside_points on the shipped meshes")
+    print("=" * 70)
+
+    from collision_server import open_scene_bundle
+    from PointInMesh import PointInMesh
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        bundle = open_scene_bundle()
+    rng = np.random.default_rng(0)
+    for name, entry in bundle.objects.items():
+        if entry['kind'] != 'mesh':
+            continue
+        vertices = bundle.array(name, 'points').astype(np.float64)
+        test = PointInMesh(vertices, bundle.array(name, 'triangles'), bundle.bvh(name))
+        lo, hi = vertices.min(axis=0), vertices.max(axis=0)
+        points = rng.uniform(lo - 0.1 * (hi - lo), hi + 0.1 * (hi - lo), (SAMPLES_PER_MESH, 3))
+
+        expected = np.zeros(len(points), dtype=bool)
+        expected[vedo.Mesh([vertices, bundle.array(name, 'faces')]).inside_points(
+            points, return_ids=True)] = True
+        inside = test.inside(points)
+        mismatch = np.count_nonzero(inside != expected)
+        print(f"  {name:12s} {np.count_nonzero(expected):5d} inside (VTK), "
+              f"{np.count_nonzero(inside):5d} (ray parity), {mismatch} differ")
+        assert mismatch <= MAX_MISMATCH * len(points)
+    print("\n✅ Ray parity agrees with VTK on every mesh\n")
+
+
+def test_server_backends_agree():
+    """Same collision verdicts from both inside tests"""
+    print("=" * 70)
+    print("TEST 2: CollisionServer inside='bvh' vs inside='vtk'")
+    print("=" * 70)
+
+    from collision_server import CollisionServer, OBSTACLES
+    from workspace_analysis import JOINT_LIMITS
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        vtk_server = CollisionServer()
+        bvh_server = CollisionServer(inside='bvh')
+
+    rng = np.random.default_rng(1)
+    largest = 0
+    for _ in range(CROSS_VALIDATION_POSES):
+        pose = {joint: rng.uniform(*limits) for joint, limits in JOINT_LIMITS.items()}
+        args = (pose['orbital'], pose['tilt'], pose['wigwag'], pose['lateral'], pose['vertical'],
+                pose['horizontal'], pose['table_vertical'], pose['table_longitudinal'],
+                pose['table_transverse'])
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected = vtk_server.check_collision(*args)
+            result = bvh_server.check_collision(*args)
+        assert result['collision'] == expected['collision']
+        for name in OBSTACLES:
+            a, b = expected['collision_points'][name], result['collision_points'][name]
+            assert (a > 0) == (b > 0)
+            largest = max(largest, abs(a - b))
+
+    print(f"  {CROSS_VALIDATION_POSES} poses: same verdicts, counts differ by at most {largest} points")
+    print("\n✅ Both backends report the same collisions\n")
+
+
+if __name__ == '__main__':
+    test_inside_matches_vtk()
+    test_server_backends_agree()
@@ -0,0 +1,182 @@
+"""
+Test - Shared-memory pose bus
+Publishes poses, segmentation groups and refreshes as H3D does and reads
+them back the way the servers do, including while the writer is busy
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / 'lib'))
+
+
+def test_bus_round_trip():
+    """Every message type comes back from a snapshot with its own sequence"""
+    print("=" * 70)
+    print("TEST 1: Pose bus write / read")
+    print("=" * 70)
+
+    from PoseBus import PoseBusWriter, PoseBusReader, POSE_FIELDS
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'pose_bus.bin')
+        writer = PoseBusWriter(path)
+        reader = PoseBusReader(path)
+        assert reader.sequence() == 0 and reader.latest_pose() is None
+
+        writer.publish_pose({'lao_rao': 30.0, 'table_vertical': 0.2, 'scene_id': 'habitus_large'})
+        writer.publish_segmentation({'ribs', 'cardiac'})
+        writer.publish_pose({'lao_rao': 31.5})
+        writer.publish_refresh()
+        snapshot = reader.snapshot()
+        print(f"  seq {snapshot['seq']}: {snapshot['pose']['pose']}")
+        assert snapshot['seq'] == 4 and snapshot['pose']['seq'] == 2
+        assert snapshot['segmentation']['groups'] == {'ribs', 'cardiac'}
+        assert snapshot['refresh']['seq'] == 1
+        pose = reader.latest_pose()
+        assert pose['lao_rao'] == 31.5 and pose['zoom'] == 1.0 and 'scene_id' not in pose
+        assert set(pose) == set(POSE_FIELDS) | {'timestamp'}
+
+        # A second writer (another H3D script) continues the sequence
+        PoseBusWriter(path).publish_pose({'lao_rao': 33.0})
+        assert reader.sequence() == 5 and reader.latest_pose()['lao_rao'] == 33.0
+        reader.close()
+        writer.close()
+    print("\n✅ Pose bus round trip\n")
+
+
+def test_no_torn_reads():
+    """Readers racing a writer only ever see complete poses"""
+    print("=" * 70)
+    print("TEST 2: Concurrent writer and reader")
+    print("=" * 70)
+
+    from PoseBus import PoseBusWriter, PoseBusReader, POSE_FIELDS
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'pose_bus.bin')
+        writer = PoseBusWriter(path)
+        reader = PoseBusReader(path)
+        writer.publish_pose({field: 0.0 for field in POSE_FIELDS})
+        done = threading.Event()
+
+        def publish():
+            i = 0
+            while not done.is_set():
+                i += 1
+                writer.publish_pose({field: float(i) for field in POSE_FIELDS})
+
+        thread = threading.Thread(target=publish)
+        thread.start()
+        reads = 0
+        end = time.time() + 0.5
+        try:
+            while time.time() < end:
+                pose = reader.latest_pose()
+                values = set(pose[field] for field in POSE_FIELDS)
+                assert len(values) == 1, f"torn pose: {values}"
+                reads += 1
+        finally:
+            done.set()
+            thread.join()
+        print(f"  {reads} consistent reads, {reader.sequence()} poses published")
+        assert reads > 100
+        reader.close()
+        writer.close()
+    print("\n✅ No torn poses\n")
+
+
+def test_subscriber():
+    """The subscriber falls back to the JSON files, then coalesces bus poses"""
+    print("=" * 70)
+    print("TEST 3: Subscriber on files, then on the bus")
+    print("=" * 70)
+
+    from PoseBus import PoseBusWriter, PoseSubscriber
+
+    with tempfile.TemporaryDirectory() as directory:
+        bus = os.path.join(directory, 'pose_bus.bin')
+        pose_file = os.path.join(directory, 'collision_pose.json')
+        seg_file = os.path.join(directory, 'segmentation_settings.json')
+        with open(pose_file, 'w') as f:
+            json.dump({'lao_rao': 10.0}, f)
+        subscriber = PoseSubscriber(bus, pose_file, seg_file)
+        assert subscriber.source == 'files'
+        messages = subscriber.wait(0)
+        assert messages[0][0] == 'pose' and messages[0][1]['lao_rao'] == 10.0
+        assert 'timestamp' in messages[0][1]
+        assert subscriber.wait(0.05) == []
+
+        writer = PoseBusWriter(bus)
+        for angle in (20.0, 21.0, 22.0):
+            writer.publish_pose({'lao_rao': angle})
+        writer.publish_segmentation({'organs'})
+        assert subscriber.source == 'bus' and subscriber.pending()
+        messages = subscriber.wait(1.0)
+        print(f"  {messages}, coalesced {subscriber.coalesced}")
+        assert [kind for kind, _ in messages] == ['segmentation', 'pose']
+        assert messages[0][1] == {'organs'} and messages[1][1]['lao_rao'] == 22.0
+        assert subscriber.coalesced == 2 and not subscriber.pending()
+
+        # Bus mode no longer reads the files
+        with open(pose_file, 'w') as f:
+            json.dump({'lao_rao': 99.0}, f)
+        writer.publish_refresh()
+        assert subscriber.wait(1.0) == [('refresh', None)]
+
+        # A restarted server gets the current pose and groups once
+        restarted = PoseSubscriber(bus, pose_file, seg_file)
+        messages = restarted.wait(0)
+        assert [kind for kind, _ in messages] == ['segmentation', 'pose']
+        assert messages[1][1]['lao_rao'] == 22.0 and restarted.coalesced == 0
+        assert restarted.wait(0) == []
+        for item in (subscriber, restarted, writer):
+            item.close()
+    print("\n✅ Subscriber delivers the newest messages\n")
+
+
+def test_stale_bus():
+    """A bus left by an earlier session does not hide a JSON-only writer"""
+    print("=" * 70)
+    print("TEST 4: Stale bus, newer JSON files")
+    print("=" * 70)
+
+    from PoseBus import PoseBusWriter, PoseSubscriber, BUS_GRACE
+
+    with tempfile.TemporaryDirectory() as directory:
+        bus = os.path.join(directory, 'pose_bus.bin')
+        pose_file = os.path.join(directory, 'collision_pose.json')
+        writer = PoseBusWriter(bus)
+        writer.publish_pose({'lao_rao': 5.0})
+        subscriber = PoseSubscriber(bus, pose_file)
+        assert subscriber.wait(0)[0][1]['lao_rao'] == 5.0
+
+        # A JSON-only H3D writes after the bus went quiet
+        with open(pose_file, 'w') as f:
+            json.dump({'lao_rao': 30.0}, f)
+        later = time.time() + BUS_GRACE + 1
+        os.utime(pose_file, (later, later))
+        assert subscriber.source == 'files'
+        messages = subscriber.wait(0)
+        print(f"  {subscriber.source}: {messages}")
+        assert messages[0][0] == 'pose' and messages[0][1]['lao_rao'] == 30.0
+
+        # The bus writer is back
+        writer.publish_pose({'lao_rao': 40.0})
+        assert subscriber.source == 'bus'
+        assert subscriber.wait(0)[0][1]['lao_rao'] == 40.0
+        for item in (subscriber, writer):
+            item.close()
+    print("\n✅ Newer JSON files win over an idle bus\n")
+
+
+if __name__ == '__main__':
+    test_bus_round_trip()
+    test_no_torn_reads()
+    test_subscriber()
+    test_stale_bus()
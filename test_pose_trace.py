@@ -0,0 +1,92 @@
+"""
+Test - Pose trace recording and replay
+Round-trips poses through the binary trace format and replays the stock
+table DOF trace against the collision server
+"""
+
+import io
+import os
+import sys
+import copy
+import tempfile
+import contextlib
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent / 'lib'))
+
+
+def test_trace_round_trip():
+    """Poses, scenes and segmentation groups survive a write / read, even cut short"""
+    print("=" * 70)
+    print("TEST 1: Trace write / read")
+    print("=" * 70)
+
+    from PoseTrace import PoseTraceWriter, PoseTrace, FIELDS
+
+    poses = [{'lao_rao': 30.0, 'cran_caud': -10.0, 'table_vertical': 0.2, 'timestamp': 100.0},
+             {'lao_rao': 31.5, 'zoom': 1.5, 'timestamp': 100.2, 'scene_id': 'habitus_large'},
+             {'lao_rao': 33.0, 'timestamp': 100.4}]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'session.trace')
+        writer = PoseTraceWriter(path)
+        writer.record(poses[0])
+        writer.record(poses[1], poses[1]['scene_id'], groups={'vessels', 'bones'})
+        writer.close()
+        writer = PoseTraceWriter(path)      # a restarted server appends
+        writer.record(poses[2], 'habitus_large')
+        writer.close()
+        size = os.path.getsize(path)
+
+        trace = PoseTrace(path)
+        print(f"  {len(trace)} poses, {size} bytes, strings {trace.strings}")
+        assert len(trace) == 3 and abs(trace.duration() - 0.4) < 1e-9
+        assert trace.pose(0)['table_vertical'] == np.float32(0.2) and trace.pose(0)['zoom'] == 1.0
+        assert trace.pose(1)['scene_id'] == 'habitus_large'
+        assert trace.pose(1)['groups'] == ['bones', 'vessels']
+        assert trace.pose(2)['scene_id'] == 'habitus_large' and 'groups' not in trace.pose(2)
+        assert set(trace.pose(0)) == set(FIELDS) | {'timestamp'}
+
+        with open(path, 'r+b') as f:
+            f.truncate(size - 5)            # server killed mid-write
+        assert len(PoseTrace(path)) == 2
+    print("\n✅ Trace round trip\n")
+
+
+def test_replay_stock_trace():
+    """The table DOF scenarios replay with stable results"""
+    print("=" * 70)
+    print("TEST 2: Replay traces/table_dof.trace")
+    print("=" * 70)
+
+    from PoseTrace import PoseTrace
+    from replay_trace import stock_traces, collision_target, replay, diff_results
+    from collision_server import CollisionServer
+
+    trace = PoseTrace('traces/table_dof.trace')
+    stock = stock_traces()['table_dof']
+    assert np.array_equal(trace.poses, stock.poses) and np.allclose(trace.times, stock.times)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        # Without coherence every pose tests the same points whatever came before
+        handle = collision_target(CollisionServer(coherence=False))
+        report = replay(trace, handle, speed=None)
+        paced = replay(trace, handle, speed=20.0)
+    print(f"  {report['processed']} poses, {report['throughput']:.1f} poses/s, "
+          f"p95 {report['latency_s']['p95'] * 1000:.1f}ms")
+    assert report['processed'] == len(trace) and report['coalesced'] == 0
+    assert paced['processed'] + paced['coalesced'] == len(trace)
+    assert paced['wall_s'] >= trace.duration() / 20.0
+
+    assert diff_results(report, paced) == []
+    changed = copy.deepcopy(paced)
+    index = next(iter(changed['results']))
+    changed['results'][index]['collision_points']['total'] += 1
+    assert [i for i, _ in diff_results(report, changed)] == [index]
+    print("\n✅ Replay reports latency and result diffs\n")
+
+
+if __name__ == '__main__':
+    test_trace_round_trip()
+    test_replay_stock_trace()
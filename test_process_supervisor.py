@@ -0,0 +1,117 @@
+"""
+Test - Process supervisor
+Starts stand-in servers that load for a while before serving /health, as
+collision_server.py and drr_server.py do, and one that keeps exiting
+"""
+
+import sys
+import time
+import socket
+import textwrap
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / 'lib'))
+
+# Loads for LOAD seconds, serves /health, runs its loop, exits after LIFE seconds
+SERVER = textwrap.dedent('''
+    import sys, time
+    sys.path.insert(0, {lib!r})
+    from ServerMetrics import Heartbeat, start_metrics_server
+    time.sleep({load})
+    heartbeat = Heartbeat()
+    start_metrics_server(lambda: '', {port}, health=heartbeat.health)
+    end = time.time() + {life}
+    while time.time() < end:
+        heartbeat.beat()
+        time.sleep(0.05)
+''')
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _component(name, load, life=60.0, **kwargs):
+    from ProcessSupervisor import Component
+    port = _free_port()
+    code = SERVER.format(lib=str(Path(__file__).parent / 'lib'), load=load, port=port, life=life)
+    return Component(name, [sys.executable, '-c', code],
+                     health_url=f'http://127.0.0.1:{port}/health', **kwargs)
+
+
+def test_parallel_start():
+    """Time to ready is that of the slowest server, not the sum"""
+    print("=" * 70)
+    print("TEST 1: Parallel start with readiness probes")
+    print("=" * 70)
+
+    from ProcessSupervisor import Supervisor
+
+    components = [_component('fast', 0.2), _component('slow', 1.5), _component('slower', 1.5)]
+    supervisor = Supervisor(components)
+    try:
+        supervisor.start_all()
+        time_to_ready = supervisor.wait_ready(timeout=20)
+        print("\n".join(supervisor.status()))
+        print(f"  ready in {time_to_ready:.2f}s")
+        assert all(c.state == 'ready' for c in components)
+        assert 1.5 <= time_to_ready < 3.0     # sequential: 3.2s + startups
+        assert components[0].time_to_ready < components[1].time_to_ready
+    finally:
+        supervisor.stop_all()
+    print("\n✅ Servers start in parallel\n")
+
+
+def test_restart_with_backoff():
+    """A server that exits is restarted after its backoff, then given up"""
+    print("=" * 70)
+    print("TEST 2: Restart with backoff")
+    print("=" * 70)
+
+    from ProcessSupervisor import Supervisor
+
+    flaky = _component('flaky', 0.1, life=0.3, backoff=(0.2, 0.4), max_restarts=2)
+    supervisor = Supervisor([flaky])
+    try:
+        supervisor.start_all()
+        assert supervisor.wait_ready(timeout=20) is not None
+        deadline = time.time() + 20
+        while not supervisor.failed and time.time() < deadline:
+            supervisor.poll()
+            time.sleep(0.05)
+        print("\n".join(supervisor.status()))
+        assert supervisor.failed == [flaky] and flaky.total_restarts == 2
+    finally:
+        supervisor.stop_all()
+    print("\n✅ Exited server restarted, then given up\n")
+
+
+def test_stale_server_not_ready():
+    """A server already on the port does not count as the one started"""
+    print("=" * 70)
+    print("TEST 3: Health token")
+    print("=" * 70)
+
+    from ProcessSupervisor import Supervisor
+    from ServerMetrics import Heartbeat, start_metrics_server
+
+    component = _component('new', 30.0, ready_timeout=0.5, restart=False)
+    port = int(component.health_url.rsplit(':', 1)[1].split('/')[0])
+    stale = start_metrics_server(lambda: '', port, health=Heartbeat().health)
+    supervisor = Supervisor([component])
+    try:
+        supervisor.start_all()
+        assert supervisor.wait_ready(timeout=20) is None
+        assert component.state == 'stopped' and component.ready_at is None
+    finally:
+        supervisor.stop_all()
+        stale.shutdown()
+    print("\n✅ Stale server ignored\n")
+
+
+if __name__ == '__main__':
+    test_parallel_start()
+    test_restart_with_backoff()
+    test_stale_server_not_ready()
@@ -0,0 +1,76 @@
+"""
+Test - Collision result publication
+Publishes results as collision_server.py does and waits for them by
+request ID as CollisionClient.py does
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / 'lib'))
+
+
+def test_result_file():
+    """The result file is replaced whole and minified"""
+    print("=" * 70)
+    print("TEST 1: Atomic result file")
+    print("=" * 70)
+
+    from ResultSlot import write_result_file
+
+    result = {'collision': True, 'collision_points': {'total': 12}, 'request_id': 7}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'collision_result.json')
+        write_result_file(path, result)
+        write_result_file(path, dict(result, request_id=8))
+        text = open(path).read()
+        print(f"  {text}")
+        assert json.loads(text)['request_id'] == 8 and '\n' not in text and ': ' not in text
+        assert os.listdir(directory) == ['collision_result.json']
+    print("\n✅ Result file replaced in one rename\n")
+
+
+def test_wait_for_own_result():
+    """A client gets the result of its own request, never an older one"""
+    print("=" * 70)
+    print("TEST 2: Waiting on a request ID")
+    print("=" * 70)
+
+    from ResultSlot import ResultSlotWriter, ResultSlotReader
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'collision_result.bin')
+        writer = ResultSlotWriter(path)
+        reader = ResultSlotReader(path)
+        assert reader.read() == (0, 0, None)
+
+        writer.publish({'collision': False, 'check_count': 1}, request_id=41)
+        assert reader.wait_for(42, timeout=0.05) is None    # only the older result is in
+
+        def answer():
+            time.sleep(0.05)
+            writer.publish({'collision': True, 'check_count': 2}, request_id=42)
+
+        thread = threading.Thread(target=answer)
+        started = time.time()
+        thread.start()
+        result = reader.wait_for(42, timeout=2.0)
+        waited = time.time() - started
+        thread.join()
+        print(f"  {result} after {waited * 1000:.0f}ms")
+        assert result == {'collision': True, 'check_count': 2}
+        assert waited < 0.5
+        assert reader.read()[:2] == (2, 42)
+        reader.close()
+        writer.close()
+    print("\n✅ Client receives its own result\n")
+
+
+if __name__ == '__main__':
+    test_result_file()
+    test_wait_for_own_result()
@@ -0,0 +1,87 @@
+"""
+Test - Sampling profiler
+Samples a busy loop of this thread and starts a window through the
+control file, as a running server would
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / 'lib'))
+
+
+def _busy(seconds):
+    end = time.perf_counter() + seconds
+    total = 0
+    while time.perf_counter() < end:
+        total += sum(range(1000))
+    return total
+
+
+def test_collapsed_stacks():
+    """Samples land in the busy function and in idle(), written as collapsed stacks"""
+    print("=" * 70)
+    print("TEST 1: Collapsed stacks of the sampled thread")
+    print("=" * 70)
+
+    from SamplingProfiler import SamplingProfiler, idle
+
+    profiler = SamplingProfiler(interval=0.002)
+    profiler.start(seconds=None)
+    _busy(0.3)
+    idle(0.2)
+    profiler.stop()
+
+    shares = dict(profiler.summary())
+    print(f"  {profiler.samples} samples: {shares}")
+    assert profiler.samples > 20
+    # The busy loop holds the GIL, so it gets fewer samples than its share of the time
+    assert shares.get('test_sampling_profiler', 0) > 0.1 and shares.get('idle', 0) > 0.1
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'out.collapsed')
+        profiler.write(path)
+        lines = open(path).read().splitlines()
+    stack, count = lines[0].rsplit(' ', 1)
+    assert int(count) > 0 and sum(int(line.rsplit(' ', 1)[1]) for line in lines) == profiler.samples
+    assert any('_busy (test_sampling_profiler.py:' in line for line in lines)
+    print("\n✅ Stacks attributed to the sampled functions\n")
+
+
+def test_control_file():
+    """A request for this server starts a window; other targets are ignored"""
+    print("=" * 70)
+    print("TEST 2: Window started through the control file")
+    print("=" * 70)
+
+    from SamplingProfiler import ProfileControl
+
+    with tempfile.TemporaryDirectory() as directory:
+        request = os.path.join(directory, 'profile_request.json')
+        control = ProfileControl('collision', request_file=request,
+                                 output_dir=os.path.join(directory, 'profiles'))
+        with open(request, 'w') as f:
+            json.dump({'target': 'drr', 'seconds': 0.1}, f)
+        control.poll()
+        assert not control.profiler.running
+
+        os.utime(request, (time.time() + 1, time.time() + 1))
+        with open(request, 'w') as f:
+            json.dump({'target': 'collision', 'seconds': 0.2}, f)
+        os.utime(request, (time.time() + 2, time.time() + 2))
+        control.poll()
+        assert control.profiler.running
+        _busy(0.4)
+        control.profiler._thread.join()
+        print(f"  wrote {control.last_output}")
+        assert control.last_output and os.path.exists(control.last_output)
+    print("\n✅ Control file starts a profiling window\n")
+
+
+if __name__ == '__main__':
+    test_collapsed_stacks()
+    test_control_file()
@@ -0,0 +1,54 @@
+"""
+Test - Metrics endpoint
+Serves a MetricsRegistry over HTTP, aggregates it like launch_all.py and
+reads percentiles back from the scraped histogram buckets
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / 'lib'))
+
+
+def test_scrape_and_quantiles():
+    """Counters, labelled histograms and gauge families survive a scrape"""
+    print("=" * 70)
+    print("TEST 1: Metrics endpoint round trip")
+    print("=" * 70)
+
+    from ServerMetrics import (MetricsRegistry, start_metrics_server, aggregate, parse_metrics,
+                               histogram_quantile)
+
+    metrics = MetricsRegistry('demo')
+    metrics.counter('requests_total', 'Requests')
+    metrics.histogram('latency_seconds', 'Latency')
+    metrics.gauge_family('hit_ratio', 'Hit ratio', lambda: [({'cache': 'a"b'}, 0.25)])
+    for i in range(100):
+        metrics.inc('requests_total')
+        metrics.observe('latency_seconds', 0.001 * (i + 1), stage='check')
+
+    endpoint = start_metrics_server(metrics.render, 0)
+    try:
+        url = f'http://127.0.0.1:{endpoint.server_address[1]}/metrics'
+        text = aggregate({'demo': url, 'missing': 'http://127.0.0.1:9/metrics'}, timeout=0.5)
+    finally:
+        endpoint.shutdown()
+    samples = parse_metrics(text)
+
+    assert samples[('launcher_up', (('component', 'demo'),))] == 1
+    assert samples[('launcher_up', (('component', 'missing'),))] == 0
+    assert samples[('demo_requests_total', ())] == 100
+    assert samples[('demo_latency_seconds_count', (('stage', 'check'),))] == 100
+    assert samples[('demo_hit_ratio', (('cache', 'a\\"b'),))] == 0.25
+    assert samples[('demo_process_resident_memory_bytes', ())] > 0
+
+    p50 = histogram_quantile(samples, 'demo_latency_seconds', 0.5, stage='check')
+    p99 = histogram_quantile(samples, 'demo_latency_seconds', 0.99, stage='check')
+    print(f"  p50 {p50 * 1000:.1f} ms, p99 {p99 * 1000:.1f} ms (exact: 50 ms, 99 ms)")
+    assert 0.025 <= p50 <= 0.05 and 0.05 <= p99 <= 0.1
+    assert histogram_quantile(samples, 'demo_latency_seconds', 0.5, stage='other') is None
+    print("\n✅ Scraped metrics match what was recorded\n")
+
+
+if __name__ == '__main__':
+    test_scrape_and_quantiles()
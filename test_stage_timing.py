@@ -0,0 +1,79 @@
+"""
+Test - Per-stage latency instrumentation
+Checks the rolling percentiles of StageTimer, and that
+CollisionServer(timing=True) reports stage times without changing results
+"""
+
+import io
+import sys
+import contextlib
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent / 'lib'))
+
+POSES = 20
+
+
+def test_rolling_percentiles():
+    """Laps accumulate per stage; the histogram keeps only the last window"""
+    print("=" * 70)
+    print("TEST 1: StageTimer laps and rolling percentiles")
+    print("=" * 70)
+
+    from StageTiming import StageTimer, RollingHistogram
+
+    histogram = RollingHistogram(window=100)
+    for value in range(1000):
+        histogram.add(float(value))
+    percentiles = histogram.percentiles()
+    print(f"  last 100 of 0..999: {percentiles}")
+    assert histogram.count == 1000 and len(histogram.values()) == 100
+    assert 900 <= percentiles[50] <= percentiles[95] <= percentiles[99] <= 999
+
+    timer = StageTimer()
+    timer.start()
+    for stage in ('a', 'b', 'a'):
+        timer.lap(stage)
+    timing = timer.finish()
+    assert set(timing['stages_ms']) == {'a', 'b'}
+    assert sum(timing['stages_ms'].values()) <= timing['total_ms'] + 3 * 0.5e-3    # stages and total rounded
+    assert timer.stats()['a']['count'] == 1 and timer.stats()['total']['count'] == 1
+    print("\n✅ Stages accumulate and percentiles cover the window only\n")
+
+
+def test_server_timing():
+    """Timed checks report every stage and match untimed checks"""
+    print("=" * 70)
+    print("TEST 2: CollisionServer(timing=True)")
+    print("=" * 70)
+
+    from collision_server import CollisionServer, OBSTACLES
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        timed = CollisionServer(timing=True, coherence=False)
+        plain = CollisionServer(coherence=False)
+    rng = np.random.default_rng(1)
+    for _ in range(POSES):
+        pose = (rng.uniform(-90, 90), rng.uniform(-45, 45), rng.uniform(-10, 10),
+                rng.uniform(-0.1, 0.1), rng.uniform(0, 0.2), rng.uniform(0, 0.3))
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = timed.check_collision(*pose)
+            expected = plain.check_collision(*pose)
+        assert result['collision_points'] == expected['collision_points']
+        assert 'timing' not in expected
+        stages = result['timing']['stages_ms']
+        assert {'fk', 'broad', 'result'} <= set(stages)
+        assert sum(stages.values()) <= result['timing']['total_ms'] + (len(stages) + 1) * 0.5e-3  # stages and total rounded
+
+    stats = timed.timer.stats()
+    for stage in ['total', 'fk'] + [f'narrow.{name}' for name in OBSTACLES]:
+        print(f"  {stage:20s} p50 {stats[stage]['p50']:7.2f} ms  p99 {stats[stage]['p99']:7.2f} ms")
+        assert stats[stage]['count'] == POSES
+    print("\n✅ Stage times reported, results unchanged\n")
+
+
+if __name__ == '__main__':
+    test_rolling_percentiles()
+    test_server_timing()
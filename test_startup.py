@@ -0,0 +1,90 @@
+"""
+Test - Lean collision server startup
+Imports without vedo, checks the VTK-only inside test against vedo's, and
+restores a spatial hash grid from its arrays
+"""
+
+import sys
+import subprocess
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent / 'lib'))
+
+
+def test_lean_imports():
+    """Importing the server or the analysis tool loads neither vedo, scipy nor VTK"""
+    print("=" * 70)
+    print("TEST 1: Deferred imports")
+    print("=" * 70)
+
+    for module in ('collision_server', 'workspace_analysis'):
+        code = (f"import sys; sys.path.insert(0, 'lib'); import {module}; "
+                f"print(sorted(m for m in ('vedo', 'scipy', 'vtkmodules') if m in sys.modules))")
+        loaded = subprocess.run([sys.executable, '-c', code], cwd=Path(__file__).parent,
+                                capture_output=True, text=True, check=True).stdout.split('\n')[-2]
+        print(f"  {module}: heavy modules loaded {loaded}")
+        assert loaded == '[]'
+    print("\n✅ Server imports stay lean\n")
+
+
+def test_enclosed_points_match_vedo():
+    """EnclosedPoints gives vedo's inside_points() verdicts, also for a moved mesh"""
+    print("=" * 70)
+    print("TEST 2: VTK inside test without vedo")
+    print("=" * 70)
+
+    import vedo
+    from EnclosedPoints import EnclosedPoints
+    from collision_server import open_scene_bundle, table_poses
+
+    bundle = open_scene_bundle()
+    points, faces = bundle.array('table_body', 'points'), bundle.array('table_body', 'faces')
+    lo, hi = bundle.array('table_body', 'bounds')
+    rng = np.random.default_rng(0)
+    queries = rng.uniform(lo - 0.1, hi + 0.1, size=(5000, 3))
+    pose = table_poses(0.2, 0.3, -0.05)['table_body']
+    moved = queries @ pose[:3, :3].T + pose[:3, 3]
+
+    reference = vedo.Mesh([points, faces])
+    moved_reference = reference.clone()
+    moved_reference.apply_transform(T=pose, reset=False, concatenate=False)
+    mesh = EnclosedPoints(points, faces)
+    expected = [reference.inside_points(queries, return_ids=True),
+                moved_reference.inside_points(moved, return_ids=True)]
+    actual = [mesh.inside_points(queries), mesh.placed(pose).inside_points(moved)]
+    print(f"  {[len(ids) for ids in actual]} of {len(queries)} points inside")
+    assert len(actual[0]) > 0
+    for ids, reference_ids in zip(actual, expected):
+        assert np.array_equal(ids, reference_ids)
+    print("\n✅ Same verdicts as vedo\n")
+
+
+def test_grid_from_arrays():
+    """A grid restored from its arrays answers like the one built"""
+    print("=" * 70)
+    print("TEST 3: Spatial hash grid from arrays")
+    print("=" * 70)
+
+    from SpatialHash import PointGrid
+
+    rng = np.random.default_rng(1)
+    points = rng.uniform(-0.5, 0.5, size=(3000, 3))
+    groups = rng.integers(0, 3, size=len(points))
+    built = PointGrid(points, groups=groups)
+    restored = PointGrid.from_arrays(built.arrays())
+    relative = np.repeat(np.eye(4)[None], 3, axis=0)
+    relative[:, :3, 3] = [0.1, -0.2, 0.05]
+    lo, hi = np.array([-0.2, -0.1, -0.3]), np.array([0.1, 0.2, 0.0])
+    print(f"  {len(restored)} cells, {restored.size} points")
+    assert len(restored) == len(built) and restored.size == built.size
+    assert np.array_equal(restored.candidates(relative, lo, hi), built.candidates(relative, lo, hi))
+    assert np.array_equal(restored.point_gaps(relative, lo, hi), built.point_gaps(relative, lo, hi))
+    print("\n✅ Restored grid matches\n")
+
+
+if __name__ == '__main__':
+    test_lean_imports()
+    test_enclosed_points_match_vedo()
+    test_grid_from_arrays()
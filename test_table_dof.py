@@ -9,9 +9,46 @@ Tests collision detection with table movement
 import json
 import time
 import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib'))
+from PoseBus import shared_writer
+from ResultSlot import ResultSlotReader
+
+# (test name, C-arm pose, table pose); also the stock trace traces/table_dof.trace
+SCENARIOS = [
+    # Neutral position (should be safe)
+    ("Neutral Position (all zeros)",
+     {'lao_rao': 0, 'cran_caud': 0, 'wigwag': 0, 'lateral': 0, 'vertical': 0, 'horizontal': 0},
+     {'vertical': 0, 'longitudinal': 0, 'transverse': 0}),
+    # Table raised, C-arm low (potential collision)
+    ("Table Raised Max (vertical = 36cm)",
+     {'lao_rao': 0, 'cran_caud': 0, 'wigwag': 0, 'lateral': 0, 'vertical': 0, 'horizontal': 0},
+     {'vertical': 0.36, 'longitudinal': 0, 'transverse': 0}),
+    # Table extended forward
+    ("Table Extended Forward (longitudinal = 70cm)",
+     {'lao_rao': 0, 'cran_caud': 0, 'wigwag': 0, 'lateral': 0, 'vertical': 0, 'horizontal': 0},
+     {'vertical': 0, 'longitudinal': 0.7, 'transverse': 0}),
+    # Table shifted left
+    ("Table Shifted Left (transverse = -13cm)",
+     {'lao_rao': 0, 'cran_caud': 0, 'wigwag': 0, 'lateral': 0, 'vertical': 0, 'horizontal': 0},
+     {'vertical': 0, 'longitudinal': 0, 'transverse': -0.13}),
+    # Table shifted right
+    ("Table Shifted Right (transverse = +13cm)",
+     {'lao_rao': 0, 'cran_caud': 0, 'wigwag': 0, 'lateral': 0, 'vertical': 0, 'horizontal': 0},
+     {'vertical': 0, 'longitudinal': 0, 'transverse': 0.13}),
+    # C-arm angled with table raised (likely collision)
+    ("C-arm Angled + Table Raised (potential collision)",
+     {'lao_rao': 30, 'cran_caud': 30, 'wigwag': 0, 'lateral': 0, 'vertical': 0.2, 'horizontal': 0},
+     {'vertical': 0.3, 'longitudinal': 0.3, 'transverse': 0}),
+    # Complex pose with all DOF
+    ("Complex Multi-DOF Configuration",
+     {'lao_rao': -45, 'cran_caud': 20, 'wigwag': 5, 'lateral': 0.2, 'vertical': 0.15, 'horizontal': 0.1},
+     {'vertical': 0.18, 'longitudinal': 0.35, 'transverse': 0.05}),
+]
 
 def write_test_pose(c_arm_pose, table_pose, test_name):
-    """Write a test pose to collision_pose.json"""
+    """Publish a test pose on the pose bus and to collision_pose.json"""
     pose_data = {
         # C-arm DOF
         'lao_rao': c_arm_pose['lao_rao'],
@@ -25,9 +62,11 @@ def write_test_pose(c_arm_pose, table_pose, test_name):
         'table_longitudinal': table_pose['longitudinal'],
         'table_transverse': table_pose['transverse'],
         'timestamp': time.time(),
+        'request_id': int(time.time() * 1000),
         'test_name': test_name
     }
     
+    shared_writer().publish_pose(pose_data)
     with open('collision_pose.json', 'w') as f:
         json.dump(pose_data, f, indent=2)
     
@@ -36,14 +75,12 @@ def write_test_pose(c_arm_pose, table_pose, test_name):
           f"LAT={c_arm_pose['lateral']:.2f}m VER={c_arm_pose['vertical']:.2f}m HOR={c_arm_pose['horizontal']:.2f}m")
     print(f"  Table: V={table_pose['vertical']:.2f}m L={table_pose['longitudinal']:.2f}m T={table_pose['transverse']:.2f}m")
     
-    # Wait for server to process
-    time.sleep(0.3)
+    # Wait for the result of this pose
+    reader = ResultSlotReader()
+    result = reader.wait_for(pose_data['request_id'], timeout=2.0)
+    reader.close()
     
-    # Read result
-    if os.path.exists('collision_result.json'):
-        with open('collision_result.json', 'r') as f:
-            result = json.load(f)
-        
+    if result is not None:
         collision = result.get('collision', False)
         points = result.get('collision_points', {}).get('total', 0)
         status = "❌ COLLISION" if collision else "✅ SAFE"
@@ -63,61 +100,8 @@ def main():
     
     time.sleep(1)
     
-    # Test 1: Neutral position (should be safe)
-    write_test_pose(
-        c_arm_pose={'lao_rao': 0, 'cran_caud': 0, 'wigwag': 0, 
-                   'lateral': 0, 'vertical': 0, 'horizontal': 0},
-        table_pose={'vertical': 0, 'longitudinal': 0, 'transverse': 0},
-        test_name="Neutral Position (all zeros)"
-    )
-    
-    # Test 2: Table raised, C-arm low (potential collision)
-    write_test_pose(
-        c_arm_pose={'lao_rao': 0, 'cran_caud': 0, 'wigwag': 0, 
-                   'lateral': 0, 'vertical': 0, 'horizontal': 0},
-        table_pose={'vertical': 0.36, 'longitudinal': 0, 'transverse': 0},
-        test_name="Table Raised Max (vertical = 36cm)"
-    )
-    
-    # Test 3: Table extended forward
-    write_test_pose(
-        c_arm_pose={'lao_rao': 0, 'cran_caud': 0, 'wigwag': 0, 
-                   'lateral': 0, 'vertical': 0, 'horizontal': 0},
-        table_pose={'vertical': 0, 'longitudinal': 0.7, 'transverse': 0},
-        test_name="Table Extended Forward (longitudinal = 70cm)"
-    )
-    
-    # Test 4: Table shifted left
-    write_test_pose(
-        c_arm_pose={'lao_rao': 0, 'cran_caud': 0, 'wigwag': 0, 
-                   'lateral': 0, 'vertical': 0, 'horizontal': 0},
-        table_pose={'vertical': 0, 'longitudinal': 0, 'transverse': -0.13},
-        test_name="Table Shifted Left (transverse = -13cm)"
-    )
-    
-    # Test 5: Table shifted right
-    write_test_pose(
-        c_arm_pose={'lao_rao': 0, 'cran_caud': 0, 'wigwag': 0, 
-                   'lateral': 0, 'vertical': 0, 'horizontal': 0},
-        table_pose={'vertical': 0, 'longitudinal': 0, 'transverse': 0.13},
-        test_name="Table Shifted Right (transverse = +13cm)"
-    )
-    
-    # Test 6: C-arm angled with table raised (likely collision)
-    write_test_pose(
-        c_arm_pose={'lao_rao': 30, 'cran_caud': 30, 'wigwag': 0, 
-                   'lateral': 0, 'vertical': 0.2, 'horizontal': 0},
-        table_pose={'vertical': 0.3, 'longitudinal': 0.3, 'transverse': 0},
-        test_name="C-arm Angled + Table Raised (potential collision)"
-    )
-    
-    # Test 7: Complex pose with all DOF
-    write_test_pose(
-        c_arm_pose={'lao_rao': -45, 'cran_caud': 20, 'wigwag': 5, 
-                   'lateral': 0.2, 'vertical': 0.15, 'horizontal': 0.1},
-        table_pose={'vertical': 0.18, 'longitudinal': 0.35, 'transverse': 0.05},
-        test_name="Complex Multi-DOF Configuration"
-    )
+    for test_name, c_arm_pose, table_pose in SCENARIOS:
+        write_test_pose(c_arm_pose, table_pose, test_name)
     
     print("\n" + "=" * 70)
     print("TEST SUITE COMPLETE")
@@ -0,0 +1,101 @@
+"""
+Test - Temporal coherence
+Checks that motion_bound() covers the real displacement of points, for
+rigid transforms and for the scaled obstacle transforms of scenes.json,
+and that a scaled scene gives the same counts with and without the cache
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent / 'lib'))
+
+
+def _random_rotation(rng):
+    q, r = np.linalg.qr(rng.normal(size=(3, 3)))
+    q = q * np.sign(np.diag(r))
+    return q if np.linalg.det(q) > 0 else -q
+
+
+def _transform(linear, translation):
+    transform = np.eye(4)
+    transform[:3, :3] = linear
+    transform[:3, 3] = translation
+    return transform
+
+
+def _max_displacement(previous, current, points):
+    moved = points @ current[:3, :3].T + current[:3, 3]
+    before = points @ previous[:3, :3].T + previous[:3, 3]
+    return np.linalg.norm(moved - before, axis=1).max()
+
+
+def test_motion_bound():
+    """The bound is tight for rotations and still holds for scaled transforms"""
+    print("=" * 70)
+    print("TEST 1: Motion bound, rigid and scaled")
+    print("=" * 70)
+
+    from TemporalCoherence import motion_bound
+    from SceneRegistry import scene_transform
+
+    rng = np.random.default_rng(0)
+    center, radius = np.array([0.1, -0.2, 0.3]), 0.5
+    directions = rng.normal(size=(2000, 3))
+    points = center + radius * directions / np.linalg.norm(directions, axis=1, keepdims=True)
+
+    # Rotation about the sphere's center: the bound is the chord 2 sin(theta / 2) r
+    for _ in range(20):
+        rotation = _random_rotation(rng)
+        previous = _transform(np.eye(3), -center)
+        current = _transform(rotation, rotation @ -center)
+        bound = motion_bound(previous, current, center, radius)
+        actual = _max_displacement(previous, current, points)
+        assert actual <= bound + 1e-9 and bound <= actual * 1.01
+
+    # Obstacle transforms of the habitus scenes scale (and mirror) the model
+    for scale in ([-0.85, 1.0, -0.85], [-1.2, 1.0, -1.25]):
+        obstacle = scene_transform({'translation': [0.3, 1.35, 0.78], 'rotation_z_deg': 270,
+                                    'scale': scale})
+        worst = 0.0
+        for _ in range(50):
+            poses = [_transform(_random_rotation(rng), rng.uniform(-0.5, 0.5, 3)) for _ in range(2)]
+            previous, current = (np.linalg.inv(obstacle) @ pose for pose in poses)
+            bound = motion_bound(previous, current, center, radius)
+            actual = _max_displacement(previous, current, points)
+            worst = max(worst, actual / bound)
+            assert actual <= bound + 1e-9
+        print(f"  scale {scale}: displacement up to {worst:.2f} of the bound")
+    print("\n✅ Bound covers every point\n")
+
+
+def test_scaled_scene_sweep():
+    """A cran sweep in a scaled scene counts the same points with and without coherence"""
+    print("=" * 70)
+    print("TEST 2: Cran sweep in habitus_small, with and without coherence")
+    print("=" * 70)
+
+    from collision_server import CollisionServer
+
+    # Ray parity decides every point the same way whichever points are queried together
+    cached = CollisionServer(scene='habitus_small', inside='bvh')
+    uncached = CollisionServer(scene='habitus_small', inside='bvh', coherence=False)
+    rigid = cached.bundle.transform('patient')[:3, :3]
+    assert np.allclose(rigid.T @ rigid, np.eye(3), atol=1e-6)
+
+    hits = 0
+    for cran in np.arange(100.0, 142.0, 2.0):
+        counts = [server.check_collision(0, cran, 0, 0.2)['collision_points']
+                  for server in (cached, uncached)]
+        assert counts[0] == counts[1], (cran, counts)
+        hits += counts[0]['patient'] > 0
+    print(f"  {hits} poses with patient contact, same counts at every pose")
+    assert hits > 0
+    print("\n✅ Coherence misses nothing in a scaled scene\n")
+
+
+if __name__ == '__main__':
+    test_motion_bound()
+    test_scaled_scene_sweep()
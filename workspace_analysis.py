@@ -13,13 +13,19 @@ This script analyzes the collision-free workspace for different DOF configuratio
 and clinical interventional projections.
 """
 
+import time
+IMPORT_STARTED = time.perf_counter()    # --startup-report counts imports from here
+
 import numpy as np
 import json
 from pathlib import Path
-import time
 from datetime import datetime
-from collision_server import CollisionServer
+from collision_server import CollisionServer, DEFAULT_SCENE
+from SceneRegistry import SceneRegistry
+from CollisionWorkerPool import remote_check
+from StartupReport import StartupReport
 import argparse
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
 
 # Clinical interventional configurations from research paper (Table VII)
 CLINICAL_INTERVENTIONS = {
@@ -55,6 +61,9 @@ CLINICAL_INTERVENTIONS = {
     }
 }
 
+# Poses per POST /check request when checking on a server (--server)
+REMOTE_CHUNK = 200
+
 # DOF configurations from research paper (Table VIII)
 DOF_SETUPS = {
     'setup1': {
@@ -118,12 +127,39 @@ JOINT_LIMITS = {
 
 
 class WorkspaceAnalyzer:
-    def __init__(self):
+    def __init__(self, fidelity=None, confirm=True, engine='points', inside='vtk', scene=DEFAULT_SCENE,
+                 timing=False, server_url=None, startup=None):
+        """
+        Args:
+            fidelity: Obstacle model per obstacle (see collision_server.parse_fidelity)
+            confirm: Confirm coarse-level hits on the full meshes
+            engine: Collision backend, 'points' or 'gjk' (see collision_server.ENGINES)
+            inside: Inside test of the points engine, 'vtk' or 'bvh' (see collision_server.INSIDE_TESTS)
+            scene: Scene from scenes.json; its joint limits replace JOINT_LIMITS
+            timing: Time every check by stage and report p50/p95/p99 per
+                    stage with the results (see StageTiming.py)
+            server_url: Check on a running collision_server.py --workers as
+                        batch requests (see CollisionWorkerPool.py) instead of
+                        loading the meshes here; the other model options are
+                        then the server's
+            startup: StartupReport of the collision server's load and
+                     build times (see StartupReport.py)
+        """
         print("="*80)
         print("SURGICAL WORKSPACE ANALYSIS TOOL")
         print("="*80)
-        print("\nInitializing collision detection system...")
-        self.collision_server = CollisionServer()
+        self.scene = scene
+        self.server_url = server_url
+        if server_url:
+            print(f"\nChecking on {server_url} (batch priority)")
+            self.collision_server = None
+            self.joint_limits = SceneRegistry().joint_limits(scene, JOINT_LIMITS)
+        else:
+            print("\nInitializing collision detection system...")
+            self.collision_server = CollisionServer(fidelity=fidelity, confirm=confirm, engine=engine,
+                                                    inside=inside, scene=scene, timing=timing,
+                                                    startup=startup)
+            self.joint_limits = self.collision_server.scenes.joint_limits(scene, JOINT_LIMITS)
         print("\n[OK] Workspace analyzer ready\n")
         
     def generate_random_pose(self, movable_joints, fixed_joints, intervention_config=None):
@@ -153,8 +189,8 @@ class WorkspaceAnalyzer:
         
         # Generate random values for movable joints
         for joint in movable_joints:
-            if joint in JOINT_LIMITS:
-                min_val, max_val = JOINT_LIMITS[joint]
+            if joint in self.joint_limits:
+                min_val, max_val = self.joint_limits[joint]
                 pose[joint] = np.random.uniform(min_val, max_val)
         
         # Ensure all joints have values (default to 0 if not set)
@@ -165,8 +201,33 @@ class WorkspaceAnalyzer:
         
         return pose
     
+    def _request_pose(self, pose):
+        """Pose in the collision server's request format (POST /check)"""
+        return {
+            'lao_rao': pose['orbital'], 'cran_caud': pose['tilt'], 'wigwag': pose['wigwag'],
+            'lateral': pose['lateral'], 'vertical': pose['vertical'],
+            'horizontal': pose['horizontal'], 'table_vertical': pose['table_vertical'],
+            'table_longitudinal': pose['table_longitudinal'],
+            'table_transverse': pose['table_transverse'], 'scene_id': self.scene
+        }
+    
+    def check_pose_collisions(self, poses):
+        """
+        Check several poses; with a server URL they go out as one batch request.
+        
+        Returns:
+            List of (collision, collision_points), in order
+        """
+        if self.server_url:
+            results = remote_check([self._request_pose(pose) for pose in poses], 'batch',
+                                   self.server_url)
+            return [(result['collision'], result['collision_points']) for result in results]
+        return [self.check_pose_collision(pose) for pose in poses]
+    
     def check_pose_collision(self, pose):
         """Check if a pose results in collision."""
+        if self.server_url:
+            return self.check_pose_collisions([pose])[0]
         result = self.collision_server.check_collision(
             lao_rao_deg=pose['orbital'],
             cran_caud_deg=pose['tilt'],
@@ -220,36 +281,38 @@ class WorkspaceAnalyzer:
         
         start_time = time.time()
         
-        # Generate and test random poses
-        for i in range(num_samples):
-            if verbose and (i % 1000 == 0 or i == num_samples - 1):
-                elapsed = time.time() - start_time
-                rate = (i + 1) / elapsed if elapsed > 0 else 0
-                eta = (num_samples - i - 1) / rate if rate > 0 else 0
-                print(f"  Progress: {i+1:,}/{num_samples:,} ({100*(i+1)/num_samples:.1f}%) | "
-                      f"Rate: {rate:.1f} poses/s | ETA: {eta:.0f}s", end='\r')
-            
-            # Generate random pose
-            pose = self.generate_random_pose(
+        # Generate and test random poses, a chunk per request with a server URL
+        chunk = REMOTE_CHUNK if self.server_url else 1
+        for first in range(0, num_samples, chunk):
+            # Generate random poses
+            poses = [self.generate_random_pose(
                 setup['movable_joints'],
                 setup['fixed_joints'],
                 intervention_config=intervention
-            )
+            ) for _ in range(min(chunk, num_samples - first))]
             
             # Check collision
-            has_collision, points = self.check_pose_collision(pose)
+            checked = self.check_pose_collisions(poses)
             
-            if has_collision:
-                collision_count += 1
-                collision_poses.append(pose)
+            for i, pose, (has_collision, points) in zip(range(first, num_samples), poses, checked):
+                if verbose and (i % 1000 == 0 or i == num_samples - 1):
+                    elapsed = time.time() - start_time
+                    rate = (i + 1) / elapsed if elapsed > 0 else 0
+                    eta = (num_samples - i - 1) / rate if rate > 0 else 0
+                    print(f"  Progress: {i+1:,}/{num_samples:,} ({100*(i+1)/num_samples:.1f}%) | "
+                          f"Rate: {rate:.1f} poses/s | ETA: {eta:.0f}s", end='\r')
                 
-                # Track which components are colliding
-                for component in collision_details:
-                    if points[component] > 0:
-                        collision_details[component] += 1
-            else:
-                collision_free_count += 1
-                collision_free_poses.append(pose)
+                if has_collision:
+                    collision_count += 1
+                    collision_poses.append(pose)
+                    
+                    # Track which components are colliding
+                    for component in collision_details:
+                        if points[component] > 0:
+                            collision_details[component] += 1
+                else:
+                    collision_free_count += 1
+                    collision_free_poses.append(pose)
         
         elapsed_time = time.time() - start_time
         
@@ -286,6 +349,8 @@ class WorkspaceAnalyzer:
             },
             'timestamp': datetime.now().isoformat()
         }
+        if self.collision_server is not None and self.collision_server.timer is not None:
+            results['stage_latency_ms'] = self.collision_server.timer.stats()
         
         if verbose:
             self._print_results(results)
@@ -312,6 +377,10 @@ class WorkspaceAnalyzer:
         
         print(f"\n  Analysis time:          {results['elapsed_time_seconds']:.1f}s")
         print(f"  Processing rate:        {results['samples_per_second']:.1f} poses/second")
+        if 'stage_latency_ms' in results:
+            print(f"\n  Stage latency (p50 / p95 / p99 ms):")
+            for stage, stats in results['stage_latency_ms'].items():
+                print(f"    {stage:20s}: {stats['p50']:7.2f} / {stats['p95']:7.2f} / {stats['p99']:7.2f}")
         print(f"{'='*80}\n")
     
     def compare_setups(self, intervention_name, num_samples=10000, setups=None):
@@ -435,6 +504,29 @@ def main():
                        help='Analyze all interventions for selected setup')
     parser.add_argument('--quick', action='store_true',
                        help='Quick test with 1000 samples')
+    parser.add_argument('--fidelity', type=str, default=None,
+                       help="Sweep on conservative obstacle models: 'dop', 'convex' or per obstacle "
+                            "(e.g. 'patient=dop,table_body=convex'); hits are confirmed on the "
+                            "full meshes (default: full meshes)")
+    parser.add_argument('--no-confirm', action='store_true',
+                       help='With --fidelity, count coarse-model hits without confirming them '
+                            '(never misses a collision, may over-report)')
+    parser.add_argument('--engine', choices=('points', 'gjk'), default='points',
+                       help='Collision backend: C-arm points inside meshes, or GJK/EPA on the '
+                            'convex pieces (conservative) (default: points)')
+    parser.add_argument('--inside', choices=('vtk', 'bvh'), default='vtk',
+                       help='Inside test of the points engine: VTK, or numpy ray parity without '
+                            'VTK (default: vtk)')
+    parser.add_argument('--scene', type=str, default=DEFAULT_SCENE,
+                       help=f'Scene from scenes.json (patient model, joint limits) (default: {DEFAULT_SCENE})')
+    parser.add_argument('--timing', action='store_true',
+                       help='Time every collision check by stage and report p50/p95/p99 per stage')
+    parser.add_argument('--server', type=str, default=None, metavar='URL',
+                       help='Check on a running collision_server.py --workers N as batch requests, '
+                            'e.g. http://127.0.0.1:9103, so interactive checks keep priority')
+    parser.add_argument('--startup-report', action='store_true',
+                       help='Print the time to ready split into imports, bundle loading and '
+                            'acceleration-structure builds')
     
     args = parser.parse_args()
     
@@ -443,7 +535,13 @@ def main():
         print("\n[QUICK MODE] Using 1000 samples for rapid testing\n")
     
     # Initialize analyzer
-    analyzer = WorkspaceAnalyzer()
+    startup = StartupReport(IMPORT_STARTED)
+    startup.add('import', IMPORT_SECONDS)
+    analyzer = WorkspaceAnalyzer(args.fidelity, confirm=not args.no_confirm, engine=args.engine,
+                                 inside=args.inside, scene=args.scene, timing=args.timing,
+                                 server_url=args.server, startup=startup)
+    if args.startup_report:
+        startup.print_report('Startup')
     
     # Run analysis based on mode
     if args.compare_setups: